@@ -5,9 +5,15 @@ import subprocess
 import sys
 import glob
 import shutil
+import time
 
 # This script is meant to run ON THE DEVICE (IQ-9075)
 
+def mark(name, edge):
+    # Event markers for the host's --trace timeline (see onnx_convert/scripts/tracing.py)
+    if os.environ.get("DINOV3_TRACE_MARKERS") == "1":
+        print(f"@@EVENT {name} {edge} {time.time():.6f}", flush=True)
+
 def run_command(command, stream_output=True):
     print(f"[CMD] {command}")
     process = subprocess.Popen(command, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
@@ -97,6 +103,7 @@ def main():
     
     # 1. Compilation
     print("--- Compiling Model (Native QNN) ---")
+    mark("compile", "start")
     os.makedirs("obj/binary", exist_ok=True)
     os.makedirs("bin", exist_ok=True)
     
@@ -130,6 +137,7 @@ def main():
     # We need to make sure `inference_dinov3.cpp` isn't hardcoded to specific tensor names if they change.
     # For DINOv3, they usually stay same.
     run_command(f"g++ -o bin/inference_dinov3 inference_dinov3.cpp -ldl {flags}")
+    mark("compile", "end")
     
     # 2. Execution
     print("--- Executing ---")
@@ -152,8 +160,10 @@ def main():
     cmd = [f"./bin/inference_dinov3", model_lib_path, qnn_lib_path]
     print(f"Running: {' '.join(cmd)}")
     
+    mark("inference_dinov3", "start")
     p = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
     out, err = p.communicate()
+    mark("inference_dinov3", "end")
     
     print("[OUTPUT]")
     print(out)
@@ -4,9 +4,15 @@ import argparse
 import subprocess
 import sys
 import glob
+import time
 
 # THIS SCRIPT RUNS ON THE IQ-9075 DEVICE
 
+def mark(name, edge):
+    # Event markers for the host's --trace timeline (see onnx_convert/scripts/tracing.py)
+    if os.environ.get("DINOV3_TRACE_MARKERS") == "1":
+        print(f"@@EVENT {name} {edge} {time.time():.6f}", flush=True)
+
 def run_command(command, stream_output=True):
     print(f"[DEVICE] {command}")
     
@@ -35,6 +41,7 @@ def main():
     print(f"--- Running E2E on Device for {model_id} ---")
     
     print("\n--- Step 0: Checking/Installing Dependencies ---")
+    mark("dependencies", "start")
     pkgs = ["torch", "transformers", "onnx", "huggingface_hub", "accelerate", "onnxscript"]
     to_install = []
     
@@ -68,8 +75,10 @@ def main():
                 sys.exit(1)
     else:
         print("All dependencies present.")
+    mark("dependencies", "end")
 
     print("\n--- Step 1: Exporting Model (PyTorch -> ONNX) ---")
+    mark("export", "start")
     
     onnx_file = f"assets/{safe_name}.onnx"
     os.makedirs("assets", exist_ok=True)
@@ -82,9 +91,11 @@ def main():
     if ret != 0:
         print(f"Export failed with return code {ret}.")
         sys.exit(1)
+    mark("export", "end")
         
     # 2. Conversion (ONNX -> QNN C++)
     print("\n--- Step 2: Converting to QNN (ONNX -> Cpp) ---")
+    mark("conversion", "start")
     # Need to find qnn-onnx-converter
     # It might be in $QNN_SDK_ROOT/bin/...
     # On device, QNN_SDK_ROOT might not be set, or might be different.
@@ -125,11 +136,14 @@ def main():
     if ret != 0:
         print("Conversion failed. Is qnn-onnx-converter installed on this device?")
         sys.exit(1)
+    mark("conversion", "end")
         
     # 3. Inference
     print("\n--- Step 3: Device Inference ---")
     cmd = f"python3 device_inference.py --model_name {safe_name}"
+    mark("device_inference", "start")
     ret, _, _ = run_command(cmd)
+    mark("device_inference", "end")
     
     if ret == 0:
         print("\nE2E Workflow Complete: SUCCESS")
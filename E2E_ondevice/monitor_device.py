@@ -1,16 +1,18 @@
 
+import os
+import sys
 import paramiko
 import time
 
-DEVICE_IP = "192.168.0.202"
-USERNAME = "ubuntu"
-PASSWORD = "qualcomm"
+# Device Config from the shared inventory (onnx_convert/scripts/devices.py; $DINOV3_DEVICE selects a board)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../onnx_convert/scripts"))
+import devices
 
-def check_status():
+def check_status(device):
     client = paramiko.SSHClient()
     client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
     try:
-        client.connect(DEVICE_IP, username=USERNAME, password=PASSWORD)
+        client.connect(device["host"], port=device["port"], username=device["username"], password=device["password"])
         
         print("--- Processes ---")
         stdin, stdout, stderr = client.exec_command("ps -ef | grep python")
@@ -34,4 +36,4 @@ def check_status():
         print(f"Connection failed: {e}")
 
 if __name__ == "__main__":
-    check_status()
+    check_status(devices.select_device())
@@ -16,35 +16,38 @@ import time
 #     print("Error: export_model.py not found in current directory.")
 #     sys.exit(1)
 
-# Device Config
-DEVICE_IP = "192.168.0.202"
-USERNAME = "ubuntu"
-PASSWORD = "qualcomm"
+# Device Config from the shared inventory (onnx_convert/scripts/devices.py; $DINOV3_DEVICE selects a board),
+# resolved in main() after argument parsing
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../onnx_convert/scripts"))
+import devices
+import tracing
+
 REMOTE_BASE_DIR = "/home/ubuntu/dinov3_e2e"
 
 def create_ssh_client(server, user, password):
     client = paramiko.SSHClient()
     client.load_system_host_keys()
     client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-    client.connect(server, username=user, password=password)
+    client.connect(server, port=DEVICE_PORT, username=user, password=password)
     return client
 
 def run_remote_command(ssh, command, stream=True):
     print(f"[REMOTE] {command}")
-    # get_pty=True merges stdout/stderr and allows line-buffering usually
-    stdin, stdout, stderr = ssh.exec_command(command, get_pty=True)
+    with tracing.span("ssh exec", cat="ssh", command=command[:200]):
+        # get_pty=True merges stdout/stderr and allows line-buffering usually
+        stdin, stdout, stderr = ssh.exec_command(command, get_pty=True)
     
-    full_output = ""
-    if stream:
-        # Stream line by line
-        for line in iter(stdout.readline, ""):
-            print(line, end="")
-            full_output += line
+        full_output = ""
+        if stream:
+            # Stream line by line
+            for line in iter(stdout.readline, ""):
+                print(line, end="")
+                full_output += line
             
-    exit_status = stdout.channel.recv_exit_status()
-    # If not streaming, we still need to read remaining if any
-    if not stream:
-        full_output = stdout.read().decode()
+        exit_status = stdout.channel.recv_exit_status()
+        # If not streaming, we still need to read remaining if any
+        if not stream:
+            full_output = stdout.read().decode()
         
     return exit_status, full_output, "" # Stderr merged in stdout due to Pty
 
@@ -60,7 +63,12 @@ def main():
     parser.add_argument("--model_id", type=str, default="facebook/dinov3-vitb16-pretrain-lvd1689m", help="Hugging Face Model ID")
     parser.add_argument("--auth_token", type=str, default=None, help="Hugging Face Auth Token")
     parser.add_argument("--skip_export", action="store_true", help="Skip export/conversion if artifacts exist")
+    parser.add_argument("--trace", help="Write a Chrome trace of the workflow (host + device) to this JSON file")
     args = parser.parse_args()
+    if args.trace:
+        tracing.enable(args.trace)
+    tracer = tracing.get_tracer()
+    device = devices.select_device()
     
     model_id = args.model_id
     safe_name = model_id.split("/")[-1].replace("-pretrain-lvd1689m", "").replace("-", "_")
@@ -83,7 +91,8 @@ def main():
         if args.auth_token:
             cmd.extend(["--auth_token", args.auth_token])
             
-        ret = subprocess.call(cmd)
+        with tracing.span("local export"):
+            ret = subprocess.call(cmd)
         if ret != 0:
             print("Local Export failed.")
             sys.exit(1)
@@ -106,7 +115,8 @@ def main():
         ]
         
         print(f"Running: {' '.join(conv_cmd)}")
-        ret = subprocess.call(conv_cmd)
+        with tracing.span("local conversion"):
+            ret = subprocess.call(conv_cmd)
         if ret != 0:
             print("Local Conversion failed.")
             sys.exit(1)
@@ -118,8 +128,9 @@ def main():
 
     # 3. Upload Artifacts
     print("\n--- Step 3: Uploading Artifacts to Device ---")
-    ssh = create_ssh_client(DEVICE_IP, USERNAME, PASSWORD)
+    ssh = create_ssh_client(device["host"], device["username"], device["password"])
     scp = SCPClient(ssh.get_transport(), socket_timeout=3600.0, progress=progress)
+    tracer.estimate_clock_offset(ssh)
     
     # Ensure remote dir
     run_remote_command(ssh, f"mkdir -p {REMOTE_BASE_DIR}", stream=False)
@@ -137,8 +148,11 @@ def main():
         if os.path.exists(f):
             size_bytes = os.path.getsize(f)
             print(f"Uploading {os.path.basename(f)} ({size_bytes/1024/1024:.2f} MB)...")
-            scp.put(f, remote_path=f"{REMOTE_BASE_DIR}/{os.path.basename(f)}")
+            with tracing.span(f"upload {os.path.basename(f)}", cat="transfer", bytes=size_bytes):
+                scp.put(f, remote_path=f"{REMOTE_BASE_DIR}/{os.path.basename(f)}")
         else:
+            print(f"Warning: {f} not found, skipping.")
+
     # Extract Assets on Device
     print("Extracting assets on device...")
     cmds = [
@@ -146,8 +160,9 @@ def main():
         f"mkdir -p {REMOTE_BASE_DIR}/lib && tar -xzf {REMOTE_BASE_DIR}/sdk_libs.tar.gz -C {REMOTE_BASE_DIR}/lib 2>/dev/null",
         f"mkdir -p {REMOTE_BASE_DIR}/lib/hexagon && tar -xzf {REMOTE_BASE_DIR}/skel_libs.tar.gz -C {REMOTE_BASE_DIR}/lib 2>/dev/null"
     ]
-    for c in cmds:
-        run_remote_command(ssh, c, stream=False)
+    with tracing.span("extract assets"):
+        for c in cmds:
+            run_remote_command(ssh, c, stream=False)
 
     # 2. Trigger Device Orchestrator
     print("\nStep 2: Triggering Device Orchestrator...")
@@ -155,10 +170,14 @@ def main():
     # We need to make sure python3 has requirements.
     # We can try to install them? No, user said "Qualcomm PC", assume Env is ready.
     
-    cmd = f"cd {REMOTE_BASE_DIR} && python3 device_orchestrator.py --model_id {model_id}"
+    # DINOV3_TRACE_MARKERS makes the device scripts print step markers for the timeline
+    trace_env = f"{tracing.DEVICE_MARKERS_ENV}=1 " if tracer.enabled else ""
+    cmd = f"cd {REMOTE_BASE_DIR} && {trace_env}python3 device_orchestrator.py --model_id {model_id}"
     if args.auth_token:
         cmd += f" --auth_token {args.auth_token}"
-    exit_code, out, err = run_remote_command(ssh, cmd)
+    with tracing.span("device orchestrator"):
+        exit_code, out, err = run_remote_command(ssh, cmd)
+    tracer.add_device_events(out)
     
     print("\n--- Final Status ---")
     if exit_code == 0:
@@ -167,6 +186,7 @@ def main():
         print("Failure.")
         
     ssh.close()
+    tracing.save()
 
 if __name__ == "__main__":
     main()
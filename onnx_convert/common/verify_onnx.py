@@ -1,6 +1,11 @@
-import onnxruntime as ort
 import numpy as np
 import os
+import sys
+import time
+
+# Shared inference backends live in onnx_convert/scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../scripts"))
+import backends
 
 def verify_onnx():
     model_path = "dinov3.onnx"
@@ -9,28 +14,28 @@ def verify_onnx():
         return
 
     print(f"Verifying ONNX model: {model_path}")
+    backend = backends.OrtCpuBackend(model_path)
     try:
-        session = ort.InferenceSession(model_path)
+        t0 = time.time()
+        backend.open()
+        # Cold start writes the optimized model cache; later runs load it
+        print(f"Session start: {(time.time() - t0) * 1000:.1f} ms")
     except Exception as e:
         print(f"Failed to load ONNX model: {e}")
         return
 
-    input_name = session.get_inputs()[0].name
-    input_shape = session.get_inputs()[0].shape
+    input_name, input_shape, _ = backend.describe()["inputs"][0]
     print(f"Input name: {input_name}, Shape: {input_shape}")
     
     # Handle dynamic batch size if present (usually represented as string or -1)
     batch_size = 1
-    h, w = 224, 224
-    if len(input_shape) == 4:
-         # simple heuristic, assume NCHW
-         pass
+    h, w = backend.input_size()
     
     dummy_input = np.random.randn(batch_size, 3, h, w).astype(np.float32)
     
-    outputs = session.run(None, {input_name: dummy_input})
-    for i, out in enumerate(outputs):
-        print(f"Output {i} shape: {out.shape}")
+    outputs = backend.infer(dummy_input)
+    for i, (name, out) in enumerate(outputs.items()):
+        print(f"Output {i} ({name}) shape: {out.shape}")
     
     print("Verification execution successful.")
 
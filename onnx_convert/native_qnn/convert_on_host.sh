@@ -54,12 +54,20 @@ if ! command -v qnn-onnx-converter &> /dev/null; then
     exit 1
 fi
 
+# Extra converter flags (e.g. the recommendation from scripts/sweep_converter.py)
+# can be passed through QNN_CONVERTER_EXTRA_ARGS.
+CALIBRATION_ARGS="--input_list input_list.txt"
+case " $QNN_CONVERTER_EXTRA_ARGS " in
+    *" --float_fallback "*) CALIBRATION_ARGS="" ;; # float fallback must not be calibrated
+esac
+
 qnn-onnx-converter \
     --input_network "$ONNX_FILE" \
     --output_path "$OUTPUT_CPP" \
     --input_dim "pixel_values" 1,3,224,224 \
-    --input_list "input_list.txt" \
-    --no_simplification
+    $CALIBRATION_ARGS \
+    --no_simplification \
+    $QNN_CONVERTER_EXTRA_ARGS
 
 # Note: We rely on 'set -e' to exit if the above fails.
 
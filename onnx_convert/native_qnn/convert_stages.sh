@@ -0,0 +1,79 @@
+#!/bin/bash
+
+# Convert every pipeline stage exported by onnx_download/export_dinov3_stages.py
+# into its own QNN graph (src/stages/<name>_qnn.cpp + bin/stages/<name>_qnn.bin).
+# Usage: ./convert_stages.sh [model_variant]   (default: dinov3-vitb7b16)
+
+# Exit on error
+set -e
+
+if [ -z "$QNN_SDK_ROOT" ]; then
+    echo "Error: QNN_SDK_ROOT is not set."
+    echo "Please set it: export QNN_SDK_ROOT=/path/to/qairt/version"
+    exit 1
+fi
+
+echo "Using QNN_SDK_ROOT: $QNN_SDK_ROOT"
+
+if [ -f "$QNN_SDK_ROOT/bin/envsetup.sh" ]; then
+    source "$QNN_SDK_ROOT/bin/envsetup.sh"
+else
+    echo "Error: envsetup.sh not found at $QNN_SDK_ROOT/bin/envsetup.sh"
+    exit 1
+fi
+
+MODEL_VARIANT="${1:-dinov3-vitb7b16}"
+STAGE_DIR="../../onnx_download/${MODEL_VARIANT}/stages"
+MANIFEST="${STAGE_DIR}/stages.json"
+
+if [ ! -f "$MANIFEST" ]; then
+    echo "Error: $MANIFEST not found."
+    echo "Run: python3 export_dinov3_stages.py --output_dir ${MODEL_VARIANT}/stages (in onnx_download/)"
+    exit 1
+fi
+
+if ! command -v qnn-onnx-converter &> /dev/null; then
+    echo "Error: qnn-onnx-converter could not be found."
+    exit 1
+fi
+
+CALIBRATION_ENABLED=1
+case " $QNN_CONVERTER_EXTRA_ARGS " in
+    *" --float_fallback "*) CALIBRATION_ENABLED=0 ;; # float fallback must not be calibrated
+esac
+
+mkdir -p src/stages bin/stages calib_stages
+
+# One line per stage: <name> <onnx> <input name> <input dims (comma separated)>
+python3 -c "
+import json
+for s in json.load(open('$MANIFEST'))['stages']:
+    print(s['name'], s['onnx'], s['input']['name'], ','.join(str(d) for d in s['input']['dims']))
+" | while read -r STAGE_NAME STAGE_ONNX INPUT_NAME INPUT_DIMS; do
+    echo "--- Converting ${STAGE_NAME} (${INPUT_NAME} ${INPUT_DIMS}) ---"
+
+    # Dummy calibration data with the stage's input shape, as in convert_on_host.sh
+    CALIBRATION_ARGS=""
+    if [ "$CALIBRATION_ENABLED" = "1" ]; then
+        python3 -c "import numpy as np; np.zeros(($INPUT_DIMS), dtype=np.float32).tofile('calib_stages/${STAGE_NAME}.raw')"
+        echo "${INPUT_NAME}:=./calib_stages/${STAGE_NAME}.raw" > "calib_stages/${STAGE_NAME}_input_list.txt"
+        CALIBRATION_ARGS="--input_list calib_stages/${STAGE_NAME}_input_list.txt"
+    fi
+
+    qnn-onnx-converter \
+        --input_network "${STAGE_DIR}/${STAGE_ONNX}" \
+        --output_path "${STAGE_NAME}_qnn.cpp" \
+        --input_dim "$INPUT_NAME" "$INPUT_DIMS" \
+        $CALIBRATION_ARGS \
+        --no_simplification \
+        $QNN_CONVERTER_EXTRA_ARGS
+
+    mv "${STAGE_NAME}_qnn.cpp" src/stages/
+    mv "${STAGE_NAME}_qnn.bin" bin/stages/
+    if [ -f "${STAGE_NAME}_qnn_net.json" ]; then
+        mv "${STAGE_NAME}_qnn_net.json" src/stages/
+    fi
+done
+
+cp "$MANIFEST" src/stages/stages.json
+echo "Success! Stage graphs are in src/stages and bin/stages (deploy with scripts/deploy_stages.py)"
@@ -0,0 +1,490 @@
+import hashlib
+import json
+import os
+import platform
+import time
+
+import numpy as np
+
+import qnn_utils
+
+# Pluggable inference backends for DINOv3 features.
+# Every backend takes NCHW float32 pixel_values (N, 3, H, W) and returns
+# {"last_hidden_state": (N, tokens, hidden), "pooler_output": (N, hidden)}.
+#
+#   htp   - the IQ-9075 over SSH (qnn-net-run on the HTP, like inference.py)
+#   ort   - local ONNX Runtime CPU, tuned threads + IOBinding + cached optimized model
+#   fake  - deterministic host-only features for tests and UI work
+#   auto  - htp, failing over to ort when the device is unavailable
+#
+#   backend = backends.create_backend("auto", model_path="../onnx_download/dinov3-vitb16/dinov3.onnx")
+#   outputs = backend.infer(pixel_values)
+#
+# ort returns its IOBinding output buffers directly: they are overwritten by the
+# next infer() at the same batch size, so copy whatever is kept across calls.
+
+# Resolve onnx_convert/ relative paths so backends work from any directory
+ONNX_CONVERT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ORT_CACHE_DIR_NAME = ".ort_cache"
+ORT_TUNING_NAME = "ort_tuning.json"
+DEFAULT_MODEL_PATH = os.path.join(ONNX_CONVERT_DIR, "../onnx_download/dinov3-vitb16/dinov3.onnx")
+# Transport / device-unavailable only: a failing model run (bad input shape,
+# qnn-net-run error) is a bug to surface, not a reason to switch backends
+FAILOVER_ERRORS = (ConnectionError, TimeoutError)
+
+
+class BackendUnavailable(ConnectionError):
+    """Raised when a backend cannot be opened (e.g. the device is unreachable)."""
+
+
+class Backend:
+    """Common interface; subclasses implement _open/_infer and describe their tensors."""
+    name = "base"
+
+    def __init__(self):
+        self.opened = False
+        self.images_per_sec = None  # known/measured throughput, used when failing over
+
+    def open(self):
+        if not self.opened:
+            self._open()
+            self.opened = True
+        return self
+
+    def infer(self, pixel_values):
+        self.open()
+        pixel_values = np.ascontiguousarray(pixel_values, dtype=np.float32)
+        if pixel_values.ndim == 3:
+            pixel_values = pixel_values[None]
+        return self._infer(pixel_values)
+
+    def describe(self):
+        """{'inputs': [(name, shape, type)], 'outputs': [...]} of the model."""
+        self.open()
+        return self._describe()
+
+    def input_size(self):
+        """(H, W) expected by the model, defaulting to 224x224 for dynamic shapes."""
+        shape = self.describe()["inputs"][0][1]
+        h = shape[2] if len(shape) == 4 and isinstance(shape[2], int) else 224
+        w = shape[3] if len(shape) == 4 and isinstance(shape[3], int) else 224
+        return h, w
+
+    def close(self):
+        self.opened = False
+
+    def _open(self):
+        pass
+
+    def _infer(self, pixel_values):
+        raise NotImplementedError
+
+    def _describe(self):
+        raise NotImplementedError
+
+
+def model_cache_key(model_path):
+    """
+    Identify a model file + onnxruntime build + host CPU for the optimized-model
+    cache (fully optimized models may contain CPU-specific layouts).
+    """
+    import onnxruntime as ort
+
+    stat = os.stat(model_path)
+    raw = (f"{os.path.abspath(model_path)}:{stat.st_size}:{int(stat.st_mtime)}:{ort.__version__}:"
+           f"{platform.machine()}:{platform.processor()}:{os.cpu_count()}")
+    return hashlib.sha1(raw.encode()).hexdigest()[:12]
+
+
+class OrtCpuBackend(Backend):
+    """
+    ONNX Runtime on the host CPU. The first session writes an offline-optimized
+    copy of the model to .ort_cache/ next to it; later sessions load that copy
+    with graph optimizations disabled, which cuts session start time. Outputs
+    are written through IOBinding into buffers preallocated per batch size and
+    returned as-is; the next infer() at that batch size overwrites them.
+    """
+    name = "ort"
+
+    def __init__(self, model_path=DEFAULT_MODEL_PATH, intra_op_threads=None, inter_op_threads=None,
+                 cache_dir=None, use_cache=True):
+        super().__init__()
+        self.model_path = model_path
+        self.cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(model_path)), ORT_CACHE_DIR_NAME)
+        self.use_cache = use_cache
+        self.intra_op_threads = intra_op_threads
+        self.inter_op_threads = inter_op_threads
+        self.session = None
+        self.session_start_ms = None
+        self.output_buffers = {}
+
+    # --- cache / tuning -----------------------------------------------------
+
+    def _optimized_path(self):
+        stem = os.path.splitext(os.path.basename(self.model_path))[0]
+        return os.path.join(self.cache_dir, f"{stem}.{model_cache_key(self.model_path)}.opt.onnx")
+
+    def _tuning_path(self):
+        return os.path.join(self.cache_dir, ORT_TUNING_NAME)
+
+    def load_tuning(self):
+        path = self._tuning_path()
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f).get(model_cache_key(self.model_path))
+
+    def _save_tuning(self, entry):
+        path = self._tuning_path()
+        tunings = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                tunings = json.load(f)
+        tunings[model_cache_key(self.model_path)] = entry
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(tunings, f, indent=2)
+
+    def _session_options(self, intra, inter, optimize_to=None):
+        import onnxruntime as ort
+
+        so = ort.SessionOptions()
+        so.intra_op_num_threads = intra
+        so.inter_op_num_threads = inter
+        so.execution_mode = ort.ExecutionMode.ORT_PARALLEL if inter > 1 else ort.ExecutionMode.ORT_SEQUENTIAL
+        if optimize_to:
+            so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            so.optimized_model_filepath = optimize_to
+            # Large models (external data) keep their initializers next to the optimized copy
+            so.add_session_config_entry("session.optimized_model_external_initializers_file_name",
+                                        os.path.basename(optimize_to) + ".data")
+            so.add_session_config_entry("session.optimized_model_external_initializers_min_size_in_bytes", "1024")
+        else:
+            so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_DISABLE_ALL
+        return so
+
+    def _create_session(self, intra, inter):
+        import onnxruntime as ort
+
+        providers = ["CPUExecutionProvider"]
+        optimized = self._optimized_path()
+        if self.use_cache and os.path.exists(optimized):
+            return ort.InferenceSession(optimized, self._session_options(intra, inter), providers=providers)
+        if self.use_cache:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            try:
+                return ort.InferenceSession(self.model_path, self._session_options(intra, inter, optimized),
+                                            providers=providers)
+            except Exception as e:
+                print(f"[WARNING] Could not cache optimized model ({e}); using the original model")
+                for path in (optimized, optimized + ".data"):
+                    if os.path.exists(path):
+                        os.remove(path)
+        so = self._session_options(intra, inter)
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        return ort.InferenceSession(self.model_path, so, providers=providers)
+
+    def _open(self):
+        tuning = self.load_tuning() or {}
+        intra = self.intra_op_threads or tuning.get("intra_op_threads") or os.cpu_count() or 1
+        inter = self.inter_op_threads or tuning.get("inter_op_threads") or 1
+        self.images_per_sec = tuning.get("images_per_sec")
+        t0 = time.time()
+        self.session = self._create_session(intra, inter)
+        self.session_start_ms = (time.time() - t0) * 1000
+        self.output_buffers = {}
+
+    def tune(self, intra_candidates=None, inter_candidates=(1, 2), batch_size=1, repeats=3):
+        """
+        Benchmark intra/inter-op thread counts on a dummy batch and persist the
+        fastest pair (and its throughput) in .ort_cache/ort_tuning.json.
+        """
+        cpus = os.cpu_count() or 1
+        intra_candidates = intra_candidates or sorted({1, max(1, cpus // 2), cpus})
+        self.open()
+        h, w = self.input_size()
+        dummy = np.random.RandomState(0).randn(batch_size, 3, h, w).astype(np.float32)
+
+        results = []
+        for intra in intra_candidates:
+            for inter in inter_candidates:
+                self.session = self._create_session(intra, inter)
+                self.output_buffers = {}
+                self._infer(dummy)  # warm-up + output discovery
+                times = []
+                for _ in range(repeats):
+                    t0 = time.time()
+                    self._infer(dummy)
+                    times.append(time.time() - t0)
+                median = float(np.median(times))
+                results.append({"intra_op_threads": intra, "inter_op_threads": inter,
+                                "median_ms": median * 1000, "images_per_sec": batch_size / median})
+                print(f"[ORT] intra={intra:<3} inter={inter:<2} {median * 1000:8.2f} ms/batch")
+
+        best = min(results, key=lambda r: r["median_ms"])
+        best.update({"batch_size": batch_size, "cpu_count": cpus, "tuned_at": time.strftime("%Y-%m-%d %H:%M:%S")})
+        self._save_tuning(best)
+        self.intra_op_threads, self.inter_op_threads = best["intra_op_threads"], best["inter_op_threads"]
+        self.images_per_sec = best["images_per_sec"]
+        self.session = self._create_session(self.intra_op_threads, self.inter_op_threads)
+        self.output_buffers = {}
+        return best, results
+
+    # --- inference ----------------------------------------------------------
+
+    def _infer(self, pixel_values):
+        batch = pixel_values.shape[0]
+        input_name = self.session.get_inputs()[0].name
+        output_names = [o.name for o in self.session.get_outputs()]
+        binding = self.session.io_binding()
+        binding.bind_cpu_input(input_name, pixel_values)
+
+        buffers = self.output_buffers.get(batch)
+        if buffers is None:
+            # First run at this batch size discovers the concrete output shapes
+            for name in output_names:
+                binding.bind_output(name, "cpu")
+            self.session.run_with_iobinding(binding)
+            outputs = dict(zip(output_names, binding.copy_outputs_to_cpu()))
+            self.output_buffers[batch] = {name: np.empty_like(value) for name, value in outputs.items()}
+            return outputs
+
+        for name, buffer in buffers.items():
+            binding.bind_output(name, "cpu", element_type=buffer.dtype, shape=buffer.shape,
+                                buffer_ptr=buffer.ctypes.data)
+        self.session.run_with_iobinding(binding)
+        return dict(buffers)
+
+    def _describe(self):
+        return {
+            "inputs": [(i.name, i.shape, i.type) for i in self.session.get_inputs()],
+            "outputs": [(o.name, o.shape, o.type) for o in self.session.get_outputs()],
+        }
+
+    def close(self):
+        self.session = None
+        self.output_buffers = {}
+        super().close()
+
+
+class HtpDeviceBackend(Backend):
+    """qnn-net-run on the IQ-9075 HTP over SSH (same flow as inference.py)."""
+    name = "htp"
+
+    def __init__(self, hidden_size=None, device=None):
+        super().__init__()
+        self.hidden_size = hidden_size
+        # An inventory entry (devices.py); None means the default board
+        self.device = device
+        self.net_json = os.path.join(ONNX_CONVERT_DIR, qnn_utils.NET_JSON_PATH)
+        self.ssh = None
+        self.sftp = None
+
+    def _open(self):
+        import devices
+        from inference import create_ssh_client
+
+        self.device = self.device or devices.get_device()
+        self.ssh = create_ssh_client(self.device["host"], self.device["port"], self.device["username"], self.device["password"])
+        if not self.ssh:
+            raise BackendUnavailable(f"device {self.device['name']} ({self.device['host']}) is unreachable")
+        self.sftp = self.ssh.open_sftp()
+
+    def _infer(self, pixel_values):
+        try:
+            return self._net_run(pixel_values)
+        except Exception as e:
+            # Only a dead link fails over; errors on a live session are real failures
+            transport = self.ssh.get_transport()
+            if transport is None or not transport.is_active():
+                raise BackendUnavailable(f"lost connection to {self.device['name']} ({e})") from e
+            raise
+
+    def _net_run(self, pixel_values):
+        from inference import run_command
+
+        base_dir = self.device["base_dir"]
+        work_dir = f"{base_dir}/test/backend"
+        run_command(self.ssh, f"rm -rf {work_dir} && mkdir -p {work_dir}", print_output=False)
+        lines = []
+        for i, image in enumerate(pixel_values):
+            remote_raw = f"{work_dir}/input_{i}.raw"
+            with self.sftp.open(remote_raw, "wb") as f:
+                f.write(qnn_utils.to_graph_layout(image[None], self.net_json).tobytes())
+            lines.append(f"pixel_values:={remote_raw}")
+        with self.sftp.open(f"{work_dir}/input_list.txt", "w") as f:
+            f.write("\n".join(lines) + "\n")
+
+        net_run = qnn_utils.net_run_invocation(
+            base_dir, f"{base_dir}/bin/libdinov3.so", f"{work_dir}/input_list.txt",
+            f"{work_dir}/output", **qnn_utils.tuned_net_run_args(
+                base_dir, qnn_utils.load_htp_tuning(os.path.join(ONNX_CONVERT_DIR, qnn_utils.HTP_TUNING_PATH))))
+        cmd = " && ".join([f"cd {base_dir}"] + qnn_utils.htp_env_exports(base_dir) + [net_run])
+        exit_code, _, err = run_command(self.ssh, cmd, print_output=False)
+        if exit_code != 0:
+            raise RuntimeError(f"qnn-net-run failed: {err}")
+
+        results = {name: [] for name in qnn_utils.OUTPUT_NAMES}
+        for i in range(len(pixel_values)):
+            for name in qnn_utils.OUTPUT_NAMES:
+                with self.sftp.open(f"{work_dir}/output/Result_{i}/{name}.raw", "rb") as f:
+                    results[name].append(np.frombuffer(f.read(), dtype=np.float32))
+        pooler = np.stack(results["pooler_output"])
+        hidden = self.hidden_size or pooler.shape[-1]
+        return {
+            "last_hidden_state": np.stack(results["last_hidden_state"]).reshape(len(pixel_values), -1, hidden),
+            "pooler_output": pooler,
+        }
+
+    def _describe(self):
+        dims, _ = qnn_utils.load_tensor_dims("pixel_values", self.net_json)
+        nchw = [dims[0], dims[3], dims[1], dims[2]] if len(dims) == 4 else dims
+        return {"inputs": [("pixel_values", nchw, "tensor(float)")],
+                "outputs": [(name, None, "tensor(float)") for name in qnn_utils.OUTPUT_NAMES]}
+
+    def close(self):
+        if self.sftp:
+            self.sftp.close()
+        if self.ssh:
+            self.ssh.close()
+        self.ssh = self.sftp = None
+        super().close()
+
+
+class FakeBackend(Backend):
+    """
+    Deterministic stand-in: patch pixels projected by a fixed random matrix,
+    so identical images give identical, spatially meaningful features.
+    """
+    name = "fake"
+
+    def __init__(self, hidden_size=768, num_register_tokens=4, patch_size=qnn_utils.PATCH_SIZE, image_size=224, seed=0):
+        super().__init__()
+        self.hidden_size = hidden_size
+        self.num_register_tokens = num_register_tokens
+        self.patch_size = patch_size
+        self.image_size = image_size
+        rng = np.random.RandomState(seed)
+        self.projection = rng.randn(3 * patch_size * patch_size, hidden_size).astype(np.float32) / np.sqrt(hidden_size)
+        self.registers = rng.randn(num_register_tokens, hidden_size).astype(np.float32)
+        self.images_per_sec = float("inf")
+
+    def _infer(self, pixel_values):
+        n, c, h, w = pixel_values.shape
+        p = self.patch_size
+        patches = pixel_values.reshape(n, c, h // p, p, w // p, p).transpose(0, 2, 4, 1, 3, 5).reshape(n, -1, c * p * p)
+        patch_tokens = np.tanh(patches @ self.projection)
+        cls = patch_tokens.mean(axis=1, keepdims=True)
+        registers = np.broadcast_to(self.registers, (n,) + self.registers.shape)
+        tokens = np.concatenate([cls, registers, patch_tokens], axis=1).astype(np.float32)
+        return {"last_hidden_state": tokens, "pooler_output": tokens[:, 0].copy()}
+
+    def _describe(self):
+        s = self.image_size
+        tokens = 1 + self.num_register_tokens + (s // self.patch_size) ** 2
+        return {"inputs": [("pixel_values", [1, 3, s, s], "tensor(float)")],
+                "outputs": [("last_hidden_state", [1, tokens, self.hidden_size], "tensor(float)"),
+                            ("pooler_output", [1, self.hidden_size], "tensor(float)")]}
+
+
+class FailoverBackend(Backend):
+    """Use the primary backend, switching to the fallback for good if it fails."""
+    name = "auto"
+
+    def __init__(self, primary, fallback):
+        super().__init__()
+        self.primary = primary
+        self.fallback = fallback
+        self.active = primary
+
+    def _fail_over(self, error):
+        self.fallback.open()
+        rate = f"{self.fallback.images_per_sec:.1f} images/s" if self.fallback.images_per_sec else "untuned throughput"
+        print(f"[FAILOVER] {self.primary.name} unavailable ({error}); using {self.fallback.name} ({rate})")
+        self.active = self.fallback
+        self.images_per_sec = self.fallback.images_per_sec
+
+    def _open(self):
+        try:
+            self.primary.open()
+            self.images_per_sec = self.primary.images_per_sec
+        except FAILOVER_ERRORS as e:
+            self._fail_over(e)
+
+    def _infer(self, pixel_values):
+        if self.active is self.primary:
+            try:
+                return self.primary.infer(pixel_values)
+            except FAILOVER_ERRORS as e:
+                self._fail_over(e)
+        return self.active.infer(pixel_values)
+
+    def _describe(self):
+        return self.active.describe()
+
+    def close(self):
+        self.primary.close()
+        self.fallback.close()
+        super().close()
+
+
+BACKENDS = ["htp", "ort", "fake", "auto"]
+_backend_cache = {}
+
+
+def create_backend(name, model_path=DEFAULT_MODEL_PATH, **kwargs):
+    """Create (or reuse, within this process) a backend by name."""
+    key = (name, os.path.abspath(model_path) if model_path else None, tuple(sorted(kwargs.items())))
+    if key in _backend_cache:
+        return _backend_cache[key]
+    if name == "ort":
+        backend = OrtCpuBackend(model_path, **kwargs)
+    elif name == "htp":
+        backend = HtpDeviceBackend(**kwargs)
+    elif name == "fake":
+        backend = FakeBackend(**kwargs)
+    elif name == "auto":
+        backend = FailoverBackend(HtpDeviceBackend(), OrtCpuBackend(model_path, **kwargs))
+    else:
+        raise ValueError(f"Unknown backend '{name}' (choose from {', '.join(BACKENDS)})")
+    _backend_cache[key] = backend
+    return backend
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Tune / benchmark DINOv3 inference backends")
+    parser.add_argument("--backend", default="ort", choices=BACKENDS)
+    parser.add_argument("--model_path", default=DEFAULT_MODEL_PATH, help="ONNX model for the ort backend")
+    parser.add_argument("--tune", action="store_true", help="Tune ORT intra/inter-op threads and persist the result")
+    parser.add_argument("--batch_size", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.tune:
+        best, _ = OrtCpuBackend(args.model_path).tune(batch_size=args.batch_size, repeats=args.repeats)
+        print(f"Best: intra={best['intra_op_threads']} inter={best['inter_op_threads']} "
+              f"({best['images_per_sec']:.2f} images/s), saved to {ORT_CACHE_DIR_NAME}/{ORT_TUNING_NAME}")
+        return
+
+    backend = create_backend(args.backend, args.model_path)
+    t0 = time.time()
+    backend.open()
+    print(f"[TIME] Backend Open    : {(time.time() - t0) * 1000:.2f} ms")
+    h, w = backend.input_size()
+    dummy = np.random.RandomState(0).randn(args.batch_size, 3, h, w).astype(np.float32)
+    backend.infer(dummy)
+    times = []
+    for _ in range(args.repeats):
+        t0 = time.time()
+        outputs = backend.infer(dummy)
+        times.append(time.time() - t0)
+    print(f"[TIME] Inference       : {np.median(times) * 1000:.2f} ms/batch (median of {args.repeats})")
+    for name, value in outputs.items():
+        print(f"  {name}: {value.shape}")
+    backend.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+import argparse
+import json
+import os
+import re
+import time
+
+import numpy as np
+
+import devices
+import qnn_utils
+from inference import connect_device, run_command, stage_input, preprocess_to_graph_buffer, read_remote_array
+
+# Host-side vs device-side preprocessing benchmark.
+# "host" uploads the preprocessed float32 tensor (602 KB for 224x224);
+# "device" uploads the encoded image and runs device_preprocess.py before
+# qnn-net-run. Both modes run the same qnn-net-run and download the same
+# outputs, so the difference is link bytes + where decode/normalize happens.
+# Also checks that the device-produced tensor matches host preprocessing.
+#
+# Usage (from onnx_convert/, after deploy.py):
+#   python3 scripts/bench_preprocess.py test/test_image.jpg --repeats 5
+#   python3 scripts/bench_preprocess.py frames/*.jpg --json bench_preprocess.json
+
+MODES = ("host", "device")
+DEVICE_PREPROCESS_PATTERN = re.compile(r"\[TIME\] Device Preprocess\s*:\s*([\d.]+) ms")
+
+
+def run_once(ssh, sftp, base_dir, image_path, mode, tuning_args):
+    remote_dir = f"{base_dir}/test/bench_{mode}"
+    remote_input_list = f"{remote_dir}/input_list.txt"
+    t0 = time.perf_counter()
+    pre_commands, up_bytes = stage_input(sftp, base_dir, image_path, remote_dir, remote_input_list, mode == "device")
+    t_upload = time.perf_counter()
+    net_run = qnn_utils.net_run_invocation(
+        base_dir, f"{base_dir}/bin/libdinov3.so", remote_input_list, f"{remote_dir}/output",
+        profiling_level="basic", **tuning_args)
+    cmd = " && ".join([f"cd {base_dir}"] + pre_commands + qnn_utils.htp_env_exports(base_dir) + [net_run])
+    exit_code, out, err = run_command(ssh, cmd, print_output=False)
+    if exit_code != 0:
+        raise RuntimeError(f"{mode} run failed for {image_path}: {err}")
+    t_exec = time.perf_counter()
+    down_bytes = 0
+    for name in qnn_utils.OUTPUT_NAMES:
+        down_bytes += read_remote_array(sftp, f"{remote_dir}/output/Result_0/{name}.raw").nbytes
+    t_end = time.perf_counter()
+
+    log = out + "\n" + err
+    device_pre = DEVICE_PREPROCESS_PATTERN.search(log)
+    return {
+        "up_bytes": up_bytes,
+        "down_bytes": down_bytes,
+        "e2e_ms": (t_end - t0) * 1000,
+        "stage_ms": (t_upload - t0) * 1000,
+        "exec_ms": (t_exec - t_upload) * 1000,
+        "inference_ms": qnn_utils.parse_inference_time_ms(log),
+        "device_preprocess_ms": float(device_pre.group(1)) if device_pre else None,
+    }
+
+
+def check_parity(sftp, base_dir, image_path):
+    """Max abs difference between the device-preprocessed tensor and host preprocessing."""
+    device = read_remote_array(sftp, f"{base_dir}/test/bench_device/input_0.raw")
+    host = preprocess_to_graph_buffer(image_path).ravel()
+    return float(np.abs(device - host).max())
+
+
+def summarize(runs):
+    def avg(key):
+        values = [r[key] for r in runs if r[key] is not None]
+        return float(np.mean(values)) if values else None
+    return {key: avg(key) for key in runs[0]}
+
+
+def print_table(results):
+    print(f"\n{'Image':<28} {'Mode':<7} {'Up (KB)':>9} {'Down (KB)':>10} {'Stage (ms)':>11} "
+          f"{'Exec (ms)':>10} {'Dev pre (ms)':>13} {'E2E (ms)':>9}")
+    for image, modes in results.items():
+        for mode, s in modes["modes"].items():
+            dev_pre = f"{s['device_preprocess_ms']:.1f}" if s["device_preprocess_ms"] is not None else "-"
+            print(f"{os.path.basename(image)[:28]:<28} {mode:<7} {s['up_bytes'] / 1024:>9.1f} "
+                  f"{s['down_bytes'] / 1024:>10.1f} {s['stage_ms']:>11.1f} {s['exec_ms']:>10.1f} "
+                  f"{dev_pre:>13} {s['e2e_ms']:>9.1f}")
+        host, device = modes["modes"]["host"], modes["modes"]["device"]
+        print(f"{'':<28} link bytes x{host['up_bytes'] / device['up_bytes']:.1f} smaller, "
+              f"e2e {host['e2e_ms'] - device['e2e_ms']:+.1f} ms for device mode, "
+              f"parity max|diff| {modes['parity_max_abs_diff']:.3g}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark host- vs device-side preprocessing on IQ-9075")
+    parser.add_argument("images", nargs="+", help="Encoded images to benchmark")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed runs per image and mode (after one warm-up)")
+    parser.add_argument("--json", help="Write the per-image summary to this file")
+    args = parser.parse_args()
+
+    device = devices.select_device()
+    base_dir = device["base_dir"]
+    print(f"--- Connecting to {device['host']} ---")
+    ssh = connect_device(device)
+    if not ssh:
+        return
+    sftp = ssh.open_sftp()
+    run_command(ssh, " && ".join(f"mkdir -p {base_dir}/test/bench_{mode}" for mode in MODES), print_output=False)
+    tuning_args = qnn_utils.tuned_net_run_args(base_dir, qnn_utils.load_htp_tuning())
+
+    results = {}
+    try:
+        for image in args.images:
+            print(f"--- {image} ---")
+            modes = {}
+            for mode in MODES:
+                run_once(ssh, sftp, base_dir, image, mode, tuning_args)  # warm-up (page cache, HTP power-up)
+                modes[mode] = summarize([run_once(ssh, sftp, base_dir, image, mode, tuning_args) for _ in range(args.repeats)])
+            results[image] = {"modes": modes, "parity_max_abs_diff": check_parity(sftp, base_dir, image)}
+    except RuntimeError as e:
+        print(f"Benchmark failed: {e}")
+    finally:
+        sftp.close()
+        ssh.close()
+
+    if results:
+        print_table(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Saved {args.json}")
+
+
+if __name__ == "__main__":
+    main()
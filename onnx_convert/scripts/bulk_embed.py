@@ -0,0 +1,285 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+
+import backends
+from preprocess_input import preprocess_array
+from result_store import ResultStore, fsync_write
+from stream_inference import list_images
+
+# Checkpointed, resumable bulk embedding over large datasets.
+# The image list is frozen into the job directory at the first start and cut
+# into fixed chunks. Each finished chunk is sealed as its own shard of a
+# result store (result_store.py: atomic, fsync'd writes) and only then
+# committed by appending a line to journal.jsonl (fsync'd). After a dropped link, crash or reboot,
+# re-running the same command skips every committed chunk; a shard written
+# but not yet journaled is simply rewritten under the same name, so retries
+# are idempotent and committed shards are never modified.
+#
+# Job directory layout:
+#   job.json                 - frozen job parameters
+#   images.txt               - the dataset listing, one path per line (row order)
+#   journal.jsonl            - one line per committed chunk
+#   store/                   - fp16 result store, shard 000123 = chunk 123 (ids = image paths)
+#
+# Usage (from onnx_convert/):
+#   python3 scripts/bulk_embed.py dataset/ --job_dir jobs/dataset --backend auto --chunk_size 256
+#   python3 scripts/bulk_embed.py dataset/ --job_dir jobs/dataset          # resume after an interruption
+#   python3 scripts/bulk_embed.py --job_dir jobs/dataset --status
+
+JOB_FILE = "job.json"
+IMAGES_FILE = "images.txt"
+JOURNAL_FILE = "journal.jsonl"
+STORE_DIR = "store"
+DEFAULT_CHUNK_SIZE = 256
+
+
+class JobJournal:
+    """
+    Append-only record of committed chunks; a torn last line (crash mid-write)
+    is dropped. read_only (--status) parses it without truncating or opening
+    it for writing, so inspecting a job never touches its resume state.
+    """
+
+    def __init__(self, path, read_only=False):
+        self.path = path
+        self.committed = {}
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                lines = f.read().split(b"\n")
+            valid = 0
+            for line in lines:
+                if not line.strip():
+                    continue
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    break
+                self.committed[entry["chunk"]] = entry
+                valid += len(line) + 1
+            if not read_only:
+                with open(path, "r+b") as f:
+                    f.truncate(valid)
+        self.f = None if read_only else open(path, "a")
+
+    def commit(self, entry):
+        self.f.write(json.dumps(entry) + "\n")
+        self.f.flush()
+        os.fsync(self.f.fileno())
+        self.committed[entry["chunk"]] = entry
+
+    def close(self):
+        if self.f:
+            self.f.close()
+
+
+class BulkJob:
+    def __init__(self, job_dir, read_only=False):
+        self.job_dir = job_dir
+        with open(os.path.join(job_dir, JOB_FILE)) as f:
+            self.config = json.load(f)
+        with open(os.path.join(job_dir, IMAGES_FILE)) as f:
+            self.images = f.read().splitlines()
+        self.chunk_size = self.config["chunk_size"]
+        self.num_chunks = (len(self.images) + self.chunk_size - 1) // self.chunk_size
+        self.journal = JobJournal(os.path.join(job_dir, JOURNAL_FILE), read_only)
+        self.store = ResultStore(os.path.join(job_dir, STORE_DIR), "fp16", self.chunk_size)
+
+    @classmethod
+    def create(cls, job_dir, images, chunk_size, backend, outputs):
+        """Freeze a new job, or reopen an existing one (checking it is the same job)."""
+        listing = "\n".join(images) + "\n"
+        digest = hashlib.sha256(listing.encode()).hexdigest()
+        job_path = os.path.join(job_dir, JOB_FILE)
+        if os.path.exists(job_path):
+            job = cls(job_dir)
+            if images and job.config["listing_sha256"] != digest:
+                print(f"Warning: dataset listing changed since the job started; "
+                      f"continuing with the frozen list of {len(job.images)} images")
+            if chunk_size and chunk_size != job.chunk_size:
+                raise ValueError(f"Job {job_dir} uses --chunk_size {job.chunk_size}; "
+                                 f"start a new --job_dir to change it")
+            return job
+        if not images:
+            raise ValueError(f"No job in {job_dir} and no images to start one")
+        chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        os.makedirs(job_dir, exist_ok=True)
+        fsync_write(os.path.join(job_dir, IMAGES_FILE), listing.encode())
+        config = {"num_images": len(images), "chunk_size": chunk_size, "backend": backend,
+                  "outputs": outputs, "listing_sha256": digest, "created": time.time()}
+        fsync_write(job_path, json.dumps(config, indent=2).encode())
+        return cls(job_dir)
+
+    @staticmethod
+    def shard_name(chunk):
+        return f"{chunk:06d}"
+
+    def chunk_rows(self, chunk):
+        return range(chunk * self.chunk_size, min((chunk + 1) * self.chunk_size, len(self.images)))
+
+    def is_committed(self, chunk):
+        entry = self.journal.committed.get(chunk)
+        # A journaled chunk whose shard is missing from the store is redone
+        return entry is not None and (entry["rows"] == 0 or self.store.has_shard(self.shard_name(chunk)))
+
+    def pending_chunks(self):
+        return [c for c in range(self.num_chunks) if not self.is_committed(c)]
+
+    def done_images(self):
+        return sum(len(self.chunk_rows(c)) for c in range(self.num_chunks) if self.is_committed(c))
+
+    def write_chunk(self, chunk, rows, outputs, skipped, elapsed):
+        if rows:
+            self.store.write_shard(self.shard_name(chunk), [self.images[r] for r in rows], outputs)
+        self.journal.commit({"chunk": chunk, "rows": len(rows), "skipped": skipped,
+                             "elapsed_s": round(elapsed, 3), "time": time.time()})
+
+    def close(self):
+        self.journal.close()
+
+
+def format_eta(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+class Progress:
+    """Progress / throughput / ETA over the chunks processed in this session."""
+
+    def __init__(self, total, done):
+        self.total = total
+        self.done = done
+        self.session_images = 0
+        self.start = time.time()
+
+    def update(self, images):
+        self.done += images
+        self.session_images += images
+        elapsed = time.time() - self.start
+        rate = self.session_images / elapsed if elapsed > 0 else 0.0
+        eta = format_eta((self.total - self.done) / rate) if rate > 0 else "-"
+        print(f"[PROGRESS] {self.done}/{self.total} ({self.done / self.total * 100:.1f}%)  "
+              f"{rate:.2f} images/s  ETA {eta}")
+
+
+def embed_chunk(backend, paths, image_size, batch_size, outputs):
+    """Preprocess + infer one chunk; unreadable images are skipped and reported by index."""
+    kept, skipped, pixel_values = [], [], []
+    for i, path in enumerate(paths):
+        try:
+            pixel_values.append(preprocess_array(path, image_size))
+            kept.append(i)
+        except OSError as e:
+            print(f"Warning: skipping {path} ({e})")
+            skipped.append(i)
+    results = {name: [] for name in outputs}
+    for start in range(0, len(pixel_values), batch_size):
+        batch = backend.infer(np.concatenate(pixel_values[start:start + batch_size]))
+        for name in outputs:
+            results[name].append(batch[name].copy())  # ort reuses its output buffers
+    return kept, skipped, {name: np.concatenate(v) for name, v in results.items() if v}
+
+
+def run_job(job, backend, batch_size=8, retries=3, retry_wait=10.0):
+    """Process every uncommitted chunk in order. Returns True when the job is complete."""
+    outputs = job.config["outputs"]
+    pending = job.pending_chunks()
+    progress = Progress(len(job.images), job.done_images())
+    if len(pending) < job.num_chunks:
+        print(f"--- Resuming: {job.num_chunks - len(pending)}/{job.num_chunks} chunks already committed ---")
+    image_size = backend.input_size()[0]
+    for chunk in pending:
+        rows = job.chunk_rows(chunk)
+        paths = [job.images[r] for r in rows]
+        for attempt in range(retries + 1):
+            t0 = time.time()
+            try:
+                kept, skipped, results = embed_chunk(backend, paths, image_size, batch_size, outputs)
+                break
+            except backends.FAILOVER_ERRORS as e:
+                backend.close()
+                if attempt == retries:
+                    print(f"Chunk {chunk} failed after {retries} retries ({e}). "
+                          f"Progress is saved; re-run the same command to resume.")
+                    return False
+                print(f"[RETRY] chunk {chunk} failed ({e}); reconnecting in {retry_wait:.0f} s")
+                time.sleep(retry_wait)
+        job.write_chunk(chunk, [rows[i] for i in kept], results, [rows[i] for i in skipped], time.time() - t0)
+        progress.update(len(rows))
+    return True
+
+
+def print_status(job):
+    committed = [job.journal.committed[c] for c in range(job.num_chunks) if job.is_committed(c)]
+    done = job.done_images()
+    print(f"Job {job.job_dir}: {done}/{len(job.images)} images, {len(committed)}/{job.num_chunks} chunks committed")
+    if committed:
+        busy = sum(e["elapsed_s"] for e in committed)
+        skipped = sum(len(e["skipped"]) for e in committed)
+        rate = done / busy if busy > 0 else 0.0
+        eta = format_eta((len(job.images) - done) / rate) if rate > 0 else "-"
+        print(f"Average {rate:.2f} images/s while running, {skipped} unreadable images skipped, ETA {eta}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checkpointed, resumable bulk embedding of an image dataset")
+    parser.add_argument("source", nargs="?", help="Directory of images or a glob pattern (omit to resume/inspect)")
+    parser.add_argument("--job_dir", required=True, help="Job directory (journal + result store)")
+    parser.add_argument("--backend", default="auto", choices=backends.BACKENDS, help="Backend for a new job (fixed per job)")
+    parser.add_argument("--model_path", default=backends.DEFAULT_MODEL_PATH)
+    parser.add_argument("--chunk_size", type=int, help=f"Images per committed chunk (default {DEFAULT_CHUNK_SIZE}; fixed per job)")
+    parser.add_argument("--batch_size", type=int, default=8, help="Images per backend call")
+    parser.add_argument("--patches", action="store_true", help="Also store last_hidden_state (large)")
+    parser.add_argument("--retries", type=int, default=3, help="Reconnect attempts per chunk before stopping")
+    parser.add_argument("--retry_wait", type=float, default=10.0, help="Seconds between reconnect attempts")
+    parser.add_argument("--status", action="store_true", help="Print job progress and exit")
+    args = parser.parse_args()
+
+    if args.status:
+        if not os.path.exists(os.path.join(args.job_dir, JOB_FILE)):
+            print(f"Error: no job in {args.job_dir}")
+            return
+        job = BulkJob(args.job_dir, read_only=True)
+        try:
+            print_status(job)
+        finally:
+            job.close()
+        return
+
+    images = list_images(args.source) if args.source else []
+    if args.source and not images:
+        print(f"Error: no images found in {args.source}")
+        return
+    outputs = ["pooler_output", "last_hidden_state"] if args.patches else ["pooler_output"]
+    try:
+        job = BulkJob.create(args.job_dir, images, args.chunk_size, args.backend, outputs)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    try:
+        print(f"--- Job {args.job_dir}: {len(job.images)} images in {job.num_chunks} chunks of {job.chunk_size} "
+              f"({job.config['backend']} backend) ---")
+        backend = backends.create_backend(job.config["backend"], model_path=args.model_path).open()
+        start = time.time()
+        try:
+            complete = run_job(job, backend, args.batch_size, args.retries, args.retry_wait)
+        except KeyboardInterrupt:
+            complete = False
+            print("\nInterrupted. Progress is saved; re-run the same command to resume.")
+        finally:
+            backend.close()
+        print(f"[TIME] Session: {time.time() - start:.1f} s")
+        print_status(job)
+        if complete:
+            job.store.write_index()
+            print(f"Job complete. Results in {job.store.path} (result_store.py info {job.store.path})")
+    finally:
+        job.close()
+
+
+if __name__ == "__main__":
+    main()
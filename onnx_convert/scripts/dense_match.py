@@ -0,0 +1,204 @@
+import argparse
+import os
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+import qnn_utils
+from feature_utils import normalize
+from patch_store import PatchStore, TokenLayout
+
+# Dense patch-to-patch similarity and correspondences between images.
+# Patch tokens are L2-normalized once; every similarity is then a dot
+# product, computed as blocked matmuls (rows of A in blocks of `block`
+# against all of B) so memory stays at block x N_B floats even for
+# high-resolution grids. One pass over the blocks yields the top-k matches
+# of every A patch and the best A patch of every B patch, which together give
+# mutual nearest neighbours (MNN) without the full N_A x N_B matrix.
+#
+# Features can come from:
+#   - the PyTorch path: x_norm_patchtokens, a (1, N, D) torch tensor or array
+#   - device / ORT outputs: last_hidden_state (1, tokens, D), split by TokenLayout
+#   - a patch store: (gh, gw, D) grids
+#
+# Usage (from onnx_convert/):
+#   python3 scripts/dense_match.py --patches dataset.patches dataset/a.jpg dataset/b.jpg --k 3 --plot matches.png
+#   python3 scripts/dense_match.py --results output_results/Result_0 output_results/Result_1 --image_a a.jpg --image_b b.jpg
+
+DEFAULT_BLOCK_ROWS = 1024
+MAX_DRAWN_MATCHES = 50
+
+
+def to_numpy(features):
+    """numpy array from a torch tensor (any device) or array-like."""
+    if hasattr(features, "detach"):
+        features = features.detach().float().cpu().numpy()
+    return np.asarray(features)
+
+
+def as_patch_grid(features, layout=None, grid_hw=None):
+    """
+    (gh, gw, D) patch grid from any supported feature form:
+    (gh, gw, D) grids, (N, D) patch tokens with grid_hw, or full
+    last_hidden_state tokens (CLS + registers + patches) with a TokenLayout.
+    A leading batch dimension of 1 is dropped.
+    """
+    features = to_numpy(features)
+    if features.ndim == 4 or (features.ndim == 3 and features.shape[0] == 1):
+        features = features[0]
+    if features.ndim == 3:
+        return features
+    if layout is not None and features.shape[0] == layout.num_tokens:
+        return layout.split(features)[2]
+    grid_hw = grid_hw or (layout.grid_hw if layout is not None else None)
+    if grid_hw is None or grid_hw[0] * grid_hw[1] != features.shape[0]:
+        raise ValueError(f"Cannot place {features.shape[0]} tokens on a patch grid {grid_hw}; pass grid_hw or a layout")
+    return features.reshape(*grid_hw, features.shape[-1])
+
+
+def normalize_patches(grid):
+    """(N, D) float32 unit-length patch tokens, row-major over the grid."""
+    return normalize(np.asarray(grid).reshape(-1, grid.shape[-1]))
+
+
+def similarity_blocks(a, b, block=DEFAULT_BLOCK_ROWS):
+    """Yield (first row, (rows, N_B) cosine block) of the A x B similarity matrix."""
+    bt = np.ascontiguousarray(b.T)
+    for start in range(0, len(a), block):
+        yield start, a[start:start + block] @ bt
+
+
+def similarity_matrix(a, b, block=DEFAULT_BLOCK_ROWS):
+    """Full (N_A, N_B) cosine matrix (only when it fits in memory)."""
+    out = np.empty((len(a), len(b)), dtype=np.float32)
+    for start, scores in similarity_blocks(a, b, block):
+        out[start:start + len(scores)] = scores
+    return out
+
+
+def similarity_heatmaps(grid, queries_yx):
+    """(Q, gh, gw) similarity of each query patch (y, x) to every patch of the same image."""
+    gh, gw = grid.shape[:2]
+    flat = normalize_patches(grid)
+    idx = [y * gw + x for y, x in queries_yx]
+    return (flat[idx] @ flat.T).reshape(len(idx), gh, gw)
+
+
+class Matches:
+    """Top-k A->B matches plus the best A patch of every B patch, from one blocked pass."""
+
+    def __init__(self, topk_index, topk_score, best_a_for_b, best_a_score, grid_a, grid_b):
+        self.topk_index = topk_index  # (N_A, k) indices into B
+        self.topk_score = topk_score  # (N_A, k)
+        self.best_a_for_b = best_a_for_b  # (N_B,)
+        self.best_a_score = best_a_score  # (N_B,)
+        self.grid_a = grid_a
+        self.grid_b = grid_b
+
+    def mutual(self, min_score=-1.0):
+        """(ia, ib, score) arrays of mutual nearest neighbours above min_score."""
+        ia = np.arange(len(self.topk_index))
+        ib = self.topk_index[:, 0]
+        keep = (self.best_a_for_b[ib] == ia) & (self.topk_score[:, 0] >= min_score)
+        order = np.argsort(-self.topk_score[keep, 0])
+        return ia[keep][order], ib[keep][order], self.topk_score[keep, 0][order]
+
+    @staticmethod
+    def to_yx(index, grid_hw):
+        return np.stack(np.divmod(index, grid_hw[1]), axis=-1)
+
+
+def match(features_a, features_b, k=1, block=DEFAULT_BLOCK_ROWS, layout=None, grid_hw=None):
+    """Dense A->B matching: top-k per A patch and MNN support (see Matches)."""
+    grid_a = as_patch_grid(features_a, layout, grid_hw)
+    grid_b = as_patch_grid(features_b, layout, grid_hw)
+    a, b = normalize_patches(grid_a), normalize_patches(grid_b)
+    k = min(k, len(b))
+    topk_index = np.empty((len(a), k), dtype=np.int64)
+    topk_score = np.empty((len(a), k), dtype=np.float32)
+    best_a_for_b = np.zeros(len(b), dtype=np.int64)
+    best_a_score = np.full(len(b), -np.inf, dtype=np.float32)
+    for start, scores in similarity_blocks(a, b, block):
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        part_scores = np.take_along_axis(scores, part, axis=1)
+        order = np.argsort(-part_scores, axis=1)
+        topk_index[start:start + len(scores)] = np.take_along_axis(part, order, axis=1)
+        topk_score[start:start + len(scores)] = np.take_along_axis(part_scores, order, axis=1)
+        col_best = scores.argmax(axis=0)
+        col_score = scores[col_best, np.arange(len(b))]
+        better = col_score > best_a_score
+        best_a_for_b[better] = col_best[better] + start
+        best_a_score[better] = col_score[better]
+    return Matches(topk_index, topk_score, best_a_for_b, best_a_score, grid_a.shape[:2], grid_b.shape[:2])
+
+
+def draw_matches(image_a, image_b, matches, ia, ib, path, patch_size=qnn_utils.PATCH_SIZE):
+    """Side-by-side images at model resolution (grid x patch_size) with lines between matched patch centres."""
+    def panel(image, grid_hw):
+        size = (grid_hw[1] * patch_size, grid_hw[0] * patch_size)
+        return Image.open(image).convert("RGB").resize(size) if image else Image.new("RGB", size, "gray")
+
+    a, b = panel(image_a, matches.grid_a), panel(image_b, matches.grid_b)
+    canvas = Image.new("RGB", (a.width + b.width, max(a.height, b.height)))
+    canvas.paste(a, (0, 0))
+    canvas.paste(b, (a.width, 0))
+    draw = ImageDraw.Draw(canvas)
+    for (ya, xa), (yb, xb) in zip(Matches.to_yx(ia, matches.grid_a), Matches.to_yx(ib, matches.grid_b)):
+        draw.line([((xa + 0.5) * patch_size, (ya + 0.5) * patch_size),
+                   (a.width + (xb + 0.5) * patch_size, (yb + 0.5) * patch_size)],
+                  fill=(255, 64, 64), width=1)
+    canvas.save(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dense patch matching between two images")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--patches", help="Patch store; a and b are image ids")
+    source.add_argument("--results", action="store_true", help="a and b are Result_N directories (last_hidden_state)")
+    parser.add_argument("a")
+    parser.add_argument("b")
+    parser.add_argument("--config", help="Model config.json for the token layout (--results)")
+    parser.add_argument("--k", type=int, default=1, help="Matches per patch of a")
+    parser.add_argument("--block", type=int, default=DEFAULT_BLOCK_ROWS, help="Rows of a per matmul block")
+    parser.add_argument("--min_score", type=float, default=0.0, help="Minimum cosine for reported mutual matches")
+    parser.add_argument("--image_a", help="Image for the plot (default: id a with --patches)")
+    parser.add_argument("--image_b", help="Image for the plot (default: id b with --patches)")
+    parser.add_argument("--plot", help="Save a side-by-side match plot (strongest mutual matches)")
+    parser.add_argument("--save", help="Save top-k and mutual matches to this .npz")
+    args = parser.parse_args()
+
+    if args.patches:
+        store = PatchStore(args.patches)
+        layout = store.layout
+        features_a, features_b = store.grid(args.a), store.grid(args.b)
+        image_a, image_b = args.image_a or args.a, args.image_b or args.b
+    else:
+        layout = TokenLayout.load(args.config)
+        features_a = qnn_utils.read_raw_outputs(args.a, layout.hidden_size)["last_hidden_state"]
+        features_b = qnn_utils.read_raw_outputs(args.b, layout.hidden_size)["last_hidden_state"]
+        image_a, image_b = args.image_a, args.image_b
+
+    t0 = time.perf_counter()
+    matches = match(features_a, features_b, args.k, args.block, layout)
+    elapsed = (time.perf_counter() - t0) * 1000
+    ia, ib, scores = matches.mutual(args.min_score)
+    n_a = matches.grid_a[0] * matches.grid_a[1]
+    n_b = matches.grid_b[0] * matches.grid_b[1]
+    print(f"[TIME] Matching {n_a} x {n_b} patches: {elapsed:.2f} ms (block {args.block})")
+    print(f"Mutual nearest neighbours: {len(ia)} (cosine >= {args.min_score})")
+    for (ya, xa), (yb, xb), s in list(zip(Matches.to_yx(ia, matches.grid_a), Matches.to_yx(ib, matches.grid_b), scores))[:10]:
+        print(f"  a({ya:>2},{xa:>2}) <-> b({yb:>2},{xb:>2})  {s:.3f}")
+    if args.save:
+        np.savez(args.save, topk_index=matches.topk_index, topk_score=matches.topk_score,
+                 mutual_a=ia, mutual_b=ib, mutual_score=scores)
+        print(f"Saved {args.save}")
+    if args.plot:
+        draw_matches(image_a if image_a and os.path.exists(image_a) else None,
+                     image_b if image_b and os.path.exists(image_b) else None,
+                     matches, ia[:MAX_DRAWN_MATCHES], ib[:MAX_DRAWN_MATCHES], args.plot, layout.patch_size)
+        print(f"Saved {args.plot}")
+
+
+if __name__ == "__main__":
+    main()
@@ -8,11 +8,13 @@ import glob
 import shutil
 import hashlib
 
-# Device Configuration
-DEVICE_IP = "192.168.0.202"
-USERNAME = "ubuntu"
-PASSWORD = "qualcomm"
-REMOTE_BASE_DIR = "/home/ubuntu/dinov3_deployment"
+import devices
+import perf_history
+import qnn_utils
+import tracing
+
+# The target board comes from the device inventory (devices.py; $DINOV3_DEVICE
+# selects one) and is resolved in main(), after argument parsing.
 
 # Local Paths (Relative to onnx_convert/)
 DIR_ASSETS = "assets"
@@ -24,7 +26,8 @@ DIR_ONNX_BASE = "../onnx_download"
 
 def cleanup_temp_files():
     """Clean up temporary files created during deployment."""
-    temp_files = ["sdk_headers.tar.gz", "sdk_jni.tar.gz", "sdk_libs.tar.gz", "run_on_device.sh", "input_list.txt", "skel_libs.tar.gz", "output.tar.gz"]
+    temp_files = ["sdk_headers.tar.gz", "sdk_jni.tar.gz", "sdk_libs.tar.gz", "run_on_device.sh", "input_list.txt", "skel_libs.tar.gz", "output.tar.gz",
+                  qnn_utils.HTP_CONFIG_NAME, qnn_utils.HTP_EXTENSIONS_NAME]
     for f in temp_files:
         if os.path.exists(f):
             os.remove(f)
@@ -40,11 +43,12 @@ def create_ssh_client(server, port, user, password):
 
 def run_command(client, command, stream_output=True):
     print(f"[REMOTE CMD] {command}")
-    stdin, stdout, stderr = client.exec_command(command)
-    exit_status = stdout.channel.recv_exit_status()
-    
-    out = stdout.read().decode().strip()
-    err = stderr.read().decode().strip()
+    with tracing.span("ssh exec", cat="ssh", command=command[:200]):
+        stdin, stdout, stderr = client.exec_command(command)
+        exit_status = stdout.channel.recv_exit_status()
+
+        out = stdout.read().decode().strip()
+        err = stderr.read().decode().strip()
     
     if stream_output:
         if out: print(f"[STDOUT]\n{out}")
@@ -114,14 +118,23 @@ def transfer_file_smart(ssh, scp, local_path, remote_path, check_integrity=True)
     # Ensure remote directory exists
     remote_dir = os.path.dirname(remote_path)
     run_command(ssh, f"mkdir -p {remote_dir}", stream_output=False)
-    scp.put(local_path, remote_path=remote_path)
+    with tracing.span(f"upload {filename}", cat="transfer", bytes=local_size):
+        scp.put(local_path, remote_path=remote_path)
     return True
 
 def main():
     parser = argparse.ArgumentParser(description="Deploy and Run on IQ-9075")
     parser.add_argument("--model-variant", default="dinov3-vitb16", help="Model variant folder name in onnx_download (e.g., dinov3-vitb16, dinov3-vitb7b16)")
     parser.add_argument("--model-name", default="dinov3", help="Base name of the model files (default: dinov3)")
+    parser.add_argument("--trace", help="Write a Chrome trace of the deployment (host + device) to this JSON file")
+    parser.add_argument("--history", default=perf_history.DEFAULT_DB_PATH,
+                        help="Performance history store to record the verification run in (empty to disable)")
     args = parser.parse_args()
+    if args.trace:
+        tracing.enable(args.trace)
+    tracer = tracing.get_tracer()
+    device = devices.select_device()
+    base_dir = device["base_dir"]
 
     model_variant = args.model_variant
     model_name = args.model_name
@@ -133,9 +146,10 @@ def main():
     print(f"Deploying Model: {model_name} (Variant: {model_variant})")
     print(f"ONNX Path: {onnx_path}")
 
-    print(f"Connecting to {DEVICE_IP}...")
+    print(f"Connecting to {device['host']}...")
+    tracer.begin("connect")
     try:
-        ssh = create_ssh_client(DEVICE_IP, 22, USERNAME, PASSWORD)
+        ssh = create_ssh_client(device["host"], device["port"], device["username"], device["password"])
         ssh.get_transport().set_keepalive(30)
         # Increased socket timeout for large files
         scp = SCPClient(ssh.get_transport(), socket_timeout=3600.0, progress=progress_bar)
@@ -143,8 +157,11 @@ def main():
     except Exception as e:
         print(f"Connection failed: {e}")
         return
+    tracer.end()
+    tracer.estimate_clock_offset(ssh)
 
     # Check Disk Space
+    tracer.begin("prepare device")
     print("--- Checking Remote Disk Space ---")
     _, out, _ = run_command(ssh, "df -h /home", stream_output=True)
 
@@ -153,10 +170,10 @@ def main():
     run_command(ssh, "rm -rf /home/ubuntu/onnx_convert", stream_output=True)
 
     # 1. Create remote directory structure
-    run_command(ssh, f"mkdir -p {REMOTE_BASE_DIR}/bin")
-    run_command(ssh, f"mkdir -p {REMOTE_BASE_DIR}/lib")
-    run_command(ssh, f"mkdir -p {REMOTE_BASE_DIR}/assets")
-    run_command(ssh, f"mkdir -p {REMOTE_BASE_DIR}/test")
+    run_command(ssh, f"mkdir -p {base_dir}/bin")
+    run_command(ssh, f"mkdir -p {base_dir}/lib")
+    run_command(ssh, f"mkdir -p {base_dir}/assets")
+    run_command(ssh, f"mkdir -p {base_dir}/test")
 
     # 2. Probe Device for SDK/Libs
     print("Probing device environment...")
@@ -164,9 +181,9 @@ def main():
     backend_lib_path = ""
     
     # Find libQnnCpu.so
-    _, lib_path, _ = run_command(ssh, f"find {REMOTE_BASE_DIR}/lib /opt/qcom /usr/lib /home/ubuntu -name 'libQnnCpu.so' 2>/dev/null | head -n 1", stream_output=False)
+    _, lib_path, _ = run_command(ssh, f"find {base_dir}/lib /opt/qcom /usr/lib /home/ubuntu -name 'libQnnCpu.so' 2>/dev/null | head -n 1", stream_output=False)
     if lib_path:
-        if REMOTE_BASE_DIR in lib_path:
+        if base_dir in lib_path:
              print(f"Found Bundled Backend: {lib_path}")
              backend_lib_path = lib_path
         else:
@@ -180,17 +197,27 @@ def main():
         print("Warning: libQnnCpu.so not found. Will attempt to upload.")
 
     # 3. Transfer Assets (Model, Configs)
+    tracer.end()
+    tracer.begin("sync assets")
     print("--- Syncing Assets ---")
-    transfer_file_smart(ssh, scp, onnx_path, f"{REMOTE_BASE_DIR}/assets/{model_name}.onnx")
+    transfer_file_smart(ssh, scp, onnx_path, f"{base_dir}/assets/{model_name}.onnx")
     if os.path.exists(onnx_data_path):
-        transfer_file_smart(ssh, scp, onnx_data_path, f"{REMOTE_BASE_DIR}/assets/{model_name}.onnx.data")
+        transfer_file_smart(ssh, scp, onnx_data_path, f"{base_dir}/assets/{model_name}.onnx.data")
     
     # Still valid as it's general config
-    transfer_file_smart(ssh, scp, f"{DIR_ASSETS}/dinov3_qnn_net.json", f"{REMOTE_BASE_DIR}/assets/dinov3_qnn_net.json")
+    transfer_file_smart(ssh, scp, f"{DIR_ASSETS}/dinov3_qnn_net.json", f"{base_dir}/assets/dinov3_qnn_net.json")
+
+    # Tuned HTP backend config (tune_htp_backend.py) travels with the model
+    htp_tuning = qnn_utils.load_htp_tuning()
+    if htp_tuning:
+        print(f"Deploying tuned HTP settings: perf_profile={htp_tuning.get('perf_profile')}")
+        transfer_file_smart(ssh, scp, qnn_utils.HTP_TUNING_PATH, f"{base_dir}/assets/htp_tuning.json")
+        for path in qnn_utils.write_htp_config_files(htp_tuning, base_dir):
+            transfer_file_smart(ssh, scp, path, f"{base_dir}/assets/{os.path.basename(path)}")
 
     # Probe for HTP Backend
     print("Probing for HTP Backend...")
-    _, lib_path, _ = run_command(ssh, f"find {REMOTE_BASE_DIR}/lib /opt/qcom /usr/lib /home/ubuntu -name 'libQnnHtp.so' 2>/dev/null | head -n 1", stream_output=False)
+    _, lib_path, _ = run_command(ssh, f"find {base_dir}/lib /opt/qcom /usr/lib /home/ubuntu -name 'libQnnHtp.so' 2>/dev/null | head -n 1", stream_output=False)
     backend_lib_path = ""
     if lib_path:
         print(f"Found HTP Backend: {lib_path}")
@@ -201,7 +228,7 @@ def main():
              sdk_root = "/usr"
     else:
         print("Warning: libQnnHtp.so not found. Fallback to CPU?")
-        _, lib_path_cpu, _ = run_command(ssh, f"find {REMOTE_BASE_DIR}/lib /opt/qcom /usr/lib /home/ubuntu -name 'libQnnCpu.so' 2>/dev/null | head -n 1", stream_output=False)
+        _, lib_path_cpu, _ = run_command(ssh, f"find {base_dir}/lib /opt/qcom /usr/lib /home/ubuntu -name 'libQnnCpu.so' 2>/dev/null | head -n 1", stream_output=False)
         if lib_path_cpu:
              print(f"Falling back to CPU Backend: {lib_path_cpu}")
              backend_lib_path = lib_path_cpu
@@ -210,8 +237,10 @@ def main():
              return
 
     # 4. Generate Script
+    tracer.end()
+    tracer.begin("sync sources + dependencies")
     script_content = "#!/bin/bash\n\n"
-    script_content += f"cd {REMOTE_BASE_DIR}\n"
+    script_content += f"cd {base_dir}\n"
     script_content += "echo '--- Starting Device Execution ---'\n"
 
     # Native QNN Logic
@@ -225,7 +254,7 @@ def main():
         
     # Check if we already have processed weights
     has_processed_weights = False
-    _, out, _ = run_command(ssh, f"[ -f {REMOTE_BASE_DIR}/weights_objs.txt ] && echo 'yes' || echo 'no'", stream_output=False)
+    _, out, _ = run_command(ssh, f"[ -f {base_dir}/weights_objs.txt ] && echo 'yes' || echo 'no'", stream_output=False)
     if out == "yes":
         print("Found pre-processed weights (weights_objs.txt). Skipping .bin upload and extraction.")
         has_processed_weights = True
@@ -234,12 +263,12 @@ def main():
     cpp_src = f"{DIR_NATIVE_SRC}/{model_name}_qnn.cpp"
     bin_src = f"{DIR_NATIVE_BIN}/{model_name}_qnn.bin"
     
-    transfer_file_smart(ssh, scp, cpp_src, f"{REMOTE_BASE_DIR}/{model_name}_qnn.cpp")
-    transfer_file_smart(ssh, scp, f"{DIR_NATIVE_SRC}/inference_dinov3.cpp", f"{REMOTE_BASE_DIR}/inference_dinov3.cpp")
+    transfer_file_smart(ssh, scp, cpp_src, f"{base_dir}/{model_name}_qnn.cpp")
+    transfer_file_smart(ssh, scp, f"{DIR_NATIVE_SRC}/inference_dinov3.cpp", f"{base_dir}/inference_dinov3.cpp")
     
     # Upload Weights (.bin) ONLY if we don't have processed weights
     if not has_processed_weights:
-         transfer_file_smart(ssh, scp, bin_src, f"{REMOTE_BASE_DIR}/{model_name}_qnn.bin")
+         transfer_file_smart(ssh, scp, bin_src, f"{base_dir}/{model_name}_qnn.bin")
 
     # Compile and Link (On-Device)
     print("--- Checking Dependencies ---")
@@ -247,17 +276,18 @@ def main():
     # Upload Headers
     if qnn_sdk_host:
          subprocess.run(f"tar -czf sdk_headers.tar.gz -C \"{qnn_sdk_host}\" include", shell=True, check=True)
-         if transfer_file_smart(ssh, scp, "sdk_headers.tar.gz", f"{REMOTE_BASE_DIR}/sdk_headers.tar.gz"):
-             run_command(ssh, f"tar -xzf {REMOTE_BASE_DIR}/sdk_headers.tar.gz -C {REMOTE_BASE_DIR} && rm {REMOTE_BASE_DIR}/sdk_headers.tar.gz")
+         if transfer_file_smart(ssh, scp, "sdk_headers.tar.gz", f"{base_dir}/sdk_headers.tar.gz"):
+             run_command(ssh, f"tar -xzf {base_dir}/sdk_headers.tar.gz -C {base_dir} && rm {base_dir}/sdk_headers.tar.gz")
          
          # Upload JNI
          share_jni_path = f"{qnn_sdk_host}/share/QNN/converter/jni"
          subprocess.run(f"tar -czf sdk_jni.tar.gz -C \"{os.path.dirname(share_jni_path)}\" jni", shell=True, check=True)
-         if transfer_file_smart(ssh, scp, "sdk_jni.tar.gz", f"{REMOTE_BASE_DIR}/sdk_jni.tar.gz"):
-             run_command(ssh, f"tar -xzf {REMOTE_BASE_DIR}/sdk_jni.tar.gz -C {REMOTE_BASE_DIR} && rm {REMOTE_BASE_DIR}/sdk_jni.tar.gz")
+         if transfer_file_smart(ssh, scp, "sdk_jni.tar.gz", f"{base_dir}/sdk_jni.tar.gz"):
+             run_command(ssh, f"tar -xzf {base_dir}/sdk_jni.tar.gz -C {base_dir} && rm {base_dir}/sdk_jni.tar.gz")
 
-    # Build Script
+    # Build Script (device-clock markers around each step with --trace)
     script_content += "echo '--- Compiling ---'\n"
+    script_content += tracer.device_marker("compile", "start")
     
     if has_processed_weights:
          script_content += "echo 'Using existing processed weights...'\n"
@@ -275,22 +305,38 @@ def main():
     script_content += f"g++ -shared -fPIC -o bin/lib{model_name}.so {model_name}_qnn.o QnnModel.o QnnWrapperUtils.o QnnModelPal.o @weights_objs.txt -I./include -I./include/QNN -I./jni\n"
     
     script_content += f"g++ -o bin/inference_dinov3 inference_dinov3.cpp -ldl -I./include -I./include/QNN -I./jni\n"
-    script_content += f"export LD_LIBRARY_PATH={REMOTE_BASE_DIR}/lib:$LD_LIBRARY_PATH\n"
-    script_content += f"./bin/inference_dinov3 {REMOTE_BASE_DIR}/bin/lib{model_name}.so {REMOTE_BASE_DIR}/lib/libQnnCpu.so\n"
+    script_content += tracer.device_marker("compile", "end")
+    script_content += f"export LD_LIBRARY_PATH={base_dir}/lib:$LD_LIBRARY_PATH\n"
+    script_content += tracer.device_marker("inference_dinov3_cpu", "start")
+    script_content += f"./bin/inference_dinov3 {base_dir}/bin/lib{model_name}.so {base_dir}/lib/libQnnCpu.so\n"
+    script_content += tracer.device_marker("inference_dinov3_cpu", "end")
     
     # Upload Libs
+    tracer.end()
+    tracer.begin("sync sdk + skel libraries")
     print("--- Syncing SDK Libraries (OpenEmbedded GCC 11.2) ---")
     target_arch = "aarch64-oe-linux-gcc11.2"
     
     subprocess.run(f"tar -czf sdk_libs.tar.gz -C \"{qnn_sdk_host}/lib/{target_arch}\" .", shell=True, check=True)
-    if transfer_file_smart(ssh, scp, "sdk_libs.tar.gz", f"{REMOTE_BASE_DIR}/sdk_libs.tar.gz"):
+    if transfer_file_smart(ssh, scp, "sdk_libs.tar.gz", f"{base_dir}/sdk_libs.tar.gz"):
         print("Extracting libs on device...")
-        run_command(ssh, f"mkdir -p {REMOTE_BASE_DIR}/lib && tar -xzf {REMOTE_BASE_DIR}/sdk_libs.tar.gz -C {REMOTE_BASE_DIR}/lib && rm {REMOTE_BASE_DIR}/sdk_libs.tar.gz")
+        run_command(ssh, f"mkdir -p {base_dir}/lib && tar -xzf {base_dir}/sdk_libs.tar.gz -C {base_dir}/lib && rm {base_dir}/sdk_libs.tar.gz")
     
     # Upload qnn-net-run
     qnn_net_run_src = f"{qnn_sdk_host}/bin/{target_arch}/qnn-net-run"
-    transfer_file_smart(ssh, scp, qnn_net_run_src, f"{REMOTE_BASE_DIR}/bin/qnn-net-run")
-    run_command(ssh, f"chmod +x {REMOTE_BASE_DIR}/bin/qnn-net-run")
+    transfer_file_smart(ssh, scp, qnn_net_run_src, f"{base_dir}/bin/qnn-net-run")
+    run_command(ssh, f"chmod +x {base_dir}/bin/qnn-net-run")
+
+    # Upload qnn-profile-viewer (used by inference.py --profiling_level detailed/linting)
+    qnn_profile_viewer_src = f"{qnn_sdk_host}/bin/{target_arch}/qnn-profile-viewer"
+    if os.path.exists(qnn_profile_viewer_src):
+        transfer_file_smart(ssh, scp, qnn_profile_viewer_src, f"{base_dir}/bin/qnn-profile-viewer")
+        run_command(ssh, f"chmod +x {base_dir}/bin/qnn-profile-viewer")
+
+    # Device-side JPEG decode/normalize, output selection/reduction/encoding and
+    # the telemetry sampler (inference.py --device_preprocess / --outputs / --reduce / --encoding / --telemetry)
+    for script in ("device_preprocess.py", "device_postprocess.py", "device_telemetry.py"):
+        transfer_file_smart(ssh, scp, f"{DIR_SCRIPTS}/{script}", f"{base_dir}/scripts/{script}")
 
     # Upload Hexagon Skel Libs
     print("--- Syncing Hexagon Skel Libraries ---")
@@ -301,39 +347,43 @@ def main():
         shutil.copy(skel_file, "temp_skel/")
     
     subprocess.run("tar -czf skel_libs.tar.gz -C temp_skel .", shell=True, check=True)
-    if transfer_file_smart(ssh, scp, "skel_libs.tar.gz", f"{REMOTE_BASE_DIR}/skel_libs.tar.gz"):
+    if transfer_file_smart(ssh, scp, "skel_libs.tar.gz", f"{base_dir}/skel_libs.tar.gz"):
         print("Extracting Skel libs on device...")
-        run_command(ssh, f"mkdir -p {REMOTE_BASE_DIR}/lib/hexagon && tar -xzf {REMOTE_BASE_DIR}/skel_libs.tar.gz -C {REMOTE_BASE_DIR}/lib/hexagon && rm {REMOTE_BASE_DIR}/skel_libs.tar.gz")
+        run_command(ssh, f"mkdir -p {base_dir}/lib/hexagon && tar -xzf {base_dir}/skel_libs.tar.gz -C {base_dir}/lib/hexagon && rm {base_dir}/skel_libs.tar.gz")
     
     shutil.rmtree("temp_skel")
     if os.path.exists("skel_libs.tar.gz"): os.remove("skel_libs.tar.gz")
 
+    tracer.end()
+
     # Verify
     if os.path.exists(f"{DIR_TEST}/test_image.jpg"):
          print("--- Preprocessing Test Image ---")
          subprocess.run([sys.executable, f"{DIR_SCRIPTS}/preprocess_input.py", f"{DIR_TEST}/test_image.jpg", f"{DIR_TEST}/input.raw"], check=True)
-         transfer_file_smart(ssh, scp, f"{DIR_TEST}/input.raw", f"{REMOTE_BASE_DIR}/test/input.raw")
-         transfer_file_smart(ssh, scp, f"{DIR_TEST}/input_list.txt", f"{REMOTE_BASE_DIR}/test/input_list.txt") 
+         transfer_file_smart(ssh, scp, f"{DIR_TEST}/input.raw", f"{base_dir}/test/input.raw")
+         transfer_file_smart(ssh, scp, f"{DIR_TEST}/input_list.txt", f"{base_dir}/test/input_list.txt") 
          with open("input_list.txt", "w") as f:
-             f.write(f"pixel_values:={REMOTE_BASE_DIR}/test/input.raw\n")
-         transfer_file_smart(ssh, scp, "input_list.txt", f"{REMOTE_BASE_DIR}/test/input_list.txt")
+             f.write(f"pixel_values:={base_dir}/test/input.raw\n")
+         transfer_file_smart(ssh, scp, "input_list.txt", f"{base_dir}/test/input_list.txt")
 
          script_content += "echo '--- Verifying with qnn-net-run (HTP Backend) ---'\n"
-         dsp_lib_path = f"{REMOTE_BASE_DIR}/lib/hexagon"
-         script_content += f"export ADSP_LIBRARY_PATH=\"{dsp_lib_path};/usr/lib/rfsa/adsp;/dsp;/usr/lib/dsp/cdsp1;/system/lib/rfsa/adsp;/system/vendor/lib/rfsa/adsp\"\n"
-         script_content += f"export LD_LIBRARY_PATH={REMOTE_BASE_DIR}/lib:$LD_LIBRARY_PATH\n"
-         script_content += f"./bin/qnn-net-run --backend {REMOTE_BASE_DIR}/lib/libQnnHtp.so --model {REMOTE_BASE_DIR}/bin/lib{model_name}.so --input_list {REMOTE_BASE_DIR}/test/input_list.txt --output_dir {REMOTE_BASE_DIR}/test/output\n"
+         for export in qnn_utils.htp_env_exports(base_dir):
+             script_content += export + "\n"
+         script_content += tracer.device_command("qnn-net-run", qnn_utils.net_run_invocation(
+             base_dir, f"{base_dir}/bin/lib{model_name}.so", f"{base_dir}/test/input_list.txt",
+             f"{base_dir}/test/output", **qnn_utils.tuned_net_run_args(base_dir, htp_tuning))) + "\n"
 
     # Execute
     with open("run_on_device.sh", "w") as f:
         f.write(script_content)
     
-    transfer_file_smart(ssh, scp, "run_on_device.sh", f"{REMOTE_BASE_DIR}/run_on_device.sh")
-    run_command(ssh, f"chmod +x {REMOTE_BASE_DIR}/run_on_device.sh")
+    transfer_file_smart(ssh, scp, "run_on_device.sh", f"{base_dir}/run_on_device.sh")
+    run_command(ssh, f"chmod +x {base_dir}/run_on_device.sh")
     
     print("--- Executing Remote Script ---")
+    tracer.begin("remote script")
     channel = ssh.get_transport().open_session()
-    channel.exec_command(f"{REMOTE_BASE_DIR}/run_on_device.sh")
+    channel.exec_command(f"{base_dir}/run_on_device.sh")
     
     output_buffer = ""
     while True:
@@ -346,30 +396,41 @@ def main():
             err_chunk = channel.recv_stderr(1024).decode()
             sys.stderr.write(err_chunk)
             output_buffer += err_chunk
+    tracer.end()
+    device_spans = tracer.add_device_events(output_buffer)
+    tracer.add_qnn_log(output_buffer, next((s for s in device_spans if s[0] == "qnn-net-run"), None))
     
     print("\n\n--- Performance Report ---")
     import re
     
     # Download Results
-    print(f"\n--- Downloading Results from {REMOTE_BASE_DIR}/test/output ---")
+    print(f"\n--- Downloading Results from {base_dir}/test/output ---")
     local_output_dir = "output_results"
     os.makedirs(local_output_dir, exist_ok=True)
+    tracer.begin("download results")
     try:
-        run_command(ssh, f"tar -czf {REMOTE_BASE_DIR}/output.tar.gz -C {REMOTE_BASE_DIR}/test output", stream_output=False)
-        scp.get(f"{REMOTE_BASE_DIR}/output.tar.gz", "output.tar.gz")
+        run_command(ssh, f"tar -czf {base_dir}/output.tar.gz -C {base_dir}/test output", stream_output=False)
+        scp.get(f"{base_dir}/output.tar.gz", "output.tar.gz")
         subprocess.run(f"tar -xzf output.tar.gz -C {local_output_dir}", shell=True)
         os.remove("output.tar.gz")
         print(f"Results downloaded to: {os.path.abspath(local_output_dir)}")
     except Exception as e:
         print(f"Failed to download results: {e}")
+    tracer.end()
 
     matches = re.findall(r"Avg: ([0-9\.]+) us", output_buffer)
     if matches:
         print(f"Detected Average Inference Time: {matches[-1]} us ({float(matches[-1])/1000.0:.2f} ms)")
+        if args.history:
+            inference_ms = float(matches[-1]) / 1000.0
+            perf_history.record_run("deploy", {"inference_ms": inference_ms, "throughput_fps": 1000.0 / inference_ms},
+                                    {"backend": "htp", "tuning": htp_tuning}, {"profiling_level": "basic"},
+                                    model_variant, onnx_path, deployed=True, path=args.history, device=device["name"])
     else:
         print("Could not automatically parse inference time from output. Please check above logs.")
 
     print("\nDone.")
+    tracing.save()
     cleanup_temp_files()
     scp.close()
     ssh.close()
@@ -0,0 +1,183 @@
+import argparse
+import json
+import os
+
+import numpy as np
+from scp import SCPClient
+
+import devices
+import qnn_utils
+from inference import connect_device, run_command, progress_bar
+from preprocess_input import preprocess_array
+from stage_scheduler import INPUT_LIST_TOKEN, OUTPUT_DIR_TOKEN
+
+# Deploy and run a stage-partitioned model (export_dinov3_stages.py + convert_stages.sh).
+# Every stage is built on the device and serialized to its own HTP context
+# binary; stage_scheduler.py then pipelines images through the contexts on
+# the device. Requires a prior deploy.py run (SDK libs, headers, QnnModel objects).
+#
+# Usage (from onnx_convert/):
+#   python3 scripts/deploy_stages.py                                   # build + generate contexts
+#   python3 scripts/deploy_stages.py --skip_build --images test/*.jpg  # pipeline images
+
+DIR_STAGE_SRC = "native_qnn/src/stages"
+DIR_STAGE_BIN = "native_qnn/bin/stages"
+REMOTE_STAGE_SUBDIR = "stages"  # under the device base dir
+DEVICE_MANIFEST_NAME = "stages_device.json"
+TARGET_ARCH = "aarch64-oe-linux-gcc11.2"
+
+
+def build_stage(ssh, sftp, base_dir, stage):
+    """Upload one stage, link its model library and serialize it to a context binary."""
+    name = stage["name"]
+    remote_dir = f"{base_dir}/{REMOTE_STAGE_SUBDIR}/{name}"
+    run_command(ssh, f"mkdir -p {remote_dir}", print_output=False)
+    print(f"--- Building {name} (blocks {stage['layers'][0]}-{stage['layers'][1] - 1}) ---")
+    sftp.put(os.path.join(DIR_STAGE_SRC, f"{name}_qnn.cpp"), f"{remote_dir}/{name}_qnn.cpp")
+    sftp.put(os.path.join(DIR_STAGE_BIN, f"{name}_qnn.bin"), f"{remote_dir}/{name}_qnn.bin")
+
+    includes = f"-I{base_dir}/include -I{base_dir}/include/QNN -I{base_dir}/jni"
+    build = (
+        f"cd {remote_dir} && rm -rf obj && mkdir -p obj/binary && "
+        f"tar -xf {name}_qnn.bin -C obj/binary && "
+        f"find obj/binary -name '*.raw' | while read f; do ld -r -b binary -o \"$f.o\" \"$f\"; done && "
+        f"find obj/binary -name '*.raw.o' > weights_objs.txt && "
+        f"g++ -c -fPIC {name}_qnn.cpp {includes} && "
+        f"g++ -shared -fPIC -o lib{name}.so {name}_qnn.o {base_dir}/QnnModel.o "
+        f"{base_dir}/QnnWrapperUtils.o {base_dir}/QnnModelPal.o @weights_objs.txt && "
+        f"rm -rf obj {name}_qnn.o {name}_qnn.bin"
+    )
+    exit_code, _, err = run_command(ssh, build, print_output=False)
+    if exit_code != 0:
+        print(f"On-device build of {name} failed: {err}")
+        return False
+
+    generate = " && ".join([f"cd {base_dir}"] + qnn_utils.htp_env_exports(base_dir) + [
+        f"./bin/qnn-context-binary-generator --backend {base_dir}/lib/libQnnHtp.so "
+        f"--model {remote_dir}/lib{name}.so --binary_file {name} --output_dir {remote_dir}"
+    ])
+    exit_code, _, err = run_command(ssh, generate, print_output=False)
+    if exit_code != 0:
+        print(f"Context generation for {name} failed: {err}")
+        return False
+    print(f"Context ready: {remote_dir}/{name}.bin")
+    return True
+
+
+def device_manifest(manifest, tuning, base_dir):
+    """Stage list for stage_scheduler.py with ready-to-run qnn-net-run templates."""
+    perf_profile = tuning.get("perf_profile") if tuning else None
+    stages = []
+    for stage in manifest["stages"]:
+        name = stage["name"]
+        stages.append({
+            "name": name,
+            "input": stage["input"]["name"],
+            "output": stage["outputs"][0]["name"],
+            "command": qnn_utils.net_run_invocation(
+                base_dir, None, INPUT_LIST_TOKEN, OUTPUT_DIR_TOKEN, perf_profile=perf_profile,
+                retrieve_context=f"{base_dir}/{REMOTE_STAGE_SUBDIR}/{name}/{name}.bin"),
+        })
+    return {"base_dir": base_dir, "env": qnn_utils.htp_env_exports(base_dir), "stages": stages}
+
+
+def upload_images(ssh, sftp, base_dir, images, manifest):
+    """Preprocess images on the host into the first stage's layout and write its input list on the device."""
+    first = manifest["stages"][0]
+    net_json = os.path.join(DIR_STAGE_SRC, f"{first['name']}_qnn_net.json")
+    run_command(ssh, f"rm -rf {base_dir}/test/stage_inputs && mkdir -p {base_dir}/test/stage_inputs",
+                print_output=False)
+    lines = []
+    for i, image in enumerate(images):
+        tensor = preprocess_array(image, manifest.get("image_size", 224))
+        if os.path.exists(net_json):
+            tensor = qnn_utils.to_graph_layout(tensor, net_json)
+        remote_raw = f"{base_dir}/test/stage_inputs/input_{i}.raw"
+        with sftp.open(remote_raw, "wb") as f:
+            f.write(np.ascontiguousarray(tensor, dtype=np.float32).tobytes())
+        lines.append(f"{first['input']['name']}:={remote_raw}")
+    remote_list = f"{base_dir}/test/stage_input_list.txt"
+    with sftp.open(remote_list, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return remote_list
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Deploy and pipeline a stage-partitioned DINOv3 on IQ-9075")
+    parser.add_argument("--manifest", default=os.path.join(DIR_STAGE_SRC, "stages.json"),
+                        help="Stage manifest copied by convert_stages.sh")
+    parser.add_argument("--images", nargs="*", default=[], help="Images to pipeline through the stages")
+    parser.add_argument("--skip_build", action="store_true", help="Reuse stage contexts already on the device")
+    parser.add_argument("--chunk", type=int, default=2, help="Images per qnn-net-run invocation")
+    parser.add_argument("--max_concurrent", type=int, default=2, help="Stage contexts allowed to execute at once")
+    parser.add_argument("--output_dir", default="stage_results", help="Local directory for the final outputs")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.manifest):
+        print(f"Error: {args.manifest} not found. Run native_qnn/convert_stages.sh first.")
+        return
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+
+    device = devices.select_device()
+    base_dir = device["base_dir"]
+    print(f"--- Connecting to {device['host']} ---")
+    ssh = connect_device(device)
+    if not ssh:
+        return
+    sftp = ssh.open_sftp()
+    scp = SCPClient(ssh.get_transport(), socket_timeout=600.0, progress=progress_bar)
+    try:
+        if not args.skip_build:
+            _, out, _ = run_command(ssh, f"[ -f {base_dir}/QnnModel.o ] && echo yes || echo no", print_output=False)
+            if out != "yes":
+                print("Error: QnnModel objects not found on the device. Run scripts/deploy.py once first.")
+                return
+            qnn_sdk_host = qnn_utils.find_qnn_sdk_root()
+            generator = f"{qnn_sdk_host}/bin/{TARGET_ARCH}/qnn-context-binary-generator"
+            if not os.path.exists(generator):
+                print(f"Error: {generator} not found (set QNN_SDK_ROOT).")
+                return
+            scp.put(generator, f"{base_dir}/bin/qnn-context-binary-generator")
+            run_command(ssh, f"chmod +x {base_dir}/bin/qnn-context-binary-generator", print_output=False)
+            for stage in manifest["stages"]:
+                if not build_stage(ssh, sftp, base_dir, stage):
+                    return
+
+        print("--- Uploading Stage Scheduler ---")
+        run_command(ssh, f"mkdir -p {base_dir}/{REMOTE_STAGE_SUBDIR}", print_output=False)
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        sftp.put(os.path.join(script_dir, "stage_scheduler.py"), f"{base_dir}/{REMOTE_STAGE_SUBDIR}/stage_scheduler.py")
+        with sftp.open(f"{base_dir}/{REMOTE_STAGE_SUBDIR}/{DEVICE_MANIFEST_NAME}", "w") as f:
+            f.write(json.dumps(device_manifest(manifest, qnn_utils.load_htp_tuning(), base_dir), indent=2))
+
+        if not args.images:
+            print("Stages deployed. Pass --images to run the pipeline.")
+            return
+
+        print(f"--- Uploading {len(args.images)} Inputs ---")
+        remote_list = upload_images(ssh, sftp, base_dir, args.images, manifest)
+        remote_output = f"{base_dir}/test/stage_output"
+        exit_code, out, err = run_command(
+            ssh, f"cd {base_dir} && rm -rf {remote_output} && python3 stages/stage_scheduler.py "
+                 f"stages/{DEVICE_MANIFEST_NAME} {remote_list} {remote_output} "
+                 f"--chunk {args.chunk} --max_concurrent {args.max_concurrent}")
+        if exit_code != 0:
+            print("Pipeline failed! Check logs above.")
+            return
+
+        print(f"--- Downloading Results to {args.output_dir} ---")
+        output_names = [o["name"] for o in manifest["stages"][-1]["outputs"]]
+        for i in range(len(args.images)):
+            result_dir = os.path.join(args.output_dir, f"Result_{i}")
+            os.makedirs(result_dir, exist_ok=True)
+            for name in output_names:
+                sftp.get(f"{remote_output}/Result_{i}/{name}.raw", os.path.join(result_dir, f"{name}.raw"))
+        print(f"Success! Results saved in {args.output_dir}")
+    finally:
+        sftp.close()
+        ssh.close()
+
+
+if __name__ == "__main__":
+    main()
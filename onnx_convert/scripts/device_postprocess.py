@@ -0,0 +1,143 @@
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+# On-device output selection / reduction / encoding (see inference.py --outputs/--reduce/--encoding).
+# Runs right after qnn-net-run on every Result_N directory: keeps only the
+# requested outputs, optionally reduces last_hidden_state (mean of the patch
+# tokens, or patch tokens average-pooled to a GxG grid), encodes the result
+# as fp32/fp16/int8 and removes the float32 .raw files, so unrequested
+# tensors never cross the link. Each Result_N gets an outputs.json manifest;
+# qnn_utils.read_raw_outputs / decode_output decode it transparently.
+#
+# int8 is symmetric with one float32 scale per row of the last axis
+# (per token for hidden states), stored next to the data as <name>.scale.
+#
+# Runs on the device (numpy only):
+#   python3 scripts/device_postprocess.py test/custom_output --outputs pooler_output --reduce mean --encoding fp16 \
+#       --prefix_tokens 5 --grid_hw 14 14 --hidden 768
+
+OUTPUT_MANIFEST_NAME = "outputs.json"
+ENCODING_DTYPES = {"fp32": np.float32, "fp16": np.float16, "int8": np.int8}
+ENCODING_EXTENSIONS = {"fp32": "f32", "fp16": "f16", "int8": "i8"}
+RAW_OUTPUTS = ("last_hidden_state", "pooler_output")
+
+
+def patch_tokens(hidden_state, prefix_tokens, grid_hw):
+    """(tokens, hidden) -> (grid_h, grid_w, hidden), dropping CLS + register tokens."""
+    grid_h, grid_w = grid_hw
+    return hidden_state[prefix_tokens:prefix_tokens + grid_h * grid_w].reshape(grid_h, grid_w, -1)
+
+
+def pool_grid(patches, size):
+    """Average-pool a (H, W, C) patch grid to (size, size, C); bins may be uneven."""
+    for axis in (0, 1):
+        n = patches.shape[axis]
+        edges = (np.arange(size) * n) // size
+        counts = np.diff(np.append(edges, n)).astype(np.float32)
+        shape = [1, 1, 1]
+        shape[axis] = size
+        patches = np.add.reduceat(patches, edges, axis=axis) / counts.reshape(shape)
+    return patches
+
+
+def check_reduction(name, grid_hw):
+    """Raise ValueError unless name is 'mean' or 'grid<N>' with 1 <= N <= the smaller grid side."""
+    if name == "mean":
+        return
+    if not (name.startswith("grid") and name[4:].isdigit()):
+        raise ValueError(f"Unknown reduction '{name}' (expected mean or grid<N>)")
+    size, limit = int(name[4:]), min(grid_hw)
+    if not 1 <= size <= limit:
+        raise ValueError(f"Reduction '{name}' needs 1 <= N <= {limit} for a {grid_hw[0]}x{grid_hw[1]} patch grid")
+
+
+def reduce_output(name, hidden_state, prefix_tokens, grid_hw):
+    """Reductions are named 'mean' or 'grid<N>' (e.g. grid7)."""
+    check_reduction(name, grid_hw)
+    patches = patch_tokens(hidden_state, prefix_tokens, grid_hw)
+    if name == "mean":
+        return patches.reshape(-1, patches.shape[-1]).mean(axis=0)
+    return pool_grid(patches, int(name[4:]))
+
+
+def encode(values, encoding):
+    """Returns (encoded array, per-row float32 scales or None)."""
+    values = np.asarray(values, dtype=np.float32)
+    if encoding != "int8":
+        return values.astype(ENCODING_DTYPES[encoding]), None
+    rows = values.reshape(-1, values.shape[-1])
+    scales = np.abs(rows).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    quantized = np.clip(np.rint(rows / scales[:, None]), -127, 127).astype(np.int8)
+    return quantized.reshape(values.shape), scales.astype(np.float32)
+
+
+def postprocess_result(result_dir, outputs, reductions, encoding, prefix_tokens, grid_hw, hidden, keep_raw=False):
+    raw = {}
+    needed = set(outputs) | ({"last_hidden_state"} if reductions else set())
+    for name in needed:
+        raw[name] = np.fromfile(os.path.join(result_dir, f"{name}.raw"), dtype=np.float32).reshape(-1, hidden)
+    if "pooler_output" in raw:
+        raw["pooler_output"] = raw["pooler_output"].ravel()
+
+    tensors = {name: raw[name] for name in outputs}
+    for reduction in reductions:
+        tensors[f"patch_{reduction}"] = reduce_output(reduction, raw["last_hidden_state"], prefix_tokens, grid_hw)
+
+    manifest = {}
+    written = 0
+    for name, values in tensors.items():
+        data, scales = encode(values, encoding)
+        entry = {"file": f"{name}.{ENCODING_EXTENSIONS[encoding]}", "shape": list(data.shape), "encoding": encoding}
+        data.tofile(os.path.join(result_dir, entry["file"]))
+        written += data.nbytes
+        if scales is not None:
+            entry["scale_file"] = f"{name}.scale"
+            scales.tofile(os.path.join(result_dir, entry["scale_file"]))
+            written += scales.nbytes
+        manifest[name] = entry
+    with open(os.path.join(result_dir, OUTPUT_MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f)
+
+    if not keep_raw:
+        for name in RAW_OUTPUTS:
+            path = os.path.join(result_dir, f"{name}.raw")
+            if os.path.exists(path):
+                os.remove(path)
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Select / reduce / encode qnn-net-run outputs on the device")
+    parser.add_argument("output_dir", help="qnn-net-run output directory (contains Result_N/)")
+    parser.add_argument("--outputs", default="", help="Comma-separated graph outputs to keep (may be empty)")
+    parser.add_argument("--reduce", default="", help="Comma-separated reductions: mean, grid<N>")
+    parser.add_argument("--encoding", default="fp32", choices=list(ENCODING_DTYPES))
+    parser.add_argument("--prefix_tokens", type=int, required=True, help="CLS + register tokens before the patches")
+    parser.add_argument("--grid_hw", type=int, nargs=2, required=True, help="Patch grid height and width")
+    parser.add_argument("--hidden", type=int, required=True, help="Hidden size")
+    parser.add_argument("--keep_raw", action="store_true", help="Keep the original float32 .raw files")
+    args = parser.parse_args()
+
+    outputs = [o for o in args.outputs.split(",") if o]
+    reductions = [r for r in args.reduce.split(",") if r]
+    result_dirs = sorted(d for d in os.listdir(args.output_dir) if d.startswith("Result_"))
+    total = 0
+    try:
+        for reduction in reductions:
+            check_reduction(reduction, args.grid_hw)
+        for d in result_dirs:
+            total += postprocess_result(os.path.join(args.output_dir, d), outputs, reductions, args.encoding,
+                                        args.prefix_tokens, args.grid_hw, args.hidden, args.keep_raw)
+    except (OSError, ValueError) as e:
+        print(f"Error postprocessing {args.output_dir}: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"[POST] {len(result_dirs)} results, {total / 1024:.1f} KB to transfer")
+
+
+if __name__ == "__main__":
+    main()
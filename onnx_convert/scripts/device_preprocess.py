@@ -0,0 +1,86 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+# On-device preprocessing for compressed inputs (see inference.py --device_preprocess).
+# The host ships the encoded JPEG/PNG bytes instead of a 602 KB float32 tensor;
+# this script decodes, resizes and normalizes them on the A-cores straight
+# into the graph's input layout and writes the qnn-net-run input list.
+#
+# Normalization is a per-channel lookup table over the 256 possible uint8
+# values, computed with the same float32 ops as preprocess_input.py, so the
+# tensors are bit-identical to host-side preprocessing.
+#
+# Runs on the device (numpy + PIL):
+#   python3 scripts/device_preprocess.py --output_dir test/dev_input --input_list test/dev_input/input_list.txt test/frame.jpg
+
+# ImageNet mean/std (same as preprocess_input.py)
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+CHANNEL_OFFSETS = np.arange(3, dtype=np.intp) * 256
+
+
+def normalize_lut():
+    """(3 * 256,) float32 table: lut[c * 256 + v] == (v / 255 - mean[c]) / std[c]."""
+    values = np.arange(256, dtype=np.float32)[None, :] / 255.0
+    return ((values - MEAN[:, None]) / STD[:, None]).astype(np.float32).ravel()
+
+
+def decode_resized(path, size, draft=False):
+    img = Image.open(path)
+    if draft:
+        # Let libjpeg decode at a reduced DCT scale (much cheaper for large
+        # camera frames); pixels then differ slightly from host preprocessing
+        img.draft("RGB", (size, size))
+    img = img.convert("RGB").resize((size, size), Image.Resampling.BILINEAR)
+    return np.asarray(img)
+
+
+def preprocess_into(path, out, lut, size, channels_last=True, draft=False):
+    """Decode one image and normalize it into `out` (one HWC or CHW image)."""
+    indices = decode_resized(path, size, draft).astype(np.intp)
+    indices += CHANNEL_OFFSETS
+    if not channels_last:
+        indices = indices.transpose(2, 0, 1)
+    np.take(lut, indices, out=out)
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode + normalize encoded images on the device for qnn-net-run")
+    parser.add_argument("images", nargs="+", help="Encoded images (JPEG/PNG) already on the device")
+    parser.add_argument("--output_dir", required=True, help="Directory for the float32 .raw tensors")
+    parser.add_argument("--input_list", required=True, help="qnn-net-run input list to write")
+    parser.add_argument("--size", type=int, default=224)
+    parser.add_argument("--layout", default="nhwc", choices=["nhwc", "nchw"], help="Graph input layout of pixel_values")
+    parser.add_argument("--draft", action="store_true", help="Reduced-scale JPEG decode (faster, not bit-identical)")
+    args = parser.parse_args()
+
+    t0 = time.perf_counter()
+    os.makedirs(args.output_dir, exist_ok=True)
+    channels_last = args.layout == "nhwc"
+    lut = normalize_lut()
+    buffer = np.empty((args.size, args.size, 3) if channels_last else (3, args.size, args.size), dtype=np.float32)
+
+    lines = []
+    for i, path in enumerate(args.images):
+        try:
+            preprocess_into(path, buffer, lut, args.size, channels_last, args.draft)
+        except (OSError, ValueError) as e:
+            print(f"Error preprocessing {path}: {e}", file=sys.stderr)
+            sys.exit(1)
+        raw_path = os.path.join(args.output_dir, f"input_{i}.raw")
+        buffer.tofile(raw_path)
+        lines.append(f"pixel_values:={os.path.abspath(raw_path)}")
+
+    with open(args.input_list, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    print(f"[TIME] Device Preprocess  : {(time.perf_counter() - t0) * 1000:.2f} ms ({len(lines)} images)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+import argparse
+import glob
+import json
+import os
+import signal
+import sys
+import time
+from collections import deque
+
+# On-device telemetry sampler (stdlib only; deployed by deploy.py).
+# Samples CPU load (/proc/stat), memory (/proc/meminfo), thermal zones,
+# per-CPU frequencies and devfreq / remoteproc nodes (the cDSP / NSP clocks
+# and state on Qualcomm BSPs) at a fixed interval into an in-memory ring
+# buffer, and dumps it as JSONL on SIGTERM/SIGINT, at --duration, or on
+# SIGUSR1 (snapshot, keeps sampling).
+#
+# cDSP load is opt-in (--extra cdsp_load=PATH): mainline Linux has no load
+# node for the DSPs, and the vendor nodes that exist differ in path and
+# units between BSP releases (often under debugfs, which needs root). Sampled
+# by default are the portable proxies: the cDSP clock (devfreq) and its
+# remoteproc state. BSP-specific nodes are added with --extra name=path.
+#
+# Every source file is discovered and opened once; a sample is one pread per
+# file plus a little parsing (~0.1 ms for ~30 files), so the sampler costs
+# well under 1% of one core at 10 Hz. Its own CPU time is reported in the
+# dump header. Samples carry the device wall clock (time.time()), the same
+# clock as the `date +%s.%N` markers telemetry.py puts around inference, so
+# the two align without any conversion.
+#
+# --root points at a fake sysfs/procfs tree for testing on any host
+# (telemetry.py fake_root DIR creates one).
+#
+# Runs on the device:
+#   python3 scripts/device_telemetry.py --interval 0.1 --output /tmp/telemetry.jsonl &
+#   kill -TERM <pid>    # dump and exit
+#   python3 scripts/device_telemetry.py --once
+
+DEFAULT_INTERVAL = 0.1
+DEFAULT_CAPACITY = 36000  # 1 h at 10 Hz
+THERMAL_GLOB = "sys/class/thermal/thermal_zone*"
+CPUFREQ_GLOB = "sys/devices/system/cpu/cpu[0-9]*/cpufreq/scaling_cur_freq"
+DEVFREQ_GLOB = "sys/class/devfreq/*"
+REMOTEPROC_GLOB = "sys/class/remoteproc/remoteproc*"
+REMOTEPROC_STATES = {"offline": 0, "suspended": 1, "running": 2, "crashed": -1}
+
+
+def read_text(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+class Source:
+    """A file kept open and re-read with pread at offset 0."""
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+
+    def read(self):
+        try:
+            return os.pread(self.fd, 65536, 0).decode(errors="replace")
+        except OSError:
+            return ""
+
+    def close(self):
+        os.close(self.fd)
+
+
+def parse_cpu_times(text):
+    """{cpu name: (busy, total)} jiffies from /proc/stat."""
+    times = {}
+    for line in text.splitlines():
+        if not line.startswith("cpu"):
+            break
+        name, *fields = line.split()
+        values = [int(v) for v in fields[:8]]
+        idle = values[3] + (values[4] if len(values) > 4 else 0)
+        total = sum(values)
+        times[name] = (total - idle, total)
+    return times
+
+
+def parse_meminfo(text):
+    info = {}
+    for line in text.splitlines():
+        key, _, rest = line.partition(":")
+        if key in ("MemTotal", "MemAvailable"):
+            info[key] = int(rest.split()[0]) // 1024  # MB
+    return info
+
+
+def parse_number(text):
+    try:
+        return float(text.split()[0])
+    except (ValueError, IndexError):
+        return None
+
+
+class Sampler:
+    def __init__(self, root="/", capacity=DEFAULT_CAPACITY, extra=()):
+        self.root = root
+        self.samples = deque(maxlen=capacity)
+        self.stat = self._open("proc/stat")
+        self.meminfo = self._open("proc/meminfo")
+        self.thermal = {}
+        for zone in sorted(glob.glob(os.path.join(root, THERMAL_GLOB))):
+            name = read_text(os.path.join(zone, "type")) or os.path.basename(zone)
+            if os.path.exists(os.path.join(zone, "temp")):
+                self.thermal[f"{name}:{os.path.basename(zone)[len('thermal_zone'):]}"] = Source(os.path.join(zone, "temp"))
+        self.cpufreq = {}
+        for path in sorted(glob.glob(os.path.join(root, CPUFREQ_GLOB))):
+            self.cpufreq[path.split(os.sep)[-3]] = Source(path)
+        self.devfreq = {}
+        for dev in sorted(glob.glob(os.path.join(root, DEVFREQ_GLOB))):
+            if os.path.exists(os.path.join(dev, "cur_freq")):
+                self.devfreq[os.path.basename(dev)] = Source(os.path.join(dev, "cur_freq"))
+        self.remoteproc = {}
+        for rproc in sorted(glob.glob(os.path.join(root, REMOTEPROC_GLOB))):
+            name = read_text(os.path.join(rproc, "name")) or os.path.basename(rproc)
+            if os.path.exists(os.path.join(rproc, "state")):
+                self.remoteproc[name] = Source(os.path.join(rproc, "state"))
+        self.extra = {name: Source(os.path.join(root, path.lstrip("/"))) for name, path in extra}
+        self.last_cpu = parse_cpu_times(self.stat.read()) if self.stat else {}
+        self.cpu_seconds = 0.0
+
+    def _open(self, rel):
+        path = os.path.join(self.root, rel)
+        return Source(path) if os.path.exists(path) else None
+
+    def describe(self):
+        return {"thermal": list(self.thermal), "cpufreq": list(self.cpufreq), "devfreq": list(self.devfreq),
+                "remoteproc": list(self.remoteproc), "extra": list(self.extra)}
+
+    def sample(self):
+        c0 = time.process_time()
+        s = {"t": round(time.time(), 6)}
+        if self.stat:
+            cpu = parse_cpu_times(self.stat.read())
+            load = {}
+            for name, (busy, total) in cpu.items():
+                last_busy, last_total = self.last_cpu.get(name, (busy, total))
+                load[name] = round(100.0 * (busy - last_busy) / (total - last_total), 1) if total > last_total else 0.0
+            self.last_cpu = cpu
+            s["cpu"] = load.pop("cpu", 0.0)
+            s["cpus"] = [load[name] for name in sorted(load, key=lambda n: int(n[3:]))]
+        if self.meminfo:
+            mem = parse_meminfo(self.meminfo.read())
+            if "MemTotal" in mem and "MemAvailable" in mem:
+                s["mem_used_mb"] = mem["MemTotal"] - mem["MemAvailable"]
+        s["temp_c"] = {name: round(v / 1000.0, 1) for name, src in self.thermal.items()
+                       if (v := parse_number(src.read())) is not None}
+        s["cpu_mhz"] = {name: round(v / 1000.0) for name, src in self.cpufreq.items()
+                        if (v := parse_number(src.read())) is not None}
+        s["devfreq_mhz"] = {name: round(v / 1e6, 1) for name, src in self.devfreq.items()
+                            if (v := parse_number(src.read())) is not None}
+        if self.remoteproc:
+            s["rproc"] = {name: REMOTEPROC_STATES.get(src.read().strip(), -2) for name, src in self.remoteproc.items()}
+        if self.extra:
+            s["extra"] = {name: parse_number(src.read()) for name, src in self.extra.items()}
+        self.samples.append(s)
+        self.cpu_seconds += time.process_time() - c0
+        return s
+
+    def dump(self, path, started, interval):
+        wall = max(time.time() - started, 1e-9)
+        header = {"type": "header", "root": self.root, "interval": interval, "started": started,
+                  "samples": len(self.samples), "sources": self.describe(),
+                  "sampler_cpu_pct": round(100.0 * self.cpu_seconds / wall, 3),
+                  "sample_cost_ms": round(1000.0 * self.cpu_seconds / max(len(self.samples), 1), 3)}
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(json.dumps(header) + "\n")
+            for s in list(self.samples):
+                f.write(json.dumps(s, separators=(",", ":")) + "\n")
+        os.replace(tmp, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Device telemetry sampler (ring buffer, dumped as JSONL)")
+    parser.add_argument("--root", default="/", help="Root of the sysfs/procfs tree (a fake tree for testing)")
+    parser.add_argument("--interval", type=float, default=DEFAULT_INTERVAL, help="Seconds between samples")
+    parser.add_argument("--capacity", type=int, default=DEFAULT_CAPACITY, help="Ring buffer size (samples)")
+    parser.add_argument("--duration", type=float, default=0, help="Stop after this many seconds (0: until SIGTERM)")
+    parser.add_argument("--output", default="telemetry.jsonl", help="JSONL dump written on stop / SIGUSR1")
+    parser.add_argument("--extra", action="append", default=[], metavar="NAME=PATH",
+                        help="Extra numeric node to sample (e.g. cdsp_load=/sys/kernel/.../load)")
+    parser.add_argument("--pidfile", help="Write the sampler PID here")
+    parser.add_argument("--once", action="store_true", help="Print one sample as JSON and exit")
+    args = parser.parse_args()
+
+    extra = [tuple(item.split("=", 1)) for item in args.extra]
+    sampler = Sampler(args.root, args.capacity, extra)
+    if args.once:
+        time.sleep(min(args.interval, 0.2))  # one interval for the CPU load delta
+        print(json.dumps({"sources": sampler.describe(), "sample": sampler.sample()}, indent=2))
+        return
+    if args.pidfile:
+        with open(args.pidfile, "w") as f:
+            f.write(str(os.getpid()))
+
+    started = time.time()
+    stop = []
+    signal.signal(signal.SIGTERM, lambda *_: stop.append(True))
+    signal.signal(signal.SIGINT, lambda *_: stop.append(True))
+    signal.signal(signal.SIGUSR1, lambda *_: sampler.dump(args.output, started, args.interval))
+    next_t = time.monotonic()
+    while not stop and (not args.duration or time.time() - started < args.duration):
+        sampler.sample()
+        next_t += args.interval
+        delay = next_t - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            next_t = time.monotonic()  # fell behind: do not burst to catch up
+    sampler.dump(args.output, started, args.interval)
+    print(f"[TELEMETRY] {len(sampler.samples)} samples -> {args.output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+import json
+import os
+
+# Device inventory for IQ-9075 boards.
+# The inventory is a JSON list of devices (see devices.example.json):
+#   {"name": "evk-a", "host": "192.168.0.202", "port": 22, "username": "ubuntu", "password": "qualcomm",
+#    "base_dir": "/home/ubuntu/dinov3_deployment", "capabilities": {"htp": true}}
+# Devices with "kind": "local" are in-process stand-ins for testing the fleet
+# scheduler on one host ("simulate_ms_per_image", "fail_after_shards").
+#
+# Single-device scripts use the device named by $DINOV3_DEVICE, or the first
+# entry. Without an inventory file they fall back to DEFAULT_DEVICE (the
+# board the scripts were originally written against).
+
+ONNX_CONVERT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_INVENTORY_PATH = os.path.join(ONNX_CONVERT_DIR, "devices.json")
+INVENTORY_ENV = "DINOV3_DEVICES"
+DEVICE_ENV = "DINOV3_DEVICE"
+
+DEFAULT_DEVICE = {
+    "name": "iq9075",
+    "kind": "ssh",
+    "host": "192.168.0.202",
+    "port": 22,
+    "username": "ubuntu",
+    "password": "qualcomm",
+    "base_dir": "/home/ubuntu/dinov3_deployment",
+    "capabilities": {"htp": True},
+}
+
+
+def inventory_path(path=None):
+    return path or os.environ.get(INVENTORY_ENV) or DEFAULT_INVENTORY_PATH
+
+
+def load_inventory(path=None):
+    """All devices in the inventory, with unspecified fields taken from DEFAULT_DEVICE."""
+    path = inventory_path(path)
+    if not os.path.exists(path):
+        return [dict(DEFAULT_DEVICE)]
+    with open(path) as f:
+        entries = json.load(f)
+    devices = []
+    for i, entry in enumerate(entries):
+        device = dict(DEFAULT_DEVICE, name=f"device{i}")
+        device.update(entry)
+        devices.append(device)
+    names = [d["name"] for d in devices]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate device names in {path}: {names}")
+    return devices
+
+
+def get_device(name=None, path=None):
+    """One device by name ($DINOV3_DEVICE by default), or the first in the inventory."""
+    devices = load_inventory(path)
+    name = name or os.environ.get(DEVICE_ENV)
+    if not name:
+        return devices[0]
+    for device in devices:
+        if device["name"] == name:
+            return device
+    raise KeyError(f"Device '{name}' not in inventory {inventory_path(path)} ({', '.join(d['name'] for d in devices)})")
+
+
+def select_device(name=None, path=None):
+    """get_device() for command-line tools: an unknown name exits with the known ones instead of a traceback."""
+    try:
+        return get_device(name, path)
+    except KeyError as e:
+        raise SystemExit(f"Error: {e.args[0]}. Set ${DEVICE_ENV} to one of these names.")
@@ -0,0 +1,239 @@
+import argparse
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+import backends
+import qnn_utils
+from preprocess_input import preprocess_array
+
+# Persistent embedding cache in front of the inference backends.
+# Entries are keyed by the image content hash plus the identity of the model
+# build that produced them (ONNX hash, converter options from the net json,
+# QNN SDK version for the device; ORT version for the host), so re-embedding
+# the same reference images costs a lookup instead of a device round trip and
+# a new conversion never serves stale features. pooler_output (and optionally
+# last_hidden_state) are stored as fp16 in sqlite with least-recently-used
+# eviction once the store exceeds its size bound.
+#
+# Usage (from onnx_convert/):
+#   python3 scripts/embedding_cache.py refs/*.jpg --backend auto --batch_size 8
+#   python3 scripts/embedding_cache.py refs/*.jpg --patches --output refs.npy
+#   python3 scripts/embedding_server.py --backend auto --cache .embedding_cache/cache.sqlite
+
+DEFAULT_CACHE_PATH = os.path.join(backends.ONNX_CONVERT_DIR, ".embedding_cache", "cache.sqlite")
+DEFAULT_MAX_MB = 512
+EVICT_TO_FRACTION = 0.9  # evict down to 90% of the bound so every insert does not evict
+
+
+def image_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    sqlite-backed fp16 store. Safe to share between threads (one connection
+    behind a lock); hits/misses/evictions are counted per process.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_mb=DEFAULT_MAX_MB, store_patches=False):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.store_patches = store_patches
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                image_hash TEXT, build_id TEXT, pooler BLOB, hidden BLOB, hidden_shape TEXT,
+                nbytes INTEGER, last_used REAL, PRIMARY KEY (image_hash, build_id));
+            CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+        """ + qnn_utils.FILE_HASHES_TABLE)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._build_ids = {}
+        with self.lock:
+            # Running size of the store, kept up to date by put/_evict (summed once for older stores)
+            self.db.execute("INSERT OR IGNORE INTO meta SELECT 'total_bytes', COALESCE(SUM(nbytes), 0) FROM embeddings")
+            # The bound may be lower than when the store was filled
+            self._evict()
+            self.db.commit()
+
+    # --- model build identity ---------------------------------------------------
+
+    def file_digest(self, path):
+        """sha256 of a (large) model file, memoized by path + size + mtime."""
+        with self.lock:
+            return qnn_utils.file_digest(self.db, path)
+
+    def build_id(self, backend, model_path=backends.DEFAULT_MODEL_PATH):
+        """Identity of the model build behind `backend` (the active one for auto)."""
+        backend = getattr(backend, "active", backend)
+        if id(backend) in self._build_ids:
+            return self._build_ids[id(backend)]
+        identity = {"backend": backend.name}
+        if backend.name == "fake":
+            identity["hidden_size"] = backend.hidden_size
+        else:
+            identity["onnx"] = [self.file_digest(p) for p in (model_path, model_path + ".data") if os.path.exists(p)]
+        if backend.name == "htp":
+            net_json = os.path.join(backends.ONNX_CONVERT_DIR, qnn_utils.NET_JSON_PATH)
+            identity["converter_options"] = qnn_utils.load_converter_options(net_json)
+            identity["sdk"] = qnn_utils.sdk_version(os.path.join(backends.ONNX_CONVERT_DIR, qnn_utils.MODEL_CPP_PATH))
+        elif backend.name == "ort":
+            import onnxruntime as ort
+            identity["ort"] = ort.__version__
+        build = hashlib.sha1(json.dumps(identity, sort_keys=True).encode()).hexdigest()[:16]
+        self._build_ids[id(backend)] = build
+        return build
+
+    # --- lookups ------------------------------------------------------------------
+
+    def get(self, digest, build_id, need_patches=False):
+        """Cached {"pooler_output", ["last_hidden_state"]} as float32, or None on a miss."""
+        with self.lock:
+            row = self.db.execute("SELECT pooler, hidden, hidden_shape FROM embeddings WHERE image_hash = ? AND build_id = ?",
+                                  (digest, build_id)).fetchone()
+            if row is None or (need_patches and row[1] is None):
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.db.execute("UPDATE embeddings SET last_used = ? WHERE image_hash = ? AND build_id = ?",
+                            (time.time(), digest, build_id))
+        result = {"pooler_output": np.frombuffer(row[0], dtype=np.float16).astype(np.float32)}
+        if row[1] is not None:
+            result["last_hidden_state"] = np.frombuffer(row[1], dtype=np.float16).astype(np.float32).reshape(json.loads(row[2]))
+        return result
+
+    def put(self, digest, build_id, outputs, store_patches=None):
+        store_patches = self.store_patches if store_patches is None else store_patches
+        pooler = np.asarray(outputs["pooler_output"], dtype=np.float16).tobytes()
+        hidden = shape = None
+        if store_patches and "last_hidden_state" in outputs:
+            array = np.asarray(outputs["last_hidden_state"], dtype=np.float16)
+            hidden, shape = array.tobytes(), json.dumps(list(array.shape))
+        nbytes = len(pooler) + len(hidden or b"")
+        with self.lock:
+            old = self.db.execute("SELECT nbytes FROM embeddings WHERE image_hash = ? AND build_id = ?",
+                                  (digest, build_id)).fetchone()
+            self.db.execute("INSERT OR REPLACE INTO embeddings VALUES (?, ?, ?, ?, ?, ?, ?)",
+                            (digest, build_id, pooler, hidden, shape, nbytes, time.time()))
+            self._add_bytes(nbytes - (old[0] if old else 0))
+            self._evict()
+            self.db.commit()
+
+    def _total_bytes(self):
+        return self.db.execute("SELECT value FROM meta WHERE key = 'total_bytes'").fetchone()[0]
+
+    def _add_bytes(self, delta):
+        self.db.execute("UPDATE meta SET value = value + ? WHERE key = 'total_bytes'", (delta,))
+
+    def _evict(self):
+        total = self._total_bytes()
+        if total <= self.max_bytes:
+            return
+        target = self.max_bytes * EVICT_TO_FRACTION
+        for digest, build_id, nbytes in self.db.execute(
+                "SELECT image_hash, build_id, nbytes FROM embeddings ORDER BY last_used").fetchall():
+            if total <= target:
+                break
+            self.db.execute("DELETE FROM embeddings WHERE image_hash = ? AND build_id = ?", (digest, build_id))
+            self._add_bytes(-nbytes)
+            total -= nbytes
+            self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            self.db.commit()  # flush last_used updates
+            entries = self.db.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            total = self._total_bytes()
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "size_mb": round(total / 1024 / 1024, 2),
+            "max_mb": round(self.max_bytes / 1024 / 1024, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+        }
+
+    def close(self):
+        with self.lock:
+            self.db.commit()
+            self.db.close()
+
+
+def embed_images(backend, cache, paths, batch_size=8, need_patches=False, model_path=backends.DEFAULT_MODEL_PATH):
+    """
+    Embed image files through the cache: hits are served from the store and
+    only the misses are preprocessed and sent to the backend, in batches.
+    Returns one output dict per path, in order.
+    """
+    image_size = backend.input_size()[0]
+    results = [None] * len(paths)
+    misses = []
+    build = cache.build_id(backend, model_path)
+    for i, path in enumerate(paths):
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = image_hash(data)
+        results[i] = cache.get(digest, build, need_patches)
+        if results[i] is None:
+            misses.append((i, digest, data))
+
+    for start in range(0, len(misses), batch_size):
+        chunk = misses[start:start + batch_size]
+        pixel_values = np.concatenate([preprocess_array(io.BytesIO(data), image_size) for _, _, data in chunk])
+        outputs = backend.infer(pixel_values)
+        # auto may have failed over mid-run: store under the build that produced these
+        build = cache.build_id(backend, model_path)
+        for j, (i, digest, _) in enumerate(chunk):
+            results[i] = {name: value[j].copy() for name, value in outputs.items()}
+            cache.put(digest, build, results[i], store_patches=need_patches or None)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embed images through the persistent embedding cache")
+    parser.add_argument("images", nargs="+", help="Images to embed")
+    parser.add_argument("--backend", default="auto", choices=backends.BACKENDS)
+    parser.add_argument("--model_path", default=backends.DEFAULT_MODEL_PATH, help="ONNX model (part of the build identity)")
+    parser.add_argument("--cache", default=DEFAULT_CACHE_PATH, help="sqlite cache file")
+    parser.add_argument("--max_mb", type=float, default=DEFAULT_MAX_MB, help="Size bound before LRU eviction")
+    parser.add_argument("--batch_size", type=int, default=8, help="Cache misses per backend call")
+    parser.add_argument("--patches", action="store_true", help="Also cache (and require) last_hidden_state")
+    parser.add_argument("--output", help="Save pooler_output of all images to this .npy file")
+    args = parser.parse_args()
+
+    cache = EmbeddingCache(args.cache, args.max_mb)
+    backend = backends.create_backend(args.backend, model_path=args.model_path).open()
+    t0 = time.time()
+    try:
+        results = embed_images(backend, cache, args.images, args.batch_size, args.patches, args.model_path)
+    finally:
+        backend.close()
+    elapsed = time.time() - t0
+
+    stats = cache.stats()
+    cache.close()
+    print(f"--- Embedded {len(results)} images in {elapsed * 1000:.1f} ms ({backend.name}) ---")
+    print(f"Cache: {stats['hits']} hits, {stats['misses']} misses (hit rate {stats['hit_rate'] * 100:.1f}%), "
+          f"{stats['evictions']} evictions, {stats['entries']} entries / {stats['size_mb']} MB of {stats['max_mb']} MB")
+    if args.output:
+        np.save(args.output, np.stack([r["pooler_output"] for r in results]))
+        print(f"Saved {args.output}")
+
+
+if __name__ == "__main__":
+    main()
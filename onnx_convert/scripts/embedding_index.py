@@ -0,0 +1,344 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from feature_utils import normalize
+from result_store import ResultStore, fsync_write
+
+# Compact on-disk nearest-neighbour index over pooler_output embeddings.
+# Vectors are L2-normalized and stored row-major in one memory-mapped file,
+# as fp16 or as int8 with one fp32 scale per row (4x smaller than fp32), so
+# cosine similarity is a dot product. Search is either exact (blocked matmul
+# over the mmap, memory bounded by the block size) or IVF: a spherical k-means
+# coarse quantizer splits the vectors into `nlist` lists and a query scans
+# only the `nprobe` lists closest to it. nprobe is the recall knob;
+# `calibrate` picks the smallest nprobe that reaches a target recall@k
+# against exact search.
+#
+# Adds are incremental: rows are appended to the files, then the count in
+# index.json is replaced atomically, so an interrupted add is simply
+# truncated on the next open. New vectors go to their nearest existing list.
+#
+#   index.json    - dim, dtype, count, nlist
+#   vectors.bin   - (count, dim) fp16 or int8
+#   scales.f32    - (count,) per-row dequantization scale (int8 only)
+#   lists.i32     - (count,) IVF list of each row
+#   centroids.npy - (nlist, dim) fp32
+#   ids.txt       - one image id per row
+#
+# Usage (from onnx_convert/):
+#   python3 scripts/embedding_index.py build refs.index --store jobs/dataset/store --dtype int8 --nlist 256
+#   python3 scripts/embedding_index.py add refs.index --store jobs/dataset/store      # only ids not yet indexed
+#   python3 scripts/embedding_index.py search refs.index --query_id dataset/cat.jpg --k 10 --nprobe 8
+#   python3 scripts/embedding_index.py bench refs.index --k 10 --target_recall 0.95
+
+INDEX_FILE = "index.json"
+INDEX_DTYPES = {"fp16": np.float16, "int8": np.int8}
+SEARCH_BLOCK_ROWS = 65536
+TRAIN_SAMPLE = 65536
+
+
+def train_centroids(vectors, nlist, iterations=15, seed=0):
+    """Spherical k-means on normalized vectors (fp32 centroids, unit length)."""
+    rng = np.random.RandomState(seed)
+    centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        sums = np.zeros_like(centroids)
+        sums[~empty] = np.add.reduceat(vectors[order], np.searchsorted(assign[order], np.nonzero(~empty)[0]))
+        # Re-seed empty lists from random vectors so every list stays useful
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+def top_k(scores, k):
+    """Indices of the k largest scores per column of (rows, queries), best first."""
+    k = min(k, len(scores))
+    part = np.argpartition(-scores, k - 1, axis=0)[:k]
+    order = np.argsort(-np.take_along_axis(scores, part, axis=0), axis=0)
+    return np.take_along_axis(part, order, axis=0)
+
+
+class EmbeddingIndex:
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE)) as f:
+            self.meta = json.load(f)
+        self.dim = self.meta["dim"]
+        self.dtype = INDEX_DTYPES[self.meta["dtype"]]
+        self.count = self.meta["count"]
+        centroids_path = os.path.join(path, "centroids.npy")
+        self.centroids = np.load(centroids_path) if os.path.exists(centroids_path) else None
+        self._truncate_to_count()
+        self._load()
+
+    @classmethod
+    def create(cls, path, dim, dtype="fp16", nlist=0, train_vectors=None):
+        if dtype not in INDEX_DTYPES:
+            raise ValueError(f"Unknown index dtype '{dtype}' (choose from {', '.join(INDEX_DTYPES)})")
+        os.makedirs(path, exist_ok=True)
+        for name in ("vectors.bin", "scales.f32", "lists.i32", "ids.txt"):
+            open(os.path.join(path, name), "wb").close()
+        if nlist:
+            sample = normalize(train_vectors)
+            if len(sample) > TRAIN_SAMPLE:
+                sample = sample[np.random.RandomState(0).choice(len(sample), TRAIN_SAMPLE, replace=False)]
+            if len(sample) < nlist:
+                raise ValueError(f"Need at least nlist={nlist} training vectors, got {len(sample)}")
+            np.save(os.path.join(path, "centroids.npy"), train_centroids(sample, nlist))
+        elif os.path.exists(os.path.join(path, "centroids.npy")):
+            os.remove(os.path.join(path, "centroids.npy"))  # left by an earlier IVF build
+        meta = {"dim": dim, "dtype": dtype, "count": 0, "nlist": nlist, "metric": "cosine"}
+        fsync_write(os.path.join(path, INDEX_FILE), json.dumps(meta, indent=2).encode())
+        return cls(path)
+
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _truncate_to_count(self):
+        """Drop rows appended by an add that never committed its count."""
+        itemsize = np.dtype(self.dtype).itemsize
+        for name, row_bytes in (("vectors.bin", self.dim * itemsize), ("scales.f32", 4), ("lists.i32", 4)):
+            if os.path.getsize(self._file(name)) > self.count * row_bytes and (name != "scales.f32" or self.dtype == np.int8):
+                with open(self._file(name), "r+b") as f:
+                    f.truncate(self.count * row_bytes)
+        with open(self._file("ids.txt")) as f:
+            self.ids = f.read().splitlines()
+        if len(self.ids) > self.count:
+            self.ids = self.ids[:self.count]
+            fsync_write(self._file("ids.txt"), "".join(f"{i}\n" for i in self.ids).encode())
+
+    def _load(self):
+        self._map()
+        if self.centroids is not None:
+            # Inverted lists: per list, chunks of row numbers (one chunk per add)
+            lists = np.asarray(np.memmap(self._file("lists.i32"), dtype=np.int32, mode="r", shape=(self.count,))
+                               if self.count else np.empty(0, np.int32))
+            order = np.argsort(lists, kind="stable").astype(np.int64)
+            offsets = np.searchsorted(lists[order], np.arange(len(self.centroids) + 1))
+            self.list_rows = [[order[offsets[c]:offsets[c + 1]]] for c in range(len(self.centroids))]
+        self.id_set = set(self.ids)
+
+    def _map(self):
+        def mmap(name, dtype, shape):
+            return np.memmap(self._file(name), dtype=dtype, mode="r", shape=shape) if self.count else np.empty(shape, dtype)
+        self.vectors = mmap("vectors.bin", self.dtype, (self.count, self.dim))
+        self.scales = mmap("scales.f32", np.float32, (self.count,)) if self.dtype == np.int8 else None
+
+    # --- adding -----------------------------------------------------------------
+
+    def add(self, ids, vectors):
+        """Append vectors (any float dtype, normalized here) under ids."""
+        vectors = normalize(vectors)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Vectors are {vectors.shape[1]}-d, index is {self.dim}-d")
+        if self.dtype == np.int8:
+            scales = np.maximum(np.abs(vectors).max(axis=1), 1e-12) / 127.0
+            stored = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        else:
+            scales, stored = None, vectors.astype(np.float16)
+        lists = (np.argmax(vectors @ self.centroids.T, axis=1) if self.centroids is not None
+                 else np.zeros(len(vectors))).astype(np.int32)
+
+        appends = [("vectors.bin", stored.tobytes()), ("lists.i32", lists.tobytes()),
+                   ("ids.txt", "".join(f"{i}\n" for i in ids).encode())]
+        if scales is not None:
+            appends.append(("scales.f32", scales.astype(np.float32).tobytes()))
+        for name, data in appends:
+            with open(self._file(name), "ab") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        self.meta["count"] = self.count + len(vectors)
+        fsync_write(self._file(INDEX_FILE), json.dumps(self.meta, indent=2).encode())
+        start, self.count = self.count, self.meta["count"]
+        self.ids.extend(ids)
+        self.id_set.update(ids)
+        self._map()
+        if self.centroids is not None:
+            order = np.argsort(lists, kind="stable")
+            offsets = np.searchsorted(lists[order], np.arange(len(self.centroids) + 1))
+            for c in np.nonzero(np.diff(offsets))[0]:
+                self.list_rows[c].append(order[offsets[c]:offsets[c + 1]].astype(np.int64) + start)
+
+    # --- searching --------------------------------------------------------------
+
+    def _scores(self, rows, queries):
+        """Cosine scores (len(rows), n_queries) for a slice or index array of rows."""
+        block = self.vectors[rows].astype(np.float32)
+        scores = block @ queries.T
+        if self.scales is not None:
+            scores *= self.scales[rows][:, None]
+        return scores
+
+    def search_exact(self, queries, k=10, block_rows=SEARCH_BLOCK_ROWS):
+        """Exact top-k over all rows: [(rows, scores)] per query."""
+        queries = normalize(np.atleast_2d(queries))
+        best_rows = np.empty((0, len(queries)), dtype=np.int64)
+        best_scores = np.empty((0, len(queries)), dtype=np.float32)
+        for start in range(0, self.count, block_rows):
+            scores = self._scores(slice(start, start + block_rows), queries)
+            local = top_k(scores, k)
+            best_rows = np.concatenate([best_rows, local + start])
+            best_scores = np.concatenate([best_scores, np.take_along_axis(scores, local, axis=0)])
+            keep = top_k(best_scores, k)
+            best_rows = np.take_along_axis(best_rows, keep, axis=0)
+            best_scores = np.take_along_axis(best_scores, keep, axis=0)
+        return [(best_rows[:, q], best_scores[:, q]) for q in range(len(queries))]
+
+    def search_ivf(self, queries, k=10, nprobe=8):
+        """Approximate top-k scanning the nprobe closest lists of each query."""
+        if self.centroids is None:
+            return self.search_exact(queries, k)
+        queries = normalize(np.atleast_2d(queries))
+        probes = top_k(self.centroids @ queries.T, nprobe)
+        results = []
+        for q in range(len(queries)):
+            rows = np.concatenate([chunk for c in probes[:, q] for chunk in self.list_rows[c]])
+            if not len(rows):
+                results.append((rows, np.empty(0, dtype=np.float32)))
+                continue
+            rows.sort()  # sequential mmap access
+            scores = self._scores(rows, queries[q:q + 1])
+            best = top_k(scores, k)[:, 0]
+            results.append((rows[best], scores[best, 0]))
+        return results
+
+    def search(self, queries, k=10, nprobe=None):
+        """IVF when the index has lists and nprobe is given, exact otherwise."""
+        if nprobe and self.centroids is not None:
+            return self.search_ivf(queries, k, nprobe)
+        return self.search_exact(queries, k)
+
+    def bytes_per_vector(self):
+        per = self.dim * np.dtype(self.dtype).itemsize + 4  # vector + list id
+        if self.dtype == np.int8:
+            per += 4
+        return per
+
+    def calibrate(self, k=10, target_recall=0.95, queries=100, seed=0):
+        """Smallest nprobe reaching target recall@k on sampled self-queries: (nprobe, recall, curve)."""
+        if self.centroids is None:
+            return None, 1.0, []
+        rng = np.random.RandomState(seed)
+        sample = self.vectors[np.sort(rng.choice(self.count, min(queries, self.count), replace=False))].astype(np.float32)
+        exact = [set(r.tolist()) for r, _ in self.search_exact(sample, k)]
+        curve = []
+        nprobe = 1
+        while True:
+            approx = self.search_ivf(sample, k, nprobe)
+            recall = float(np.mean([len(set(r.tolist()) & e) / len(e) for (r, _), e in zip(approx, exact)]))
+            curve.append((nprobe, recall))
+            if recall >= target_recall or nprobe >= len(self.centroids):
+                return nprobe, recall, curve
+            nprobe = min(nprobe * 2, len(self.centroids))
+
+
+def latency_ms(fn, queries, repeats=1):
+    times = []
+    for q in queries:
+        for _ in range(repeats):
+            t0 = time.perf_counter()
+            fn(q[None])
+            times.append((time.perf_counter() - t0) * 1000)
+    return np.percentile(times, 50), np.percentile(times, 95)
+
+
+def store_vectors(store, skip_ids=()):
+    """(ids, fp32 vectors) of pooler_output rows in a result store, one shard at a time."""
+    for ids, array in store.iter_shards("pooler_output"):
+        keep = [i for i, image_id in enumerate(ids) if image_id not in skip_ids]
+        if keep:
+            yield [ids[i] for i in keep], np.asarray(array[keep], dtype=np.float32)
+
+
+def train_sample(store, size=TRAIN_SAMPLE, seed=0):
+    """fp32 pooler_output of up to `size` random store rows (memory bounded by the sample)."""
+    rows = np.random.RandomState(seed).choice(len(store), min(size, len(store)), replace=False)
+    return store.rows(np.sort(rows), "pooler_output").astype(np.float32)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="On-disk nearest-neighbour index over pooler_output embeddings")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Build a new index from a result store")
+    build.add_argument("index")
+    build.add_argument("--store", required=True, help="Result store with pooler_output (bulk_embed / result_store)")
+    build.add_argument("--dtype", default="fp16", choices=list(INDEX_DTYPES))
+    build.add_argument("--nlist", type=int, default=0, help="IVF lists (0: exact search only; ~sqrt(N) is typical)")
+    add = sub.add_parser("add", help="Add the store rows whose ids are not indexed yet")
+    add.add_argument("index")
+    add.add_argument("--store", required=True)
+    search = sub.add_parser("search", help="Nearest neighbours of an indexed id or a .npy query")
+    search.add_argument("index")
+    group = search.add_mutually_exclusive_group(required=True)
+    group.add_argument("--query_id", help="Id of an indexed image")
+    group.add_argument("--query_npy", help=".npy file with one or more query embeddings")
+    search.add_argument("--k", type=int, default=10)
+    search.add_argument("--nprobe", type=int, help="IVF lists to scan (default: exact search)")
+    bench = sub.add_parser("bench", help="Query latency, recall vs exact and memory per vector")
+    bench.add_argument("index")
+    bench.add_argument("--k", type=int, default=10)
+    bench.add_argument("--queries", type=int, default=100)
+    bench.add_argument("--target_recall", type=float, default=0.95, help="Recall@k the suggested nprobe must reach")
+    args = parser.parse_args()
+
+    if args.command in ("build", "add"):
+        store = ResultStore(args.store)
+        t0 = time.time()
+        if args.command == "build":
+            train = train_sample(store) if args.nlist else None
+            dim = store.manifest["outputs"]["pooler_output"][-1]
+            index = EmbeddingIndex.create(args.index, dim, args.dtype, args.nlist, train)
+            t_train = time.time() - t0
+        else:
+            index = EmbeddingIndex(args.index)
+            t_train = 0.0
+        before = index.count
+        for ids, vectors in store_vectors(store, index.id_set):
+            index.add(ids, vectors)
+        elapsed = time.time() - t0
+        print(f"--- {args.command}: {index.count - before} vectors added ({index.count} total) in {elapsed:.2f} s "
+              f"(IVF training {t_train:.2f} s) ---")
+        print(f"Memory: {index.bytes_per_vector()} bytes/vector ({index.meta['dtype']}, {index.dim}-d), "
+              f"{index.bytes_per_vector() * index.count / 1024 / 1024:.1f} MB total")
+        return
+
+    index = EmbeddingIndex(args.index)
+    if args.command == "search":
+        if args.query_id:
+            queries = index.vectors[index.ids.index(args.query_id)][None].astype(np.float32)
+        else:
+            queries = np.atleast_2d(np.load(args.query_npy))
+        t0 = time.perf_counter()
+        results = index.search(queries, args.k, args.nprobe)
+        print(f"[TIME] Search: {(time.perf_counter() - t0) * 1000:.2f} ms for {len(queries)} queries")
+        for q, (rows, scores) in enumerate(results):
+            print(f"Query {q}:")
+            for rank, (row, score) in enumerate(zip(rows, scores), 1):
+                print(f"  {rank:>3}. {score:.4f}  {index.ids[row]}")
+        return
+
+    rng = np.random.RandomState(1)
+    sample = index.vectors[np.sort(rng.choice(index.count, min(args.queries, index.count), replace=False))].astype(np.float32)
+    print(f"--- Index {args.index}: {index.count} vectors, {index.dim}-d {index.meta['dtype']}, nlist {index.meta['nlist']} ---")
+    print(f"Memory: {index.bytes_per_vector()} bytes/vector (fp32 would be {index.dim * 4})")
+    p50, p95 = latency_ms(lambda q: index.search_exact(q, args.k), sample)
+    print(f"Exact  : p50 {p50:.2f} ms  p95 {p95:.2f} ms")
+    if index.centroids is not None:
+        nprobe, recall, curve = index.calibrate(args.k, args.target_recall, args.queries)
+        for probe, r in curve:
+            p50, p95 = latency_ms(lambda q: index.search_ivf(q, args.k, probe), sample)
+            print(f"IVF nprobe {probe:<4}: recall@{args.k} {r:.3f}  p50 {p50:.2f} ms  p95 {p95:.2f} ms")
+        print(f"Suggested --nprobe {nprobe} (recall@{args.k} {recall:.3f}, target {args.target_recall})")
+
+
+if __name__ == "__main__":
+    main()
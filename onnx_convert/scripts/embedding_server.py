@@ -0,0 +1,395 @@
+import argparse
+import base64
+import io
+import json
+import os
+import queue
+import socketserver
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+
+import backends
+import qnn_utils
+from embedding_cache import EmbeddingCache, image_hash, DEFAULT_MAX_MB
+from preprocess_input import preprocess_array
+
+# Local embedding server with dynamic micro-batching.
+# Requests are preprocessed in their handler threads, queued, and grouped into
+# micro-batches by a single dispatcher that owns the backend session. Batch
+# size adapts to a latency SLO using observed per-batch latencies; a full
+# queue answers 429 (backpressure). JSON {"image_path": ...} requests are
+# only served with --image_root, and only for files under that directory.
+#
+# Usage (from onnx_convert/):
+#   python3 scripts/embedding_server.py --backend auto --max_batch 8 --max_wait_ms 10 --slo_ms 250
+#   curl --data-binary @test/test_image.jpg 'http://127.0.0.1:8765/embed?patch_tokens=1'
+#   curl http://127.0.0.1:8765/metrics
+#   python3 scripts/embedding_server.py --backend auto --cache .embedding_cache/cache.sqlite   # only misses reach the batcher
+#   python3 scripts/embedding_server.py --image_root dataset/
+#   curl -H 'Content-Type: application/json' -d '{"image_path": "cat.jpg"}' http://127.0.0.1:8765/embed
+
+DEFAULT_PORT = 8765
+
+
+class LatencyModel:
+    """EWMA of backend latency per batch size, extrapolated linearly for unseen sizes."""
+
+    def __init__(self, default_ms_per_image, alpha=0.2):
+        self.default_ms_per_image = default_ms_per_image
+        self.alpha = alpha
+        self.ewma = {}
+        self.lock = threading.Lock()
+
+    def observe(self, batch_size, ms):
+        with self.lock:
+            prev = self.ewma.get(batch_size)
+            self.ewma[batch_size] = ms if prev is None else (1 - self.alpha) * prev + self.alpha * ms
+
+    def estimate(self, batch_size):
+        with self.lock:
+            if batch_size in self.ewma:
+                return self.ewma[batch_size]
+            if not self.ewma:
+                return self.default_ms_per_image * batch_size
+            nearest = min(self.ewma, key=lambda b: abs(b - batch_size))
+            return self.ewma[nearest] * batch_size / nearest
+
+
+class Metrics:
+    def __init__(self, max_batch, window=1000):
+        self.max_batch = max_batch
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rejected = 0
+        self.failed = 0
+        self.slo_violations = 0
+        self.batches = 0
+        self.batch_sizes = {}
+        self.fill_sum = 0.0
+        self.max_queue_depth = 0
+        self.latencies_ms = deque(maxlen=window)
+        self.queue_ms = deque(maxlen=window)
+        self.started = time.time()
+
+    def record_batch(self, size):
+        with self.lock:
+            self.batches += 1
+            self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+            self.fill_sum += size / self.max_batch
+
+    def record_request(self, latency_ms, queue_ms, slo_ms):
+        with self.lock:
+            self.requests += 1
+            self.latencies_ms.append(latency_ms)
+            self.queue_ms.append(queue_ms)
+            if slo_ms and latency_ms > slo_ms:
+                self.slo_violations += 1
+
+    def snapshot(self, queue_depth, latency_model):
+        with self.lock:
+            self.max_queue_depth = max(self.max_queue_depth, queue_depth)
+            lat = np.array(self.latencies_ms) if self.latencies_ms else np.zeros(1)
+            waits = np.array(self.queue_ms) if self.queue_ms else np.zeros(1)
+            uptime = time.time() - self.started
+            return {
+                "uptime_s": round(uptime, 1),
+                "requests": self.requests,
+                "requests_per_sec": round(self.requests / uptime, 2) if uptime else 0.0,
+                "rejected": self.rejected,
+                "failed": self.failed,
+                "slo_violations": self.slo_violations,
+                "queue_depth": queue_depth,
+                "max_queue_depth": self.max_queue_depth,
+                "batches": self.batches,
+                "batch_fill_ratio": round(self.fill_sum / self.batches, 3) if self.batches else 0.0,
+                "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_sizes.items())},
+                "latency_ms": {p: round(float(np.percentile(lat, q)), 2) for p, q in (("p50", 50), ("p95", 95), ("p99", 99))},
+                "queue_wait_ms_p50": round(float(np.percentile(waits, 50)), 2),
+                "backend_ms_by_batch": {str(k): round(v, 2) for k, v in sorted(latency_model.ewma.items())},
+            }
+
+
+class Request:
+    __slots__ = ("pixel_values", "arrived", "done", "result", "error")
+
+    def __init__(self, pixel_values):
+        self.pixel_values = pixel_values
+        self.arrived = time.time()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Single dispatcher thread that forms micro-batches and runs them on the
+    backend. A batch closes when it reaches the SLO-aware target size, when
+    max_wait_ms has passed since its first request, or when waiting longer
+    would push the oldest request past the SLO.
+    """
+
+    def __init__(self, backend, max_batch=8, max_wait_ms=10.0, slo_ms=None, max_queue=64, default_ms_per_image=50.0):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.slo_ms = slo_ms
+        self.queue = queue.Queue(maxsize=max_queue)
+        if backend.images_per_sec and backend.images_per_sec != float("inf"):
+            default_ms_per_image = 1000.0 / backend.images_per_sec
+        self.latency = LatencyModel(default_ms_per_image)
+        self.metrics = Metrics(max_batch)
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, pixel_values):
+        """Queue one request; raises queue.Full when the server is saturated."""
+        request = Request(pixel_values)
+        try:
+            self.queue.put_nowait(request)
+        except queue.Full:
+            with self.metrics.lock:
+                self.metrics.rejected += 1
+            raise
+        with self.metrics.lock:
+            self.metrics.max_queue_depth = max(self.metrics.max_queue_depth, self.queue.qsize())
+        return request
+
+    def target_batch(self, oldest_age_ms):
+        """Largest batch whose estimated latency still meets the SLO for the oldest request."""
+        if not self.slo_ms:
+            return self.max_batch
+        for size in range(self.max_batch, 1, -1):
+            if oldest_age_ms + self.latency.estimate(size) <= self.slo_ms:
+                return size
+        return 1
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        first = batch[0].arrived
+        while len(batch) < self.max_batch:
+            age_ms = (time.time() - first) * 1000
+            if len(batch) >= self.target_batch(age_ms):
+                break
+            wait_ms = self.max_wait_ms - age_ms
+            if self.slo_ms:
+                wait_ms = min(wait_ms, self.slo_ms - age_ms - self.latency.estimate(len(batch) + 1))
+            if wait_ms <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=wait_ms / 1000))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self.metrics.record_batch(len(batch))
+            start = time.time()
+            try:
+                outputs = self.backend.infer(np.concatenate([r.pixel_values for r in batch]))
+            except Exception as e:
+                with self.metrics.lock:
+                    self.metrics.failed += len(batch)
+                for r in batch:
+                    r.error = str(e)
+                    r.done.set()
+                continue
+            end = time.time()
+            self.latency.observe(len(batch), (end - start) * 1000)
+            for i, r in enumerate(batch):
+                # Copied: ort overwrites its output buffers on the next batch
+                r.result = {name: value[i].copy() for name, value in outputs.items()}
+                r.result["batch_size"] = len(batch)
+                r.result["queue_ms"] = (start - r.arrived) * 1000
+                r.result["backend_ms"] = (end - start) * 1000
+                self.metrics.record_request((end - r.arrived) * 1000, (start - r.arrived) * 1000, self.slo_ms)
+                r.done.set()
+
+
+def encode_array(array, fmt):
+    array = np.ascontiguousarray(array, dtype=np.float32)
+    if fmt == "list":
+        return array.tolist()
+    return {"shape": list(array.shape), "dtype": "float32", "data": base64.b64encode(array.tobytes()).decode()}
+
+
+def resolve_image_path(image_root, image_path):
+    """Real path of image_path if it lies under image_root, else None."""
+    root = os.path.realpath(image_root)
+    path = os.path.realpath(os.path.join(root, image_path))
+    return path if os.path.commonpath([root, path]) == root else None
+
+
+def make_handler(batcher, image_size, request_timeout_s, cache=None, model_path=backends.DEFAULT_MODEL_PATH,
+                 image_root=None):
+    class Handler(BaseHTTPRequestHandler):
+        def _send_json(self, status, payload, headers=None):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            path = urlparse(self.path).path
+            if path == "/healthz":
+                self._send_json(200, {"status": "ok", "backend": batcher.backend.name})
+            elif path == "/metrics":
+                metrics = batcher.metrics.snapshot(batcher.queue.qsize(), batcher.latency)
+                if cache:
+                    metrics["cache"] = cache.stats()
+                self._send_json(200, metrics)
+            else:
+                self._send_json(404, {"error": "not found"})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path != "/embed":
+                self._send_json(404, {"error": "not found"})
+                return
+            params = parse_qs(url.query)
+            want_patches = params.get("patch_tokens", ["0"])[0] == "1"
+            body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if self.headers.get("Content-Type", "").startswith("application/json"):
+                # {"image_path": "..."} for callers sharing the filesystem, confined to --image_root
+                if image_root is None:
+                    self._send_json(403, {"error": "image_path requests are disabled (start the server with --image_root)"})
+                    return
+                try:
+                    path = resolve_image_path(image_root, json.loads(body)["image_path"])
+                except (ValueError, KeyError, TypeError):
+                    self._send_json(400, {"error": "expected {\"image_path\": \"...\"}"})
+                    return
+                if path is None:
+                    self._send_json(403, {"error": "image_path is outside --image_root"})
+                    return
+                try:
+                    with open(path, "rb") as f:
+                        body = f.read()
+                except OSError:
+                    self._send_json(400, {"error": "could not read image_path"})
+                    return
+
+            # Cache hits skip decoding and the batcher entirely
+            result = None
+            if cache:
+                digest = image_hash(body)
+                build = cache.build_id(batcher.backend, model_path)
+                result = cache.get(digest, build, want_patches)
+                if result:
+                    result.update(batch_size=0, queue_ms=0.0, backend_ms=0.0, cached=True)
+
+            if result is None:
+                try:
+                    pixel_values = preprocess_array(io.BytesIO(body), image_size)
+                except Exception as e:
+                    self._send_json(400, {"error": f"could not decode image: {e}"})
+                    return
+                try:
+                    request = batcher.submit(pixel_values)
+                except queue.Full:
+                    self._send_json(429, {"error": "server busy"}, {"Retry-After": "1"})
+                    return
+                if not request.done.wait(request_timeout_s):
+                    self._send_json(504, {"error": "timed out"})
+                    return
+                if request.error:
+                    self._send_json(503, {"error": request.error})
+                    return
+                result = request.result
+                if cache:
+                    # Re-read the build: auto may have failed over while this request ran
+                    cache.put(digest, cache.build_id(batcher.backend, model_path), result, want_patches or None)
+
+            fmt = params.get("format", ["base64"])[0]
+            response = {
+                "pooler_output": encode_array(result["pooler_output"], fmt),
+                "batch_size": result["batch_size"],
+                "queue_ms": round(result["queue_ms"], 2),
+                "backend_ms": round(result["backend_ms"], 2),
+                "cached": result.get("cached", False),
+            }
+            if want_patches:
+                n_patches = (image_size // qnn_utils.PATCH_SIZE) ** 2
+                response["patch_tokens"] = encode_array(result["last_hidden_state"][-n_patches:], fmt)
+            self._send_json(200, response)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+class BatchingHTTPServer(ThreadingHTTPServer):
+    # Bursts of clients should queue in the batcher (and get 429s), not be reset by a short listen backlog
+    request_queue_size = 128
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def get_request(self):
+        request, _ = super().get_request()
+        return request, ("local", 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-batching DINOv3 embedding server")
+    parser.add_argument("--backend", default="auto", choices=backends.BACKENDS)
+    parser.add_argument("--model_path", default=backends.DEFAULT_MODEL_PATH, help="ONNX model for the ort backend")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--unix_socket", help="Serve on a Unix domain socket instead of TCP")
+    parser.add_argument("--max_batch", type=int, default=8, help="Upper bound on micro-batch size")
+    parser.add_argument("--max_wait_ms", type=float, default=10.0, help="Longest a batch waits to fill after its first request")
+    parser.add_argument("--slo_ms", type=float, default=None, help="End-to-end latency SLO used to size batches")
+    parser.add_argument("--max_queue", type=int, default=64, help="Queued requests before answering 429")
+    parser.add_argument("--image_size", type=int, default=224)
+    parser.add_argument("--request_timeout_s", type=float, default=60.0)
+    parser.add_argument("--cache", help="sqlite embedding cache in front of the batcher (see embedding_cache.py)")
+    parser.add_argument("--cache_max_mb", type=float, default=DEFAULT_MAX_MB, help="Cache size bound before LRU eviction")
+    parser.add_argument("--cache_patches", action="store_true", help="Cache last_hidden_state for every request")
+    parser.add_argument("--image_root", help="Serve JSON image_path requests for files under this directory (off by default)")
+    args = parser.parse_args()
+
+    backend = backends.create_backend(args.backend, model_path=args.model_path).open()
+    batcher = MicroBatcher(backend, args.max_batch, args.max_wait_ms, args.slo_ms, args.max_queue).start()
+    cache = EmbeddingCache(args.cache, args.cache_max_mb, args.cache_patches) if args.cache else None
+    handler = make_handler(batcher, args.image_size, args.request_timeout_s, cache, args.model_path, args.image_root)
+
+    if args.unix_socket:
+        if os.path.exists(args.unix_socket):
+            os.remove(args.unix_socket)
+        server = ThreadingUnixHTTPServer(args.unix_socket, handler)
+        where = args.unix_socket
+    else:
+        server = BatchingHTTPServer((args.host, args.port), handler)
+        where = f"http://{args.host}:{args.port}"
+    print(f"--- Serving {backend.name} embeddings on {where} "
+          f"(max_batch {args.max_batch}, max_wait {args.max_wait_ms} ms, slo {args.slo_ms} ms) ---")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        backend.close()
+        if cache:
+            cache.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import numpy as np
+
+# Helpers shared by the scripts that consume stored features: embedding_index,
+# dense_match, segment_patches and onnx_download/visualize/visualize_pca_batch.py.
+
+
+def normalize(vectors):
+    """float32 copy of `vectors` scaled to unit L2 norm along the last axis."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=-1, keepdims=True), 1e-12)
+
+
+def iter_batches(patches, batch_size):
+    """(first row, ids, (n, gh, gw, D) fp16 mmap slice) batches over a patch store, shard by shard."""
+    row = 0
+    for ids, grids in patches.iter_grids():
+        for start in range(0, len(ids), batch_size):
+            yield row + start, ids[start:start + batch_size], grids[start:start + batch_size]
+        row += len(ids)
+
+
+def png_name(row, image_id):
+    """Per-image output file name; the row prefix keeps store order and makes names unique."""
+    return f"{row:06d}_{os.path.splitext(os.path.basename(image_id))[0]}.png"
+
+
+@contextmanager
+def png_writers(workers):
+    """
+    Yields submit(fn, *args), which runs a per-image write on a thread pool so
+    PNG encoding overlaps the next batch's compute. On exit every write has
+    finished and the first failure is raised.
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = []
+        yield lambda fn, *args: futures.append(pool.submit(fn, *args))
+        for future in futures:
+            future.result()
@@ -0,0 +1,294 @@
+import argparse
+import collections
+import os
+import threading
+import time
+
+import numpy as np
+
+import backends
+import devices
+import qnn_utils
+from preprocess_input import preprocess_array
+from result_store import ResultStore
+from stream_inference import list_images
+
+# Shards a large image job across a fleet of IQ-9075 boards from the device
+# inventory (devices.py). The job is cut into small shards in a shared queue;
+# one worker per board pulls work when idle, so faster boards naturally take
+# more. Claims are throughput-weighted guided self-scheduling: a board claims
+# roughly (its share of fleet images/s) x (remaining shards) / 2, so early
+# claims are large (fewer qnn-net-run launches) and the tail is split finely
+# (no slow board left holding the last big claim). The first claim of every
+# board is a single probe shard that measures its throughput.
+# A failed board's claimed shards go back to the front of the queue for the
+# other boards; results are merged and written in input order. Unreadable
+# images are skipped and reported (their Result_N index is left unused).
+#
+# Usage (from onnx_convert/):
+#   python3 scripts/fleet_scheduler.py dataset/ --inventory devices.json --shard_size 8
+#   python3 scripts/fleet_scheduler.py dataset/ --inventory devices.local-test.json   # local stand-ins
+#   python3 scripts/fleet_scheduler.py dataset/ --store dataset.store   # sharded result store instead of Result_N
+
+RETRY_ERRORS = backends.FAILOVER_ERRORS
+
+
+class SimulatedDevice(backends.FakeBackend):
+    """
+    Local stand-in for a board ("kind": "local" in the inventory): fake
+    features at a configurable speed, optionally failing after N shards.
+    """
+    name = "local"
+
+    def __init__(self, device):
+        super().__init__()
+        self.ms_per_image = device.get("simulate_ms_per_image", 20.0)
+        self.fail_after_shards = device.get("fail_after_shards")
+        self.calls = 0
+
+    def _infer(self, pixel_values):
+        self.calls += 1
+        if self.fail_after_shards is not None and self.calls > self.fail_after_shards:
+            raise ConnectionError("simulated link drop")
+        time.sleep(self.ms_per_image * len(pixel_values) / 1000)
+        return super()._infer(pixel_values)
+
+
+def open_device_backend(device):
+    if device["kind"] == "local":
+        return SimulatedDevice(device).open()
+    return backends.HtpDeviceBackend(device=device).open()
+
+
+class DeviceWorker:
+    def __init__(self, device, alpha=0.3):
+        self.device = device
+        self.name = device["name"]
+        self.alpha = alpha
+        self.backend = None
+        self.images_per_sec = None  # EWMA, measured
+        self.shards = 0
+        self.images = 0
+        self.busy = 0.0
+        self.failures = 0
+        self.alive = True
+
+    def run(self, pixel_values):
+        if self.backend is None:
+            self.backend = open_device_backend(self.device)
+        start = time.time()
+        outputs = self.backend.infer(pixel_values)
+        elapsed = time.time() - start
+        rate = len(pixel_values) / max(elapsed, 1e-6)
+        self.images_per_sec = rate if self.images_per_sec is None else (1 - self.alpha) * self.images_per_sec + self.alpha * rate
+        self.busy += elapsed
+        self.images += len(pixel_values)
+        return outputs
+
+    def reset(self):
+        if self.backend is not None:
+            try:
+                self.backend.close()
+            except RETRY_ERRORS:
+                pass
+        self.backend = None
+
+
+class FleetScheduler:
+    def __init__(self, inventory, shard_size=8, max_claim=8, max_failures=2, image_size=224):
+        self.workers = [DeviceWorker(device) for device in inventory]
+        self.shard_size = shard_size
+        self.max_claim = max_claim
+        self.max_failures = max_failures
+        self.image_size = image_size
+        self.cond = threading.Condition()
+
+    def claim_count(self, worker):
+        """Throughput-weighted guided self-scheduling (called with the lock held)."""
+        if worker.images_per_sec is None:
+            return 1  # probe
+        alive = [w for w in self.workers if w.alive]
+        known = [w.images_per_sec for w in alive if w.images_per_sec]
+        share = worker.images_per_sec / sum(known) if known else 1.0 / len(alive)
+        return max(1, min(self.max_claim, int(len(self.pending) * share / 2)))
+
+    def _claim(self, worker):
+        with self.cond:
+            while True:
+                if not worker.alive or self.error is not None:
+                    return []
+                if self.pending:
+                    n = self.claim_count(worker)
+                    claimed = [self.pending.popleft() for _ in range(min(n, len(self.pending)))]
+                    self.in_flight += len(claimed)
+                    return claimed
+                if not self.in_flight:
+                    return []
+                # Others still hold shards that may come back if their board fails
+                self.cond.wait()
+
+    def _complete(self, claimed, kept=None, outputs=None, error=None):
+        """Store the outputs of the kept (shard, position) images of `claimed`, or requeue it on error."""
+        with self.cond:
+            self.in_flight -= len(claimed)
+            if error is None:
+                for shard in claimed:
+                    rows = [i for i, (s, _) in enumerate(kept) if s == shard]
+                    self.results[shard] = ([kept[i][1] for i in rows],
+                                           {name: value[rows] for name, value in outputs.items()})
+            else:
+                self.pending.extendleft(reversed(claimed))
+            self.cond.notify_all()
+
+    def _preprocess(self, claimed):
+        """(kept [(shard, position)], pixel values); unreadable images are skipped and reported."""
+        kept, pixel_values = [], []
+        for shard in claimed:
+            for position, path in enumerate(self.shards[shard]):
+                try:
+                    pixel_values.append(preprocess_array(path, self.image_size))
+                    kept.append((shard, position))
+                except OSError as e:
+                    with self.cond:
+                        if path not in self.skipped:
+                            print(f"Warning: skipping {path} ({e})")
+                            self.skipped.append(path)
+        return kept, pixel_values
+
+    def _worker_loop(self, worker):
+        while True:
+            claimed = self._claim(worker)
+            if not claimed:
+                return
+            try:
+                # Bad inputs are not the board's fault: read them outside the failure accounting
+                kept, pixel_values = self._preprocess(claimed)
+                try:
+                    outputs = worker.run(np.concatenate(pixel_values)) if pixel_values else {}
+                except RETRY_ERRORS as e:
+                    worker.failures += 1
+                    worker.reset()
+                    print(f"[FLEET] {worker.name} failed on shards {claimed} ({e}); requeued"
+                          + ("; removing board" if worker.failures >= self.max_failures else ""))
+                    with self.cond:
+                        worker.alive = worker.failures < self.max_failures
+                    self._complete(claimed, error=e)
+                    continue
+                worker.shards += len(claimed)
+                self._complete(claimed, kept, outputs)
+            except Exception as e:
+                # Anything else is a bug: stop the job instead of leaving the others waiting
+                with self.cond:
+                    worker.alive = False
+                    self.error = self.error or RuntimeError(f"{worker.name} crashed on shards {claimed}: {e!r}")
+                self._complete(claimed, error=e)
+                return
+
+    def run(self, paths, on_result=None):
+        """
+        Embed `paths` across the fleet. on_result(index, outputs) is called in
+        input order (index into `paths`) as soon as each contiguous prefix of
+        shards is done. Returns the per-image outputs in order, without the
+        unreadable images (listed in self.skipped).
+        """
+        self.shards = [paths[i:i + self.shard_size] for i in range(0, len(paths), self.shard_size)]
+        self.pending = collections.deque(range(len(self.shards)))
+        self.in_flight = 0
+        self.results = {}
+        self.skipped = []
+        self.error = None
+        threads = [threading.Thread(target=self._worker_loop, args=(w,), daemon=True) for w in self.workers]
+        for t in threads:
+            t.start()
+
+        merged = []
+        next_shard = 0
+        while next_shard < len(self.shards):
+            with self.cond:
+                while next_shard not in self.results:
+                    if self.error is not None:
+                        raise self.error
+                    if not any(w.alive for w in self.workers):
+                        raise RuntimeError(f"All devices failed; {len(self.shards) - next_shard} shards unfinished")
+                    self.cond.wait(timeout=1.0)
+                positions, shard_outputs = self.results.pop(next_shard)
+            # Emit outside the lock so writing results never stalls the workers
+            for j, position in enumerate(positions):
+                result = {name: value[j] for name, value in shard_outputs.items()}
+                if on_result:
+                    on_result(next_shard * self.shard_size + position, result)
+                merged.append(result)
+            next_shard += 1
+        for t in threads:
+            t.join()
+        for w in self.workers:
+            w.reset()
+        return merged
+
+    def report(self, wall):
+        total = sum(w.images for w in self.workers)
+        print("\n--- Fleet Summary ---")
+        print(f"Images: {total}  Wall: {wall:.2f} s  Fleet throughput: {total / wall:.2f} images/s")
+        if self.skipped:
+            print(f"Skipped {len(self.skipped)} unreadable image(s): {', '.join(self.skipped)}")
+        print(f"{'Device':<16} {'Shards':>7} {'Images':>7} {'Images/s':>9} {'Busy %':>7} {'Failures':>9}  State")
+        for w in self.workers:
+            rate = f"{w.images_per_sec:.2f}" if w.images_per_sec else "-"
+            print(f"{w.name:<16} {w.shards:>7} {w.images:>7} {rate:>9} {w.busy / wall * 100:>6.1f}% "
+                  f"{w.failures:>9}  {'ok' if w.alive else 'removed'}")
+
+
+def write_result(output_dir, index, outputs):
+    result_dir = os.path.join(output_dir, f"Result_{index}")
+    os.makedirs(result_dir, exist_ok=True)
+    for name in qnn_utils.OUTPUT_NAMES:
+        np.asarray(outputs[name], dtype=np.float32).tofile(os.path.join(result_dir, f"{name}.raw"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Shard an image job across a fleet of IQ-9075 boards")
+    parser.add_argument("source", help="Directory of images or a glob pattern")
+    parser.add_argument("--inventory", help=f"Device inventory JSON (default: ${devices.INVENTORY_ENV} or devices.json)")
+    parser.add_argument("--devices", help="Comma-separated subset of inventory device names")
+    parser.add_argument("--output_dir", default="fleet_results", help="Local directory for Result_N outputs (input order)")
+    parser.add_argument("--store", help="Write results to this result store (ids = image paths) instead of Result_N")
+    parser.add_argument("--shard_size", type=int, default=8, help="Images per shard")
+    parser.add_argument("--max_claim", type=int, default=8, help="Most shards a board claims at once")
+    parser.add_argument("--max_failures", type=int, default=2, help="Failures before a board is removed")
+    args = parser.parse_args()
+
+    images = list_images(args.source)
+    if not images:
+        print(f"Error: no images found in {args.source}")
+        return
+    inventory = devices.load_inventory(args.inventory)
+    if args.devices:
+        wanted = args.devices.split(",")
+        inventory = [d for d in inventory if d["name"] in wanted]
+    print(f"--- Sharding {len(images)} images over {len(inventory)} devices: {', '.join(d['name'] for d in inventory)} ---")
+
+    scheduler = FleetScheduler(inventory, args.shard_size, args.max_claim, args.max_failures)
+    if args.store:
+        store = ResultStore(args.store)
+        on_result = lambda i, outputs: store.append([images[i]], {name: value[None] for name, value in outputs.items()})
+    else:
+        on_result = lambda i, outputs: write_result(args.output_dir, i, outputs)
+    start = time.time()
+    failed = False
+    try:
+        scheduler.run(images, on_result=on_result)
+    except RuntimeError as e:
+        print(f"Fleet job failed: {e}")
+        failed = True
+    finally:
+        if args.store:
+            store.flush()  # seal the rows merged so far
+            store.write_index()
+    scheduler.report(time.time() - start)
+    print(f"Results saved in {args.store or args.output_dir}")
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,20 +1,41 @@
+import time
+_T_START = time.perf_counter()  # before any other import, to measure CLI startup
 
 import argparse
+import json
 import sys
 import os
-import subprocess
-import paramiko
-from scp import SCPClient
-import time
-import re
+import shutil
+
+import numpy as np
+
+import devices
+import profile_blocks
+import qnn_utils
+import tracing
+
+# perf_history (sqlite), telemetry and preprocess_input (PIL) are imported
+# where they are used, so runs that don't need them start faster
+
+# The board comes from the device inventory (devices.py; $DINOV3_DEVICE selects
+# one) and is resolved in main(), after argument parsing.
+
+# Device-side decode/normalize for compressed uploads and output
+# selection/reduction/encoding (deployed by deploy.py), relative to the base dir
+REMOTE_PREPROCESS_SCRIPT = "scripts/device_preprocess.py"
+REMOTE_POSTPROCESS_SCRIPT = "scripts/device_postprocess.py"
+
+# Reused input buffers, keyed by graph input shape
+_input_buffers = {}
 
-# Connection Config (Should match deploy.py or be configurable)
-DEVICE_IP = "192.168.0.202"
-USERNAME = "ubuntu"
-PASSWORD = "qualcomm"
-REMOTE_BASE_DIR = "/home/ubuntu/dinov3_deployment"
+def connect_device(device):
+    """SSH client for an inventory entry (devices.py), or None."""
+    return create_ssh_client(device["host"], device["port"], device["username"], device["password"])
 
 def create_ssh_client(server, port, user, password):
+    # paramiko is slow to import; only pay for it when connecting
+    import paramiko
+
     client = paramiko.SSHClient()
     client.load_system_host_keys()
     client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
@@ -27,10 +48,11 @@ def create_ssh_client(server, port, user, password):
 
 def run_command(client, command, print_output=True):
     if print_output: print(f"[REMOTE] {command}")
-    stdin, stdout, stderr = client.exec_command(command)
-    exit_status = stdout.channel.recv_exit_status()
-    out = stdout.read().decode().strip()
-    err = stderr.read().decode().strip()
+    with tracing.span("ssh exec", cat="ssh", command=command[:200]):
+        stdin, stdout, stderr = client.exec_command(command)
+        exit_status = stdout.channel.recv_exit_status()
+        out = stdout.read().decode().strip()
+        err = stderr.read().decode().strip()
     if print_output:
         if out: print(out)
         if err: print(err)
@@ -42,113 +64,314 @@ def progress_bar(filename, size, sent):
     if sent == size:
         sys.stdout.write('\n')
 
-def main():
-    parser = argparse.ArgumentParser(description="Run DINOv3 Inference on IQ-9075 (HTP)")
-    parser.add_argument("image_path", help="Path to the input image")
-    parser.add_argument("--output_dir", default="inference_results", help="Local directory to save results")
-    args = parser.parse_args()
+def preprocess_to_graph_buffer(image_path, net_json=qnn_utils.NET_JSON_PATH):
+    """Preprocess in-process straight into a reused buffer in the graph's input layout."""
+    from preprocess_input import preprocess_array
 
-    if not os.path.exists(args.image_path):
-        print(f"Error: Image {args.image_path} not found.")
-        return
+    dims, perm = qnn_utils.load_tensor_dims("pixel_values", net_json)
+    channels_last = bool(perm) and dims[-1] == 3
+    key = tuple(dims)
+    if key not in _input_buffers:
+        _input_buffers[key] = np.empty(dims, dtype=np.float32)
+    size = dims[1] if channels_last else dims[2]
+    return preprocess_array(image_path, size, out=_input_buffers[key], channels_last=channels_last)
 
-    # 1. Preprocess Image
-    print(f"--- Preprocessing {args.image_path} ---")
-    raw_path = "temp_input.raw"
-    # Assuming preprocess_input.py is in the same 'scripts' dir or CWD
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    preprocess_script = os.path.join(script_dir, "preprocess_input.py")
-    
-    try:
-        t0 = time.time()
-        subprocess.run([sys.executable, preprocess_script, args.image_path, raw_path], check=True)
-        t1 = time.time()
-        print(f"[TIME] Preprocessing Time : {(t1-t0)*1000:.2f} ms")
-    except subprocess.CalledProcessError as e:
-        print(f"Preprocessing failed: {e}")
-        return
+def upload_bytes(sftp, data, remote_path):
+    """Stream a buffer to the device over an open SFTP session (no temp file)."""
+    with sftp.open(remote_path, "wb") as f:
+        f.set_pipelined(True)
+        f.write(memoryview(data).cast("B"))
 
-    # 2. Connect
-    print(f"--- Connecting to {DEVICE_IP} ---")
-    ssh = create_ssh_client(DEVICE_IP, 22, USERNAME, PASSWORD)
-    if not ssh: return
-    scp = SCPClient(ssh.get_transport(), socket_timeout=600.0, progress=progress_bar)
+def device_preprocess_command(base_dir, remote_images, remote_dir, remote_input_list, net_json=qnn_utils.NET_JSON_PATH):
+    """Shell command that turns uploaded encoded images into qnn-net-run inputs on the device."""
+    dims, perm = qnn_utils.load_tensor_dims("pixel_values", net_json)
+    channels_last = bool(perm) and dims[-1] == 3
+    size = dims[1] if channels_last else dims[2]
+    return (f"python3 {base_dir}/{REMOTE_PREPROCESS_SCRIPT} --size {size} --layout {'nhwc' if channels_last else 'nchw'} "
+            f"--output_dir {remote_dir} --input_list {remote_input_list} {' '.join(remote_images)}")
 
-    # 3. Upload Input
-    remote_input_path = f"{REMOTE_BASE_DIR}/test/custom_input.raw"
-    remote_input_list = f"{REMOTE_BASE_DIR}/test/custom_input_list.txt"
-    
-    print(f"--- Uploading Input ---")
-    scp.put(raw_path, remote_input_path)
-    os.remove(raw_path) # Clean local temp
+def stage_input(sftp, base_dir, image_path, remote_dir, remote_input_list, device_preprocess=False):
+    """
+    Put one image on the device as a qnn-net-run input. Returns (commands to
+    run before qnn-net-run, bytes sent over the link). With device_preprocess
+    the encoded file is shipped as-is and decoded/normalized on the device.
+    """
+    if device_preprocess:
+        with open(image_path, "rb") as f:
+            encoded = f.read()
+        remote_image = f"{remote_dir}/input{os.path.splitext(image_path)[1].lower()}"
+        upload_bytes(sftp, encoded, remote_image)
+        return [device_preprocess_command(base_dir, [remote_image], remote_dir, remote_input_list)], len(encoded)
+
+    pixel_values = preprocess_to_graph_buffer(image_path)
+    remote_raw = f"{remote_dir}/custom_input.raw"
+    upload_bytes(sftp, pixel_values, remote_raw)
+    with sftp.open(remote_input_list, "w") as f:
+        f.write(f"pixel_values:={remote_raw}\n")
+    return [], pixel_values.nbytes
+
+def read_remote_bytes(sftp, remote_path):
+    with sftp.open(remote_path, "rb") as f:
+        f.prefetch()
+        return f.read()
 
-    # 4. Create Input List on Device
-    run_command(ssh, f"echo 'pixel_values:={remote_input_path}' > {remote_input_list}")
+def read_remote_array(sftp, remote_path):
+    return np.frombuffer(read_remote_bytes(sftp, remote_path), dtype=np.float32)
+
+def device_postprocess_command(base_dir, remote_output_dir, outputs, reductions, encoding, net_json=qnn_utils.NET_JSON_PATH):
+    """Shell command that selects/reduces/encodes every Result_N on the device (after qnn-net-run)."""
+    prefix_tokens, (grid_h, grid_w), hidden = qnn_utils.token_layout(net_json)
+    return (f"python3 {base_dir}/{REMOTE_POSTPROCESS_SCRIPT} {remote_output_dir} --outputs '{','.join(outputs)}' "
+            f"--reduce '{','.join(reductions)}' --encoding {encoding} --prefix_tokens {prefix_tokens} "
+            f"--grid_hw {grid_h} {grid_w} --hidden {hidden}")
+
+def read_remote_result(sftp, remote_result_dir, postprocessed=False):
+    """
+    Read one Result_N straight into numpy. Returns (decoded float32 outputs,
+    {file name: bytes} as transferred, for saving locally).
+    """
+    if not postprocessed:
+        files = {f"{name}.raw": read_remote_bytes(sftp, f"{remote_result_dir}/{name}.raw") for name in qnn_utils.OUTPUT_NAMES}
+        return {name: np.frombuffer(files[f"{name}.raw"], dtype=np.float32) for name in qnn_utils.OUTPUT_NAMES}, files
+
+    manifest_bytes = read_remote_bytes(sftp, f"{remote_result_dir}/{qnn_utils.OUTPUT_MANIFEST_NAME}")
+    files = {qnn_utils.OUTPUT_MANIFEST_NAME: manifest_bytes}
+    outputs = {}
+    for name, entry in json.loads(manifest_bytes).items():
+        files[entry["file"]] = read_remote_bytes(sftp, f"{remote_result_dir}/{entry['file']}")
+        if "scale_file" in entry:
+            files[entry["scale_file"]] = read_remote_bytes(sftp, f"{remote_result_dir}/{entry['scale_file']}")
+        outputs[name] = qnn_utils.decode_output(entry, files[entry["file"]], files.get(entry.get("scale_file")))
+    return outputs, files
+
+def infer(args, device, ssh, sftp, selected, reductions, timings):
+    """Steps 2-4 of main() on an open session: upload, run, download, report, record."""
+    tracer = tracing.get_tracer()
+    base_dir = device["base_dir"]
+    postprocess = selected != qnn_utils.OUTPUT_NAMES or reductions or args.encoding != "fp32"
+    if tracer.estimate_clock_offset(ssh) is not None:
+        print(f"[TRACE] Device clock offset {tracer.clock_offset * 1000:+.2f} ms (+-{tracer.clock_uncertainty * 1000:.2f} ms)")
+
+    # 2. Preprocess (in-process, into the graph's input layout) + Upload, streamed from memory;
+    # with --device_preprocess only the encoded image crosses the link
+    remote_input_dir = f"{base_dir}/test"
+    remote_input_list = f"{remote_input_dir}/custom_input_list.txt"
+    where = "device" if args.device_preprocess else "host"
+    print(f"--- Preprocessing {args.image_path} ({where}) + Uploading Input ---")
+    t0 = time.perf_counter()
+    tracer.begin("preprocess+upload", where=where)
+    link_bytes = 0
+    try:
+        pre_commands, link_bytes = stage_input(sftp, base_dir, args.image_path, remote_input_dir, remote_input_list,
+                                               args.device_preprocess)
+    except (IOError, OSError, ValueError) as e:
+        print(f"Preprocessing/upload failed: {e}")
+        return
+    finally:
+        tracer.end(bytes=link_bytes)
+    timings["preprocess+upload"] = (time.perf_counter() - t0) * 1000
+    print(f"[LINK] Uploaded {link_bytes / 1024:.1f} KB")
 
-    # 5. Run Execution
+    # 3. Run Execution
     print(f"--- Running Inference (HTP) ---")
     # Using the same environment setup as deploy.py
-    # Added --profiling_level basic to get pure inference stats
-    cmd = f"cd {REMOTE_BASE_DIR} && " \
-          f"export ADSP_LIBRARY_PATH=\"{REMOTE_BASE_DIR}/lib/hexagon;/usr/lib/rfsa/adsp;/dsp;/usr/lib/dsp/cdsp1;/system/lib/rfsa/adsp;/system/vendor/lib/rfsa/adsp\" && " \
-          f"export LD_LIBRARY_PATH={REMOTE_BASE_DIR}/lib:$LD_LIBRARY_PATH && " \
-          f"./bin/qnn-net-run --backend {REMOTE_BASE_DIR}/lib/libQnnHtp.so " \
-          f"--model {REMOTE_BASE_DIR}/bin/libdinov3.so " \
-          f"--input_list {remote_input_list} " \
-          f"--output_dir {REMOTE_BASE_DIR}/test/custom_output " \
-          f"--profiling_level basic " \
-          f"--log_level info"
+    # --profiling_level basic gives pure inference stats; detailed/linting add per-op cycles
+    # A tuned HTP backend config / perf profile (tune_htp_backend.py) is applied automatically
+    tuning = qnn_utils.load_htp_tuning()
+    if tuning:
+        print(f"Using tuned HTP settings: perf_profile={tuning.get('perf_profile')}, graph_config={tuning.get('graph_config')}")
+    if args.profiling_level == "linting":
+        for path in profile_blocks.write_lint_config_files(tuning, base_dir):
+            sftp.put(path, f"{base_dir}/assets/{os.path.basename(path)}")
+            os.remove(path)
+    remote_output_dir = f"{base_dir}/test/custom_output"
+    net_run = qnn_utils.net_run_invocation(
+        base_dir, f"{base_dir}/bin/libdinov3.so", remote_input_list,
+        remote_output_dir, log_level="info",
+        **profile_blocks.profiling_args(args.profiling_level, base_dir, tuning))
+    post_commands = [device_postprocess_command(base_dir, remote_output_dir, selected, reductions, args.encoding)] if postprocess else []
+    if args.telemetry:
+        import telemetry
+
+        # net_run start/end are stamped on the device clock, like the samples
+        net_run = telemetry.event_wrap("net_run", net_run)
+        try:
+            telemetry.start(ssh, base_dir, interval=0.05)
+        except RuntimeError as e:
+            print(f"[WARNING] {e}")
+            args.telemetry = False
+    # With --trace each device-side step is stamped on the device clock
+    pre_commands = [tracer.device_command("device_preprocess", c) for c in pre_commands]
+    post_commands = [tracer.device_command("device_postprocess", c) for c in post_commands]
+    net_run = tracer.device_command("qnn-net-run", net_run)
+    cmd = " && ".join([f"cd {base_dir}", f"rm -rf {remote_output_dir}"] + pre_commands + qnn_utils.htp_env_exports(base_dir)
+                      + [net_run] + post_commands)
     
-    start_time = time.time()
-    exit_code, out, err = run_command(ssh, cmd, print_output=False)
-    end_time = time.time()
+    start_time = time.perf_counter()
+    tracer.begin("execute (remote shell)")
+    exit_code = None
+    try:
+        exit_code, out, err = run_command(ssh, cmd, print_output=False)
+    finally:
+        tracer.end(exit_code=exit_code)
+    end_time = time.perf_counter()
     
     # Python-measured shell time (includes init + overhead)
-    total_time_ms = (end_time - start_time) * 1000 
+    timings["execute"] = (end_time - start_time) * 1000
+
+    device_spans = tracer.add_device_events(out)
+    net_run_span = next((s for s in device_spans if s[0] == "qnn-net-run"), None)
+    qnn_spans = tracer.add_qnn_log(out + "\n" + err, net_run_span)
+    events, device_telemetry = [], None
+    if args.telemetry or tracer.enabled:
+        import telemetry
+
+        # Markers from --telemetry / --trace are not part of the net-run log
+        events = [e for e in telemetry.parse_events(out) if e[0] == "net_run"]
+        out = telemetry.strip_events(out)
+    if args.telemetry:
+        os.makedirs(args.output_dir, exist_ok=True)
+        try:
+            device_telemetry = telemetry.stop(ssh, sftp, os.path.join(args.output_dir, "telemetry.jsonl"))
+        except (RuntimeError, IOError, OSError, ValueError) as e:
+            print(f"[WARNING] Telemetry unavailable: {e}")
     
     if exit_code != 0:
-        print("Inference failed! Check logs above.")
+        print(f"Inference failed! {err}")
         return
 
     # Try to parse QNN internal timing (Pure Inference Time)
+    # "Avg: ... us" (Standard Profiling), falling back to the
+    # "QnnGraph_execute started/done" log timestamps
     full_log = out + "\n" + err
-    
-    # Method 1: Look for "Avg: ... us" (Standard Profiling)
-    avg_match = re.search(r"Avg: ([0-9\.]+) us", full_log)
-    
-    # Method 2: Calculate from Log Timestamps (Fallback)
-    # Format: "  6209.0ms [  INFO ]  <I> QnnGraph_execute started."
-    start_match = re.search(r"([0-9\.]+)ms .* QnnGraph_execute started", full_log)
-    end_match = re.search(r"([0-9\.]+)ms .* QnnGraph_execute done", full_log)
-
-    if avg_match:
-         avg_us = float(avg_match.group(1))
-         print(f"[TIME] Inference Time     : {avg_us/1000:.2f} ms")
-    elif start_match and end_match:
-         start_ms = float(start_match.group(1))
-         end_ms = float(end_match.group(1))
-         diff_ms = end_ms - start_ms
-         print(f"[TIME] Inference Time     : {diff_ms:.2f} ms")
+    inference_ms = qnn_utils.parse_inference_time_ms(full_log)
+    if inference_ms is not None:
+         print(f"[TIME] Inference Time     : {inference_ms:.2f} ms")
     else:
          print("[WARNING] Could not parse pure inference time from QNN logs.")
 
-    # 6. Download Results
+    # Per-op profiles are rendered on the device so they travel with the results
+    if args.profiling_level != "basic":
+        run_command(ssh, " && ".join([f"cd {base_dir}"] + qnn_utils.htp_env_exports(base_dir) + [
+            profile_blocks.viewer_command(base_dir, f"{remote_output_dir}/{profile_blocks.PROFILE_LOG_NAME}",
+                                          f"{remote_output_dir}/{profile_blocks.PROFILE_TEXT_NAME}")]), print_output=False)
+
+    # 4. Read Results straight into numpy
     print(f"--- Downloading Results to {args.output_dir} ---")
     os.makedirs(args.output_dir, exist_ok=True)
-    
-    # Tar remote output for efficiency
-    run_command(ssh, f"tar -czf {REMOTE_BASE_DIR}/custom_output.tar.gz -C {REMOTE_BASE_DIR}/test/custom_output .")
+    t0 = time.perf_counter()
+    tracer.begin("download")
+    outputs, files = {}, {}
     try:
-        scp.get(f"{REMOTE_BASE_DIR}/custom_output.tar.gz", "custom_output.tar.gz")
-        subprocess.run(f"tar -xzf custom_output.tar.gz -C {args.output_dir}", shell=True)
-        os.remove("custom_output.tar.gz")
-        print(f"Success! Results saved in {args.output_dir}")
-    except Exception as e:
+        outputs, files = read_remote_result(sftp, f"{remote_output_dir}/Result_0", postprocess)
+        if args.profiling_level != "basic":
+            for name in (profile_blocks.PROFILE_LOG_NAME, profile_blocks.PROFILE_TEXT_NAME):
+                sftp.get(f"{remote_output_dir}/{name}", os.path.join(args.output_dir, name))
+    except (IOError, OSError) as e:
         print(f"Download failed: {e}")
+    finally:
+        tracer.end(bytes=sum(len(data) for data in files.values()))
+    timings["download"] = (time.perf_counter() - t0) * 1000
+    print(f"[LINK] Downloaded {sum(len(data) for data in files.values()) / 1024:.1f} KB")
+
+    # Saved as transferred; qnn_utils.read_raw_outputs decodes either form
+    result_dir = os.path.join(args.output_dir, "Result_0")
+    if os.path.isdir(result_dir):
+        shutil.rmtree(result_dir)
+    os.makedirs(result_dir)
+    for file_name, data in files.items():
+        with open(os.path.join(result_dir, file_name), "wb") as f:
+            f.write(data)
+    for name, array in outputs.items():
+        print(f"  {name}: shape {tuple(array.shape)}")
+    if outputs:
+        print(f"Success! Results saved in {args.output_dir}")
+
+    # Host overhead = everything except the pure HTP execution
+    total_ms = (time.perf_counter() - _T_START) * 1000
+    print("--- Host Overhead ---")
+    for phase, ms in timings.items():
+        print(f"[TIME] {phase.capitalize():<18}: {ms:.2f} ms")
+    if inference_ms is not None:
+        print(f"[TIME] Host Overhead      : {total_ms - inference_ms:.2f} ms of {total_ms:.2f} ms total")
+    if device_telemetry is not None:
+        telemetry.print_summary(device_telemetry, events)
+
+    profile_text = os.path.join(args.output_dir, profile_blocks.PROFILE_TEXT_NAME)
+    if args.profiling_level != "basic" and os.path.exists(profile_text):
+        graph_path = "native_qnn/src/dinov3_qnn.cpp" if os.path.exists("native_qnn/src/dinov3_qnn.cpp") else qnn_utils.NET_JSON_PATH
+        profile_blocks.report(profile_text, graph_path, os.path.join(args.output_dir, "profile_blocks.json"))
+        with open(profile_text) as f:
+            tracer.add_qnn_profile(f.read(), net_run_span, qnn_spans)
+    if args.history != "" and inference_ms is not None:
+        import perf_history
+
+        metrics = {perf_history.metric_name(phase): ms for phase, ms in timings.items()}
+        metrics.update(inference_ms=inference_ms, throughput_fps=1000.0 / inference_ms, total_ms=total_ms,
+                       host_overhead_ms=total_ms - inference_ms)
+        run_config = {"profiling_level": args.profiling_level, "device_preprocess": args.device_preprocess,
+                      "encoding": args.encoding}
+        perf_history.record_run("inference", metrics, {"backend": "htp", "tuning": tuning}, run_config,
+                                path=args.history or perf_history.DEFAULT_DB_PATH, device=device["name"])
 
-    # Cleanup remote temporary tar
-    run_command(ssh, f"rm {REMOTE_BASE_DIR}/custom_output.tar.gz")
-    ssh.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Run DINOv3 Inference on IQ-9075 (HTP)")
+    parser.add_argument("image_path", help="Path to the input image")
+    parser.add_argument("--output_dir", default="inference_results", help="Local directory to save results")
+    parser.add_argument("--profiling_level", default="basic", choices=list(profile_blocks.PROFILING_LEVELS),
+                        help="detailed/linting capture per-op HTP cycles and attribute them to model blocks")
+    parser.add_argument("--device_preprocess", action="store_true",
+                        help="Upload the encoded image and decode/normalize it on the device (run deploy.py first)")
+    parser.add_argument("--outputs", default=",".join(qnn_utils.OUTPUT_NAMES),
+                        help="Comma-separated graph outputs to download (others never leave the device; may be empty)")
+    parser.add_argument("--reduce", default="",
+                        help="Comma-separated on-device reductions of the patch tokens: mean, grid<N> (e.g. grid7)")
+    parser.add_argument("--encoding", default="fp32", choices=list(qnn_utils.OUTPUT_ENCODING_DTYPES),
+                        help="Encoding of the downloaded outputs (int8 uses per-row scales)")
+    parser.add_argument("--telemetry", action="store_true",
+                        help="Sample device load/thermals/clocks around the run (device_telemetry.py; run deploy.py first)")
+    parser.add_argument("--trace", help="Write a Chrome trace (host + device + QNN phases) to this JSON file")
+    parser.add_argument("--history",
+                        help="Performance history store to record this run in (default: perf_history.py's; empty to disable)")
+    args = parser.parse_args()
+    device = devices.select_device()
+
+    if not os.path.exists(args.image_path):
+        print(f"Error: Image {args.image_path} not found.")
+        return
+    selected = [o for o in args.outputs.split(",") if o]
+    reductions = [r for r in args.reduce.split(",") if r]
+    unknown = set(selected) - set(qnn_utils.OUTPUT_NAMES)
+    if unknown:
+        print(f"Error: unknown outputs {sorted(unknown)} (choose from {qnn_utils.OUTPUT_NAMES})")
+        return
+    if args.trace:
+        tracing.enable(args.trace)
+    tracer = tracing.get_tracer()
+
+    timings = {"startup": (time.perf_counter() - _T_START) * 1000}
+    tracer.complete("startup", tracer.now() - timings["startup"] / 1000, tracer.now())
+
+    # The trace and the SSH session are closed on every exit path
+    try:
+        # 1. Connect
+        print(f"--- Connecting to {device['host']} ---")
+        t0 = time.perf_counter()
+        tracer.begin("connect")
+        ssh = connect_device(device)
+        if not ssh:
+            return
+        sftp = ssh.open_sftp()
+        tracer.end()
+        timings["connect"] = (time.perf_counter() - t0) * 1000
+        try:
+            infer(args, device, ssh, sftp, selected, reductions, timings)
+        finally:
+            sftp.close()
+            ssh.close()
+    finally:
+        tracing.save()
 
 if __name__ == "__main__":
     main()
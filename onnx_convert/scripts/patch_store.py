@@ -0,0 +1,240 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+import backends
+import qnn_utils
+from result_store import ResultStore, read_ids, result_dirs
+
+# Token-layout-aware store of dense patch features.
+# last_hidden_state is [CLS, register_1..R, patch_(0,0) .. patch_(gh-1,gw-1)]
+# (1 + num_register_tokens + gh*gw tokens, patches row-major). The layout is
+# read from the model's config.json (num_register_tokens, patch_size) instead
+# of guessed from the token count, and checked against the stored tensors.
+# Every image is kept in a result store (result_store.py) as separate fp16
+# outputs so dense tasks never touch the tokens they do not need:
+#
+#   patch_grid - (gh, gw, D)  patch tokens as a spatial grid
+#   cls        - (D,)
+#   registers  - (R, D)
+#
+# grid()/region()/patches() return memory-mapped views (no copy) or gather
+# just the requested patches; pooled() average-pools a grid to a coarser one.
+#
+# Usage (from onnx_convert/):
+#   python3 scripts/patch_store.py build jobs/dataset/store --store dataset.patches   # from bulk_embed --patches
+#   python3 scripts/patch_store.py build output_results/ --store custom.patches --ids input_list.txt
+#   python3 scripts/patch_store.py info dataset.patches
+
+DEFAULT_CONFIG_PATH = os.path.join(os.path.dirname(backends.DEFAULT_MODEL_PATH), "config.json")
+
+
+class TokenLayout:
+    """Where the CLS, register and patch tokens sit in last_hidden_state."""
+
+    def __init__(self, num_register_tokens, patch_size, grid_hw, hidden_size=None):
+        self.num_register_tokens = num_register_tokens
+        self.patch_size = patch_size
+        self.grid_hw = tuple(grid_hw)
+        self.hidden_size = hidden_size
+
+    @property
+    def prefix_tokens(self):
+        return 1 + self.num_register_tokens
+
+    @property
+    def num_tokens(self):
+        return self.prefix_tokens + self.grid_hw[0] * self.grid_hw[1]
+
+    @classmethod
+    def from_config(cls, config_path, image_hw=None):
+        """Layout from a Hugging Face config.json at image_hw (default: config image_size)."""
+        with open(config_path) as f:
+            config = json.load(f)
+        patch = config["patch_size"]
+        h, w = image_hw or (config.get("image_size", 224),) * 2
+        return cls(config.get("num_register_tokens", 0), patch, (h // patch, w // patch), config.get("hidden_size"))
+
+    @classmethod
+    def from_net_json(cls, path=qnn_utils.NET_JSON_PATH):
+        """Layout of a converted graph (registers counted from its token dimension)."""
+        prefix, grid_hw, hidden = qnn_utils.token_layout(path)
+        return cls(prefix - 1, qnn_utils.PATCH_SIZE, grid_hw, hidden)
+
+    @classmethod
+    def load(cls, config_path=None, image_hw=None):
+        """config.json when available, else the converted graph description."""
+        config_path = config_path or DEFAULT_CONFIG_PATH
+        if os.path.exists(config_path):
+            return cls.from_config(config_path, image_hw)
+        net_json = os.path.join(backends.ONNX_CONVERT_DIR, qnn_utils.NET_JSON_PATH)
+        print(f"Note: {config_path} not found; taking the token layout from {qnn_utils.NET_JSON_PATH}")
+        return cls.from_net_json(net_json)
+
+    def to_dict(self):
+        return {"num_register_tokens": self.num_register_tokens, "patch_size": self.patch_size,
+                "grid_hw": list(self.grid_hw), "hidden_size": self.hidden_size}
+
+    def check(self, tokens):
+        if tokens.shape[-2] != self.num_tokens:
+            raise ValueError(f"last_hidden_state has {tokens.shape[-2]} tokens; layout expects {self.num_tokens} "
+                             f"(1 CLS + {self.num_register_tokens} registers + {self.grid_hw[0]}x{self.grid_hw[1]} patches)")
+        if self.hidden_size and tokens.shape[-1] != self.hidden_size:
+            raise ValueError(f"last_hidden_state is {tokens.shape[-1]}-d; layout expects {self.hidden_size}-d (wrong config?)")
+
+    def split(self, tokens):
+        """(cls, registers, patch_grid) views of (..., tokens, D)."""
+        self.check(tokens)
+        r = self.prefix_tokens
+        grid = tokens[..., r:, :].reshape(*tokens.shape[:-2], *self.grid_hw, tokens.shape[-1])
+        return tokens[..., 0, :], tokens[..., 1:r, :], grid
+
+
+class PatchStore:
+    """Patch grids, CLS and register tokens of many images, fp16, memory-mapped."""
+
+    def __init__(self, path, layout=None, shard_rows=1024):
+        self.store = ResultStore(path, "fp16", shard_rows)
+        if "layout" in self.store.manifest:
+            stored = self.store.manifest["layout"]
+            self.layout = TokenLayout(stored["num_register_tokens"], stored["patch_size"], stored["grid_hw"],
+                                      stored["hidden_size"])
+            if layout is not None and layout.to_dict() != self.layout.to_dict():
+                raise ValueError(f"Store {path} has layout {stored}, not {layout.to_dict()}")
+        elif layout is None:
+            raise ValueError(f"{path} is not a patch store (no token layout); build it first")
+        else:
+            self.layout = layout
+            self.store.manifest["layout"] = layout.to_dict()
+
+    # --- writing --------------------------------------------------------------
+
+    def append(self, ids, last_hidden_state):
+        """Split (N, tokens, D) last_hidden_state by the layout and buffer the rows."""
+        tokens = np.asarray(last_hidden_state)
+        cls, registers, grid = self.layout.split(tokens)
+        self.store.append(ids, {"patch_grid": grid, "cls": cls, "registers": registers})
+
+    def flush(self):
+        """Seal buffered rows and persist the id index."""
+        self.store.flush()
+        self.store.write_index()
+
+    # --- reading --------------------------------------------------------------
+
+    def __len__(self):
+        return len(self.store)
+
+    def _row(self, key):
+        return self.store.row_of(key) if isinstance(key, str) else key
+
+    def grid(self, key):
+        """(gh, gw, D) mmap view of one image (id or row)."""
+        return self.store.row(self._row(key), "patch_grid")
+
+    def cls(self, key):
+        return self.store.row(self._row(key), "cls")
+
+    def registers(self, key):
+        return self.store.row(self._row(key), "registers")
+
+    def region(self, key, y0, y1, x0, x1):
+        """Patch rows y0:y1 and columns x0:x1 of one image, as a view."""
+        return self.grid(key)[y0:y1, x0:x1]
+
+    def region_pixels(self, key, box):
+        """Patches covering a pixel box (left, top, right, bottom) in model input coordinates."""
+        p = self.layout.patch_size
+        left, top, right, bottom = box
+        return self.region(key, top // p, -(-bottom // p), left // p, -(-right // p))
+
+    def patches(self, key, ys, xs):
+        """(K, D) gather of the patches at (ys[k], xs[k])."""
+        return self.grid(key)[np.asarray(ys), np.asarray(xs)]
+
+    def flat(self, key):
+        """(gh*gw, D) row-major patch tokens (a view)."""
+        grid = self.grid(key)
+        return grid.reshape(-1, grid.shape[-1])
+
+    def pooled(self, key, factor):
+        """Average-pool the grid by `factor` (gh and gw must be divisible), float32."""
+        gh, gw = self.layout.grid_hw
+        if gh % factor or gw % factor:
+            raise ValueError(f"Grid {gh}x{gw} is not divisible by {factor}")
+        grid = np.asarray(self.grid(key), dtype=np.float32)
+        return grid.reshape(gh // factor, factor, gw // factor, factor, -1).mean(axis=(1, 3))
+
+    def iter_grids(self):
+        """(ids, (rows, gh, gw, D) mmap array) per shard."""
+        return self.store.iter_shards("patch_grid")
+
+
+def build_from_store(source, patches):
+    """Append every last_hidden_state row of a result store (e.g. bulk_embed --patches)."""
+    count = 0
+    for ids, hidden in source.iter_shards("last_hidden_state"):
+        patches.append(ids, hidden)
+        count += len(ids)
+    patches.flush()
+    return count
+
+
+def build_from_results(results_dir, patches, ids=None):
+    """Append every Result_N of a qnn-net-run output tree (ids[N] or 'Result_N')."""
+    dirs = result_dirs(results_dir)
+    for n, result_dir in enumerate(dirs):
+        hidden = qnn_utils.read_raw_outputs(result_dir, patches.layout.hidden_size)["last_hidden_state"]
+        patches.append([ids[n] if ids else os.path.basename(result_dir)], hidden[None])
+    patches.flush()
+    return len(dirs)
+
+
+def print_info(patches):
+    layout = patches.layout
+    gh, gw = layout.grid_hw
+    print(f"Patch store {patches.store.path}: {len(patches)} images, grid {gh}x{gw}, "
+          f"{layout.num_register_tokens} registers, patch {layout.patch_size}, hidden {layout.hidden_size}")
+    grid_bytes = gh * gw * (layout.hidden_size or 0) * 2
+    print(f"  patch_grid {grid_bytes / 1024:.1f} KB/image (fp16), "
+          f"{grid_bytes * len(patches) / 1024 / 1024:.1f} MB total in {len(patches.store.manifest['shards'])} shards")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Token-layout-aware dense patch feature store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="Build from a result store with last_hidden_state or a Result_N tree")
+    build.add_argument("source", help="Result store directory or directory of Result_N")
+    build.add_argument("--store", required=True, help="Patch store directory (created or appended to)")
+    build.add_argument("--config", help=f"Model config.json (default: {DEFAULT_CONFIG_PATH}, else the net json)")
+    build.add_argument("--image_size", type=int, nargs=2, metavar=("H", "W"), help="Model input size (default: config)")
+    build.add_argument("--ids", help="Input list / id file for a Result_N tree")
+    build.add_argument("--shard_rows", type=int, default=1024, help="Images per shard")
+    info = sub.add_parser("info", help="Print the layout and size of a patch store")
+    info.add_argument("store")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        print_info(PatchStore(args.store))
+        return
+
+    layout = TokenLayout.load(args.config, args.image_size)
+    t0 = time.time()
+    try:
+        patches = PatchStore(args.store, layout, args.shard_rows)
+        if os.path.exists(os.path.join(args.source, "store.json")):
+            count = build_from_store(ResultStore(args.source), patches)
+        else:
+            count = build_from_results(args.source, patches, read_ids(args.ids) if args.ids else None)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+    print(f"--- Added {count} images in {time.time() - t0:.2f} s ---")
+    print_info(patches)
+
+
+if __name__ == "__main__":
+    main()
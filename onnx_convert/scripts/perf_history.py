@@ -0,0 +1,425 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import re
+import sqlite3
+import time
+
+import backends
+import devices
+import qnn_utils
+
+# Local performance history.
+# Every deploy.py / inference.py run appends its timings to a sqlite store,
+# keyed by the build that produced them: model variant, ONNX hash, converter
+# options (from the net json), QNN SDK version (qnn_utils.sdk_version),
+# backend config (HTP tuning) and device. Per-run knobs (profiling level,
+# device preprocessing, output encoding) are stored on the run, not the
+# build, so deploy.py and inference.py runs of one model share a build.
+# `compare` tests each metric of two builds with Welch's t-test over their
+# runs and flags changes that are both significant (p < --alpha) and larger
+# than --min_change_pct in the bad direction (latency up, throughput down).
+# Only runs from the same tool and with the same knobs as the candidate's
+# latest run are compared. A metric whose base mean is 0 has no relative
+# change and is reported as "not comparable" rather than judged.
+#
+# A build needs a few runs before it can be judged (--min_runs); re-run
+# inference.py a handful of times after each conversion or SDK update.
+#
+# Usage (from onnx_convert/):
+#   python3 scripts/perf_history.py builds
+#   python3 scripts/perf_history.py runs --build 3f2a
+#   python3 scripts/perf_history.py compare                  # previous build vs latest (the latest run's tool)
+#   python3 scripts/perf_history.py compare 3f2a 9c01 --fail_on_regression
+#   python3 scripts/perf_history.py record --model_variant dinov3-vitb16 --metric inference_ms=12.4
+
+DEFAULT_DB_PATH = os.path.join(backends.ONNX_CONVERT_DIR, ".perf_history", "history.sqlite")
+DEFAULT_ALPHA = 0.05
+DEFAULT_MIN_CHANGE_PCT = 3.0
+DEFAULT_MIN_RUNS = 3
+
+
+def higher_is_better(metric):
+    return metric.endswith("_fps")
+
+
+def metric_name(label):
+    """'preprocess+upload' -> 'preprocess_upload_ms'."""
+    return re.sub(r"[^0-9a-z]+", "_", label.lower()).strip("_") + "_ms"
+
+
+# --- statistics ------------------------------------------------------------------
+
+def _betacf(a, b, x):
+    """Continued fraction of the regularized incomplete beta (Numerical Recipes)."""
+    qab, qap, qam = a + b, a + 1.0, a - 1.0
+    c, d = 1.0, 1.0 - qab * x / qap
+    d = 1.0 / (d if abs(d) > 1e-30 else 1e-30)
+    h = d
+    for m in range(1, 201):
+        m2 = 2 * m
+        for aa in (m * (b - m) * x / ((qam + m2) * (a + m2)), -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))):
+            d = 1.0 + aa * d
+            d = 1.0 / (d if abs(d) > 1e-30 else 1e-30)
+            c = 1.0 + aa / c
+            c = c if abs(c) > 1e-30 else 1e-30
+            h *= d * c
+        if abs(d * c - 1.0) < 1e-12:
+            break
+    return h
+
+
+def betainc(a, b, x):
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log1p(-x))
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * _betacf(a, b, x) / a
+    return 1.0 - front * _betacf(b, a, 1.0 - x) / b
+
+
+def mean_std(values):
+    mean = sum(values) / len(values)
+    var = sum((v - mean) ** 2 for v in values) / (len(values) - 1) if len(values) > 1 else 0.0
+    return mean, math.sqrt(var)
+
+
+def welch_test(base, candidate):
+    """Two-sided Welch's t-test p-value (1.0 when there is nothing to test)."""
+    if len(base) < 2 or len(candidate) < 2:
+        return 1.0
+    m1, s1 = mean_std(base)
+    m2, s2 = mean_std(candidate)
+    v1, v2 = s1 * s1 / len(base), s2 * s2 / len(candidate)
+    if v1 + v2 == 0.0:
+        return 0.0 if m1 != m2 else 1.0
+    t = (m2 - m1) / math.sqrt(v1 + v2)
+    df = (v1 + v2) ** 2 / ((v1 * v1 / (len(base) - 1) if v1 else 0.0) + (v2 * v2 / (len(candidate) - 1) if v2 else 0.0))
+    return betainc(df / 2.0, 0.5, df / (df + t * t))
+
+
+def compare_metric(metric, base, candidate, alpha=DEFAULT_ALPHA, min_change_pct=DEFAULT_MIN_CHANGE_PCT,
+                   min_runs=DEFAULT_MIN_RUNS):
+    base_mean, base_std = mean_std(base)
+    cand_mean, cand_std = mean_std(candidate)
+    if base_mean:
+        change_pct = 100.0 * (cand_mean - base_mean) / base_mean
+    else:
+        # No relative change from a zero baseline, unless nothing moved
+        change_pct = 0.0 if cand_mean == base_mean else float("nan")
+    p = welch_test(base, candidate)
+    worse = change_pct < 0 if higher_is_better(metric) else change_pct > 0
+    if len(base) < min_runs or len(candidate) < min_runs:
+        verdict = "too few runs"
+    elif math.isnan(change_pct):
+        verdict = "not comparable"
+    elif p < alpha and abs(change_pct) >= min_change_pct:
+        verdict = "REGRESSION" if worse else "improvement"
+    else:
+        verdict = "no change"
+    return {"metric": metric, "base_mean": base_mean, "base_std": base_std, "base_n": len(base),
+            "cand_mean": cand_mean, "cand_std": cand_std, "cand_n": len(candidate),
+            "change_pct": change_pct, "p": p, "verdict": verdict}
+
+
+# --- store -----------------------------------------------------------------------
+
+class PerfHistory:
+    """sqlite store of builds, runs and per-run metrics."""
+
+    def __init__(self, path=DEFAULT_DB_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS builds (
+                build_id TEXT PRIMARY KEY, model_variant TEXT, onnx_hash TEXT, converter_options TEXT,
+                sdk_version TEXT, backend_config TEXT, device TEXT, first_seen REAL);
+            CREATE TABLE IF NOT EXISTS runs (
+                run_id INTEGER PRIMARY KEY AUTOINCREMENT, build_id TEXT, source TEXT, t REAL, note TEXT,
+                config TEXT);
+            CREATE INDEX IF NOT EXISTS runs_build ON runs (build_id, t);
+            CREATE TABLE IF NOT EXISTS metrics (
+                run_id INTEGER, name TEXT, value REAL, PRIMARY KEY (run_id, name));
+            CREATE TABLE IF NOT EXISTS deployments (
+                device TEXT PRIMARY KEY, build_id TEXT, t REAL);
+        """ + qnn_utils.FILE_HASHES_TABLE)
+        if "config" not in [row[1] for row in self.db.execute("PRAGMA table_info(runs)")]:
+            self.db.execute("ALTER TABLE runs ADD COLUMN config TEXT")  # stores from before run configs
+
+    def close(self):
+        self.db.close()
+
+    def file_digest(self, path):
+        """sha256 of the ONNX (+ external data), memoized by path + size + mtime."""
+        digest = hashlib.sha256()
+        for p in (path, path + ".data"):
+            if os.path.exists(p):
+                digest.update(qnn_utils.file_digest(self.db, p).encode())
+        return digest.hexdigest()[:16] if os.path.exists(path) else "missing"
+
+    # --- builds ------------------------------------------------------------------
+
+    def add_build(self, identity):
+        """Register a build identity dict; returns its id."""
+        build_id = hashlib.sha1(json.dumps(identity, sort_keys=True).encode()).hexdigest()[:12]
+        self.db.execute("INSERT OR IGNORE INTO builds VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                        (build_id, identity["model_variant"], identity["onnx_hash"],
+                         json.dumps(identity["converter_options"], sort_keys=True), identity["sdk_version"],
+                         json.dumps(identity["backend_config"], sort_keys=True), identity["device"], time.time()))
+        return build_id
+
+    def build(self, build_id):
+        row = self.db.execute("SELECT * FROM builds WHERE build_id = ?", (build_id,)).fetchone()
+        if row is None:
+            return None
+        keys = ("build_id", "model_variant", "onnx_hash", "converter_options", "sdk_version", "backend_config",
+                "device", "first_seen")
+        build = dict(zip(keys, row))
+        build["converter_options"] = json.loads(build["converter_options"])
+        build["backend_config"] = json.loads(build["backend_config"])
+        return build
+
+    def resolve(self, ref, **filters):
+        """Build id from a prefix, 'latest' or 'previous' (by most recent run, within the filters)."""
+        if ref in ("latest", "previous"):
+            ids = [b["build_id"] for b in self.builds(**filters)]
+            index = 0 if ref == "latest" else 1
+            if len(ids) <= index:
+                raise ValueError(f"No {ref} build in {self.path}")
+            return ids[index]
+        ids = [r[0] for r in self.db.execute("SELECT build_id FROM builds WHERE build_id LIKE ?", (ref + "%",))]
+        if len(ids) != 1:
+            raise ValueError(f"Build '{ref}' matches {len(ids)} builds")
+        return ids[0]
+
+    def builds(self, device=None, model_variant=None, source=None):
+        """Builds with run counts, most recently run first."""
+        query = ("SELECT b.build_id, b.model_variant, b.sdk_version, b.device, COUNT(r.run_id), MAX(r.t) "
+                 "FROM builds b JOIN runs r ON r.build_id = b.build_id WHERE 1")
+        params = []
+        for column, value in (("b.device", device), ("b.model_variant", model_variant), ("r.source", source)):
+            if value:
+                query += f" AND {column} = ?"
+                params.append(value)
+        query += " GROUP BY b.build_id ORDER BY MAX(r.t) DESC"
+        keys = ("build_id", "model_variant", "sdk_version", "device", "runs", "last_run")
+        return [dict(zip(keys, row)) for row in self.db.execute(query, params)]
+
+    def set_deployed(self, device, build_id):
+        self.db.execute("INSERT OR REPLACE INTO deployments VALUES (?, ?, ?)", (device, build_id, time.time()))
+        self.db.commit()
+
+    def deployed(self, device):
+        row = self.db.execute("SELECT build_id FROM deployments WHERE device = ?", (device,)).fetchone()
+        return self.build(row[0]) if row else None
+
+    # --- runs ----------------------------------------------------------------------
+
+    def add_run(self, build_id, source, metrics, note="", config=None):
+        cursor = self.db.execute("INSERT INTO runs (build_id, source, t, note, config) VALUES (?, ?, ?, ?, ?)",
+                                 (build_id, source, time.time(), note, json.dumps(config or {}, sort_keys=True)))
+        run_id = cursor.lastrowid
+        self.db.executemany("INSERT INTO metrics VALUES (?, ?, ?)",
+                            [(run_id, name, float(value)) for name, value in metrics.items() if value is not None])
+        self.db.commit()
+        return run_id
+
+    def runs(self, build_id, source=None, last=None, config=None):
+        query = "SELECT run_id, source, t, note, config FROM runs WHERE build_id = ?"
+        params = [build_id]
+        if source:
+            query += " AND source = ?"
+            params.append(source)
+        if config is not None:
+            query += " AND COALESCE(config, '{}') = ?"
+            params.append(json.dumps(config, sort_keys=True))
+        query += " ORDER BY t DESC"
+        if last:
+            query += f" LIMIT {int(last)}"
+        runs = []
+        for run_id, run_source, t, note, run_config in self.db.execute(query, params).fetchall():
+            metrics = dict(self.db.execute("SELECT name, value FROM metrics WHERE run_id = ?", (run_id,)))
+            runs.append({"run_id": run_id, "source": run_source, "t": t, "note": note,
+                         "config": json.loads(run_config or "{}"), "metrics": metrics})
+        return runs[::-1]
+
+    def latest_run(self, build_id, source=None):
+        runs = self.runs(build_id, source, last=1)
+        return runs[0] if runs else None
+
+    def samples(self, build_id, source=None, last=None, config=None):
+        """{metric: [values]} over the build's runs (oldest first)."""
+        samples = {}
+        for run in self.runs(build_id, source, last, config):
+            for name, value in run["metrics"].items():
+                samples.setdefault(name, []).append(value)
+        return samples
+
+    def compare(self, base_id, cand_id, source=None, last=None, metrics=None, config=None, **thresholds):
+        base, cand = self.samples(base_id, source, last, config), self.samples(cand_id, source, last, config)
+        names = [m for m in sorted(set(base) & set(cand)) if not metrics or m in metrics]
+        return [compare_metric(name, base[name], cand[name], **thresholds) for name in names]
+
+
+def build_diff(base, cand):
+    """Human-readable differences between two build identities."""
+    lines = []
+    for key in ("model_variant", "onnx_hash", "sdk_version", "device"):
+        if base[key] != cand[key]:
+            lines.append(f"{key}: {base[key]} -> {cand[key]}")
+    for key in ("converter_options", "backend_config"):
+        a, b = base[key] or {}, cand[key] or {}
+        for option in sorted(set(a) | set(b)):
+            if a.get(option) != b.get(option):
+                lines.append(f"{key}.{option}: {a.get(option)} -> {b.get(option)}")
+    return lines
+
+
+def record_run(source, metrics, backend_config, run_config=None, model_variant=None, onnx_path=None,
+               deployed=False, path=DEFAULT_DB_PATH, note="", device=None):
+    """
+    Record one run. backend_config is part of the build identity; run_config
+    (profiling level etc.) is stored on the run only. Without an explicit model
+    the build last deployed to this device (deploy.py) supplies the model
+    variant / ONNX hash / converter options / SDK version.
+    Returns (build_id, run_id), or None if the store is unavailable.
+    """
+    device = device or devices.select_device()["name"]
+    try:
+        history = PerfHistory(path)
+    except sqlite3.Error as e:
+        print(f"[WARNING] Performance history unavailable: {e}")
+        return None
+    try:
+        current = history.deployed(device) if onnx_path is None and model_variant is None else None
+        if current:
+            model_variant, onnx_hash, options = current["model_variant"], current["onnx_hash"], current["converter_options"]
+            sdk = current["sdk_version"]
+        else:
+            onnx_path = onnx_path or backends.DEFAULT_MODEL_PATH
+            model_variant = model_variant or os.path.basename(os.path.dirname(os.path.abspath(onnx_path)))
+            onnx_hash = history.file_digest(onnx_path)
+            options = qnn_utils.load_converter_options() if os.path.exists(qnn_utils.NET_JSON_PATH) else {}
+            sdk = qnn_utils.sdk_version(os.path.join(backends.ONNX_CONVERT_DIR, qnn_utils.MODEL_CPP_PATH))
+        identity = {"model_variant": model_variant, "onnx_hash": onnx_hash, "converter_options": options,
+                    "sdk_version": sdk, "backend_config": backend_config, "device": device}
+        build_id = history.add_build(identity)
+        run_id = history.add_run(build_id, source, metrics, note, run_config)
+        if deployed:
+            history.set_deployed(device, build_id)
+        runs = len(history.runs(build_id))
+    except sqlite3.Error as e:
+        print(f"[WARNING] Could not record run: {e}")
+        return None
+    finally:
+        history.close()
+    print(f"[HISTORY] Run {run_id} recorded for build {build_id} ({model_variant}, {sdk}, "
+          f"{device}; {runs} run(s))")
+    return build_id, run_id
+
+
+# --- reports -----------------------------------------------------------------------
+
+def print_builds(builds):
+    print(f"{'build':<13}{'model':<18}{'sdk':<17}{'device':<12}{'runs':>5}  last run")
+    for b in builds:
+        last = time.strftime("%Y-%m-%d %H:%M", time.localtime(b["last_run"]))
+        print(f"{b['build_id']:<13}{b['model_variant']:<18}{b['sdk_version']:<17}{b['device']:<12}{b['runs']:>5}  {last}")
+
+
+def print_comparison(rows):
+    print(f"{'metric':<24}{'base':>20}{'candidate':>20}{'change':>9}{'p':>9}  verdict")
+    for r in rows:
+        base = f"{r['base_mean']:.2f}±{r['base_std']:.2f} ({r['base_n']})"
+        cand = f"{r['cand_mean']:.2f}±{r['cand_std']:.2f} ({r['cand_n']})"
+        print(f"{r['metric']:<24}{base:>20}{cand:>20}{r['change_pct']:>+8.1f}%{r['p']:>9.3g}  {r['verdict']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Performance history: record runs, compare builds")
+    parser.add_argument("--db", default=DEFAULT_DB_PATH, help="sqlite store")
+    sub = parser.add_subparsers(dest="command", required=True)
+    builds = sub.add_parser("builds", help="List builds, most recently run first")
+    runs = sub.add_parser("runs", help="List the runs of one build")
+    runs.add_argument("--build", default="latest", help="Build id prefix, latest or previous")
+    compare = sub.add_parser("compare", help="Test every metric of two builds for regressions")
+    compare.add_argument("base", nargs="?", default="previous", help="Build id prefix, latest or previous")
+    compare.add_argument("candidate", nargs="?", default="latest", help="Build id prefix, latest or previous")
+    compare.add_argument("--metric", action="append", help="Only these metrics (repeatable)")
+    compare.add_argument("--last", type=int, help="Only the last N runs of each build")
+    compare.add_argument("--alpha", type=float, default=DEFAULT_ALPHA, help="Significance level")
+    compare.add_argument("--min_change_pct", type=float, default=DEFAULT_MIN_CHANGE_PCT,
+                         help="Ignore significant changes smaller than this")
+    compare.add_argument("--min_runs", type=int, default=DEFAULT_MIN_RUNS, help="Runs needed per build for a verdict")
+    compare.add_argument("--json", help="Also write the comparison as JSON")
+    compare.add_argument("--fail_on_regression", action="store_true", help="Exit with status 1 on a regression")
+    record = sub.add_parser("record", help="Record a run by hand (e.g. from another benchmark)")
+    record.add_argument("--metric", action="append", required=True, metavar="NAME=VALUE")
+    record.add_argument("--model_variant", help="Defaults to the build deployed on the device")
+    record.add_argument("--onnx", help="ONNX file of the build")
+    record.add_argument("--note", default="")
+    for p in (builds, runs, compare):
+        p.add_argument("--device", help="Only builds for this device")
+        p.add_argument("--model_variant", help="Only builds of this model variant")
+        p.add_argument("--source", help="Only runs from this tool (deploy, inference, manual)")
+    args = parser.parse_args()
+
+    if args.command == "record":
+        metrics = {name: float(value) for name, value in (item.split("=", 1) for item in args.metric)}
+        backend_config = {"backend": "htp", "tuning": qnn_utils.load_htp_tuning()}
+        record_run("manual", metrics, backend_config, None, args.model_variant, args.onnx, path=args.db, note=args.note)
+        return
+
+    history = PerfHistory(args.db)
+    filters = {"device": args.device, "model_variant": args.model_variant, "source": args.source}
+    if args.command == "builds":
+        print_builds(history.builds(**filters))
+        return
+
+    if args.command == "runs":
+        build_id = history.resolve(args.build, **filters)
+        print(f"--- Runs of {build_id} ---")
+        for run in history.runs(build_id, args.source):
+            when = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(run["t"]))
+            values = ", ".join(f"{k}={v:.2f}" for k, v in sorted(run["metrics"].items()))
+            config = " ".join(f"{k}={v}" for k, v in sorted(run["config"].items()))
+            print(f"{run['run_id']:>5}  {when}  {run['source']:<10} {values}  {config}  {run['note']}")
+        return
+
+    # Compare like with like: the tool and run knobs of the candidate's latest run
+    cand_id = history.resolve(args.candidate, **filters)
+    latest = history.latest_run(cand_id, args.source)
+    if latest is None:
+        print(f"Build {cand_id} has no {args.source} runs.")
+        return
+    filters["source"] = latest["source"]
+    base_id = history.resolve(args.base, **filters)
+    print(f"--- {base_id} (base) vs {cand_id} (candidate), {latest['source']} runs ---")
+    for line in build_diff(history.build(base_id), history.build(cand_id)) or ["identical build keys"]:
+        print(f"  {line}")
+    if latest["config"]:
+        print("  run config: " + ", ".join(f"{k}={v}" for k, v in sorted(latest["config"].items())))
+    rows = history.compare(base_id, cand_id, latest["source"], args.last, args.metric, latest["config"],
+                           alpha=args.alpha, min_change_pct=args.min_change_pct, min_runs=args.min_runs)
+    if not rows:
+        print("No metrics in common.")
+        return
+    print_comparison(rows)
+    regressions = [r["metric"] for r in rows if r["verdict"] == "REGRESSION"]
+    print(f"[HISTORY] {len(regressions)} regression(s)" + (f": {', '.join(regressions)}" if regressions else ""))
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"base": base_id, "candidate": cand_id, "source": latest["source"], "config": latest["config"],
+                       "metrics": rows}, f, indent=2)
+    if regressions and args.fail_on_regression:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,21 +3,38 @@ import numpy as np
 from PIL import Image
 import os
 
+# ImageNet mean/std
+MEAN = np.array([0.485, 0.456, 0.406], dtype=np.float32)
+STD = np.array([0.229, 0.224, 0.225], dtype=np.float32)
+
+def preprocess_array(image_path, size=224, out=None, channels_last=False):
+    """
+    Load an image (path or file object) and return the normalized float32
+    tensor, (1, 3, size, size) or (1, size, size, 3) with channels_last.
+    When `out` is given the result is written into it (reusable buffer).
+    """
+    img = Image.open(image_path).convert('RGB')
+    img = img.resize((size, size), Image.Resampling.BILINEAR)
+    img_data = np.asarray(img, dtype=np.float32)
+    if out is None:
+        out = np.empty((1, size, size, 3) if channels_last else (1, 3, size, size), dtype=np.float32)
+    
+    # Normalize: (x / 255 - mean) / std, written straight into the target layout
+    if channels_last:
+        np.divide(img_data, 255.0, out=out[0])
+        out[0] -= MEAN
+        out[0] /= STD
+    else:
+        # Transpose to CHW (1, 3, 224, 224)
+        np.divide(img_data.transpose(2, 0, 1), 255.0, out=out[0])
+        out[0] -= MEAN[:, None, None]
+        out[0] /= STD[:, None, None]
+    return out
+
 def preprocess_image(image_path, output_path):
     print(f"Processing {image_path}...")
     try:
-        img = Image.open(image_path).convert('RGB')
-        img = img.resize((224, 224), Image.Resampling.BILINEAR)
-        img_data = np.array(img).astype(np.float32) / 255.0
-        
-        # Normalize (ImageNet mean/std)
-        mean = np.array([0.485, 0.456, 0.406], dtype=np.float32)
-        std = np.array([0.229, 0.224, 0.225], dtype=np.float32)
-        img_data = (img_data - mean) / std
-        
-        # Transpose to CHW (1, 3, 224, 224)
-        img_data = img_data.transpose(2, 0, 1)
-        img_data = np.expand_dims(img_data, axis=0)
+        img_data = preprocess_array(image_path)
         
         # Save as raw
         img_data.tofile(output_path)
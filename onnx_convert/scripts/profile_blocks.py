@@ -0,0 +1,259 @@
+import argparse
+import json
+import os
+import re
+
+import qnn_utils
+
+# Per-op HTP profiling attribution.
+# Joins the per-node cycle counts of a detailed/linting qnn-net-run profile
+# (as printed by qnn-profile-viewer) to the nodes of the converted graph and
+# rolls them up to embeddings / layer_N (attention, mlp) / final_norm and op type.
+#
+# Usage (from onnx_convert/):
+#   python3 scripts/inference.py test/test_image.jpg --profiling_level detailed
+#   python3 scripts/profile_blocks.py inference_results/profile_viewer.txt --json profile_blocks.json
+#   python3 scripts/profile_blocks.py inference_results/qnn-profiling-data_0.log   # needs the host SDK
+
+PROFILE_LOG_NAME = "qnn-profiling-data_0.log"
+PROFILE_TEXT_NAME = "profile_viewer.txt"
+LINT_CONFIG_NAME = "htp_backend_config_lint.json"
+LINT_EXTENSIONS_NAME = "htp_backend_extensions_lint.json"
+
+# --profiling_level choices of the runner -> qnn-net-run --profiling_level
+PROFILING_LEVELS = {"basic": "basic", "detailed": "detailed", "linting": "backend"}
+
+OP_CYCLES_RE = re.compile(r"^\s*(?:Backend \()?(?P<name>[^\s():]+):OpId_\d+ \(cycles\)\)?:\s*(?P<cycles>\d+)", re.M)
+# The backend line only; "QNN Accelerator (execute) time" (with QNN overhead) precedes it
+ACCEL_TIME_RE = re.compile(r"^\s*(?:Backend \()?Accelerator \(execute\) time\)?:\s*(\d+) us", re.M)
+SECTION_RE = re.compile(r"^(\w[\w ]*Stats[^\n]*?):?\s*$", re.M)
+
+
+def profiling_args(level, base_dir, tuning):
+    """
+    qnn-net-run keyword arguments for a profiling level. Linting profiling is
+    requested through the HTP backend extension config, so it gets its own
+    config pair (written by write_lint_config_files) on top of any tuning.
+    """
+    args = qnn_utils.tuned_net_run_args(base_dir, tuning)
+    args["profiling_level"] = PROFILING_LEVELS[level]
+    if level == "linting":
+        args["backend_config"] = f"{base_dir}/assets/{LINT_EXTENSIONS_NAME}"
+    return args
+
+
+def write_lint_config_files(tuning, base_dir, local_dir="."):
+    """Write the linting backend config pair locally for upload to {base_dir}/assets."""
+    tuning = tuning or {}
+    config, extensions = qnn_utils.htp_config_documents(
+        tuning.get("graph_config", {}), base_dir, f"{base_dir}/assets", tuning.get("htp_arch"),
+        device_config={"profiling_level": "linting"}, config_name=LINT_CONFIG_NAME)
+    paths = []
+    for name, doc in ((LINT_CONFIG_NAME, config), (LINT_EXTENSIONS_NAME, extensions)):
+        path = os.path.join(local_dir, name)
+        with open(path, "w") as f:
+            json.dump(doc, f, indent=2)
+        paths.append(path)
+    return paths
+
+
+def viewer_command(base_dir, log_path, text_path):
+    """Device-side command that renders a binary profiling log as text."""
+    return f"{base_dir}/bin/qnn-profile-viewer --input_log {log_path} > {text_path}"
+
+
+def render_log_on_host(log_path):
+    """Render a downloaded profiling log with the host SDK's qnn-profile-viewer."""
+    import subprocess
+
+    sdk_root = qnn_utils.find_qnn_sdk_root()
+    viewer = os.path.join(sdk_root, "bin", qnn_utils.HOST_ARCH, "qnn-profile-viewer")
+    if not sdk_root or not os.path.exists(viewer):
+        raise FileNotFoundError("qnn-profile-viewer not found (set QNN_SDK_ROOT)")
+    result = subprocess.run([viewer, "--input_log", log_path], capture_output=True, text=True, check=True)
+    return result.stdout
+
+
+def parse_viewer_text(text):
+    """
+    Extract per-op cycles and the accelerator execute time from qnn-profile-viewer
+    output. Uses the 'Execute Stats (Average)' section when present, otherwise
+    the first execute section.
+    """
+    sections = []
+    headers = list(SECTION_RE.finditer(text))
+    for i, match in enumerate(headers):
+        end = headers[i + 1].start() if i + 1 < len(headers) else len(text)
+        sections.append((match.group(1), text[match.end():end]))
+    execute = [body for title, body in sections if title.startswith("Execute")]
+    average = [body for title, body in sections if title.startswith("Execute") and "Average" in title]
+    body = (average or execute or [text])[0]
+
+    ops = {}
+    for match in OP_CYCLES_RE.finditer(body):
+        ops[match.group("name")] = ops.get(match.group("name"), 0) + int(match.group("cycles"))
+    accel = ACCEL_TIME_RE.search(body)
+    return {"ops": ops, "accelerator_us": float(accel.group(1)) if accel else None}
+
+
+def match_node(name, node_names, by_length):
+    """Map a profiled op name to a graph node (HTP may append suffixes to fused ops)."""
+    if name in node_names:
+        return name
+    for candidate in by_length:
+        if name.startswith(candidate):
+            return candidate
+    return None
+
+
+def attribute(profile, graph):
+    """Join profiled ops to graph nodes; returns per-op rows in descending time order."""
+    import qnn_graph
+
+    node_types = {n["name"]: n["type"] for n in graph["nodes"]}
+    blocks = qnn_graph.assign_blocks(graph)
+    by_length = sorted(node_types, key=len, reverse=True)
+
+    total_cycles = sum(profile["ops"].values())
+    rows = []
+    for name, cycles in profile["ops"].items():
+        node = match_node(name, node_types, by_length)
+        block, section = blocks.get(node, ("unattributed", "unattributed"))
+        share = cycles / total_cycles if total_cycles else 0.0
+        rows.append({
+            "op": name,
+            "node": node,
+            "type": node_types.get(node, "unknown"),
+            "block": block,
+            "section": section,
+            "cycles": cycles,
+            "share": share,
+            "us": share * profile["accelerator_us"] if profile["accelerator_us"] else None,
+        })
+    rows.sort(key=lambda r: r["cycles"], reverse=True)
+    return rows
+
+
+def build_tree(rows):
+    """graph -> block -> section -> op type, in execution order of the blocks."""
+    order = {"embeddings": -1, "final_norm": 10 ** 6, "unattributed": 10 ** 6 + 1}
+
+    def block_rank(name):
+        return order.get(name, int(name.split("_")[-1]) if name.startswith("layer_") else 10 ** 6)
+
+    def node(name):
+        return {"name": name, "cycles": 0, "us": 0.0, "children": {}}
+
+    root = node("graph")
+    for r in rows:
+        path = [r["block"]]
+        if r["section"] != r["block"]:
+            path.append(r["section"])
+        path.append(r["type"])
+        current = root
+        for level in [None] + path:
+            if level is not None:
+                current = current["children"].setdefault(level, node(level))
+            current["cycles"] += r["cycles"]
+            current["us"] += r["us"] or 0.0
+
+    def finalize(n, depth):
+        children = list(n["children"].values())
+        if depth == 0:
+            children.sort(key=lambda c: block_rank(c["name"]))
+        else:
+            children.sort(key=lambda c: c["cycles"], reverse=True)
+        n["share"] = n["cycles"] / root["cycles"] if root["cycles"] else 0.0
+        n["children"] = [finalize(c, depth + 1) for c in children]
+        return n
+
+    return finalize(root, 0)
+
+
+def print_flame(tree, width=40):
+    print(f"{'Scope':<40} {'Cycles':>14} {'Time (ms)':>10} {'Share':>7}  ")
+
+    def walk(n, depth):
+        label = ("  " * depth + n["name"])[:40]
+        bar = "#" * max(1, round(n["share"] * width)) if n["cycles"] else ""
+        print(f"{label:<40} {n['cycles']:>14,} {n['us'] / 1000:>10.3f} {n['share'] * 100:>6.1f}%  {bar}")
+        for child in n["children"]:
+            walk(child, depth + 1)
+
+    walk(tree, 0)
+
+
+def summarize(rows, key):
+    totals = {}
+    for r in rows:
+        entry = totals.setdefault(r[key], {key: r[key], "ops": 0, "cycles": 0, "us": 0.0})
+        entry["ops"] += 1
+        entry["cycles"] += r["cycles"]
+        entry["us"] += r["us"] or 0.0
+    return sorted(totals.values(), key=lambda e: e["cycles"], reverse=True)
+
+
+def report(profile_path, graph_path, json_path=None, top=15):
+    """Print the attribution of a profile (viewer text or binary log) and optionally save it as JSON."""
+    if profile_path.endswith(".log"):
+        text = render_log_on_host(profile_path)
+    else:
+        with open(profile_path) as f:
+            text = f.read()
+    profile = parse_viewer_text(text)
+    if not profile["ops"]:
+        print("[WARNING] No per-op cycles in the profile (was it captured with --profiling_level detailed/linting?)")
+        return None
+
+    import qnn_graph
+
+    rows = attribute(profile, qnn_graph.load_graph(graph_path))
+    tree = build_tree(rows)
+    unmatched = [r["op"] for r in rows if r["node"] is None]
+
+    accel = profile["accelerator_us"]
+    print(f"--- HTP Per-Op Attribution ({len(rows)} ops, accelerator execute "
+          f"{accel / 1000:.2f} ms) ---" if accel else f"--- HTP Per-Op Attribution ({len(rows)} ops) ---")
+    print_flame(tree)
+
+    print("\n--- Attention vs MLP ---")
+    for entry in summarize([r for r in rows if r["section"] in ("attention", "mlp")], "section"):
+        print(f"{entry['section']:<12} {entry['ops']:>5} ops {entry['cycles']:>14,} cycles {entry['us'] / 1000:>9.3f} ms")
+
+    print("\n--- Per Op Type ---")
+    for entry in summarize(rows, "type"):
+        print(f"{entry['type']:<20} {entry['ops']:>5} ops {entry['cycles']:>14,} cycles {entry['us'] / 1000:>9.3f} ms")
+
+    print(f"\n--- Top {top} Ops ---")
+    for r in rows[:top]:
+        print(f"{r['op'][:50]:<50} {r['type']:<16} {r['block']:<11} {r['section']:<10} {r['share'] * 100:>6.2f}%")
+    if unmatched:
+        print(f"[WARNING] {len(unmatched)} profiled ops did not match a graph node (e.g. {unmatched[0]})")
+
+    result = {"profile": profile_path, "graph": graph_path, "accelerator_us": accel,
+              "total_cycles": tree["cycles"], "tree": tree, "ops": rows, "unmatched": unmatched}
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Saved attribution to {json_path}")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Attribute HTP per-op profiling to DINOv3 blocks")
+    parser.add_argument("profile", nargs="?", default=f"inference_results/{PROFILE_TEXT_NAME}",
+                        help="qnn-profile-viewer text output, or a binary qnn-profiling-data log")
+    parser.add_argument("--graph", default="native_qnn/src/dinov3_qnn.cpp",
+                        help="Generated model source (.cpp) or converter IR dump (_net.json)")
+    parser.add_argument("--json", help="Write the attribution tree and per-op rows to this JSON file")
+    parser.add_argument("--top", type=int, default=15, help="Number of individual ops to list")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.profile):
+        print(f"Error: {args.profile} not found.")
+        return
+    report(args.profile, args.graph, args.json, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,490 @@
+import argparse
+import json
+import os
+import re
+
+# Static cost model and hotspot report for a converted QNN graph.
+# Parses the converter's generated source (dinov3_qnn.cpp) or its IR dump
+# (dinov3_qnn_net.json) into tensors + topologically ordered nodes, then
+# estimates MACs, weight/activation bytes and a roofline time per node and
+# per transformer block, flags pure data-movement layout ops and predicts the
+# memory footprint - no hardware needed.
+#
+# Usage (from onnx_convert/):
+#   python3 scripts/qnn_graph.py native_qnn/src/dinov3_qnn.cpp
+#   python3 scripts/qnn_graph.py assets/dinov3_qnn_net.json --top 30 --json graph_cost.json
+#   python3 scripts/qnn_graph.py native_qnn/src/dinov3_qnn.cpp --compare sweep_results/a8_.../dinov3_qnn.cpp
+
+# QNN_DATATYPE_* enum values as stored in the net json
+DTYPE_CODES = {
+    0x0008: "INT_8", 0x0016: "INT_16", 0x0032: "INT_32", 0x0064: "INT_64",
+    0x0108: "UINT_8", 0x0116: "UINT_16", 0x0132: "UINT_32", 0x0164: "UINT_64",
+    0x0216: "FLOAT_16", 0x0232: "FLOAT_32", 0x0264: "FLOAT_64",
+    0x0304: "SFIXED_POINT_4", 0x0308: "SFIXED_POINT_8", 0x0316: "SFIXED_POINT_16", 0x0332: "SFIXED_POINT_32",
+    0x0404: "UFIXED_POINT_4", 0x0408: "UFIXED_POINT_8", 0x0416: "UFIXED_POINT_16", 0x0432: "UFIXED_POINT_32",
+    0x0508: "BOOL_8",
+}
+TENSOR_TYPE_CODES = {0: "APP_WRITE", 1: "APP_READ", 2: "APP_READWRITE", 3: "NATIVE", 4: "STATIC", 5: "NULL"}
+ENCODING_CODES = {0: "SCALE_OFFSET", 1: "AXIS_SCALE_OFFSET", 2: "BW_SCALE_OFFSET", 3: "BW_AXIS_SCALE_OFFSET",
+                  2147483647: "UNDEFINED"}
+
+LAYOUT_OPS = {"Reshape", "Transpose", "StridedSlice"}
+MAC_OPS = {"Conv2d", "FullyConnected", "MatMul"}
+
+# Roofline defaults: relative ranking matters more than absolute numbers.
+DEFAULT_PEAK_GMACS = 2000.0     # fp16-rate MACs per second (x1e9)
+DEFAULT_BANDWIDTH_GBS = 25.0    # effective DDR bandwidth (GB/s)
+# Throughput multiplier vs. fp16 by compute bitwidth
+BITWIDTH_SPEEDUP = {4: 4.0, 8: 2.0, 16: 1.0, 32: 1.0, 64: 0.5}
+
+BLOCK_RE = re.compile(r"^layer_(\d+)_")
+ATTENTION_RE = re.compile(r"^layer_\d+_(attention|norm1|layer_scale1)")
+MLP_RE = re.compile(r"^layer_\d+_(mlp|norm2|layer_scale2)")
+FINAL_NORM_RE = re.compile(r"^norm_(weight|bias)$")
+
+
+def dtype_bits(dtype):
+    """Bit width from a QNN data type name (e.g. UFIXED_POINT_8 -> 8)."""
+    match = re.search(r"_(\d+)$", dtype)
+    return int(match.group(1)) if match else 32
+
+
+def tensor_bytes(tensor):
+    elems = 1
+    for d in tensor["dims"]:
+        elems *= d
+    return elems * dtype_bits(tensor["dtype"]) // 8
+
+
+def num_elements(dims):
+    elems = 1
+    for d in dims:
+        elems *= d
+    return elems
+
+
+# ---------------------------------------------------------------------------
+# Parsers
+# ---------------------------------------------------------------------------
+
+FUNC_RE = re.compile(r"^static ModelError_t (addTensor|addNode)_(\w+)\(QnnModel& model\)\{\n(.*?)^\}\n", re.S | re.M)
+ARRAY_RE = re.compile(r"\w+ (\w+)\[\] = \{([^}]*)\};")
+NODE_HEADER_RE = re.compile(r'model\.addNode\(QNN_OPCONFIG_VERSION_1[^\n]*\n\s*"([^"]+)", // Node Name\s*'
+                            r'"([^"]+)", // Package Name\s*"([^"]+)", // Qnn Node Type')
+SCALAR_PARAM_RE = re.compile(r'\.name="(\w+)",\s*\{\.scalarParam= \(Qnn_Scalar_t\) \{QNN_DATATYPE_\w+, \{\.\w+ = ([^}]+)\}\}\}')
+TENSOR_PARAM_RE = re.compile(r'\.name="(\w+)",\s*\{\.tensorParam=.*?\.data=\(uint8_t\*\)(\w+)', re.S)
+COMPOSE_RE = re.compile(r"VALIDATE\(add(Tensor|Node)_(\w+)\(\w+\), err\);")
+
+
+def _parse_cpp_tensor(text, arrays):
+    """Parse one Qnn_Tensor_t initializer from generated source."""
+    name = re.search(r'\.name= "([^"]+)"', text).group(1)
+    ttype = re.search(r"\.type= QNN_TENSOR_TYPE_(\w+)", text).group(1)
+    dtype = re.search(r"\.dataType= QNN_DATATYPE_(\w+)", text).group(1)
+    quant = re.search(r"\.quantizeParams= \{ QNN_DEFINITION_(\w+),\s*QNN_QUANTIZATION_ENCODING_(\w+)", text)
+    dims_ref = re.search(r"\.dimensions=(\w+)", text).group(1)
+    return name, {
+        "dims": arrays.get(dims_ref, []),
+        "dtype": dtype,
+        "type": ttype,
+        "encoding": quant.group(2) if quant else "UNDEFINED",
+    }
+
+
+def parse_cpp(path):
+    """Parse qnn-onnx-converter generated C++ into {"tensors", "nodes"}."""
+    with open(path) as f:
+        source = f.read()
+
+    tensors = {}
+    node_defs = {}
+    for kind, func_name, body in FUNC_RE.findall(source):
+        arrays = {}
+        for arr_name, values in ARRAY_RE.findall(body):
+            try:
+                arrays[arr_name] = [int(v) for v in values.replace(" ", "").split(",") if v]
+            except ValueError:
+                arrays[arr_name] = [float(v.rstrip("f")) for v in values.replace(" ", "").split(",") if v]
+
+        if kind == "addTensor":
+            name, tensor = _parse_cpp_tensor(body, arrays)
+            tensors[name] = tensor
+            continue
+
+        header = NODE_HEADER_RE.search(body)
+        if not header:
+            continue
+        node_name, package, op_type = header.groups()
+        inputs_match = re.search(r"const char\*\s+inputs_\w+\[\] = \{(.*?)\};", body, re.S)
+        inputs = re.findall(r'"([^"]+)"', inputs_match.group(1)) if inputs_match else []
+
+        outputs = []
+        out_start = body.find("Qnn_Tensor_t outputs_")
+        out_end = body.find("VALIDATE(model.addNode")
+        if out_start >= 0:
+            for chunk in body[out_start:out_end].split("(Qnn_Tensor_t) {")[1:]:
+                name, tensor = _parse_cpp_tensor(chunk, arrays)
+                tensors[name] = tensor
+                outputs.append(name)
+
+        params = {}
+        param_section = body[:out_start] if out_start >= 0 else body
+        for pname, value in SCALAR_PARAM_RE.findall(param_section):
+            try:
+                params[pname] = float(value) if "." in value else int(value)
+            except ValueError:
+                params[pname] = value.strip()
+        for pname, data_ref in TENSOR_PARAM_RE.findall(param_section):
+            params[pname] = arrays.get(data_ref)
+
+        node_defs[func_name] = {"name": node_name, "package": package, "type": op_type,
+                                "inputs": inputs, "outputs": outputs, "params": params}
+
+    # Execution order is the order nodes are added in QnnModel_composeGraphs
+    order = [name for kind, name in COMPOSE_RE.findall(source) if kind == "Node" and name in node_defs]
+    if not order:
+        order = list(node_defs)
+    return {"tensors": tensors, "nodes": [node_defs[n] for n in order]}
+
+
+def _json_param_value(entry):
+    # {"<dtype code>": value}
+    return next(iter(entry.values())) if isinstance(entry, dict) and entry else entry
+
+
+def parse_net_json(path):
+    """Parse the converter IR dump (<model>_net.json) into {"tensors", "nodes"}."""
+    with open(path) as f:
+        graph = json.load(f)["graph"]
+
+    tensors = {}
+    for name, t in graph["tensors"].items():
+        tensors[name] = {
+            "dims": t["dims"],
+            "dtype": DTYPE_CODES.get(t["data_type"], "FLOAT_32"),
+            "type": TENSOR_TYPE_CODES.get(t["type"], "NATIVE"),
+            "encoding": ENCODING_CODES.get(t["quant_params"]["encoding"], "UNDEFINED"),
+        }
+
+    nodes = []
+    for name, n in graph["nodes"].items():
+        params = {k: _json_param_value(v) for k, v in n.get("scalar_params", {}).items() if k != "packageName"}
+        for pname, entry in n.get("tensor_params", {}).items():
+            params[pname] = next(iter(entry.values())).get("data")
+        nodes.append({"name": name, "package": n.get("package"), "type": n["type"],
+                      "inputs": n["input_names"], "outputs": n["output_names"], "params": params})
+    return {"tensors": tensors, "nodes": nodes}
+
+
+def load_graph(path):
+    if path.endswith(".json"):
+        return parse_net_json(path)
+    return parse_cpp(path)
+
+
+# ---------------------------------------------------------------------------
+# Block attribution
+# ---------------------------------------------------------------------------
+
+def block_label(rank, num_layers):
+    if rank < 0:
+        return "embeddings"
+    if rank >= num_layers:
+        return "final_norm"
+    return f"layer_{rank}"
+
+
+def assign_blocks(graph):
+    """
+    Attribute every node to embeddings / layer_N (attention or mlp) / final_norm.
+    Nodes that touch a layer_N_* weight are anchored to that block; every node
+    also inherits the latest (block, section) among the producers of its inputs.
+    Returns {node_name: (block_label, section)}.
+    """
+    layer_ids = set()
+    for name in graph["tensors"]:
+        match = BLOCK_RE.match(name)
+        if match:
+            layer_ids.add(int(match.group(1)))
+    num_layers = max(layer_ids) + 1 if layer_ids else 0
+    sections = ["attention", "mlp"]
+
+    producer = {}
+    key_of = {}
+    for node in graph["nodes"]:
+        key = None
+        for inp in node["inputs"]:
+            match = BLOCK_RE.match(inp)
+            if match:
+                section = 1 if MLP_RE.match(inp) else 0
+                key = max(key or (-1, 0), (int(match.group(1)), section))
+            elif FINAL_NORM_RE.match(inp):
+                key = (num_layers, 0)
+        # The exporter deduplicates identical initializers (e.g. zero biases)
+        # across layers, so an anchor can only move a node forward.
+        inherited = [key_of[producer[i]] for i in node["inputs"] if i in producer]
+        if inherited:
+            key = max([key] + inherited) if key else max(inherited)
+        elif key is None:
+            key = (-1, 0)
+        key_of[node["name"]] = key
+        for out in node["outputs"]:
+            producer[out] = node["name"]
+
+    result = {}
+    for name, (rank, section) in key_of.items():
+        label = block_label(rank, num_layers)
+        result[name] = (label, sections[section] if label.startswith("layer_") else label)
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Cost model
+# ---------------------------------------------------------------------------
+
+def node_macs(node, tensors):
+    op = node["type"]
+    if op not in MAC_OPS or not node["outputs"]:
+        return 0
+    out = tensors.get(node["outputs"][0])
+    if not out:
+        return 0
+    out_elems = num_elements(out["dims"])
+    ins = [tensors.get(i) for i in node["inputs"]]
+    if op == "Conv2d" and len(ins) > 1 and ins[1]:
+        kh, kw, cin_per_group = ins[1]["dims"][:3]
+        return out_elems * kh * kw * cin_per_group
+    if op == "FullyConnected" and len(ins) > 1 and ins[1]:
+        # weights are [out_features, in_features]
+        return out_elems * ins[1]["dims"][-1]
+    if op == "MatMul" and ins and ins[0]:
+        dims = ins[0]["dims"]
+        k = dims[-2] if node["params"].get("transpose_in0") else dims[-1]
+        return out_elems * k
+    return 0
+
+
+def layout_reason(node, tensors, producers):
+    """Why a layout op is pure data movement (None for non-layout ops)."""
+    op = node["type"]
+    if op not in LAYOUT_OPS:
+        return None
+    name = node["name"]
+    if name.endswith("_pre_reshape") or name.endswith("_post_reshape"):
+        return "FC rank adapter"
+    ins = [tensors.get(i) for i in node["inputs"] if i in tensors]
+    out = tensors.get(node["outputs"][0]) if node["outputs"] else None
+    if ins and out and ins[0]["dims"] == out["dims"] and op != "StridedSlice":
+        return "no-op (same shape)"
+    src = producers.get(node["inputs"][0]) if node["inputs"] else None
+    if src is not None:
+        if op == "Reshape" and src["type"] == "Reshape":
+            return "reshape chain"
+        if op == "Transpose" and src["type"] == "Transpose":
+            a, b = src["params"].get("perm"), node["params"].get("perm")
+            if a and b and [a[i] for i in b] == list(range(len(b))):
+                return "inverse transpose pair"
+            return "transpose chain"
+    if op == "StridedSlice":
+        return "slice copy"
+    return "layout change"
+
+
+def analyze(graph, peak_gmacs=DEFAULT_PEAK_GMACS, bandwidth_gbs=DEFAULT_BANDWIDTH_GBS):
+    """Per-node cost records in execution order."""
+    tensors = graph["tensors"]
+    blocks = assign_blocks(graph)
+    producers = {}
+    for node in graph["nodes"]:
+        for out in node["outputs"]:
+            producers[out] = node
+
+    records = []
+    for node in graph["nodes"]:
+        weight_bytes = 0
+        act_bytes = 0
+        compute_bits = 8
+        for name in node["inputs"]:
+            t = tensors.get(name)
+            if not t:
+                continue
+            if t["type"] == "STATIC":
+                weight_bytes += tensor_bytes(t)
+            else:
+                act_bytes += tensor_bytes(t)
+                compute_bits = max(compute_bits, dtype_bits(t["dtype"]))
+        for name in node["outputs"]:
+            t = tensors.get(name)
+            if t:
+                act_bytes += tensor_bytes(t)
+
+        macs = node_macs(node, tensors)
+        compute_s = macs / (peak_gmacs * 1e9 * BITWIDTH_SPEEDUP.get(compute_bits, 1.0))
+        memory_s = (weight_bytes + act_bytes) / (bandwidth_gbs * 1e9)
+        block, section = blocks.get(node["name"], ("embeddings", "embeddings"))
+        records.append({
+            "name": node["name"],
+            "type": node["type"],
+            "block": block,
+            "section": section,
+            "macs": macs,
+            "weight_bytes": weight_bytes,
+            "activation_bytes": act_bytes,
+            "est_us": max(compute_s, memory_s) * 1e6,
+            "bound": "compute" if compute_s >= memory_s else "memory",
+            "layout": layout_reason(node, tensors, producers),
+        })
+    return records
+
+
+def memory_footprint(graph):
+    """Static weight bytes and peak live activation bytes over the execution order."""
+    tensors = graph["tensors"]
+    weights = sum(tensor_bytes(t) for t in tensors.values() if t["type"] == "STATIC")
+
+    last_use = {}
+    for step, node in enumerate(graph["nodes"]):
+        for name in node["inputs"]:
+            last_use[name] = step
+    live = {}
+    peak = 0
+    peak_step = 0
+    for name, t in tensors.items():
+        if t["type"] == "APP_WRITE":
+            live[name] = tensor_bytes(t)
+    for step, node in enumerate(graph["nodes"]):
+        for name in node["outputs"]:
+            t = tensors.get(name)
+            if t and t["type"] != "STATIC":
+                live[name] = tensor_bytes(t)
+        current = sum(live.values())
+        if current > peak:
+            peak, peak_step = current, step
+        for name in list(live):
+            if last_use.get(name, -1) <= step and tensors[name]["type"] not in ("APP_READ", "APP_READWRITE"):
+                del live[name]
+    return {
+        "weight_bytes": weights,
+        "peak_activation_bytes": peak,
+        "peak_at_node": graph["nodes"][peak_step]["name"] if graph["nodes"] else None,
+        "total_bytes": weights + peak,
+    }
+
+
+def summarize_blocks(records):
+    """Roll records up per block, keeping execution order of first appearance."""
+    summary = {}
+    for r in records:
+        s = summary.setdefault(r["block"], {"block": r["block"], "nodes": 0, "macs": 0, "weight_bytes": 0,
+                                            "activation_bytes": 0, "est_us": 0.0, "layout_nodes": 0,
+                                            "layout_us": 0.0})
+        s["nodes"] += 1
+        s["macs"] += r["macs"]
+        s["weight_bytes"] += r["weight_bytes"]
+        s["activation_bytes"] += r["activation_bytes"]
+        s["est_us"] += r["est_us"]
+        if r["layout"]:
+            s["layout_nodes"] += 1
+            s["layout_us"] += r["est_us"]
+    return list(summary.values())
+
+
+def totals(records, footprint):
+    return {
+        "nodes": len(records),
+        "gmacs": sum(r["macs"] for r in records) / 1e9,
+        "weights_mb": footprint["weight_bytes"] / 1024 / 1024,
+        "peak_activation_mb": footprint["peak_activation_bytes"] / 1024 / 1024,
+        "activation_traffic_mb": sum(r["activation_bytes"] for r in records) / 1024 / 1024,
+        "layout_nodes": sum(1 for r in records if r["layout"]),
+        "layout_us": sum(r["est_us"] for r in records if r["layout"]),
+        "est_ms": sum(r["est_us"] for r in records) / 1000,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+def print_report(path, records, footprint, top):
+    t = totals(records, footprint)
+    print(f"=== {path} ===")
+    print(f"Nodes: {t['nodes']}  MACs: {t['gmacs']:.2f} G  Estimated: {t['est_ms']:.2f} ms (roofline)")
+    print(f"Weights: {t['weights_mb']:.2f} MB  Peak activations: {t['peak_activation_mb']:.2f} MB "
+          f"(at {footprint['peak_at_node']})  Predicted footprint: {footprint['total_bytes'] / 1024 / 1024:.2f} MB")
+    print(f"Layout-only ops: {t['layout_nodes']} ({t['layout_us'] / 1000:.2f} ms estimated)")
+
+    print(f"\n--- Top {top} Hotspots ---")
+    print(f"{'#':>3} {'Node':<45} {'Type':<16} {'Block':<11} {'MMACs':>9} {'W (KB)':>9} {'Act (KB)':>9} {'Est (us)':>9}  Note")
+    ranked = sorted(records, key=lambda r: r["est_us"], reverse=True)[:top]
+    for i, r in enumerate(ranked, 1):
+        note = r["layout"] or r["bound"]
+        print(f"{i:>3} {r['name'][:45]:<45} {r['type']:<16} {r['block']:<11} {r['macs'] / 1e6:>9.1f} "
+              f"{r['weight_bytes'] / 1024:>9.1f} {r['activation_bytes'] / 1024:>9.1f} {r['est_us']:>9.1f}  {note}")
+
+    print("\n--- Per Block ---")
+    print(f"{'Block':<12} {'Nodes':>6} {'GMACs':>8} {'W (MB)':>8} {'Act (MB)':>9} {'Est (ms)':>9} {'Layout ops':>11} {'Layout (ms)':>12}")
+    for s in summarize_blocks(records):
+        print(f"{s['block']:<12} {s['nodes']:>6} {s['macs'] / 1e9:>8.3f} {s['weight_bytes'] / 1024 / 1024:>8.2f} "
+              f"{s['activation_bytes'] / 1024 / 1024:>9.2f} {s['est_us'] / 1000:>9.3f} {s['layout_nodes']:>11} "
+              f"{s['layout_us'] / 1000:>12.3f}")
+
+    by_reason = {}
+    for r in records:
+        if r["layout"]:
+            entry = by_reason.setdefault(r["layout"], [0, 0.0])
+            entry[0] += 1
+            entry[1] += r["est_us"]
+    print("\n--- Layout Ops (data movement only) ---")
+    for reason, (count, us) in sorted(by_reason.items(), key=lambda kv: kv[1][1], reverse=True):
+        print(f"{reason:<24} {count:>5} nodes {us / 1000:>9.3f} ms")
+
+    by_type = {}
+    for r in records:
+        entry = by_type.setdefault(r["type"], [0, 0.0])
+        entry[0] += 1
+        entry[1] += r["est_us"]
+    print("\n--- Per Op Type ---")
+    for op, (count, us) in sorted(by_type.items(), key=lambda kv: kv[1][1], reverse=True):
+        print(f"{op:<20} {count:>5} nodes {us / 1000:>9.3f} ms")
+
+
+def print_comparison(results):
+    print("\n=== Comparison ===")
+    keys = ["nodes", "gmacs", "weights_mb", "peak_activation_mb", "activation_traffic_mb", "layout_nodes", "est_ms"]
+    print(f"{'Metric':<24}" + "".join(f"{os.path.basename(os.path.dirname(p)) or p:>24}" for p, _ in results))
+    for key in keys:
+        print(f"{key:<24}" + "".join(f"{t[key]:>24.2f}" for _, t in results))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Static cost model and hotspot report for a converted QNN graph")
+    parser.add_argument("graph", nargs="?", default="native_qnn/src/dinov3_qnn.cpp",
+                        help="Generated model source (.cpp) or converter IR dump (_net.json)")
+    parser.add_argument("--compare", nargs="*", default=[], help="Other exports to compare against")
+    parser.add_argument("--top", type=int, default=20, help="Number of hotspots to list")
+    parser.add_argument("--peak-gmacs", type=float, default=DEFAULT_PEAK_GMACS, help="Roofline fp16 compute peak (GMAC/s)")
+    parser.add_argument("--bandwidth-gbs", type=float, default=DEFAULT_BANDWIDTH_GBS, help="Roofline memory bandwidth (GB/s)")
+    parser.add_argument("--json", help="Write per-node/per-block results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    for i, path in enumerate([args.graph] + args.compare):
+        graph = load_graph(path)
+        records = analyze(graph, args.peak_gmacs, args.bandwidth_gbs)
+        footprint = memory_footprint(graph)
+        if i == 0:
+            print_report(path, records, footprint, args.top)
+            if args.json:
+                with open(args.json, "w") as f:
+                    json.dump({"graph": path, "totals": totals(records, footprint), "footprint": footprint,
+                               "blocks": summarize_blocks(records), "nodes": records}, f, indent=2)
+                print(f"\nSaved analysis to {args.json}")
+        results.append((path, totals(records, footprint)))
+
+    if args.compare:
+        print_comparison(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+# Shared helpers for the host-side tooling in scripts/.
+# Paths are relative to onnx_convert/, like the rest of the scripts.
+
+NET_JSON_PATH = "assets/dinov3_qnn_net.json"
+MODEL_CPP_PATH = "native_qnn/src/dinov3_qnn.cpp"
+SDK_SEARCH_PATHS = ["/home/hyeokjun/IQ-9075 Evaluation Kit (EVK)/v2.41.0.251128/qairt/2.41.0.251128"]
+HOST_ARCH = "x86_64-linux-clang"
+# "v2.41.0.251128" in an SDK path, "qaisw-v2.41.0.251128145156_191518" in the model cpp
+SDK_VERSION_RE = re.compile(r"\bv?(\d+\.\d+\.\d+\.\d{6})\d*")
+PATCH_SIZE = 16
+GRAPH_NAME = "dinov3_qnn"
+
+# Persisted HTP backend tuning (written by tune_htp_backend.py)
+HTP_TUNING_PATH = "assets/htp_tuning.json"
+HTP_CONFIG_NAME = "htp_backend_config.json"
+HTP_EXTENSIONS_NAME = "htp_backend_extensions.json"
+ADSP_SYSTEM_PATHS = "/usr/lib/rfsa/adsp;/dsp;/usr/lib/dsp/cdsp1;/system/lib/rfsa/adsp;/system/vendor/lib/rfsa/adsp"
+
+# Output tensors of the DINOv3 graph, in qnn-net-run Result_N file naming.
+OUTPUT_NAMES = ["last_hidden_state", "pooler_output"]
+
+# Compact outputs written by device_postprocess.py
+OUTPUT_MANIFEST_NAME = "outputs.json"
+OUTPUT_ENCODING_DTYPES = {"fp32": np.float32, "fp16": np.float16, "int8": np.int8}
+
+
+def find_qnn_sdk_root():
+    """Return the host QNN SDK root (QNN_SDK_ROOT or a known install path), or ''."""
+    sdk_root = os.environ.get("QNN_SDK_ROOT", "")
+    if sdk_root and os.path.isdir(sdk_root):
+        return sdk_root
+    for p in SDK_SEARCH_PATHS:
+        if os.path.isdir(p):
+            return p
+    return ""
+
+
+def sdk_version(model_cpp=MODEL_CPP_PATH):
+    """QNN SDK version ("v2.41.0.251128") of the model build: the converted model cpp, else the host SDK root."""
+    if os.path.exists(model_cpp):
+        with open(model_cpp, errors="replace") as f:
+            for line in f:
+                if "QNN_SDK_VERSION" in line and (match := SDK_VERSION_RE.search(line)):
+                    return "v" + match.group(1)
+    name = os.path.basename(find_qnn_sdk_root().rstrip("/"))
+    match = SDK_VERSION_RE.search(name)
+    return "v" + match.group(1) if match else name or "unknown"
+
+
+def load_net_json(path=NET_JSON_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def parse_converter_command(command):
+    """
+    Parse the 'converter_command' string recorded by qnn-onnx-converter
+    ("qnn-onnx-converter; act_bitwidth=8; ...") into a dict of raw string values.
+    """
+    options = {}
+    for part in command.split(";")[1:]:
+        part = part.strip()
+        if "=" not in part:
+            continue
+        key, value = part.split("=", 1)
+        options[key.strip()] = value.strip()
+    return options
+
+
+def load_converter_options(path=NET_JSON_PATH):
+    return parse_converter_command(load_net_json(path).get("converter_command", ""))
+
+
+def load_tensor_dims(name, path=NET_JSON_PATH):
+    """Return (dims, permute_order_to_src) of a graph tensor as seen by the QNN graph."""
+    tensor = load_net_json(path)["graph"]["tensors"][name]
+    return tensor["dims"], tensor.get("permute_order_to_src", [])
+
+
+def to_graph_layout(nchw, path=NET_JSON_PATH):
+    """
+    Reorder a framework-layout (NCHW) input into the layout the converted graph
+    expects. The converter records the permutation it applied to pixel_values
+    (e.g. [0, 3, 1, 2] for NHWC) in the net json.
+    """
+    dims, perm = load_tensor_dims("pixel_values", path)
+    if perm and list(nchw.shape) != list(dims):
+        # graph.transpose(perm) gives the source layout, so invert the permutation
+        return np.ascontiguousarray(nchw.transpose(np.argsort(perm)))
+    return nchw
+
+
+def token_layout(path=NET_JSON_PATH):
+    """
+    (prefix_tokens, (grid_h, grid_w), hidden) of last_hidden_state: CLS and
+    register tokens come first, followed by the row-major patch grid.
+    """
+    dims, perm = load_tensor_dims("pixel_values", path)
+    h, w = (dims[1], dims[2]) if perm and dims[-1] == 3 else (dims[2], dims[3])
+    tokens, hidden = load_tensor_dims("last_hidden_state", path)[0][-2:]
+    grid_hw = (h // PATCH_SIZE, w // PATCH_SIZE)
+    return tokens - grid_hw[0] * grid_hw[1], grid_hw, hidden
+
+
+def decode_output(entry, data, scales=None):
+    """Decode one output written by device_postprocess.py (manifest entry + file bytes) to float32."""
+    values = np.frombuffer(data, dtype=OUTPUT_ENCODING_DTYPES[entry["encoding"]]).astype(np.float32)
+    if entry["encoding"] == "int8":
+        values = values.reshape(-1, entry["shape"][-1]) * np.frombuffer(scales, dtype=np.float32)[:, None]
+    return values.reshape(entry["shape"])
+
+
+def read_raw_outputs(result_dir, hidden_size=None, names=OUTPUT_NAMES):
+    """
+    Read qnn-net-run float32 outputs from a Result_N directory.
+    last_hidden_state is reshaped to (tokens, hidden) when hidden_size is known,
+    or inferred from pooler_output otherwise.
+    Results post-processed on the device (outputs.json manifest) are decoded
+    instead, and include every selected output and reduction.
+    """
+    manifest_path = os.path.join(result_dir, OUTPUT_MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        outputs = {}
+        for name, entry in manifest.items():
+            with open(os.path.join(result_dir, entry["file"]), "rb") as f:
+                data = f.read()
+            scales = None
+            if "scale_file" in entry:
+                with open(os.path.join(result_dir, entry["scale_file"]), "rb") as f:
+                    scales = f.read()
+            outputs[name] = decode_output(entry, data, scales)
+        return outputs
+
+    outputs = {}
+    for name in names:
+        path = os.path.join(result_dir, f"{name}.raw")
+        if os.path.exists(path):
+            outputs[name] = np.fromfile(path, dtype=np.float32)
+    if hidden_size is None and "pooler_output" in outputs:
+        hidden_size = outputs["pooler_output"].size
+    if hidden_size and "last_hidden_state" in outputs:
+        outputs["last_hidden_state"] = outputs["last_hidden_state"].reshape(-1, hidden_size)
+    return outputs
+
+
+def parse_inference_time_ms(log_text):
+    """
+    Extract the pure inference time from qnn-net-run output.
+    Prefers the profiling 'Avg: ... us' line, falling back to the
+    QnnGraph_execute started/done log timestamps.
+    """
+    matches = re.findall(r"Avg: ([0-9\.]+) us", log_text)
+    if matches:
+        return float(matches[-1]) / 1000.0
+    start_match = re.search(r"([0-9\.]+)ms .* QnnGraph_execute started", log_text)
+    end_match = re.search(r"([0-9\.]+)ms .* QnnGraph_execute done", log_text)
+    if start_match and end_match:
+        return float(end_match.group(1)) - float(start_match.group(1))
+    return None
+
+
+def file_sha256(path):
+    """Hex sha256 of a (possibly multi-GB) file, read in 1 MB chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Memo table of file_digest(), created by each sqlite store that hashes model files
+FILE_HASHES_TABLE = """
+    CREATE TABLE IF NOT EXISTS file_hashes (
+        path TEXT PRIMARY KEY, size INTEGER, mtime REAL, digest TEXT);
+"""
+
+
+def file_digest(db, path):
+    """file_sha256 memoized in the file_hashes table of a sqlite connection, by path + size + mtime."""
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    row = db.execute("SELECT size, mtime, digest FROM file_hashes WHERE path = ?", (key,)).fetchone()
+    if row and row[0] == stat.st_size and row[1] == stat.st_mtime:
+        return row[2]
+    digest = file_sha256(path)
+    db.execute("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)", (key, stat.st_size, stat.st_mtime, digest))
+    db.commit()
+    return digest
+
+
+def cosine_similarity(a, b, axis=-1):
+    a = a.astype(np.float64)
+    b = b.astype(np.float64)
+    num = (a * b).sum(axis=axis)
+    den = np.linalg.norm(a, axis=axis) * np.linalg.norm(b, axis=axis)
+    return num / np.maximum(den, 1e-12)
+
+
+def output_fidelity(reference, candidate, n_patches):
+    """
+    Compare one image's candidate outputs against the float reference.
+    Returns CLS/pooler cosine similarity and per-patch error statistics.
+    """
+    ref_tokens = reference["last_hidden_state"].reshape(-1, reference["pooler_output"].size)
+    cand_tokens = candidate["last_hidden_state"].reshape(ref_tokens.shape)
+    ref_patches = ref_tokens[-n_patches:]
+    cand_patches = cand_tokens[-n_patches:]
+
+    patch_cos = cosine_similarity(ref_patches, cand_patches)
+    patch_rel_l2 = np.linalg.norm(ref_patches - cand_patches, axis=-1) / np.maximum(np.linalg.norm(ref_patches, axis=-1), 1e-12)
+    return {
+        "pooler_cos": float(cosine_similarity(reference["pooler_output"].ravel(), candidate["pooler_output"].ravel())),
+        "cls_cos": float(cosine_similarity(ref_tokens[0], cand_tokens[0])),
+        "patch_cos_mean": float(patch_cos.mean()),
+        "patch_cos_min": float(patch_cos.min()),
+        "patch_rel_l2_mean": float(patch_rel_l2.mean()),
+        "patch_max_abs_err": float(np.abs(ref_patches - cand_patches).max()),
+    }
+
+
+def htp_env_exports(base_dir):
+    """Environment needed by qnn-net-run on the device (bundled skel libs first)."""
+    return [
+        f"export ADSP_LIBRARY_PATH=\"{base_dir}/lib/hexagon;{ADSP_SYSTEM_PATHS}\"",
+        f"export LD_LIBRARY_PATH={base_dir}/lib:$LD_LIBRARY_PATH",
+    ]
+
+
+def net_run_invocation(base_dir, model_lib, input_list, output_dir, profiling_level=None,
+                       backend_config=None, perf_profile=None, log_level=None, extra_args=None,
+                       retrieve_context=None):
+    """
+    Build the qnn-net-run command line used on the device. backend_config is
+    only passed when the file exists remotely, so a stale local tuning never
+    breaks a run. With retrieve_context, a serialized context binary is loaded
+    instead of the model library.
+    """
+    parts = [
+        f"./bin/qnn-net-run --backend {base_dir}/lib/libQnnHtp.so",
+        f"--retrieve_context {retrieve_context}" if retrieve_context else f"--model {model_lib}",
+        f"--input_list {input_list}",
+        f"--output_dir {output_dir}",
+    ]
+    if backend_config:
+        parts.append(f"$([ -f {backend_config} ] && echo \"--config_file {backend_config}\")")
+    if perf_profile:
+        parts.append(f"--perf_profile {perf_profile}")
+    if profiling_level:
+        parts.append(f"--profiling_level {profiling_level}")
+    if log_level:
+        parts.append(f"--log_level {log_level}")
+    if extra_args:
+        parts.extend(extra_args)
+    return " ".join(parts)
+
+
+def load_htp_tuning(path=HTP_TUNING_PATH):
+    """Return the persisted HTP tuning, or None when the model has not been tuned."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def htp_config_documents(graph_config, base_dir, config_dir, htp_arch=None, device_config=None,
+                         config_name=HTP_CONFIG_NAME):
+    """
+    Build the HTP backend config and the qnn-net-run backend extensions
+    document that points at it (both with device-side paths).
+    """
+    graph = {"graph_names": [GRAPH_NAME]}
+    graph.update({k: v for k, v in graph_config.items() if v is not None})
+    config = {"graphs": [graph]}
+    device = dict(device_config or {})
+    if htp_arch:
+        device["htp_arch"] = htp_arch
+    if device:
+        config["devices"] = [device]
+    extensions = {
+        "backend_extensions": {
+            "shared_library_path": f"{base_dir}/lib/libQnnHtpNetRunExtensions.so",
+            "config_file_path": f"{config_dir}/{config_name}",
+        }
+    }
+    return config, extensions
+
+
+def tuned_net_run_args(base_dir, tuning):
+    """qnn-net-run keyword arguments for a persisted tuning (empty when untuned)."""
+    if not tuning:
+        return {}
+    args = {"perf_profile": tuning.get("perf_profile")}
+    if tuning.get("graph_config"):
+        args["backend_config"] = f"{base_dir}/assets/{HTP_EXTENSIONS_NAME}"
+    return args
+
+
+def write_htp_config_files(tuning, base_dir, local_dir="."):
+    """Write the tuned backend config files locally for upload to {base_dir}/assets."""
+    config, extensions = htp_config_documents(tuning.get("graph_config", {}), base_dir,
+                                              f"{base_dir}/assets", tuning.get("htp_arch"))
+    paths = []
+    for name, doc in ((HTP_CONFIG_NAME, config), (HTP_EXTENSIONS_NAME, extensions)):
+        path = os.path.join(local_dir, name)
+        with open(path, "w") as f:
+            json.dump(doc, f, indent=2)
+        paths.append(path)
+    return paths
@@ -0,0 +1,341 @@
+import argparse
+import bisect
+import hashlib
+import io
+import json
+import os
+import re
+
+import numpy as np
+
+import qnn_utils
+
+# Sharded columnar store for inference outputs.
+# qnn-net-run writes one Result_N directory per image; at dataset scale that
+# is millions of small files. The store keeps each output as one .npy array
+# per shard (rows = images) plus the row ids of the shard, and a manifest
+# (store.json) listing the sealed shards in row order:
+#
+#   store.json                            - dtype, per-row output shapes, shards
+#   shard_000000.ids.txt                  - one image id per row
+#   shard_000000.pooler_output.npy        - (rows, 768) fp16
+#   shard_000000.last_hidden_state.npy    - (rows, 201, 768) fp16
+#   index.keys.npy / index.rows.npy       - id lookup: sorted 64-bit id hashes
+#                                           and their rows (written by convert)
+#
+# Shards are immutable once sealed: every file is written atomically and the
+# shard only exists once the manifest (also replaced atomically) lists it, so
+# a crash leaves at most an orphan file that the next write of that shard
+# overwrites. Readers memory-map the shard arrays; a random row costs an
+# id -> row lookup and one mmap slice. The lookup binary-searches the
+# persisted index when it is current (sealing a shard invalidates it) and
+# otherwise builds a dict from every shard's ids.txt.
+#
+# Usage (from onnx_convert/):
+#   python3 scripts/result_store.py convert output_results/ --store results.store --ids input_list.txt
+#   python3 scripts/result_store.py info results.store
+#   python3 scripts/result_store.py get results.store test/test_image.jpg --output pooler_output
+
+STORE_FILE = "store.json"
+INDEX_FILE = "index.{}.npy"
+STORE_DTYPES = {"fp16": np.float16, "fp32": np.float32}
+DEFAULT_SHARD_ROWS = 4096
+RESULT_DIR_PATTERN = re.compile(r"^Result_(\d+)$")
+
+
+def id_key(image_id):
+    """64-bit hash of an image id, the sort key of the persisted index."""
+    return int.from_bytes(hashlib.blake2b(image_id.encode(), digest_size=8).digest(), "little")
+
+
+def fsync_write(path, data):
+    """Atomically replace `path` with `data` (temp file + fsync + rename)."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+class ResultStore:
+    """
+    Append-only writer and memory-mapped reader over one store directory.
+    append() buffers rows and seals a shard every `shard_rows` rows;
+    write_shard() seals one named shard directly (replacing it if present).
+    """
+
+    def __init__(self, path, dtype="fp16", shard_rows=DEFAULT_SHARD_ROWS):
+        self.path = path
+        self.shard_rows = shard_rows
+        manifest_path = os.path.join(path, STORE_FILE)
+        if os.path.exists(manifest_path):
+            with open(manifest_path) as f:
+                self.manifest = json.load(f)
+        else:
+            if dtype not in STORE_DTYPES:
+                raise ValueError(f"Unknown store dtype '{dtype}' (choose from {', '.join(STORE_DTYPES)})")
+            os.makedirs(path, exist_ok=True)
+            self.manifest = {"dtype": dtype, "outputs": {}, "shards": []}
+        self.dtype = STORE_DTYPES[self.manifest["dtype"]]
+        self._pending_ids = []
+        self._pending = {}
+        self._reset_index()
+
+    # --- writing --------------------------------------------------------------
+
+    def _file(self, shard, suffix):
+        return os.path.join(self.path, f"shard_{shard}.{suffix}")
+
+    def append(self, ids, outputs):
+        """Buffer rows (ids + {name: (rows, ...)} arrays); full shards are sealed."""
+        self._pending_ids.extend(ids)
+        for name, value in outputs.items():
+            self._pending.setdefault(name, []).append(np.asarray(value, dtype=self.dtype))
+        if len(self._pending_ids) >= self.shard_rows:
+            self.flush()
+
+    def flush(self):
+        """Seal buffered rows into new shards (the last one may be partial)."""
+        if not self._pending_ids:
+            return
+        columns = {name: np.concatenate(parts) for name, parts in self._pending.items()}
+        ids = self._pending_ids
+        self._pending_ids, self._pending = [], {}
+        next_number = max((int(s["name"]) for s in self.manifest["shards"]), default=-1) + 1
+        for number, start in enumerate(range(0, len(ids), self.shard_rows), next_number):
+            stop = start + self.shard_rows
+            self.write_shard(f"{number:06d}", ids[start:stop], {name: v[start:stop] for name, v in columns.items()})
+
+    def write_shard(self, shard, ids, outputs):
+        """Seal one shard named `shard` (zero-padded number); rows sort by shard name."""
+        outputs = {name: np.asarray(value, dtype=self.dtype) for name, value in outputs.items()}
+        for name, value in outputs.items():
+            if len(value) != len(ids):
+                raise ValueError(f"{name} has {len(value)} rows for {len(ids)} ids")
+            shape = self.manifest["outputs"].setdefault(name, list(value.shape[1:]))
+            if list(value.shape[1:]) != shape:
+                raise ValueError(f"{name} rows are {list(value.shape[1:])}, store has {shape}")
+        for name, value in outputs.items():
+            self._save_array(self._file(shard, f"{name}.npy"), value)
+        fsync_write(self._file(shard, "ids.txt"), "".join(f"{i}\n" for i in ids).encode())
+
+        shards = [s for s in self.manifest["shards"] if s["name"] != shard]
+        shards.append({"name": shard, "rows": len(ids), "outputs": sorted(outputs)})
+        self.manifest["shards"] = sorted(shards, key=lambda s: s["name"])
+        self.manifest.pop("index_rows", None)  # the persisted index no longer covers every row
+        self._write_manifest()
+        self._reset_index()
+
+    def write_index(self):
+        """Persist the id -> row lookup so readers don't rebuild it from ids.txt on every start."""
+        keys = np.fromiter((id_key(image_id) for image_id in self.ids()), dtype=np.uint64, count=len(self))
+        order = np.argsort(keys, kind="stable")
+        self._save_array(os.path.join(self.path, INDEX_FILE.format("keys")), keys[order])
+        self._save_array(os.path.join(self.path, INDEX_FILE.format("rows")), order.astype(np.int64))
+        self.manifest["index_rows"] = len(self)
+        self._write_manifest()
+        self._reset_index()
+
+    def _save_array(self, path, value):
+        buffer = io.BytesIO()
+        np.save(buffer, value)
+        fsync_write(path, buffer.getvalue())
+
+    def _write_manifest(self):
+        fsync_write(os.path.join(self.path, STORE_FILE), json.dumps(self.manifest, indent=1).encode())
+
+    def has_shard(self, shard):
+        return any(s["name"] == shard for s in self.manifest["shards"])
+
+    # --- reading --------------------------------------------------------------
+
+    def _reset_index(self):
+        self.starts = np.cumsum([0] + [s["rows"] for s in self.manifest["shards"]]).tolist()
+        self._ids = None
+        self._shard_ids = {}
+        self._index = None
+        self._arrays = {}
+
+    def __len__(self):
+        return self.starts[-1]
+
+    @property
+    def outputs(self):
+        return list(self.manifest["outputs"])
+
+    def shard_ids(self, shard_index):
+        """Row ids of one shard."""
+        if shard_index not in self._shard_ids:
+            with open(self._file(self.manifest["shards"][shard_index]["name"], "ids.txt")) as f:
+                self._shard_ids[shard_index] = f.read().splitlines()
+        return self._shard_ids[shard_index]
+
+    def ids(self):
+        """All row ids in row order."""
+        if self._ids is None:
+            self._ids = [i for shard_index in range(len(self.manifest["shards"])) for i in self.shard_ids(shard_index)]
+        return self._ids
+
+    def row_of(self, image_id):
+        """Row of an image id (its last row if it was stored more than once)."""
+        if self.manifest.get("index_rows") == len(self):
+            row = self._indexed_row(image_id)
+        else:
+            if self._index is None:
+                self._index = {image_id: row for row, image_id in enumerate(self.ids())}
+            row = self._index.get(image_id)
+        if row is None:
+            raise KeyError(f"Id '{image_id}' not in store {self.path}")
+        return row
+
+    def _indexed_row(self, image_id):
+        """Binary search of the persisted index; hash collisions are resolved against ids.txt."""
+        for suffix in ("keys", "rows"):
+            if suffix not in self._arrays:
+                self._arrays[suffix] = np.load(os.path.join(self.path, INDEX_FILE.format(suffix)), mmap_mode="r")
+        keys, rows = self._arrays["keys"], self._arrays["rows"]
+        key = np.uint64(id_key(image_id))
+        lo, hi = np.searchsorted(keys, key, "left"), np.searchsorted(keys, key, "right")
+        for row in reversed(rows[lo:hi].tolist()):
+            shard_index, offset = self.locate(row)
+            if self.shard_ids(shard_index)[offset] == image_id:
+                return row
+        return None
+
+    def shard_array(self, shard_index, name):
+        """Memory-mapped (rows, ...) array of one output in one shard."""
+        key = (shard_index, name)
+        if key not in self._arrays:
+            shard = self.manifest["shards"][shard_index]
+            if name not in shard["outputs"]:
+                raise KeyError(f"Shard {shard['name']} has no output '{name}' ({', '.join(shard['outputs'])})")
+            self._arrays[key] = np.load(self._file(shard["name"], f"{name}.npy"), mmap_mode="r")
+        return self._arrays[key]
+
+    def locate(self, row):
+        """(shard index, offset within the shard) of a global row."""
+        if not 0 <= row < len(self):
+            raise IndexError(f"Row {row} out of range for {len(self)} rows")
+        shard_index = bisect.bisect_right(self.starts, row) - 1
+        return shard_index, row - self.starts[shard_index]
+
+    def row(self, row, name="pooler_output"):
+        """One row as a read-only mmap view (no copy)."""
+        shard_index, offset = self.locate(row)
+        return self.shard_array(shard_index, name)[offset]
+
+    def get(self, image_id, name="pooler_output"):
+        return self.row(self.row_of(image_id), name)
+
+    def rows(self, rows, name="pooler_output"):
+        """Gather arbitrary rows (in the given order) with one fancy index per shard touched."""
+        rows = np.asarray(rows, dtype=np.int64)
+        shape = self.manifest["outputs"][name]
+        out = np.empty((len(rows), *shape), dtype=self.dtype)
+        shard_of = np.searchsorted(self.starts, rows, side="right") - 1
+        for shard_index in np.unique(shard_of):
+            selected = np.nonzero(shard_of == shard_index)[0]
+            out[selected] = self.shard_array(shard_index, name)[rows[selected] - self.starts[shard_index]]
+        return out
+
+    def iter_shards(self, name="pooler_output"):
+        """(ids, mmap array) per shard, in row order; memory is bounded by one shard."""
+        ids = self.ids()
+        for shard_index in range(len(self.manifest["shards"])):
+            start, stop = self.starts[shard_index], self.starts[shard_index + 1]
+            yield ids[start:stop], self.shard_array(shard_index, name)
+
+    def column(self, name="pooler_output"):
+        """The whole output as one float32 array (only for outputs that fit in memory)."""
+        if not len(self):
+            return np.empty((0, *self.manifest["outputs"].get(name, [])), dtype=np.float32)
+        return np.concatenate([array for _, array in self.iter_shards(name)]).astype(np.float32)
+
+
+def result_dirs(results_dir):
+    """Result_N directories sorted by N."""
+    found = []
+    for name in os.listdir(results_dir):
+        m = RESULT_DIR_PATTERN.match(name)
+        if m and os.path.isdir(os.path.join(results_dir, name)):
+            found.append((int(m.group(1)), os.path.join(results_dir, name)))
+    return [path for _, path in sorted(found)]
+
+
+def read_ids(path):
+    """Image ids from a qnn-net-run input list ("pixel_values:=<file>" or plain paths) or one id per line."""
+    ids = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                ids.append(line.split(":=", 1)[-1].split()[0])
+    return ids
+
+
+def convert_results(results_dir, store, ids=None, hidden_size=None):
+    """Append every Result_N under results_dir to `store`; rows are ids[N] (or 'Result_N')."""
+    dirs = result_dirs(results_dir)
+    if ids is not None and len(ids) < len(dirs):
+        raise ValueError(f"{len(ids)} ids for {len(dirs)} Result_N directories")
+    for n, result_dir in enumerate(dirs):
+        outputs = qnn_utils.read_raw_outputs(result_dir, hidden_size)
+        image_id = ids[n] if ids is not None else os.path.basename(result_dir)
+        store.append([image_id], {name: value[None] for name, value in outputs.items()})
+    store.flush()
+    store.write_index()
+    return len(dirs)
+
+
+def print_info(store):
+    print(f"Store {store.path}: {len(store)} rows in {len(store.manifest['shards'])} shards ({store.manifest['dtype']})")
+    for name, shape in store.manifest["outputs"].items():
+        row_bytes = int(np.prod(shape)) * np.dtype(store.dtype).itemsize
+        print(f"  {name:<20} row shape {tuple(shape)}  {row_bytes / 1024:.1f} KB/row  "
+              f"{row_bytes * len(store) / 1024 / 1024:.1f} MB total")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sharded columnar store for inference outputs")
+    sub = parser.add_subparsers(dest="command", required=True)
+    convert = sub.add_parser("convert", help="Convert a tree of Result_N directories into a store")
+    convert.add_argument("results_dir", help="Directory containing Result_0, Result_1, ...")
+    convert.add_argument("--store", required=True, help="Store directory (created or appended to)")
+    convert.add_argument("--ids", help="Input list / id file giving the image id of each Result_N")
+    convert.add_argument("--dtype", default="fp16", choices=list(STORE_DTYPES), help="Dtype of a new store")
+    convert.add_argument("--shard_rows", type=int, default=DEFAULT_SHARD_ROWS, help="Rows per shard")
+    convert.add_argument("--hidden_size", type=int, default=None, help="Hidden size (inferred from pooler_output)")
+    info = sub.add_parser("info", help="Print rows, shards and outputs of a store")
+    info.add_argument("store")
+    get = sub.add_parser("get", help="Print one row of a store")
+    get.add_argument("store")
+    get.add_argument("id", help="Image id")
+    get.add_argument("--output", default="pooler_output")
+    args = parser.parse_args()
+
+    if args.command == "convert":
+        store = ResultStore(args.store, args.dtype, args.shard_rows)
+        ids = read_ids(args.ids) if args.ids else None
+        count = convert_results(args.results_dir, store, ids, args.hidden_size)
+        print(f"Converted {count} Result_N directories")
+        print_info(store)
+    elif args.command == "info":
+        print_info(ResultStore(args.store))
+    else:
+        store = ResultStore(args.store)
+        try:
+            value = np.asarray(store.get(args.id, args.output), dtype=np.float32)
+        except KeyError as e:
+            print(f"Error: {e.args[0]}")
+            raise SystemExit(1)
+        print(f"{args.id} {args.output} {value.shape}: {value.ravel()[:8]} ...")
+
+
+if __name__ == "__main__":
+    main()
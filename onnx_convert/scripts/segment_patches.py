@@ -0,0 +1,184 @@
+import argparse
+import os
+import time
+
+import numpy as np
+from PIL import Image
+
+from feature_utils import iter_batches, normalize, png_name, png_writers
+from patch_store import PatchStore
+
+# Label-free segmentation from DINOv3 patch tokens.
+# Patch tokens of every image in a patch store are clustered with a
+# vectorized mini-batch spherical k-means (cosine, like the features are
+# compared everywhere else): the store is streamed shard by shard in fp16,
+# each batch is normalized in float32, assigned with one matmul and moves
+# its centres with per-centre 1/count learning rates (Sculley 2010), so
+# memory is one batch + k x D regardless of dataset size. Centres start from
+# k-means++ on a sample, or from PCA (quantile bins along the first principal
+# component of the sample; deterministic). Each image then gets a gh x gw
+# label map, upsampled to its original size (nearest, or --smooth: bilinear
+# upsampling of the per-cluster scores before the argmax) and written as a
+# palette PNG by a thread pool.
+#
+# Usage (from onnx_convert/):
+#   python3 scripts/segment_patches.py dataset.patches --k 8 --output_dir segments
+#   python3 scripts/segment_patches.py dataset.patches --k 8 --init pca --epochs 3 --save_model km8.npz --smooth
+#   python3 scripts/segment_patches.py video.patches --model km8.npz --output_dir video_segments
+
+INIT_METHODS = ("kmeans++", "pca")
+INIT_SAMPLE_PATCHES = 20000
+
+
+def palette(k, seed=3):
+    colours = np.random.RandomState(seed).randint(40, 256, size=(k, 3)).astype(np.uint8)
+    return colours.ravel().tolist() + [0] * (768 - 3 * k)
+
+
+def sample_patches(patches, count, seed=0):
+    """Uniform random patches from the whole store (fp32, normalized)."""
+    gh, gw = patches.layout.grid_hw
+    rng = np.random.RandomState(seed)
+    picks = np.sort(rng.choice(len(patches) * gh * gw, min(count, len(patches) * gh * gw), replace=False))
+    images, cells = np.divmod(picks, gh * gw)
+    out = []
+    for image in np.unique(images):
+        grid = patches.grid(int(image))
+        ys, xs = np.divmod(cells[images == image], gw)
+        out.append(grid[ys, xs])
+    return normalize(np.concatenate(out))
+
+
+def init_kmeans_pp(sample, k, seed=0):
+    rng = np.random.RandomState(seed)
+    centres = [sample[rng.randint(len(sample))]]
+    closest = 1 - sample @ centres[0]
+    for _ in range(1, k):
+        probs = np.maximum(closest, 0) ** 2
+        probs = probs / probs.sum() if probs.sum() > 0 else np.full(len(sample), 1 / len(sample))
+        centres.append(sample[rng.choice(len(sample), p=probs)])
+        closest = np.minimum(closest, 1 - sample @ centres[-1])
+    return np.stack(centres)
+
+
+def init_pca(sample, k):
+    """Centres = mean of k quantile bins along the first principal component."""
+    centred = sample - sample.mean(axis=0)
+    _, _, vt = np.linalg.svd(centred[:min(len(centred), 5000)], full_matrices=False)
+    order = np.argsort(centred @ vt[0])
+    return normalize(np.stack([sample[part].mean(axis=0) for part in np.array_split(order, k)]))
+
+
+class MiniBatchKMeans:
+    def __init__(self, centres):
+        self.centres = normalize(centres)
+        self.counts = np.zeros(len(centres), dtype=np.float64)
+        self.inertia = 0.0
+
+    def partial_fit(self, x):
+        """One mini-batch step on (n, D) normalized float32 patches."""
+        scores = x @ self.centres.T
+        assign = scores.argmax(axis=1)
+        self.inertia += float((1 - scores[np.arange(len(x)), assign]).sum())
+        batch_counts = np.bincount(assign, minlength=len(self.centres))
+        hit = batch_counts > 0
+        sums = np.zeros_like(self.centres)
+        order = np.argsort(assign, kind="stable")
+        sums[hit] = np.add.reduceat(x[order], np.searchsorted(assign[order], np.nonzero(hit)[0]))
+        self.counts[hit] += batch_counts[hit]
+        # centre <- centre + (batch_count / total_count) * (batch_mean - centre)
+        rate = (batch_counts[hit] / self.counts[hit])[:, None].astype(np.float32)
+        means = sums[hit] / batch_counts[hit][:, None]
+        self.centres[hit] = normalize(self.centres[hit] + rate * (means - self.centres[hit]))
+
+    def scores(self, x):
+        return normalize(x) @ self.centres.T
+
+
+def upsample_labels(label_grid, score_grid, size, smooth):
+    """Label map at `size` (W, H): nearest labels, or argmax of bilinearly upsampled scores."""
+    if not smooth:
+        return Image.fromarray(label_grid.astype(np.uint8), mode="L").resize(size, Image.Resampling.NEAREST)
+    channels = [np.asarray(Image.fromarray(score_grid[..., c]).resize(size, Image.Resampling.BILINEAR))
+                for c in range(score_grid.shape[-1])]
+    return Image.fromarray(np.argmax(np.stack(channels, axis=-1), axis=-1).astype(np.uint8), mode="L")
+
+
+def write_segmentation(path, label_grid, score_grid, image_id, default_size, smooth, colours):
+    size = default_size
+    if os.path.exists(image_id):
+        with Image.open(image_id) as img:
+            size = img.size
+    labels = upsample_labels(label_grid, score_grid, size, smooth).convert("P")
+    labels.putpalette(colours)
+    labels.save(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Unsupervised segmentation of patch tokens with mini-batch k-means")
+    parser.add_argument("store", help="Patch store (patch_store.py)")
+    parser.add_argument("--k", type=int, default=8, help="Number of segments")
+    parser.add_argument("--init", default="kmeans++", choices=INIT_METHODS)
+    parser.add_argument("--epochs", type=int, default=2, help="Passes over the store while fitting")
+    parser.add_argument("--batch_size", type=int, default=32, help="Images per mini-batch")
+    parser.add_argument("--model", help="Reuse saved centres (.npz) instead of fitting")
+    parser.add_argument("--save_model", help="Save the fitted centres (.npz)")
+    parser.add_argument("--output_dir", default="segments", help="Where the label PNGs go")
+    parser.add_argument("--smooth", action="store_true", help="Bilinear score upsampling instead of nearest labels")
+    parser.add_argument("--size", type=int, nargs=2, default=(224, 224), metavar=("W", "H"),
+                        help="Output size when the image id is not a readable file")
+    parser.add_argument("--workers", type=int, default=4, help="PNG writer threads")
+    args = parser.parse_args()
+    if not 1 < args.k < 256:
+        parser.error("--k must be between 2 and 255 (labels are written as palette PNGs)")
+
+    patches = PatchStore(args.store)
+    gh, gw = patches.layout.grid_hw
+    print(f"--- {len(patches)} images, {gh}x{gw} patches, {patches.layout.hidden_size}-d, k={args.k} ---")
+
+    t0 = time.time()
+    if args.model:
+        kmeans = MiniBatchKMeans(np.load(args.model)["centres"])
+        print(f"Using centres from {args.model}")
+    else:
+        sample = sample_patches(patches, INIT_SAMPLE_PATCHES)
+        centres = init_pca(sample, args.k) if args.init == "pca" else init_kmeans_pp(sample, args.k)
+        kmeans = MiniBatchKMeans(centres)
+        for epoch in range(args.epochs):
+            kmeans.inertia = 0.0
+            for _, _, grids in iter_batches(patches, args.batch_size):
+                kmeans.partial_fit(normalize(grids.reshape(-1, grids.shape[-1])))
+            print(f"Epoch {epoch + 1}: mean cosine distance {kmeans.inertia / (len(patches) * gh * gw):.4f}")
+    t_fit = time.time() - t0
+    if args.save_model:
+        np.savez(args.save_model, centres=kmeans.centres)
+        print(f"Saved centres to {args.save_model}")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    colours = palette(len(kmeans.centres))
+    t1 = time.time()
+    t_assign = 0.0
+    sizes = np.zeros(len(kmeans.centres), dtype=np.int64)
+    with png_writers(args.workers) as submit:
+        for first_row, ids, grids in iter_batches(patches, args.batch_size):
+            ta = time.time()
+            scores = kmeans.scores(grids.reshape(-1, grids.shape[-1])).reshape(len(ids), gh, gw, -1)
+            labels = scores.argmax(axis=-1)
+            sizes += np.bincount(labels.ravel(), minlength=len(sizes))
+            t_assign += time.time() - ta
+            for i, image_id in enumerate(ids):
+                submit(write_segmentation, os.path.join(args.output_dir, png_name(first_row + i, image_id)), labels[i],
+                       scores[i] if args.smooth else None, image_id, tuple(args.size), args.smooth, colours)
+    t_total = time.time() - t1
+
+    print("\n--- Segmentation Summary ---")
+    if not args.model:
+        print(f"[TIME] Fit ({args.epochs} epochs): {t_fit:.2f} s  ({len(patches) * args.epochs / t_fit:.1f} images/s)")
+    print(f"[TIME] Assign      : {t_assign:.2f} s  ({len(patches) / max(t_assign, 1e-9):.1f} images/s)")
+    print(f"[TIME] Assign + write: {t_total:.2f} s  ({len(patches) / t_total:.1f} images/s)")
+    print("Segment sizes (% of patches): " + "  ".join(f"{c}:{n / sizes.sum() * 100:.1f}" for c, n in enumerate(sizes)))
+    print(f"Saved {len(patches)} label maps to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,475 @@
+import argparse
+import io
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import devices
+import qnn_utils
+import telemetry
+
+# Thermal soak benchmark.
+# Short benchmarks measure burst performance; production runs for hours and
+# the SoC throttles once it heats up. This drives a runner at maximum rate
+# (or a fixed --rate) for --duration seconds, records every inference
+# latency, samples temperatures and clocks with device_telemetry.py, and
+# reports per --window:
+#
+#   throughput, p50/p99 latency, hottest thermal zone, accelerator clock
+#
+# plus burst FPS (median of the first --burst_seconds), steady-state FPS
+# (mean of the last quarter), when throttling starts (first window after
+# which latency stays --throttle_pct above burst, and first window after
+# which the clock stays that far below its initial maximum), and a suggested
+# rate limit. Telemetry runs for --idle_seconds before the load starts, which
+# gives the idle temperature T_idle. The limit comes from a first-order
+# thermal fit of the pre-throttle windows (dT/dt = (T_inf - T) / tau): at
+# duty d the board settles at T_idle + d * (T_inf - T_idle), so the largest
+# rate that stays --margin_c below the trip temperature is burst FPS x
+# (T_trip - margin - T_idle) / (T_inf - T_idle). Without an idle reading or
+# a usable fit the steady-state FPS is suggested.
+#
+# Runners:
+#   device - qnn-net-run on the board, --chunk inferences per invocation,
+#            latencies from the QnnGraph_execute log; samples and chunk
+#            start/end are both on the device clock
+#   ort    - host ONNX Runtime CPU (backends.py), sampled from the host /sys
+#   fake   - simulated board on a fake sysfs tree (telemetry.FakeRoot) that
+#            heats up and halves its clocks at 85 C; exercises the whole
+#            pipeline without hardware
+#
+# Usage (from onnx_convert/, after deploy.py):
+#   python3 scripts/soak_bench.py --duration 3600 --json soak.json
+#   python3 scripts/soak_bench.py --duration 1800 --rate 20 --perf_profile sustained_high_performance
+#   python3 scripts/soak_bench.py --runner fake --duration 120 --window 5
+
+DEFAULT_WINDOW = 10.0
+DEFAULT_BURST_SECONDS = 30.0
+DEFAULT_IDLE_SECONDS = 10.0
+STEADY_FRACTION = 0.25
+TELEMETRY_INTERVAL = 0.5
+FAKE_LATENCY_MS = 20.0
+
+
+def parse_execute_times_ms(log_text):
+    """Per-inference times from the QnnGraph_execute started/done log pairs, else [Avg]."""
+    starts = [float(m) for m in re.findall(r"([0-9\.]+)ms .* QnnGraph_execute started", log_text)]
+    ends = [float(m) for m in re.findall(r"([0-9\.]+)ms .* QnnGraph_execute done", log_text)]
+    if starts and len(starts) == len(ends):
+        return [end - start for start, end in zip(starts, ends)]
+    avg = qnn_utils.parse_inference_time_ms(log_text)
+    return [avg] if avg is not None else []
+
+
+class LocalTelemetry:
+    """device_telemetry.py as a local subprocess (host /sys, or a fake tree)."""
+
+    def __init__(self, root="/", interval=TELEMETRY_INTERVAL):
+        self.output = tempfile.NamedTemporaryFile(suffix=".jsonl", delete=False).name
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "device_telemetry.py")
+        self.process = subprocess.Popen([sys.executable, script, "--root", root, "--interval", str(interval),
+                                         "--output", self.output], stderr=subprocess.DEVNULL)
+
+    def stop(self, local_path):
+        self.process.terminate()
+        self.process.wait()
+        os.replace(self.output, local_path)
+        return telemetry.Telemetry.load(local_path)
+
+
+class DeviceRunner:
+    """Repeated qnn-net-run invocations of one image on the board."""
+
+    def __init__(self, device, image, chunk, perf_profile=None):
+        from inference import connect_device
+        from preprocess_input import preprocess_array
+
+        self.base_dir = device["base_dir"]
+        self.work_dir = f"{self.base_dir}/soak"
+        self.ssh = connect_device(device)
+        if not self.ssh:
+            raise ConnectionError(f"device {device['name']} ({device['host']}) is unreachable")
+        self.sftp = self.ssh.open_sftp()
+        self.ssh.exec_command(f"mkdir -p {self.work_dir}")[1].channel.recv_exit_status()
+        remote_raw = f"{self.work_dir}/input.raw"
+        input_list = f"{self.work_dir}/input_list.txt"
+        raw = qnn_utils.to_graph_layout(preprocess_array(image)).astype(np.float32)
+        self.sftp.putfo(io.BytesIO(raw.tobytes()), remote_raw)
+        self.sftp.putfo(io.BytesIO((f"pixel_values:={remote_raw}\n" * chunk).encode()), input_list)
+        net_run_args = qnn_utils.tuned_net_run_args(self.base_dir, qnn_utils.load_htp_tuning())
+        if perf_profile:
+            net_run_args["perf_profile"] = perf_profile
+        net_run = qnn_utils.net_run_invocation(self.base_dir, f"{self.base_dir}/bin/libdinov3.so", input_list,
+                                               f"{self.work_dir}/output", log_level="info", **net_run_args)
+        self.command = " && ".join([f"cd {self.base_dir}"] + qnn_utils.htp_env_exports(self.base_dir)
+                                   + [telemetry.event_wrap("chunk", net_run)])
+        self.chunk = chunk
+        self.describe = f"device {device['name']}, {chunk} inferences per qnn-net-run, perf_profile {net_run_args.get('perf_profile')}"
+
+    def start_telemetry(self):
+        telemetry.start(self.ssh, self.base_dir, TELEMETRY_INTERVAL)
+
+    def stop_telemetry(self, local_path):
+        return telemetry.stop(self.ssh, self.sftp, local_path)
+
+    def idle(self, seconds):
+        time.sleep(seconds)
+
+    def run(self):
+        """(device start, device end, [latency ms]) of one chunk."""
+        stdin, stdout, stderr = self.ssh.exec_command(self.command)
+        status = stdout.channel.recv_exit_status()
+        out, err = stdout.read().decode(), stderr.read().decode()
+        if status != 0:
+            raise RuntimeError(f"qnn-net-run failed: {err.strip()[-500:]}")
+        events = telemetry.parse_events(out)
+        if not events:
+            raise RuntimeError("no chunk markers in the qnn-net-run output")
+        _, t0, t1 = events[-1]
+        latencies = parse_execute_times_ms(out + "\n" + err)
+        if len(latencies) != self.chunk:
+            # Only the average is known: spread it over the chunk
+            latencies = [latencies[0] if latencies else (t1 - t0) * 1000 / self.chunk] * self.chunk
+        return t0, t1, latencies
+
+    def close(self):
+        self.ssh.exec_command(f"rm -rf {self.work_dir}")[1].channel.recv_exit_status()
+        self.sftp.close()
+        self.ssh.close()
+
+
+class BackendRunner:
+    """Host backend (backends.py) inferring one image; host clock throughout."""
+
+    def __init__(self, backend_name, image, chunk):
+        import backends
+        from preprocess_input import preprocess_array
+
+        self.backend = backends.create_backend(backend_name)
+        self.backend.open()
+        self.pixel_values = preprocess_array(image)
+        self.chunk = chunk
+        self.describe = f"host backend {backend_name}"
+        self.sampler = None
+
+    def start_telemetry(self):
+        self.sampler = LocalTelemetry()
+
+    def stop_telemetry(self, local_path):
+        return self.sampler.stop(local_path)
+
+    def idle(self, seconds):
+        time.sleep(seconds)
+
+    def infer_once(self):
+        self.backend.infer(self.pixel_values)
+
+    def run(self):
+        t0 = time.time()
+        latencies = []
+        for _ in range(self.chunk):
+            ts = time.perf_counter()
+            self.infer_once()
+            latencies.append((time.perf_counter() - ts) * 1000)
+        return t0, time.time(), latencies
+
+    def close(self):
+        self.backend.close()
+
+
+class FakeThermalRunner(BackendRunner):
+    """Simulated board: latency scales with the clock of a FakeRoot that heats under load."""
+
+    def __init__(self, chunk):
+        self.root = tempfile.mkdtemp(prefix="soak_fakesys_")
+        self.board = telemetry.FakeRoot(self.root)
+        self.chunk = chunk
+        self.describe = f"simulated board (fake sysfs tree {self.root})"
+        self.sampler = None
+        self.last_step = time.time()
+        self.busy = 0.0
+
+    def start_telemetry(self):
+        self.sampler = LocalTelemetry(self.root)
+
+    def idle(self, seconds):
+        end = time.time() + seconds
+        while time.time() < end:
+            time.sleep(0.1)
+            now = time.time()
+            self.board.step(now - self.last_step, 0.0)
+            self.last_step = now
+
+    def infer_once(self):
+        latency = FAKE_LATENCY_MS / 1000 / self.board.clock_ratio
+        time.sleep(latency)
+        self.busy += latency
+        now = time.time()
+        if now - self.last_step >= 0.1:
+            self.board.step(now - self.last_step, min(1.0, self.busy / (now - self.last_step)))
+            self.last_step, self.busy = now, 0.0
+
+    def close(self):
+        pass
+
+
+# --- analysis ------------------------------------------------------------------
+
+def completions(chunks):
+    """(completion times, latencies ms) of every inference, spread evenly over its chunk."""
+    times, latencies = [], []
+    for t0, t1, chunk_latencies in chunks:
+        n = len(chunk_latencies)
+        times += [t0 + (t1 - t0) * (i + 1) / n for i in range(n)]
+        latencies += chunk_latencies
+    return np.array(times), np.array(latencies)
+
+
+def hottest(device_telemetry, zone=None):
+    """(times, temperature) of the hottest matching thermal zone per sample."""
+    channels = [c for c in device_telemetry.channels() if c.startswith("temp_c/") and (not zone or zone in c)]
+    if not channels:
+        return None
+    temps = np.stack([device_telemetry.series(c)[1] for c in channels])
+    return device_telemetry.t, np.fmax.reduce(temps, axis=0)
+
+
+def clock_series(device_telemetry, clock=None):
+    """(times, MHz) of the accelerator clock: --clock, else devfreq, else the fastest CPU."""
+    channels = device_telemetry.channels()
+    if clock:
+        picked = [c for c in channels if clock in c]
+    else:
+        picked = [c for c in channels if c.startswith("devfreq_mhz/")] or [c for c in channels if c.startswith("cpu_mhz/")]
+    if not picked:
+        return None, None, None
+    values = np.stack([device_telemetry.series(c)[1] for c in picked])
+    return device_telemetry.t, np.fmax.reduce(values, axis=0), (", ".join(picked) if len(picked) < 3
+                                                                  else f"max of {len(picked)} {picked[0].split('/')[0]}")
+
+
+def window_table(times, latencies, start, end, window, temp=None, clock=None):
+    """Per-window rows: start offset, images/s, p50/p99 latency, max temperature, mean clock."""
+    rows = []
+    for w0 in np.arange(start, end, window):
+        w1 = min(w0 + window, end)
+        mask = (times >= w0) & (times < w1)
+        row = {"t": float(w0 - start), "fps": float(mask.sum() / max(w1 - w0, 1e-9)),
+               "p50_ms": float(np.median(latencies[mask])) if mask.any() else None,
+               "p99_ms": float(np.percentile(latencies[mask], 99)) if mask.any() else None,
+               "temp_c": None, "clock_mhz": None}
+        for key, series in (("temp_c", temp), ("clock_mhz", clock)):
+            if series is not None:
+                t, v = series
+                sel = v[(t >= w0) & (t < w1)]
+                sel = sel[~np.isnan(sel)]
+                if len(sel):
+                    row[key] = float(sel.max() if key == "temp_c" else sel.mean())
+        if w1 - w0 >= window / 2:  # drop a short tail window
+            rows.append(row)
+    return rows
+
+
+def sustained_onset(values, predicate, hold):
+    """Index of the first value from which `predicate` holds for `hold` values in a row (else None)."""
+    run = 0
+    for i, v in enumerate(values):
+        run = run + 1 if v is not None and predicate(v) else 0
+        if run >= hold:
+            return i - hold + 1
+    return None
+
+
+def idle_temperature(temp, load_start):
+    """Median temperature of the samples taken before load_start, or None."""
+    if temp is None:
+        return None
+    t, v = temp
+    idle = v[(t < load_start) & ~np.isnan(v)]
+    return float(np.median(idle)) if len(idle) else None
+
+
+def fit_thermal(rows, until):
+    """(T_inf, tau) from dT/dt = (T_inf - T) / tau over rows[:until], or None."""
+    pts = [(r["t"], r["temp_c"]) for r in rows[:until] if r["temp_c"] is not None]
+    if len(pts) < 4:
+        return None
+    t, temp = np.array(pts).T
+    slope = np.gradient(temp, t)
+    b, a = np.polyfit(temp, slope, 1)
+    if b >= 0:
+        return None
+    return float(-a / b), float(-1 / b)
+
+
+def analyze(rows, burst_seconds, throttle_pct, hold, margin_c, idle_c=None):
+    burst_rows = [r for r in rows if r["t"] < burst_seconds] or rows[:1]
+    steady_rows = rows[-max(1, int(len(rows) * STEADY_FRACTION)):]
+    burst_fps = float(np.median([r["fps"] for r in burst_rows]))
+    steady_fps = float(np.mean([r["fps"] for r in steady_rows]))  # throttling may cycle: average throughput
+    burst_p50 = float(np.median([r["p50_ms"] for r in burst_rows if r["p50_ms"] is not None]))
+    summary = {"burst_fps": burst_fps, "steady_fps": steady_fps, "burst_p50_ms": burst_p50,
+               "steady_p50_ms": float(np.median([r["p50_ms"] for r in steady_rows if r["p50_ms"] is not None]))}
+
+    factor = throttle_pct / 100.0
+    latency_onset = sustained_onset([r["p50_ms"] for r in rows], lambda v: v > burst_p50 * (1 + factor), hold)
+    clocks = [r["clock_mhz"] for r in burst_rows if r["clock_mhz"] is not None]
+    clock_onset = None
+    if clocks:
+        clock_onset = sustained_onset([r["clock_mhz"] for r in rows], lambda v: v < max(clocks) * (1 - factor), hold)
+    summary["latency_throttle_s"] = rows[latency_onset]["t"] if latency_onset is not None else None
+    summary["clock_throttle_s"] = rows[clock_onset]["t"] if clock_onset is not None else None
+    onsets = [i for i in (clock_onset, latency_onset) if i is not None]
+    onset = min(onsets) if onsets else None
+    summary["time_to_throttle_s"] = rows[onset]["t"] if onset is not None else None
+    summary["throttle_temp_c"] = rows[onset]["temp_c"] if onset is not None else None
+
+    if onset is None:
+        summary["suggested_rate"] = burst_fps
+        summary["suggestion"] = "no throttling seen; the burst rate held for the whole run"
+        return summary
+    # The onset window already runs at reduced clocks: fit the heating before it
+    fit = fit_thermal(rows, onset)
+    trip = max(r["temp_c"] for r in rows[:onset + 1] if r["temp_c"] is not None) if fit else None
+    if idle_c is None:
+        summary["suggested_rate"] = steady_fps
+        summary["suggestion"] = "no idle temperature measured; suggesting the throttled steady-state rate"
+    elif fit and fit[0] > idle_c and trip - margin_c > idle_c:
+        t_inf, tau = fit
+        duty = min(1.0, (trip - margin_c - idle_c) / (t_inf - idle_c))
+        summary.update(thermal_fit={"idle_c": idle_c, "t_inf_c": t_inf, "tau_s": tau, "trip_c": trip})
+        summary["suggested_rate"] = burst_fps * duty
+        summary["suggestion"] = (f"thermal fit: idle {idle_c:.1f} C, T_inf {t_inf:.1f} C at full rate, tau {tau:.0f} s; "
+                                 f"stays {margin_c:.0f} C below the {trip:.1f} C trip at {duty * 100:.0f}% duty")
+    else:
+        summary["suggested_rate"] = steady_fps
+        summary["suggestion"] = "no usable thermal fit; suggesting the throttled steady-state rate"
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Thermal soak benchmark: burst vs steady-state throughput")
+    parser.add_argument("--runner", default="device", choices=["device", "ort", "fake"])
+    parser.add_argument("--image", default="test/test_image.jpg", help="Benchmark input image")
+    parser.add_argument("--duration", type=float, default=600, help="Soak length in seconds")
+    parser.add_argument("--rate", type=float, default=0, help="Target images/s (0: as fast as possible)")
+    parser.add_argument("--chunk", type=int, default=20, help="Inferences per qnn-net-run invocation / rate step")
+    parser.add_argument("--perf_profile", help="Override the qnn-net-run perf profile (device runner)")
+    parser.add_argument("--window", type=float, default=DEFAULT_WINDOW, help="Seconds per reported window")
+    parser.add_argument("--idle_seconds", type=float, default=DEFAULT_IDLE_SECONDS,
+                        help="Telemetry before the load starts, for the idle temperature")
+    parser.add_argument("--burst_seconds", type=float, default=DEFAULT_BURST_SECONDS, help="Initial span counted as burst")
+    parser.add_argument("--throttle_pct", type=float, default=10.0,
+                        help="Latency rise / clock drop (%%) that counts as throttling")
+    parser.add_argument("--hold", type=int, default=3, help="Consecutive windows the condition must hold")
+    parser.add_argument("--margin_c", type=float, default=3.0, help="Degrees to stay below the trip point")
+    parser.add_argument("--zone", help="Thermal zone substring to track (default: hottest zone)")
+    parser.add_argument("--clock", help="Clock channel substring to track (default: devfreq, else CPU)")
+    parser.add_argument("--output_dir", default="soak_results", help="Telemetry dump and per-window table")
+    parser.add_argument("--json", help="Also write the summary + windows here")
+    args = parser.parse_args()
+
+    if args.runner == "fake":
+        runner = FakeThermalRunner(args.chunk)
+    else:
+        if not os.path.exists(args.image):
+            print(f"Error: Image {args.image} not found.")
+            return
+        try:
+            runner = DeviceRunner(devices.select_device(), args.image, args.chunk, args.perf_profile) if args.runner == "device" \
+                else BackendRunner(args.runner, args.image, args.chunk)
+        except (ConnectionError, OSError) as e:
+            print(f"Error: {e}")
+            return
+    os.makedirs(args.output_dir, exist_ok=True)
+    print(f"--- Soak: {runner.describe}, {args.duration:.0f} s at "
+          f"{f'{args.rate:g} images/s' if args.rate else 'maximum rate'} ---")
+
+    runner.start_telemetry()
+    print(f"Measuring idle temperature for {args.idle_seconds:g} s...")
+    runner.idle(args.idle_seconds)
+    chunks = []
+    t_start = time.time()
+    next_report = t_start + args.window
+    reported = 0
+    try:
+        while time.time() - t_start < args.duration:
+            chunk_start = time.time()
+            chunks.append(runner.run())
+            if args.rate:
+                # Pace whole chunks: chunk / rate seconds each
+                time.sleep(max(0.0, chunk_start + args.chunk / args.rate - time.time()))
+            if time.time() >= next_report:
+                recent = [lat for c in chunks[reported:] for lat in c[2]]
+                print(f"[SOAK] {time.time() - t_start:>6.0f} s  {sum(len(c[2]) for c in chunks):>7} images  "
+                      f"p50 {np.median(recent):.2f} ms")
+                next_report += args.window
+                reported = len(chunks)
+    except KeyboardInterrupt:
+        print("Interrupted; analysing what ran so far")
+    except RuntimeError as e:
+        print(f"Error: {e}; analysing what ran so far")
+    telemetry_path = os.path.join(args.output_dir, "telemetry.jsonl")
+    try:
+        device_telemetry = runner.stop_telemetry(telemetry_path)
+    except (RuntimeError, IOError, OSError, ValueError) as e:
+        print(f"[WARNING] Telemetry unavailable: {e}")
+        device_telemetry = None
+    runner.close()
+    if not chunks:
+        print("No inferences completed.")
+        return
+
+    # Runner clock: the device's for the device runner, the host's otherwise
+    times, latencies = completions(chunks)
+    temp = clock = None
+    clock_name = None
+    if device_telemetry is not None and len(device_telemetry.t):
+        temp = hottest(device_telemetry, args.zone)
+        t, mhz, clock_name = clock_series(device_telemetry, args.clock)
+        clock = (t, mhz) if t is not None else None
+    rows = window_table(times, latencies, chunks[0][0], chunks[-1][1], args.window, temp, clock)
+    if not rows:
+        print("Run too short for one window; lower --window.")
+        return
+    idle_c = idle_temperature(temp, chunks[0][0])
+    summary = analyze(rows, args.burst_seconds, args.throttle_pct, args.hold, args.margin_c, idle_c)
+
+    print(f"\n--- Soak Timeline ({args.window:g} s windows; clock: {clock_name or 'n/a'}) ---")
+    print(f"{'t (s)':>7} {'FPS':>8} {'p50 (ms)':>9} {'p99 (ms)':>9} {'Temp (C)':>9} {'Clock (MHz)':>12}")
+    fmt = lambda v, spec: format(v, spec) if v is not None else "-"
+    for r in rows:
+        print(f"{r['t']:>7.0f} {r['fps']:>8.2f} {fmt(r['p50_ms'], '>9.2f')} {fmt(r['p99_ms'], '>9.2f')} "
+              f"{fmt(r['temp_c'], '>9.1f')} {fmt(r['clock_mhz'], '>12.0f')}")
+
+    print("\n--- Soak Summary ---")
+    print(f"[SOAK] Images           : {len(latencies)} in {chunks[-1][1] - chunks[0][0]:.0f} s")
+    print(f"[SOAK] Idle temperature : {fmt(idle_c, '.1f')} C (first {args.idle_seconds:g} s, no load)")
+    print(f"[SOAK] Burst FPS        : {summary['burst_fps']:.2f}  (p50 {summary['burst_p50_ms']:.2f} ms, first {args.burst_seconds:g} s)")
+    print(f"[SOAK] Steady-state FPS : {summary['steady_fps']:.2f}  (p50 {summary['steady_p50_ms']:.2f} ms, last {STEADY_FRACTION:.0%})")
+    if summary["time_to_throttle_s"] is None:
+        print("[SOAK] Throttling       : none detected")
+    else:
+        print(f"[SOAK] Time to throttle : {summary['time_to_throttle_s']:.0f} s "
+              f"(latency: {fmt(summary['latency_throttle_s'], '.0f')} s, clock: {fmt(summary['clock_throttle_s'], '.0f')} s, "
+              f"at {fmt(summary['throttle_temp_c'], '.1f')} C)")
+    print(f"[SOAK] Suggested rate   : {summary['suggested_rate']:.2f} images/s ({summary['suggestion']})")
+
+    with open(os.path.join(args.output_dir, "soak_windows.json"), "w") as f:
+        json.dump(rows, f, indent=2)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"runner": runner.describe, "duration_s": args.duration, "rate": args.rate,
+                       "summary": summary, "windows": rows}, f, indent=2)
+        print(f"Saved {args.json}")
+    print(f"Telemetry and windows in {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
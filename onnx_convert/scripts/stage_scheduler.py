@@ -0,0 +1,165 @@
+import argparse
+import json
+import os
+import queue
+import shutil
+import subprocess
+import threading
+import time
+
+# On-device pipeline scheduler for stage-partitioned models (see deploy_stages.py).
+# Runs every stage as its own HTP context through qnn-net-run and pipelines
+# micro-batches of images through the stages: while stage k works on chunk c,
+# stage k+1 works on chunk c-1. Intermediate activations stay on the device
+# (in a RAM-backed work dir) and never go back to the host.
+#
+# Runs on the device with the stdlib only:
+#   python3 stages/stage_scheduler.py stages/stages_device.json test/stage_input_list.txt test/stage_output
+
+INPUT_LIST_TOKEN = "@INPUT_LIST@"
+OUTPUT_DIR_TOKEN = "@OUTPUT_DIR@"
+
+
+def read_input_list(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def chunk_inputs(lines, chunk_size):
+    return [lines[i:i + chunk_size] for i in range(0, len(lines), chunk_size)]
+
+
+def stage_input_lines(manifest, k, chunk_lines, work_dir, c):
+    """Input list of stage k for chunk c (stage 0 reads images, later stages read stage k-1 results)."""
+    if k == 0:
+        return chunk_lines
+    prev = manifest["stages"][k - 1]
+    name = manifest["stages"][k]["input"]
+    prev_dir = os.path.join(work_dir, f"chunk{c}", prev["name"])
+    return [f"{name}:={prev_dir}/Result_{i}/{prev['output']}.raw" for i in range(len(chunk_lines))]
+
+
+def run_stage(manifest, k, c, chunk_lines, work_dir):
+    stage = manifest["stages"][k]
+    chunk_dir = os.path.join(work_dir, f"chunk{c}")
+    output_dir = os.path.join(chunk_dir, stage["name"])
+    input_list = os.path.join(chunk_dir, f"{stage['name']}_input_list.txt")
+    with open(input_list, "w") as f:
+        f.write("\n".join(stage_input_lines(manifest, k, chunk_lines, work_dir, c)) + "\n")
+
+    command = stage["command"].replace(INPUT_LIST_TOKEN, input_list).replace(OUTPUT_DIR_TOKEN, output_dir)
+    command = " && ".join([f"cd {manifest['base_dir']}"] + manifest.get("env", []) + [command])
+    result = subprocess.run(["bash", "-c", command], capture_output=True, text=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"{stage['name']} failed on chunk {c}: {result.stderr.strip() or result.stdout.strip()}")
+
+
+def run_pipeline(manifest, lines, output_dir, work_dir, chunk_size, max_concurrent, keep_intermediate=False):
+    """
+    One worker thread per stage; chunks flow stage to stage through queues.
+    max_concurrent bounds how many stage contexts execute at once (memory).
+    Returns per-stage busy seconds and the wall time.
+    """
+    stages = manifest["stages"]
+    chunks = chunk_inputs(lines, chunk_size)
+    queues = [queue.Queue() for _ in stages]
+    slots = threading.Semaphore(max_concurrent)
+    busy = [0.0] * len(stages)
+    errors = []
+
+    for c in range(len(chunks)):
+        os.makedirs(os.path.join(work_dir, f"chunk{c}"), exist_ok=True)
+        queues[0].put(c)
+    queues[0].put(None)
+
+    def step(k, c):
+        with slots:
+            t0 = time.time()
+            try:
+                run_stage(manifest, k, c, chunks[c], work_dir)
+            finally:
+                busy[k] += time.time() - t0
+        if k > 0 and not keep_intermediate:
+            # Stage k-1 results for this chunk have been consumed
+            shutil.rmtree(os.path.join(work_dir, f"chunk{c}", stages[k - 1]["name"]), ignore_errors=True)
+        if k + 1 < len(stages):
+            queues[k + 1].put(c)
+        else:
+            collect_outputs(stages[k], work_dir, c, chunk_size, len(chunks[c]), output_dir)
+
+    def worker(k):
+        while True:
+            c = queues[k].get()
+            if c is None or errors:
+                if k + 1 < len(stages):
+                    queues[k + 1].put(None)
+                return
+            try:
+                step(k, c)
+            except Exception as e:
+                # Any failure (OSError, subprocess, ...) ends the run; a worker dying
+                # silently would leave the later stages waiting on their queues
+                errors.append(str(e) if isinstance(e, RuntimeError)
+                              else f"{stages[k]['name']} failed on chunk {c}: {e!r}")
+
+    start = time.time()
+    threads = [threading.Thread(target=worker, args=(k,)) for k in range(len(stages))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.time() - start
+    if errors:
+        raise RuntimeError(errors[0])
+    return busy, wall
+
+
+def collect_outputs(stage, work_dir, c, chunk_size, count, output_dir):
+    """Move the last stage's Result_i dirs to global Result_N numbering."""
+    src_dir = os.path.join(work_dir, f"chunk{c}", stage["name"])
+    for i in range(count):
+        dst = os.path.join(output_dir, f"Result_{c * chunk_size + i}")
+        shutil.rmtree(dst, ignore_errors=True)
+        shutil.move(os.path.join(src_dir, f"Result_{i}"), dst)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pipeline images through stage-partitioned QNN contexts")
+    parser.add_argument("manifest", help="Device stage manifest written by deploy_stages.py")
+    parser.add_argument("input_list", help="qnn-net-run input list for the first stage (pixel_values:=...)")
+    parser.add_argument("output_dir", help="Where Result_N directories of the final stage go")
+    parser.add_argument("--chunk", type=int, default=2, help="Images per qnn-net-run invocation")
+    parser.add_argument("--max_concurrent", type=int, default=2, help="Stage contexts allowed to execute at once")
+    parser.add_argument("--work_dir", default="/dev/shm/dinov3_stages", help="RAM-backed dir for intermediate activations")
+    parser.add_argument("--keep_intermediate", action="store_true", help="Keep per-stage activations in work_dir")
+    args = parser.parse_args()
+
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+    lines = read_input_list(args.input_list)
+    if not lines:
+        print("Error: empty input list.")
+        return
+
+    shutil.rmtree(args.work_dir, ignore_errors=True)
+    os.makedirs(args.output_dir, exist_ok=True)
+    print(f"--- Pipelining {len(lines)} images through {len(manifest['stages'])} stages "
+          f"(chunk {args.chunk}, {args.max_concurrent} concurrent) ---")
+    try:
+        busy, wall = run_pipeline(manifest, lines, args.output_dir, args.work_dir, args.chunk,
+                                  args.max_concurrent, args.keep_intermediate)
+    except RuntimeError as e:
+        print(f"Pipeline failed: {e}")
+        raise SystemExit(1)
+    finally:
+        if not args.keep_intermediate:
+            shutil.rmtree(args.work_dir, ignore_errors=True)
+
+    for stage, seconds in zip(manifest["stages"], busy):
+        print(f"[STAGE] {stage['name']:<16} busy {seconds * 1000:10.1f} ms  utilization {seconds / wall * 100:5.1f}%")
+    print(f"[TIME] Pipeline Wall Time : {wall * 1000:.2f} ms")
+    print(f"[TIME] Throughput         : {len(lines) / wall:.2f} images/s")
+
+
+if __name__ == "__main__":
+    main()
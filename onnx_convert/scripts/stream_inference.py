@@ -0,0 +1,316 @@
+import argparse
+import asyncio
+import glob
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+import qnn_utils
+import devices
+from inference import connect_device, run_command
+from preprocess_input import preprocess_array
+from result_store import ResultStore, convert_results
+
+# Streaming inference for image sequences with all stages in flight together.
+# preprocess -> upload -> execute -> download are asyncio tasks connected by
+# bounded queues; each runs its blocking work (PIL, SFTP, qnn-net-run over
+# SSH) on its own thread, so while frame N executes on the HTP, frame N+1 is
+# uploading, frame N+2 is being preprocessed and frame N-1 is downloading.
+# With --skip_similar, a near-duplicate gate runs before preprocessing and
+# frames close to the last inferred frame reuse its embedding.
+#
+# Usage (from onnx_convert/):
+#   python3 scripts/stream_inference.py frames/ --output_dir stream_results
+#   python3 scripts/stream_inference.py "frames/*.jpg" --depth 2 --chunk 4
+#   python3 scripts/stream_inference.py frames/ --skip_similar dhash --skip_threshold 0.05 --max_skip 30
+#   python3 scripts/stream_inference.py frames/ --store stream.store   # also pack results into a result store
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+REMOTE_STREAM_SUBDIR = "test/stream"  # under the device base dir
+GATE_MODES = ("diff", "dhash")
+
+
+def list_images(source):
+    if os.path.isdir(source):
+        paths = [os.path.join(source, f) for f in os.listdir(source)]
+    else:
+        paths = glob.glob(source)
+    return sorted(p for p in paths if p.lower().endswith(IMAGE_EXTENSIONS))
+
+
+class FrameGate:
+    """
+    Near-duplicate gate on a tiny grayscale thumbnail (JPEGs are DCT-downscaled
+    while decoding, so this costs a fraction of a full decode). A frame is
+    skipped when its distance to the last *kept* frame is below the threshold,
+    so slow drift still triggers a refresh; max_skip bounds staleness.
+    Distances are normalized to [0, 1]:
+      diff  - mean absolute pixel difference of 32x32 thumbnails
+      dhash - Hamming distance of 64-bit difference hashes / 64
+    """
+
+    def __init__(self, mode="diff", threshold=0.02, max_skip=0):
+        self.mode = mode
+        self.threshold = threshold
+        self.max_skip = max_skip
+        self.reference = None
+        self.skipped_in_row = 0
+
+    def signature(self, path):
+        size = (32, 32) if self.mode == "diff" else (9, 8)
+        img = Image.open(path)
+        img.draft("L", (size[0] * 2, size[1] * 2))
+        pixels = np.asarray(img.convert("L").resize(size, Image.Resampling.BILINEAR), dtype=np.float32)
+        if self.mode == "diff":
+            return pixels / 255.0
+        return pixels[:, 1:] > pixels[:, :-1]
+
+    def distance(self, a, b):
+        if self.mode == "diff":
+            return float(np.abs(a - b).mean())
+        return np.count_nonzero(a != b) / a.size
+
+    def should_skip(self, path):
+        signature = self.signature(path)
+        if self.reference is not None and self.distance(signature, self.reference) < self.threshold:
+            if not self.max_skip or self.skipped_in_row < self.max_skip:
+                self.skipped_in_row += 1
+                return True
+        self.reference = signature
+        self.skipped_in_row = 0
+        return False
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.busy = 0.0
+        self.items = 0
+
+    def add(self, seconds):
+        self.busy += seconds
+        self.items += 1
+
+
+class StreamPipeline:
+    """
+    One bounded queue between each pair of stages. A chunk is a group of
+    frames executed by a single qnn-net-run invocation (chunk=1 is
+    frame-by-frame streaming).
+    """
+
+    def __init__(self, ssh, base_dir, images, output_dir, depth=1, chunk=1, net_json=qnn_utils.NET_JSON_PATH, gate=None):
+        self.ssh = ssh
+        self.base_dir = base_dir
+        self.stream_dir = f"{base_dir}/{REMOTE_STREAM_SUBDIR}"
+        self.images = images
+        self.output_dir = output_dir
+        self.depth = depth
+        self.chunk = chunk
+        self.net_json = net_json
+        self.gate = gate
+        # Skipped frame index -> index of the inferred frame whose result it reuses
+        self.reused = {}
+        stages = ("gate",) * bool(gate) + ("preprocess", "upload", "execute", "download")
+        self.stats = {name: StageStats(name) for name in stages}
+        self.executors = {name: ThreadPoolExecutor(max_workers=1) for name in self.stats}
+        # Separate SFTP sessions so uploads and downloads do not serialize on one channel
+        self.upload_sftp = ssh.open_sftp()
+        self.download_sftp = ssh.open_sftp()
+        self.tuning_args = qnn_utils.tuned_net_run_args(self.base_dir, qnn_utils.load_htp_tuning())
+        self.inference_ms = []
+        self.completed_at = []
+        # Inferred frames whose results are downloaded (gated frames reusing them complete with them)
+        self.downloaded = set()
+
+    async def _timed(self, stage, fn, *args):
+        loop = asyncio.get_running_loop()
+        t0 = time.time()
+        result = await loop.run_in_executor(self.executors[stage], fn, *args)
+        self.stats[stage].add(time.time() - t0)
+        return result
+
+    # --- blocking stage bodies (run on the stage's thread) --------------------
+
+    def _preprocess(self, paths):
+        return [qnn_utils.to_graph_layout(preprocess_array(p), self.net_json).astype(np.float32).tobytes() for p in paths]
+
+    def _upload(self, c, tensors):
+        remote_dir = f"{self.stream_dir}/chunk_{c}"
+        self.upload_sftp.mkdir(remote_dir)
+        lines = []
+        for i, data in enumerate(tensors):
+            with self.upload_sftp.open(f"{remote_dir}/input_{i}.raw", "wb") as f:
+                f.write(data)
+            lines.append(f"pixel_values:={remote_dir}/input_{i}.raw")
+        with self.upload_sftp.open(f"{remote_dir}/input_list.txt", "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return remote_dir
+
+    def _execute(self, remote_dir):
+        net_run = qnn_utils.net_run_invocation(
+            self.base_dir, f"{self.base_dir}/bin/libdinov3.so", f"{remote_dir}/input_list.txt",
+            f"{remote_dir}/output", profiling_level="basic", **self.tuning_args)
+        cmd = " && ".join([f"cd {self.base_dir}"] + qnn_utils.htp_env_exports(self.base_dir) + [net_run])
+        exit_code, out, err = run_command(self.ssh, cmd, print_output=False)
+        if exit_code != 0:
+            raise RuntimeError(f"qnn-net-run failed for {remote_dir}: {err}")
+        return qnn_utils.parse_inference_time_ms(out + "\n" + err)
+
+    def _download(self, remote_dir, indices):
+        for i, index in enumerate(indices):
+            result_dir = os.path.join(self.output_dir, f"Result_{index}")
+            os.makedirs(result_dir, exist_ok=True)
+            for name in qnn_utils.OUTPUT_NAMES:
+                self.download_sftp.get(f"{remote_dir}/output/Result_{i}/{name}.raw", os.path.join(result_dir, f"{name}.raw"))
+        run_command(self.ssh, f"rm -rf {remote_dir}", print_output=False)
+
+    def _reuse_results(self):
+        """Give every skipped frame a copy of the result it reuses."""
+        for index, source in sorted(self.reused.items()):
+            shutil.copytree(os.path.join(self.output_dir, f"Result_{source}"),
+                            os.path.join(self.output_dir, f"Result_{index}"), dirs_exist_ok=True)
+
+    # --- async stages -----------------------------------------------------------
+
+    async def kept_chunks(self):
+        """Chunks of (frame index, path) that need inference; gated frames go to self.reused."""
+        chunk, last_kept = [], None
+        for index, path in enumerate(self.images):
+            if self.gate and await self._timed("gate", self.gate.should_skip, path):
+                self.reused[index] = last_kept
+                # Done once the reused frame is; download_stage records the rest
+                if last_kept is None or last_kept in self.downloaded:
+                    self.completed_at.append(time.time())
+                continue
+            last_kept = index
+            chunk.append((index, path))
+            if len(chunk) == self.chunk:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    async def preprocess_stage(self, out_q):
+        c = 0
+        async for chunk in self.kept_chunks():
+            tensors = await self._timed("preprocess", self._preprocess, [path for _, path in chunk])
+            await out_q.put((c, [index for index, _ in chunk], tensors))
+            c += 1
+        await out_q.put(None)
+
+    async def upload_stage(self, in_q, out_q):
+        while (item := await in_q.get()) is not None:
+            c, indices, tensors = item
+            remote_dir = await self._timed("upload", self._upload, c, tensors)
+            await out_q.put((remote_dir, indices))
+        await out_q.put(None)
+
+    async def execute_stage(self, in_q, out_q):
+        while (item := await in_q.get()) is not None:
+            remote_dir, indices = item
+            inference_ms = await self._timed("execute", self._execute, remote_dir)
+            if inference_ms is not None:
+                self.inference_ms.append(inference_ms)
+            await out_q.put((remote_dir, indices))
+        await out_q.put(None)
+
+    async def download_stage(self, in_q):
+        while (item := await in_q.get()) is not None:
+            remote_dir, indices = item
+            await self._timed("download", self._download, remote_dir, indices)
+            self.downloaded.update(indices)
+            reusing = sum(source in indices for source in self.reused.values())
+            self.completed_at.extend([time.time()] * (len(indices) + reusing))
+
+    async def run(self):
+        run_command(self.ssh, f"rm -rf {self.stream_dir} && mkdir -p {self.stream_dir}", print_output=False)
+        queues = [asyncio.Queue(maxsize=self.depth) for _ in range(3)]
+        start = time.time()
+        await asyncio.gather(
+            self.preprocess_stage(queues[0]),
+            self.upload_stage(queues[0], queues[1]),
+            self.execute_stage(queues[1], queues[2]),
+            self.download_stage(queues[2]),
+        )
+        self._reuse_results()
+        return time.time() - start
+
+    def close(self):
+        self.upload_sftp.close()
+        self.download_sftp.close()
+        for executor in self.executors.values():
+            executor.shutdown()
+
+
+def report(pipeline, wall):
+    n = len(pipeline.completed_at)
+    print("\n--- Stream Summary ---")
+    print(f"Frames: {n}  Wall: {wall * 1000:.1f} ms  Overall: {n / wall:.2f} frames/s")
+    if pipeline.gate:
+        skipped = len(pipeline.reused)
+        print(f"Skipped (reused embedding): {skipped}/{n} ({skipped / n * 100:.1f}%)  "
+              f"Effective FPS: {n / wall:.2f} frames/s vs {(n - skipped) / wall:.2f} inferred/s")
+    if n > 1:
+        # Steady state: from the first completed frame on, once the pipeline is full
+        completed = sorted(pipeline.completed_at)
+        steady = (n - 1) / (completed[-1] - completed[0])
+        print(f"Steady-state throughput: {steady:.2f} frames/s")
+    if pipeline.inference_ms:
+        print(f"HTP inference: {np.mean(pipeline.inference_ms):.2f} ms per qnn-net-run (avg)")
+    print(f"{'Stage':<12} {'Busy (ms)':>10} {'Per item (ms)':>14} {'Utilization':>12}")
+    for s in pipeline.stats.values():
+        per_item = s.busy / s.items * 1000 if s.items else 0.0
+        print(f"{s.name:<12} {s.busy * 1000:>10.1f} {per_item:>14.1f} {s.busy / wall * 100:>11.1f}%")
+    bottleneck = max(pipeline.stats.values(), key=lambda s: s.busy)
+    print(f"Bottleneck: {bottleneck.name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Overlapped streaming DINOv3 inference on IQ-9075 (HTP)")
+    parser.add_argument("source", help="Directory of frames or a glob pattern")
+    parser.add_argument("--output_dir", default="stream_results", help="Local directory for Result_N outputs")
+    parser.add_argument("--depth", type=int, default=1, help="Bounded queue size between stages")
+    parser.add_argument("--chunk", type=int, default=1, help="Frames per qnn-net-run invocation")
+    parser.add_argument("--skip_similar", choices=GATE_MODES,
+                        help="Skip near-duplicate frames (diff: thumbnail difference, dhash: perceptual hash)")
+    parser.add_argument("--skip_threshold", type=float, default=0.02,
+                        help="Normalized distance [0, 1] below which a frame reuses the previous embedding")
+    parser.add_argument("--max_skip", type=int, default=0, help="Force inference after this many consecutive skips (0: no limit)")
+    parser.add_argument("--store", help="Also append the results to this result store (ids = frame paths)")
+    args = parser.parse_args()
+
+    images = list_images(args.source)
+    if not images:
+        print(f"Error: no images found in {args.source}")
+        return
+
+    device = devices.select_device()
+    print(f"--- Connecting to {device['host']} ---")
+    ssh = connect_device(device)
+    if not ssh:
+        return
+    os.makedirs(args.output_dir, exist_ok=True)
+    gate = FrameGate(args.skip_similar, args.skip_threshold, args.max_skip) if args.skip_similar else None
+    pipeline = StreamPipeline(ssh, device["base_dir"], images, args.output_dir, args.depth, args.chunk, gate=gate)
+    print(f"--- Streaming {len(images)} frames (depth {args.depth}, chunk {args.chunk}) ---")
+    try:
+        wall = asyncio.run(pipeline.run())
+        report(pipeline, wall)
+        print(f"Results saved in {args.output_dir}")
+        if args.store:
+            count = convert_results(args.output_dir, ResultStore(args.store), ids=images)
+            print(f"Appended {count} results to {args.store}")
+    except RuntimeError as e:
+        print(f"Streaming failed: {e}")
+    finally:
+        pipeline.close()
+        ssh.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,497 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from preprocess_input import preprocess_array
+import devices
+import qnn_utils
+
+# Converter option sweep: convert the ONNX model under a grid of quantization
+# options, measure output fidelity against the float ONNX reference and report
+# the latency-vs-accuracy Pareto front. Variants whose latency could not be
+# measured are listed but left off the front; weight size stands in for
+# latency only when no variant was timed.
+#
+# Usage (from onnx_convert/):
+#   python3 scripts/sweep_converter.py --images test/test_image.jpg --runner host
+#   python3 scripts/sweep_converter.py --grid weights_bitwidth=8,4 act_bitwidth=8,16 --runner device
+
+DIR_ONNX_BASE = "../onnx_download"
+DEFAULT_WORK_DIR = "sweep_results"
+
+# Options swept by default. Values are converter flag values; booleans map to
+# presence/absence of the flag.
+DEFAULT_GRID = {
+    "use_per_channel_quantization": [False, True],
+    "weights_bitwidth": [8, 4],
+    "act_bitwidth": [8, 16],
+    "float_fallback": [False],
+    "use_dynamic_16_bit_weights": [False],
+}
+
+# Options that only matter for calibrated (fixed point) conversion
+QUANT_ONLY_OPTIONS = ["use_per_channel_quantization", "weights_bitwidth", "act_bitwidth", "use_dynamic_16_bit_weights"]
+
+
+def parse_value(text):
+    lowered = text.lower()
+    if lowered in ("true", "false"):
+        return lowered == "true"
+    try:
+        return int(text)
+    except ValueError:
+        return text
+
+
+def parse_grid(specs):
+    grid = dict(DEFAULT_GRID)
+    for spec in specs or []:
+        if "=" not in spec:
+            raise ValueError(f"Grid entry must look like option=v1,v2: {spec}")
+        key, values = spec.split("=", 1)
+        grid[key] = [parse_value(v) for v in values.split(",")]
+    return grid
+
+
+def baseline_variant(grid, recorded_options):
+    """The options dinov3_qnn_net.json was converted with, restricted to the swept keys."""
+    variant = {}
+    for key, values in grid.items():
+        recorded = recorded_options.get(key)
+        variant[key] = parse_value(recorded) if recorded is not None else values[0]
+    return variant
+
+
+def expand_grid(grid, recorded_options):
+    """Cartesian product of the grid, with float_fallback variants de-duplicated."""
+    keys = list(grid)
+    defaults = baseline_variant(grid, recorded_options)
+    variants = []
+    seen = set()
+    for values in itertools.product(*(grid[k] for k in keys)):
+        variant = dict(zip(keys, values))
+        if variant.get("float_fallback"):
+            # No calibration happens, so the fixed point options are irrelevant
+            for key in QUANT_ONLY_OPTIONS:
+                if key in variant:
+                    variant[key] = defaults[key]
+        key = tuple(sorted(variant.items()))
+        if key not in seen:
+            seen.add(key)
+            variants.append(variant)
+    return variants
+
+
+def variant_tag(variant):
+    short = {
+        "use_per_channel_quantization": "pc",
+        "weights_bitwidth": "w",
+        "act_bitwidth": "a",
+        "float_fallback": "ff",
+        "use_dynamic_16_bit_weights": "d16",
+        "bias_bitwidth": "b",
+    }
+    parts = []
+    for key in sorted(variant):
+        value = variant[key]
+        value = int(value) if isinstance(value, bool) else value
+        parts.append(f"{short.get(key, key)}{value}")
+    return "_".join(parts)
+
+
+def converter_flags(variant):
+    flags = []
+    for key, value in variant.items():
+        if isinstance(value, bool):
+            if value:
+                flags.append(f"--{key}")
+        else:
+            flags.extend([f"--{key}", str(value)])
+    return flags
+
+
+def converter_command(onnx_path, output_cpp, variant, input_list):
+    cmd = [
+        "qnn-onnx-converter",
+        "--input_network", onnx_path,
+        "--output_path", output_cpp,
+        "--input_dim", "pixel_values", "1,3,224,224",
+        "--no_simplification",
+    ]
+    # float_fallback must not be combined with calibration data
+    if input_list and not variant.get("float_fallback"):
+        cmd.extend(["--input_list", input_list])
+    return cmd + converter_flags(variant)
+
+
+def sdk_tool(sdk_root, name):
+    path = os.path.join(sdk_root, "bin", qnn_utils.HOST_ARCH, name)
+    return path if os.path.exists(path) else name
+
+
+def prepare_inputs(image_paths, work_dir):
+    """Write graph-layout raw inputs plus an input list; return (input_list, nchw arrays)."""
+    input_dir = os.path.abspath(os.path.join(work_dir, "inputs"))
+    os.makedirs(input_dir, exist_ok=True)
+    arrays = []
+    lines = []
+    for i, image_path in enumerate(image_paths):
+        nchw = preprocess_array(image_path)
+        arrays.append(nchw)
+        raw_path = os.path.join(input_dir, f"input_{i}.raw")
+        # Calibration and qnn-net-run both consume the converted graph's layout (NHWC)
+        qnn_utils.to_graph_layout(nchw).astype(np.float32).tofile(raw_path)
+        lines.append(f"pixel_values:={raw_path}")
+    input_list = os.path.join(input_dir, "input_list.txt")
+    with open(input_list, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    return input_list, arrays
+
+
+def compute_reference(onnx_path, arrays, work_dir):
+    """
+    Float ONNX Runtime outputs for every evaluation image, cached in work_dir
+    under the digest of the model (+ external data) and of the input arrays.
+    """
+    cache_path = os.path.join(work_dir, "reference.npz")
+    key = hashlib.sha256()
+    for path in (onnx_path, onnx_path + ".data"):
+        if os.path.exists(path):
+            key.update(qnn_utils.file_sha256(path).encode())
+    for nchw in arrays:
+        key.update(np.ascontiguousarray(nchw, dtype=np.float32).tobytes())
+    key = key.hexdigest()
+    if os.path.exists(cache_path):
+        data = np.load(cache_path)
+        if "cache_key" in data.files and str(data["cache_key"]) == key:
+            return [{name: data[f"{name}_{i}"] for name in qnn_utils.OUTPUT_NAMES} for i in range(len(arrays))]
+        print("Cached float reference is for another model or image set; recomputing")
+
+    import onnxruntime as ort
+    print(f"--- Computing float reference with ONNX Runtime ({onnx_path}) ---")
+    session = ort.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+    input_name = session.get_inputs()[0].name
+    output_names = [o.name for o in session.get_outputs()]
+    references = []
+    flat = {}
+    for i, nchw in enumerate(arrays):
+        outs = dict(zip(output_names, session.run(None, {input_name: nchw.astype(np.float32)})))
+        ref = {name: outs[name][0] for name in qnn_utils.OUTPUT_NAMES}
+        references.append(ref)
+        for name, value in ref.items():
+            flat[f"{name}_{i}"] = value
+    np.savez(cache_path, cache_key=np.array(key), **flat)
+    return references
+
+
+def convert_variant(sdk_root, onnx_path, variant_dir, variant, input_list):
+    os.makedirs(variant_dir, exist_ok=True)
+    output_cpp = os.path.join(variant_dir, "dinov3_qnn.cpp")
+    cmd = converter_command(onnx_path, output_cpp, variant, input_list)
+    cmd[0] = sdk_tool(sdk_root, "qnn-onnx-converter")
+    print(f"Running: {' '.join(cmd)}")
+    with open(os.path.join(variant_dir, "converter.log"), "w") as log:
+        ret = subprocess.call(cmd, stdout=log, stderr=subprocess.STDOUT)
+    if ret != 0:
+        print(f"Conversion failed (see {variant_dir}/converter.log)")
+        return None
+    return output_cpp
+
+
+def run_host(sdk_root, variant_dir, input_list, num_images):
+    """
+    Stand-in runner: build an x86 model library and execute it with the HTP
+    emulation backend shipped in the SDK. Latency is emulator time, not device time.
+    """
+    lib_dir = os.path.join(variant_dir, "model_libs")
+    ret = subprocess.call([
+        sys.executable, sdk_tool(sdk_root, "qnn-model-lib-generator"),
+        "-c", os.path.join(variant_dir, "dinov3_qnn.cpp"),
+        "-b", os.path.join(variant_dir, "dinov3_qnn.bin"),
+        "-o", lib_dir,
+        "-t", qnn_utils.HOST_ARCH,
+    ])
+    if ret != 0:
+        print("Model library generation failed.")
+        return None, None
+
+    output_dir = os.path.join(variant_dir, "output")
+    cmd = [
+        sdk_tool(sdk_root, "qnn-net-run"),
+        "--backend", os.path.join(sdk_root, "lib", qnn_utils.HOST_ARCH, "libQnnHtp.so"),
+        "--model", os.path.join(lib_dir, qnn_utils.HOST_ARCH, "libdinov3_qnn.so"),
+        "--input_list", input_list,
+        "--output_dir", output_dir,
+        "--profiling_level", "basic",
+    ]
+    env = os.environ.copy()
+    env["LD_LIBRARY_PATH"] = os.path.join(sdk_root, "lib", qnn_utils.HOST_ARCH) + ":" + env.get("LD_LIBRARY_PATH", "")
+    proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        print(f"qnn-net-run failed:\n{proc.stderr}")
+        return None, None
+    outputs = [qnn_utils.read_raw_outputs(os.path.join(output_dir, f"Result_{i}")) for i in range(num_images)]
+    return outputs, qnn_utils.parse_inference_time_ms(proc.stdout + "\n" + proc.stderr)
+
+
+def run_device(device, variant_dir, tag, input_list, num_images):
+    """
+    Device runner: upload the variant's cpp/bin, build it on the device next to
+    the deployment from deploy.py (reusing its compiled QnnModel objects) and
+    run it on the HTP.
+    """
+    from inference import connect_device, run_command
+
+    base_dir = device["base_dir"]
+    ssh = connect_device(device)
+    if not ssh:
+        return None, None
+    sftp = ssh.open_sftp()
+    remote_dir = f"{base_dir}/sweep/{tag}"
+    run_command(ssh, f"mkdir -p {remote_dir}/inputs", print_output=False)
+    try:
+        sftp.put(os.path.join(variant_dir, "dinov3_qnn.cpp"), f"{remote_dir}/dinov3_qnn.cpp")
+        sftp.put(os.path.join(variant_dir, "dinov3_qnn.bin"), f"{remote_dir}/dinov3_qnn.bin")
+
+        remote_lines = []
+        with open(input_list) as f:
+            for i, line in enumerate(l for l in f.read().splitlines() if l):
+                local_raw = line.split(":=", 1)[1]
+                remote_raw = f"{remote_dir}/inputs/input_{i}.raw"
+                sftp.put(local_raw, remote_raw)
+                remote_lines.append(f"pixel_values:={remote_raw}")
+        with sftp.open(f"{remote_dir}/input_list.txt", "w") as f:
+            f.write("\n".join(remote_lines) + "\n")
+
+        includes = f"-I{base_dir}/include -I{base_dir}/include/QNN -I{base_dir}/jni"
+        build = (
+            f"cd {remote_dir} && rm -rf obj && mkdir -p obj/binary && "
+            f"tar -xf dinov3_qnn.bin -C obj/binary && "
+            f"find obj/binary -name '*.raw' | while read f; do ld -r -b binary -o \"$f.o\" \"$f\"; done && "
+            f"find obj/binary -name '*.raw.o' > weights_objs.txt && "
+            f"g++ -c -fPIC dinov3_qnn.cpp {includes} && "
+            f"g++ -shared -fPIC -o libdinov3.so dinov3_qnn.o {base_dir}/QnnModel.o "
+            f"{base_dir}/QnnWrapperUtils.o {base_dir}/QnnModelPal.o @weights_objs.txt"
+        )
+        exit_code, _, err = run_command(ssh, build, print_output=False)
+        if exit_code != 0:
+            print(f"On-device build failed: {err}")
+            return None, None
+
+        net_run = qnn_utils.net_run_invocation(base_dir, f"{remote_dir}/libdinov3.so", f"{remote_dir}/input_list.txt",
+                                               f"{remote_dir}/output", profiling_level="basic")
+        cmd = " && ".join([f"cd {base_dir}"] + qnn_utils.htp_env_exports(base_dir) + [net_run])
+        exit_code, out, err = run_command(ssh, cmd, print_output=False)
+        if exit_code != 0:
+            print(f"qnn-net-run failed on device: {err}")
+            return None, None
+
+        local_output = os.path.join(variant_dir, "output")
+        outputs = []
+        for i in range(num_images):
+            result_dir = os.path.join(local_output, f"Result_{i}")
+            os.makedirs(result_dir, exist_ok=True)
+            for name in qnn_utils.OUTPUT_NAMES:
+                sftp.get(f"{remote_dir}/output/Result_{i}/{name}.raw", os.path.join(result_dir, f"{name}.raw"))
+            outputs.append(qnn_utils.read_raw_outputs(result_dir))
+        return outputs, qnn_utils.parse_inference_time_ms(out + "\n" + err)
+    finally:
+        run_command(ssh, f"rm -rf {remote_dir}", print_output=False)
+        sftp.close()
+        ssh.close()
+
+
+def summarize(references, outputs, n_patches):
+    per_image = [qnn_utils.output_fidelity(ref, out, n_patches) for ref, out in zip(references, outputs)]
+    return {
+        "pooler_cos_min": min(m["pooler_cos"] for m in per_image),
+        "pooler_cos_mean": float(np.mean([m["pooler_cos"] for m in per_image])),
+        "cls_cos_mean": float(np.mean([m["cls_cos"] for m in per_image])),
+        "patch_cos_mean": float(np.mean([m["patch_cos_mean"] for m in per_image])),
+        "patch_rel_l2_mean": float(np.mean([m["patch_rel_l2_mean"] for m in per_image])),
+        "patch_max_abs_err": max(m["patch_max_abs_err"] for m in per_image),
+    }
+
+
+def cost_axis(results):
+    """latency_ms when any variant was timed, otherwise the weight blob size (bin_mb) as a proxy."""
+    return "latency_ms" if any(r.get("latency_ms") is not None for r in results) else "bin_mb"
+
+
+def ranked(results):
+    """(cost axis, variants that have a value on it); the rest are never compared across units."""
+    axis = cost_axis(results)
+    return axis, [r for r in results if r.get(axis) is not None]
+
+
+def pareto_front(results):
+    """Variants not dominated on (lower cost, higher worst-case pooler cosine)."""
+    axis, candidates = ranked(results)
+    front = []
+    for r in candidates:
+        dominated = False
+        for o in candidates:
+            if o is r:
+                continue
+            better_or_equal = o[axis] <= r[axis] and o["pooler_cos_min"] >= r["pooler_cos_min"]
+            strictly_better = o[axis] < r[axis] or o["pooler_cos_min"] > r["pooler_cos_min"]
+            if better_or_equal and strictly_better:
+                dominated = True
+                break
+        if not dominated:
+            front.append(r)
+    return sorted(front, key=lambda r: r[axis])
+
+
+def recommend(results, accuracy_floor, patch_floor):
+    axis, candidates = ranked(results)
+    eligible = [r for r in candidates
+                if r["pooler_cos_min"] >= accuracy_floor and r["patch_cos_mean"] >= patch_floor]
+    if not eligible:
+        return None
+    return min(eligible, key=lambda r: (r[axis], -r["pooler_cos_min"]))
+
+
+def format_table(results, front):
+    front_tags = {r["tag"] for r in front}
+    axis = cost_axis(results)
+
+    def fmt(value):
+        return "n/a" if value is None else f"{value:.2f}"
+
+    lines = [
+        "| Variant | Latency (ms) | Weights (MB) | Pooler cos (min) | CLS cos | Patch cos | Patch rel-L2 | Pareto |",
+        "| :--- | ---: | ---: | ---: | ---: | ---: | ---: | :---: |",
+    ]
+    for r in sorted(results, key=lambda r: (r.get(axis) is None, r.get(axis) or 0.0)):
+        lines.append(
+            f"| {r['tag']} | {fmt(r.get('latency_ms'))} | {fmt(r.get('bin_mb'))} | {r['pooler_cos_min']:.5f} | "
+            f"{r['cls_cos_mean']:.5f} | {r['patch_cos_mean']:.5f} | {r['patch_rel_l2_mean']:.4f} | "
+            f"{'*' if r['tag'] in front_tags else ''} |"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep qnn-onnx-converter options and report the latency/accuracy Pareto front")
+    parser.add_argument("--model-variant", default="dinov3-vitb16", help="Model variant folder name in onnx_download")
+    parser.add_argument("--model-name", default="dinov3", help="Base name of the model files (default: dinov3)")
+    parser.add_argument("--images", nargs="+", default=["test/test_image.jpg"], help="Evaluation images (also used for calibration)")
+    parser.add_argument("--calib-images", nargs="+", default=None, help="Calibration images (default: --images)")
+    parser.add_argument("--grid", nargs="*", help="Override grid entries, e.g. weights_bitwidth=8,4 act_bitwidth=8,16")
+    parser.add_argument("--runner", choices=["host", "device"], default="host",
+                        help="host: x86 HTP emulation (stand-in), device: build and run on the IQ-9075")
+    parser.add_argument("--work-dir", default=DEFAULT_WORK_DIR, help="Directory for converted variants and reports")
+    parser.add_argument("--accuracy-floor", type=float, default=0.99, help="Minimum worst-case pooler_output cosine similarity")
+    parser.add_argument("--patch-floor", type=float, default=0.0, help="Minimum mean patch-token cosine similarity")
+    parser.add_argument("--keep", action="store_true", help="Keep converted variant directories")
+    args = parser.parse_args()
+    device = devices.select_device() if args.runner == "device" else None
+
+    onnx_path = os.path.abspath(os.path.join(DIR_ONNX_BASE, args.model_variant, f"{args.model_name}.onnx"))
+    if not os.path.exists(onnx_path):
+        print(f"Error: {onnx_path} not found.")
+        return
+
+    sdk_root = qnn_utils.find_qnn_sdk_root()
+    if not sdk_root:
+        print("Error: QNN SDK not found. Set QNN_SDK_ROOT.")
+        return
+
+    os.makedirs(args.work_dir, exist_ok=True)
+    grid = parse_grid(args.grid)
+    recorded = qnn_utils.load_converter_options()
+    variants = expand_grid(grid, recorded)
+    print(f"Sweeping {len(variants)} converter variants over {list(grid)}")
+    print(f"Recorded options in {qnn_utils.NET_JSON_PATH}: " +
+          ", ".join(f"{k}={recorded.get(k)}" for k in grid))
+
+    eval_list, eval_arrays = prepare_inputs(args.images, os.path.join(args.work_dir, "eval"))
+    if args.calib_images:
+        calib_list, _ = prepare_inputs(args.calib_images, os.path.join(args.work_dir, "calib"))
+    else:
+        calib_list = eval_list
+    references = compute_reference(onnx_path, eval_arrays, args.work_dir)
+    side = eval_arrays[0].shape[-1] // qnn_utils.PATCH_SIZE
+    n_patches = side * side
+
+    results = []
+    for variant in variants:
+        tag = variant_tag(variant)
+        variant_dir = os.path.join(args.work_dir, tag)
+        print(f"\n--- Variant {tag} ---")
+        t0 = time.time()
+        if not convert_variant(sdk_root, onnx_path, variant_dir, variant, calib_list):
+            continue
+        convert_s = time.time() - t0
+
+        if args.runner == "device":
+            outputs, latency_ms = run_device(device, variant_dir, tag, eval_list, len(eval_arrays))
+        else:
+            outputs, latency_ms = run_host(sdk_root, variant_dir, eval_list, len(eval_arrays))
+        if outputs is None:
+            continue
+
+        bin_path = os.path.join(variant_dir, "dinov3_qnn.bin")
+        result = {
+            "tag": tag,
+            "options": variant,
+            "latency_ms": latency_ms,
+            "latency_source": "device HTP" if args.runner == "device" else "x86 HTP emulation",
+            "bin_mb": os.path.getsize(bin_path) / 1024 / 1024 if os.path.exists(bin_path) else None,
+            "convert_s": convert_s,
+        }
+        result.update(summarize(references, outputs, n_patches))
+        results.append(result)
+        print(f"pooler cos (min) {result['pooler_cos_min']:.5f}, patch cos {result['patch_cos_mean']:.5f}, "
+              f"latency {latency_ms if latency_ms is not None else 'n/a'} ms")
+
+        if not args.keep:
+            shutil.rmtree(variant_dir, ignore_errors=True)
+
+    if not results:
+        print("No variant completed.")
+        return
+
+    front = pareto_front(results)
+    table = format_table(results, front)
+    best = recommend(results, args.accuracy_floor, args.patch_floor)
+
+    report = ["# Converter Sweep Report", "",
+              f"- Model: `{onnx_path}`",
+              f"- Runner: {results[0]['latency_source']}",
+              f"- Accuracy floor: pooler cos >= {args.accuracy_floor}, patch cos >= {args.patch_floor}", "",
+              table, ""]
+    axis, candidates = ranked(results)
+    unranked = [r["tag"] for r in results if r not in candidates]
+    if unranked:
+        report += [f"Not ranked (no {axis}): {', '.join(unranked)}", ""]
+    if best:
+        cmd = converter_command(onnx_path, f"{args.model_name}_qnn.cpp", best["options"], "input_list.txt")
+        report += ["## Recommended", "", f"Variant `{best['tag']}`:", "", "```bash", " ".join(cmd), "```", "",
+                   "Or with convert_on_host.sh:", "", "```bash",
+                   f"QNN_CONVERTER_EXTRA_ARGS=\"{' '.join(converter_flags(best['options']))}\" ./convert_on_host.sh {args.model_variant}",
+                   "```"]
+    else:
+        report += ["## Recommended", "", "No variant meets the accuracy floor."]
+    report_text = "\n".join(report) + "\n"
+
+    print("\n" + report_text)
+    with open(os.path.join(args.work_dir, "sweep_report.md"), "w") as f:
+        f.write(report_text)
+    with open(os.path.join(args.work_dir, "sweep_results.json"), "w") as f:
+        json.dump({"results": results, "pareto": [r["tag"] for r in front],
+                   "recommended": best["tag"] if best else None}, f, indent=2)
+    print(f"Report saved to {os.path.join(args.work_dir, 'sweep_report.md')}")
+
+
+if __name__ == "__main__":
+    main()
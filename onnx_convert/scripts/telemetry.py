@@ -0,0 +1,308 @@
+import argparse
+import json
+import os
+import random
+import re
+import shlex
+import time
+
+import numpy as np
+
+import devices
+
+# Host side of the device telemetry sampler (device_telemetry.py).
+# Starts the sampler on the device in the background (nohup + pidfile), stops
+# it with SIGTERM (it dumps its ring buffer as JSONL), downloads and parses
+# the dump, and lines it up with inference events. Events are timestamped on
+# the device with `date +%s.%N` markers around the command (event_wrap), i.e.
+# on the same clock as the samples, so no host/device clock offset enters the
+# alignment.
+#
+# fake_root writes a fake /proc + /sys tree so the sampler can be exercised
+# on any host; with --animate it keeps the counters moving and simulates a
+# board that heats up under load and drops its clocks past a trip point.
+#
+# Usage (from onnx_convert/):
+#   python3 scripts/telemetry.py record --duration 30 --output telemetry.jsonl    # sample the device for 30 s
+#   python3 scripts/telemetry.py summary inference_results/telemetry.jsonl
+#   python3 scripts/telemetry.py fake_root /tmp/fakesys --animate 60 &
+#   python3 scripts/device_telemetry.py --root /tmp/fakesys --duration 10 --output /tmp/t.jsonl
+
+EVENT_MARKER = "@@EVENT"
+EVENT_RE = re.compile(EVENT_MARKER + r" (\S+) (start|end) ([0-9.]+)")
+REMOTE_TELEMETRY_SCRIPT = "scripts/device_telemetry.py"
+REMOTE_TELEMETRY_OUTPUT = "/tmp/dinov3_telemetry.jsonl"
+REMOTE_TELEMETRY_PIDFILE = "/tmp/dinov3_telemetry.pid"
+
+
+# --- device control ------------------------------------------------------------
+
+def _run(ssh, command):
+    stdin, stdout, stderr = ssh.exec_command(command)
+    status = stdout.channel.recv_exit_status()
+    return status, stdout.read().decode().strip(), stderr.read().decode().strip()
+
+
+def start_command(base_dir, interval=0.1, output=REMOTE_TELEMETRY_OUTPUT, pidfile=REMOTE_TELEMETRY_PIDFILE,
+                  extra=(), root="/"):
+    args = [f"{base_dir}/{REMOTE_TELEMETRY_SCRIPT}", "--interval", str(interval), "--output", output,
+            "--pidfile", pidfile, "--root", root] + [f"--extra={item}" for item in extra]
+    return f"rm -f {output} {pidfile}; nohup python3 {' '.join(shlex.quote(a) for a in args)} > /dev/null 2>&1 &"
+
+
+def stop_command(pidfile=REMOTE_TELEMETRY_PIDFILE, timeout=10):
+    # Wait for the process to exit so the dump is complete before it is fetched
+    return (f"pid=$(cat {pidfile} 2>/dev/null) && kill -TERM $pid && "
+            f"for i in $(seq {int(timeout * 20)}); do kill -0 $pid 2>/dev/null || exit 0; sleep 0.05; done; exit 1")
+
+
+def start(ssh, base_dir, interval=0.1, extra=(), output=REMOTE_TELEMETRY_OUTPUT, pidfile=REMOTE_TELEMETRY_PIDFILE):
+    """Start the sampler in the background; returns once its pidfile exists."""
+    _run(ssh, start_command(base_dir, interval, output, pidfile, extra))
+    status, _, _ = _run(ssh, f"for i in $(seq 100); do test -s {pidfile} && exit 0; sleep 0.05; done; exit 1")
+    if status != 0:
+        raise RuntimeError(f"Telemetry sampler did not start (is {REMOTE_TELEMETRY_SCRIPT} deployed? run deploy.py)")
+
+
+def stop(ssh, sftp, local_path, output=REMOTE_TELEMETRY_OUTPUT, pidfile=REMOTE_TELEMETRY_PIDFILE):
+    """Stop the sampler, download its dump to local_path and parse it."""
+    status, _, err = _run(ssh, stop_command(pidfile))
+    if status != 0:
+        raise RuntimeError(f"Telemetry sampler did not stop cleanly: {err}")
+    sftp.get(output, local_path)
+    return Telemetry.load(local_path)
+
+
+def event_wrap(name, command):
+    """Shell snippet running `command` between device-clock start/end markers for `name`."""
+    return (f"echo \"{EVENT_MARKER} {name} start $(date +%s.%N)\" && {command} && "
+            f"echo \"{EVENT_MARKER} {name} end $(date +%s.%N)\"")
+
+
+def parse_events(text):
+    """[(name, start, end)] from event_wrap markers in command output (device wall clock)."""
+    starts, events = {}, []
+    # Markers may follow output that did not end with a newline
+    for name, edge, stamp in EVENT_RE.findall(text):
+        if edge == "start":
+            starts[name] = float(stamp)
+        elif name in starts:
+            events.append((name, starts.pop(name), float(stamp)))
+    return events
+
+
+def strip_events(text):
+    """Command output without the markers (lines holding only a marker are dropped)."""
+    lines = []
+    for line in text.splitlines():
+        stripped = EVENT_RE.sub("", line)
+        if stripped.strip() or not EVENT_RE.search(line):
+            lines.append(stripped)
+    return "\n".join(lines)
+
+
+# --- parsing / alignment -------------------------------------------------------
+
+class Telemetry:
+    """Parsed sampler dump: header + time-ordered samples."""
+
+    def __init__(self, header, samples):
+        self.header = header
+        self.samples = samples
+        self.t = np.array([s["t"] for s in samples], dtype=np.float64)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        if not lines or lines[0].get("type") != "header":
+            raise ValueError(f"{path} is not a device_telemetry.py dump")
+        return cls(lines[0], lines[1:])
+
+    def channels(self):
+        """['cpu', 'mem_used_mb', 'temp_c/<zone>', 'cpu_mhz/<cpu>', ...] present in the samples."""
+        names = []
+        for s in self.samples[:1]:
+            for key, value in s.items():
+                if isinstance(value, dict):
+                    names += [f"{key}/{k}" for k in value]
+                elif key not in ("t", "cpus"):
+                    names.append(key)
+        return names
+
+    def series(self, channel):
+        """(times, values) of one channel; NaN where a sample lacks it."""
+        key, _, sub = channel.partition("/")
+        values = []
+        for s in self.samples:
+            v = s.get(key)
+            v = v.get(sub) if sub and isinstance(v, dict) else v
+            values.append(np.nan if v is None else v)
+        return self.t, np.array(values, dtype=np.float64)
+
+    def window(self, t0, t1, margin=0.0):
+        """{channel: (min, mean, max)} over samples in [t0 - margin, t1 + margin]."""
+        mask = (self.t >= t0 - margin) & (self.t <= t1 + margin)
+        stats = {"samples": int(mask.sum())}
+        if not mask.any():
+            return stats
+        for channel in self.channels():
+            v = self.series(channel)[1][mask]
+            v = v[~np.isnan(v)]
+            if len(v):
+                stats[channel] = (float(v.min()), float(v.mean()), float(v.max()))
+        return stats
+
+    def align(self, events, margin=None):
+        """[(name, start, end, window stats)] for device-clock events; margin defaults to one interval."""
+        margin = self.header.get("interval", 0.1) if margin is None else margin
+        return [(name, t0, t1, self.window(t0, t1, margin)) for name, t0, t1 in events]
+
+
+def print_window(title, stats):
+    print(f"--- Telemetry: {title} ({stats['samples']} samples) ---")
+    for channel, value in stats.items():
+        if channel == "samples":
+            continue
+        lo, mean, hi = value
+        print(f"  {channel:<28} min {lo:>8.1f}  mean {mean:>8.1f}  max {hi:>8.1f}")
+
+
+def print_summary(telemetry, events=()):
+    header = telemetry.header
+    span = telemetry.t[-1] - telemetry.t[0] if len(telemetry.t) > 1 else 0.0
+    print(f"[TELEMETRY] {len(telemetry.samples)} samples over {span:.1f} s every {header['interval']} s; "
+          f"sampler cost {header['sampler_cpu_pct']:.2f}% of one core ({header['sample_cost_ms']:.3f} ms/sample)")
+    if len(telemetry.t):
+        print_window("whole run", telemetry.window(telemetry.t[0], telemetry.t[-1]))
+    for name, t0, t1, stats in telemetry.align(events):
+        print_window(f"{name} ({(t1 - t0) * 1000:.1f} ms)", stats)
+
+
+# --- fake sysfs tree -----------------------------------------------------------
+
+FAKE_ZONES = ("cpu-0-0", "cpu-1-0", "gpu", "nsp0", "ddr")
+FAKE_CPU_KHZ = 2361600
+FAKE_THROTTLED_KHZ = 1190400
+FAKE_CDSP_HZ = 1420000000
+FAKE_TRIP_C = 85.0
+FAKE_HYSTERESIS_C = 10.0
+
+
+def _write(path, text):
+    # In place, like sysfs: the sampler keeps its file descriptors open
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(text)
+
+
+class FakeRoot:
+    """A fake /proc + /sys tree with the nodes device_telemetry.py reads."""
+
+    def __init__(self, root, cpus=8):
+        self.root = root
+        self.cpus = cpus
+        self.jiffies = np.zeros((cpus, 8), dtype=np.int64)
+        self.temp = 45.0
+        self.load = 0.3
+        self.throttled = False
+        self.write()
+
+    @property
+    def clock_ratio(self):
+        """Current / maximum clock (latency scales with its inverse)."""
+        return FAKE_THROTTLED_KHZ / FAKE_CPU_KHZ if self.throttled else 1.0
+
+    def write(self):
+        throttled = self.throttled
+        total = self.jiffies.sum(axis=0)
+        lines = ["cpu  " + " ".join(map(str, total))] + [f"cpu{i} " + " ".join(map(str, row))
+                                                         for i, row in enumerate(self.jiffies)]
+        _write(os.path.join(self.root, "proc/stat"), "\n".join(lines + ["intr 0", "ctxt 0"]) + "\n")
+        _write(os.path.join(self.root, "proc/meminfo"),
+               f"MemTotal:       16000000 kB\nMemFree:         9000000 kB\n"
+               f"MemAvailable:   {int(12000000 - 2000000 * self.load)} kB\n")
+        for i, zone in enumerate(FAKE_ZONES):
+            base = f"sys/class/thermal/thermal_zone{i}"
+            _write(os.path.join(self.root, base, "type"), zone + "\n")
+            _write(os.path.join(self.root, base, "temp"), f"{int((self.temp - 2 * i) * 1000)}\n")
+        for i in range(self.cpus):
+            khz = FAKE_THROTTLED_KHZ if throttled else FAKE_CPU_KHZ
+            _write(os.path.join(self.root, f"sys/devices/system/cpu/cpu{i}/cpufreq/scaling_cur_freq"), f"{khz}\n")
+        cdsp = FAKE_CDSP_HZ // 2 if throttled else FAKE_CDSP_HZ
+        _write(os.path.join(self.root, "sys/class/devfreq/cdsp-cpufreq/cur_freq"), f"{cdsp}\n")
+        _write(os.path.join(self.root, "sys/class/remoteproc/remoteproc0/name"), "cdsp\n")
+        _write(os.path.join(self.root, "sys/class/remoteproc/remoteproc0/state"), "running\n")
+
+    def step(self, dt, load):
+        """Advance the counters by dt seconds at `load` (0..1); heat follows load x clock."""
+        self.load = load
+        ticks = int(100 * dt)  # USER_HZ
+        busy = np.array([int(ticks * min(1.0, max(0.0, load + random.uniform(-0.1, 0.1))))
+                         for _ in range(self.cpus)])
+        self.jiffies[:, 0] += busy
+        self.jiffies[:, 3] += ticks - busy
+        # First-order thermal model: settles at 40 + 60 * load * clock ratio degrees C;
+        # clocks drop at the trip point and recover FAKE_HYSTERESIS_C below it
+        self.temp += (40 + 60 * load * self.clock_ratio - self.temp) * min(1.0, dt / 30.0)
+        if self.temp >= FAKE_TRIP_C:
+            self.throttled = True
+        elif self.temp < FAKE_TRIP_C - FAKE_HYSTERESIS_C:
+            self.throttled = False
+        self.write()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Device telemetry: record, summarize, fake sysfs tree")
+    sub = parser.add_subparsers(dest="command", required=True)
+    record = sub.add_parser("record", help="Sample the device for a while and download the dump")
+    record.add_argument("--duration", type=float, default=30, help="Seconds to sample")
+    record.add_argument("--interval", type=float, default=0.1, help="Seconds between samples")
+    record.add_argument("--extra", action="append", default=[], metavar="NAME=PATH", help="Extra sysfs node")
+    record.add_argument("--output", default="telemetry.jsonl", help="Local JSONL path")
+    summary = sub.add_parser("summary", help="Summarize a telemetry dump")
+    summary.add_argument("path")
+    summary.add_argument("--events", help="Command output containing event markers to align")
+    fake = sub.add_parser("fake_root", help="Write a fake /proc + /sys tree for local testing")
+    fake.add_argument("root")
+    fake.add_argument("--cpus", type=int, default=8)
+    fake.add_argument("--animate", type=float, default=0, help="Keep updating it for this many seconds")
+    fake.add_argument("--load", type=float, default=0.9, help="Simulated load while animating (0..1)")
+    args = parser.parse_args()
+
+    if args.command == "fake_root":
+        fake_root = FakeRoot(args.root, args.cpus)
+        print(f"Fake sysfs tree in {args.root}")
+        t_end = time.time() + args.animate
+        while time.time() < t_end:
+            time.sleep(0.1)
+            fake_root.step(0.1, args.load)
+        return
+
+    if args.command == "summary":
+        events = []
+        if args.events:
+            with open(args.events) as f:
+                events = parse_events(f.read())
+        print_summary(Telemetry.load(args.path), events)
+        return
+
+    # paramiko is slow to import; only pay for it when connecting
+    from inference import connect_device
+    device = devices.select_device()
+    ssh = connect_device(device)
+    if not ssh:
+        return
+    sftp = ssh.open_sftp()
+    start(ssh, device["base_dir"], args.interval, args.extra)
+    print(f"--- Sampling {device['host']} for {args.duration:.0f} s ---")
+    time.sleep(args.duration)
+    telemetry = stop(ssh, sftp, args.output)
+    print(f"Saved {args.output}")
+    print_summary(telemetry)
+    sftp.close()
+    ssh.close()
+
+
+if __name__ == "__main__":
+    main()
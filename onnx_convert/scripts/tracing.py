@@ -0,0 +1,335 @@
+import argparse
+import json
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# Host + device timeline tracing, exported as Chrome trace JSON (open in
+# chrome://tracing or https://ui.perfetto.dev).
+#
+#   host   - nested spans (span()/begin()/end()) on a wall-anchored
+#            perf_counter clock, one track per thread
+#   device - remote commands wrapped with device_command() print
+#            `date +%s.%N` start/end markers (telemetry.event_wrap), and
+#            device-side scripts print the same markers; add_device_events()
+#            moves them onto the host clock with the offset measured by
+#            estimate_clock_offset() (min-RTT over one SSH channel, +-RTT/2)
+#   qnn    - the qnn-net-run log (QnnBackend/Context/Graph_* started/done,
+#            ms since net-run start) becomes children of the qnn-net-run
+#            span; a qnn-profile-viewer text adds the Init/Compose/Finalize/
+#            Execute/De-Init phases and, for detailed profiles, HTP ops laid
+#            out inside the execute phase in proportion to their cycles
+#
+# Tracing is off unless enable(path) is called (--trace on the scripts) or
+# $DINOV3_TRACE_FILE names the output file; disabled calls are no-ops and
+# device commands are left unwrapped. On the device, $DINOV3_TRACE_MARKERS=1
+# makes the E2E_ondevice scripts print their step markers.
+#
+# Usage (from onnx_convert/):
+#   python3 scripts/inference.py test/test_image.jpg --profiling_level detailed --trace inference_trace.json
+#   python3 scripts/deploy.py --trace deploy_trace.json
+#   python3 scripts/tracing.py summary inference_trace.json
+
+TRACE_ENV = "DINOV3_TRACE_FILE"
+DEVICE_MARKERS_ENV = "DINOV3_TRACE_MARKERS"
+HOST_PID = 1
+DEVICE_PID = 2
+QNN_LOG_RE = re.compile(r"^\s*([0-9\.]+)ms .*?\b(Qnn\w+) (started|done)", re.M)
+NETRUN_US_RE = re.compile(r"NetRun:\s*(\d+) us")
+# qnn-profile-viewer section title prefix -> phase
+QNN_PHASES = (("Init", "init"), ("Compose", "compose"), ("Finalize", "finalize"), ("Execute", "execute"),
+              ("De-Init", "deinit"))
+# QNN API prefix -> phase, for log spans
+QNN_API_PHASES = (("QnnGraph_create", "compose"), ("QnnGraph_addNode", "compose"), ("QnnGraph_finalize", "finalize"),
+                  ("QnnGraph_execute", "execute"), ("_free", "deinit"), ("_create", "init"))
+
+
+def qnn_api_phase(api):
+    for key, phase in QNN_API_PHASES:
+        if key in api:
+            return phase
+    return "other"
+
+
+class Tracer:
+    def __init__(self, path=None):
+        self.path = path
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.tids = {}
+        self.device_tids = {}
+        self.clock_offset = None  # device - host, seconds
+        self.clock_uncertainty = None
+        self._wall0 = time.time()
+        self._perf0 = time.perf_counter()
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def now(self):
+        """Host wall clock (s) with perf_counter resolution."""
+        return self._wall0 + time.perf_counter() - self._perf0
+
+    def _host_tid(self):
+        ident = threading.get_ident()
+        if ident not in self.tids:
+            self.tids[ident] = len(self.tids) + 1
+            name = threading.current_thread().name
+            self.events.append({"ph": "M", "name": "thread_name", "pid": HOST_PID, "tid": self.tids[ident],
+                                "args": {"name": name}})
+        return self.tids[ident]
+
+    def _device_tid(self, track):
+        if track not in self.device_tids:
+            self.device_tids[track] = len(self.device_tids) + 1
+            self.events.append({"ph": "M", "name": "thread_name", "pid": DEVICE_PID, "tid": self.device_tids[track],
+                                "args": {"name": track}})
+        return self.device_tids[track]
+
+    def complete(self, name, start, end, cat="host", args=None, pid=HOST_PID, tid=None):
+        """Record a finished span [start, end] (host wall seconds)."""
+        if not self.enabled:
+            return
+        with self.lock:
+            event = {"ph": "X", "name": name, "cat": cat, "pid": pid,
+                     "tid": tid if tid is not None else self._host_tid(),
+                     "ts": round(start * 1e6, 3), "dur": round(max(end - start, 0.0) * 1e6, 3)}
+            if args:
+                event["args"] = args
+            self.events.append(event)
+
+    @contextmanager
+    def span(self, name, cat="host", **args):
+        if not self.enabled:
+            yield
+            return
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.complete(name, start, self.now(), cat, args or None)
+
+    def begin(self, name, cat="host", **args):
+        if self.enabled:
+            self.local.__dict__.setdefault("stack", []).append((name, self.now(), cat, args or None))
+
+    def end(self, **args):
+        stack = self.local.__dict__.get("stack")
+        if self.enabled and stack:
+            name, start, cat, begin_args = stack.pop()
+            self.complete(name, start, self.now(), cat, {**(begin_args or {}), **args} or None)
+
+    def instant(self, name, **args):
+        if self.enabled:
+            with self.lock:
+                self.events.append({"ph": "i", "s": "g", "name": name, "pid": HOST_PID, "tid": self._host_tid(),
+                                    "ts": round(self.now() * 1e6, 3), "args": args})
+
+    # --- device clock ------------------------------------------------------------
+
+    def estimate_clock_offset(self, ssh, rounds=8):
+        """
+        Device - host clock offset from `date` round trips over one open SSH
+        channel; the round with the smallest RTT wins (error <= RTT/2).
+        """
+        if not self.enabled:
+            return None
+        stdin, stdout, _ = ssh.exec_command("while read x; do date +%s.%N; done")
+        best = None
+        for _ in range(rounds):
+            t0 = self.now()
+            stdin.write("x\n")
+            stdin.flush()
+            line = stdout.readline().strip()
+            t1 = self.now()
+            if not line:
+                break
+            sample = (t1 - t0, float(line) - (t0 + t1) / 2)
+            best = min(best, sample) if best else sample
+        stdin.close()
+        if best:
+            rtt, self.clock_offset = best
+            self.clock_uncertainty = rtt / 2
+            self.instant("clock_offset", offset_ms=self.clock_offset * 1000, uncertainty_ms=rtt / 2 * 1000)
+        return self.clock_offset
+
+    def to_host(self, device_seconds):
+        return device_seconds - (self.clock_offset or 0.0)
+
+    def device_command(self, name, command):
+        """`command` between device-clock markers (unchanged when tracing is off)."""
+        if not self.enabled:
+            return command
+        import telemetry
+
+        return telemetry.event_wrap(name, command)
+
+    def device_marker(self, name, edge):
+        """Shell script line printing a start/end marker ('' when tracing is off)."""
+        if not self.enabled:
+            return ""
+        import telemetry
+
+        return f"echo \"{telemetry.EVENT_MARKER} {name} {edge} $(date +%s.%N)\"\n"
+
+    def add_device_events(self, text, track="shell", cat="device"):
+        """Device spans from event markers in command output; returns [(name, host start, host end)]."""
+        spans = []
+        if not self.enabled:
+            return spans
+        import telemetry
+
+        tid = self._device_tid(track)
+        for name, t0, t1 in telemetry.parse_events(text):
+            start, end = self.to_host(t0), self.to_host(t1)
+            self.complete(name, start, end, cat, pid=DEVICE_PID, tid=tid)
+            spans.append((name, start, end))
+        return spans
+
+    # --- QNN ---------------------------------------------------------------------
+
+    def add_qnn_log(self, log_text, anchor, track="shell"):
+        """
+        Children of the anchor span (name, host start, host end) from the
+        net-run log's `<ms>ms ... QnnX started/done` lines (ms since net-run start).
+        """
+        if not self.enabled or anchor is None:
+            return []
+        _, a0, a1 = anchor
+        tid = self._device_tid(track)
+        open_calls, spans = {}, []
+        for ms, api, edge in QNN_LOG_RE.findall(log_text):
+            if edge == "started":
+                open_calls.setdefault(api, []).append(float(ms))
+            elif open_calls.get(api):
+                start = min(a0 + open_calls[api].pop() / 1000, a1)
+                end = min(a0 + float(ms) / 1000, a1)
+                self.complete(api, start, end, "qnn", {"phase": qnn_api_phase(api)}, DEVICE_PID, tid)
+                spans.append((api, start, end))
+        return spans
+
+    def add_qnn_profile(self, viewer_text, anchor, log_spans=()):
+        """
+        qnn-profile-viewer phases (NetRun us per section) laid back to back
+        from the anchor start, on their own track; the execute phase is aligned
+        with the first QnnGraph_execute log span when there is one. Detailed
+        profiles add per-op spans inside execute, proportional to cycles.
+        """
+        if not self.enabled or anchor is None:
+            return
+        import profile_blocks
+
+        headers = list(profile_blocks.SECTION_RE.finditer(viewer_text))
+        phases = []
+        for i, match in enumerate(headers):
+            body = viewer_text[match.end():headers[i + 1].start() if i + 1 < len(headers) else len(viewer_text)]
+            phase = next((p for prefix, p in QNN_PHASES if match.group(1).startswith(prefix)), None)
+            netrun = NETRUN_US_RE.search(body)
+            if phase and netrun and phase not in [p for p, _, _ in phases]:
+                phases.append((phase, match.group(1), int(netrun.group(1)) / 1e6))
+        tid = self._device_tid("qnn profile")
+        cursor = anchor[1]
+        executes = [start for api, start, _ in log_spans if api == "QnnGraph_execute"]
+        for phase, title, seconds in phases:
+            if phase == "execute" and executes:
+                cursor = executes[0]
+            self.complete(phase, cursor, cursor + seconds, "qnn", {"section": title}, DEVICE_PID, tid)
+            if phase == "execute":
+                self._add_ops(viewer_text, cursor, seconds)
+            cursor += seconds
+
+    def _add_ops(self, viewer_text, start, seconds):
+        import profile_blocks
+
+        profile = profile_blocks.parse_viewer_text(viewer_text)
+        total = sum(profile["ops"].values())
+        if not total:
+            return
+        span = (profile["accelerator_us"] / 1e6) if profile["accelerator_us"] else seconds
+        tid = self._device_tid("htp ops (cycle-proportional)")
+        cursor = start
+        for name, cycles in profile["ops"].items():
+            width = span * cycles / total
+            self.complete(name, cursor, cursor + width, "htp", {"cycles": cycles}, DEVICE_PID, tid)
+            cursor += width
+
+    # --- export ------------------------------------------------------------------
+
+    def save(self, path=None):
+        """Write the Chrome trace JSON; open begin() spans are closed first."""
+        path = path or self.path
+        if not self.enabled or not path:
+            return None
+        while self.local.__dict__.get("stack"):
+            self.end(unclosed=True)
+        meta = [{"ph": "M", "name": "process_name", "pid": HOST_PID, "args": {"name": "host"}},
+                {"ph": "M", "name": "process_name", "pid": DEVICE_PID, "args": {"name": "device"}}]
+        other = {"clock_offset_ms": self.clock_offset * 1000 if self.clock_offset is not None else None,
+                 "clock_uncertainty_ms": self.clock_uncertainty * 1000 if self.clock_uncertainty is not None else None}
+        with open(path, "w") as f:
+            json.dump({"traceEvents": meta + self.events, "displayTimeUnit": "ms", "otherData": other}, f)
+        print(f"[TRACE] {sum(e['ph'] == 'X' for e in self.events)} spans -> {path} (chrome://tracing, ui.perfetto.dev)")
+        return path
+
+
+_tracer = Tracer(os.environ.get(TRACE_ENV) or None)
+
+
+def enable(path):
+    """Turn tracing on for this process and write to `path` at save()."""
+    _tracer.path = path
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name, cat="host", **args):
+    return _tracer.span(name, cat, **args)
+
+
+def begin(name, cat="host", **args):
+    _tracer.begin(name, cat, **args)
+
+
+def end(**args):
+    _tracer.end(**args)
+
+
+def save(path=None):
+    return _tracer.save(path)
+
+
+def summarize(path, top=25):
+    """Per-span-name totals of a saved trace, longest first."""
+    with open(path) as f:
+        events = [e for e in json.load(f)["traceEvents"] if e.get("ph") == "X"]
+    totals = {}
+    for e in events:
+        key = ("device" if e["pid"] == DEVICE_PID else "host", e["name"])
+        count, dur = totals.get(key, (0, 0.0))
+        totals[key] = (count + 1, dur + e["dur"] / 1000)
+    if events:
+        wall = (max(e["ts"] + e["dur"] for e in events) - min(e["ts"] for e in events)) / 1000
+        print(f"--- {len(events)} spans over {wall:.1f} ms ---")
+    print(f"{'Where':<7} {'Span':<44} {'Count':>6} {'Total (ms)':>11}")
+    for (where, name), (count, dur) in sorted(totals.items(), key=lambda kv: -kv[1][1])[:top]:
+        print(f"{where:<7} {name[:44]:<44} {count:>6} {dur:>11.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize a Chrome trace written by --trace")
+    sub = parser.add_subparsers(dest="command", required=True)
+    summary = sub.add_parser("summary", help="Per-span totals")
+    summary.add_argument("path")
+    summary.add_argument("--top", type=int, default=25)
+    args = parser.parse_args()
+    summarize(args.path, args.top)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+import argparse
+import io
+import itertools
+import json
+import os
+import statistics
+import time
+
+import numpy as np
+
+from preprocess_input import preprocess_array
+import devices
+import qnn_utils
+
+# HTP backend-config and perf-profile tuner for qnn-net-run.
+# Generates HTP backend extension config variants (graph optimization level,
+# VTCM size, FP16 relaxed precision, HVX threads) x perf profiles, benchmarks
+# each on the device and persists the fastest stable one to
+# assets/htp_tuning.json. inference.py and deploy.py pick it up automatically.
+#
+# Usage (from onnx_convert/, after deploy.py):
+#   python3 scripts/tune_htp_backend.py
+#   python3 scripts/tune_htp_backend.py --grid O=2,3 vtcm_mb=0,4,8 --perf-profiles burst --repeats 5
+#   python3 scripts/tune_htp_backend.py --emit-only tuning_configs   # write the variants, no device
+
+# Graph config options swept by default (None = backend default, key omitted)
+DEFAULT_GRID = {
+    "O": [2, 3],
+    "vtcm_mb": [None, 8],
+    "fp16_relaxed_precision": [1],
+    "hvx_threads": [None, 4],
+}
+DEFAULT_PERF_PROFILES = ["burst", "sustained_high_performance"]
+DEFAULT_HTP_ARCH = "v73"  # QCS9075 Hexagon
+
+
+def parse_grid(specs):
+    grid = dict(DEFAULT_GRID)
+    for spec in specs or []:
+        if "=" not in spec:
+            raise ValueError(f"Grid entry must look like option=v1,v2: {spec}")
+        key, values = spec.split("=", 1)
+        grid[key] = [None if v.lower() in ("none", "default") else int(v) for v in values.split(",")]
+    return grid
+
+
+def expand_variants(grid, perf_profiles):
+    keys = list(grid)
+    variants = []
+    for perf_profile in perf_profiles:
+        for values in itertools.product(*(grid[k] for k in keys)):
+            graph_config = {k: v for k, v in zip(keys, values) if v is not None}
+            variants.append({"perf_profile": perf_profile, "graph_config": graph_config})
+    return variants
+
+
+def variant_tag(variant):
+    parts = [variant["perf_profile"]]
+    for key in sorted(variant["graph_config"]):
+        parts.append(f"{key}{variant['graph_config'][key]}")
+    return "_".join(parts)
+
+
+def emit_variants(variants, out_dir, base_dir, htp_arch):
+    """Write every variant's backend config/extension JSON for manual inspection."""
+    for variant in variants:
+        tag = variant_tag(variant)
+        variant_dir = os.path.join(out_dir, tag)
+        os.makedirs(variant_dir, exist_ok=True)
+        config, extensions = qnn_utils.htp_config_documents(
+            variant["graph_config"], base_dir, f"{base_dir}/tuning/{tag}", htp_arch)
+        with open(os.path.join(variant_dir, qnn_utils.HTP_CONFIG_NAME), "w") as f:
+            json.dump(config, f, indent=2)
+        with open(os.path.join(variant_dir, qnn_utils.HTP_EXTENSIONS_NAME), "w") as f:
+            json.dump(extensions, f, indent=2)
+        with open(os.path.join(variant_dir, "perf_profile.txt"), "w") as f:
+            f.write(variant["perf_profile"] + "\n")
+    print(f"Wrote {len(variants)} variants to {out_dir}")
+
+
+def upload_json(sftp, doc, remote_path):
+    sftp.putfo(io.BytesIO(json.dumps(doc, indent=2).encode()), remote_path)
+
+
+def benchmark_variant(ssh, sftp, variant, remote_input_list, repeats, base_dir, htp_arch):
+    """
+    Run qnn-net-run `repeats` times with the variant's config. Returns
+    (per-repeat avg latencies in ms, pooler_output of the first run or None).
+    """
+    from inference import run_command
+
+    run_args = {}
+    if variant is not None:
+        tag = variant_tag(variant)
+        remote_dir = f"{base_dir}/tuning/{tag}"
+        run_command(ssh, f"mkdir -p {remote_dir}", print_output=False)
+        config, extensions = qnn_utils.htp_config_documents(variant["graph_config"], base_dir, remote_dir, htp_arch)
+        upload_json(sftp, config, f"{remote_dir}/{qnn_utils.HTP_CONFIG_NAME}")
+        upload_json(sftp, extensions, f"{remote_dir}/{qnn_utils.HTP_EXTENSIONS_NAME}")
+        run_args = {"backend_config": f"{remote_dir}/{qnn_utils.HTP_EXTENSIONS_NAME}",
+                    "perf_profile": variant["perf_profile"]}
+
+    output_dir = f"{base_dir}/tuning/output"
+    net_run = qnn_utils.net_run_invocation(base_dir, f"{base_dir}/bin/libdinov3.so", remote_input_list,
+                                           output_dir, profiling_level="basic", **run_args)
+    cmd = " && ".join([f"cd {base_dir}"] + qnn_utils.htp_env_exports(base_dir) + [net_run])
+
+    latencies = []
+    pooler = None
+    for i in range(repeats):
+        exit_code, out, err = run_command(ssh, cmd, print_output=False)
+        if exit_code != 0:
+            print(f"  repeat {i}: qnn-net-run failed ({err.splitlines()[-1] if err else exit_code})")
+            return None, None
+        latency = qnn_utils.parse_inference_time_ms(out + "\n" + err)
+        if latency is None:
+            print(f"  repeat {i}: could not parse inference time")
+            return None, None
+        latencies.append(latency)
+        if pooler is None:
+            with sftp.open(f"{output_dir}/Result_0/pooler_output.raw", "rb") as f:
+                pooler = np.frombuffer(f.read(), dtype=np.float32).copy()
+    return latencies, pooler
+
+
+def score(latencies, pooler, reference_pooler, max_cv, min_cos):
+    median = statistics.median(latencies)
+    cv = statistics.pstdev(latencies) / statistics.mean(latencies) if len(latencies) > 1 else 0.0
+    cos = float(qnn_utils.cosine_similarity(pooler, reference_pooler)) if reference_pooler is not None else 1.0
+    return {
+        "median_ms": median,
+        "min_ms": min(latencies),
+        "cv": cv,
+        "pooler_cos_vs_default": cos,
+        "stable": cv <= max_cv and cos >= min_cos,
+    }
+
+
+def tune(args, ssh, sftp, variants, base_dir):
+    """Benchmark the baseline and every variant, then persist and deploy the fastest stable one."""
+    from inference import run_command
+
+    # Benchmark input: one image repeated num_inferences times in the input list
+    run_command(ssh, f"mkdir -p {base_dir}/tuning", print_output=False)
+    remote_raw = f"{base_dir}/tuning/input.raw"
+    remote_input_list = f"{base_dir}/tuning/input_list.txt"
+    raw = qnn_utils.to_graph_layout(preprocess_array(args.image)).astype(np.float32)
+    sftp.putfo(io.BytesIO(raw.tobytes()), remote_raw)
+    sftp.putfo(io.BytesIO((f"pixel_values:={remote_raw}\n" * args.num_inferences).encode()), remote_input_list)
+
+    print("--- Baseline (no backend config, default perf profile) ---")
+    base_latencies, reference_pooler = benchmark_variant(ssh, sftp, None, remote_input_list, args.repeats,
+                                                         base_dir, args.htp_arch)
+    if base_latencies is None:
+        print("Baseline run failed. Is the model deployed (deploy.py)?")
+        return
+    baseline = score(base_latencies, reference_pooler, None, args.max_cv, args.min_cos)
+    print(f"  median {baseline['median_ms']:.2f} ms, cv {baseline['cv']:.3f}")
+
+    results = []
+    for i, variant in enumerate(variants):
+        tag = variant_tag(variant)
+        print(f"--- [{i + 1}/{len(variants)}] {tag} ---")
+        latencies, pooler = benchmark_variant(ssh, sftp, variant, remote_input_list, args.repeats,
+                                              base_dir, args.htp_arch)
+        if latencies is None:
+            results.append({"tag": tag, **variant, "stable": False, "failed": True})
+            continue
+        result = {"tag": tag, **variant, **score(latencies, pooler, reference_pooler, args.max_cv, args.min_cos)}
+        results.append(result)
+        print(f"  median {result['median_ms']:.2f} ms, cv {result['cv']:.3f}, "
+              f"cos {result['pooler_cos_vs_default']:.5f}{'' if result['stable'] else ' (unstable)'}")
+
+    print("\n--- Results ---")
+    print(f"{'Variant':<60} {'Median (ms)':>12} {'CV':>7} {'Stable':>7}")
+    print(f"{'(default)':<60} {baseline['median_ms']:>12.2f} {baseline['cv']:>7.3f} {'-':>7}")
+    for r in sorted(results, key=lambda r: r.get("median_ms", float("inf"))):
+        if r.get("failed"):
+            print(f"{r['tag']:<60} {'failed':>12}")
+            continue
+        print(f"{r['tag']:<60} {r['median_ms']:>12.2f} {r['cv']:>7.3f} {'yes' if r['stable'] else 'no':>7}")
+
+    stable = [r for r in results if r.get("stable")]
+    if not stable:
+        print("No stable configuration found; keeping defaults.")
+        run_command(ssh, f"rm -rf {base_dir}/tuning", print_output=False)
+        return
+    best = min(stable, key=lambda r: r["median_ms"])
+    if best["median_ms"] >= baseline["median_ms"]:
+        print(f"Best stable variant ({best['median_ms']:.2f} ms) is not faster than the default "
+              f"({baseline['median_ms']:.2f} ms); keeping defaults.")
+        run_command(ssh, f"rm -rf {base_dir}/tuning", print_output=False)
+        return
+
+    tuning = {
+        "perf_profile": best["perf_profile"],
+        "graph_config": best["graph_config"],
+        "htp_arch": args.htp_arch,
+        "median_ms": best["median_ms"],
+        "baseline_median_ms": baseline["median_ms"],
+        "tuned_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(tuning, f, indent=2)
+    print(f"\nSelected {best['tag']}: {best['median_ms']:.2f} ms "
+          f"({baseline['median_ms'] / best['median_ms']:.2f}x vs default). Saved to {args.output}")
+
+    # Persist alongside the deployed model so later runs use it
+    config, extensions = qnn_utils.htp_config_documents(best["graph_config"], base_dir,
+                                                        f"{base_dir}/assets", args.htp_arch)
+    upload_json(sftp, config, f"{base_dir}/assets/{qnn_utils.HTP_CONFIG_NAME}")
+    upload_json(sftp, extensions, f"{base_dir}/assets/{qnn_utils.HTP_EXTENSIONS_NAME}")
+    sftp.put(args.output, f"{base_dir}/assets/htp_tuning.json")
+    run_command(ssh, f"rm -rf {base_dir}/tuning", print_output=False)
+    print(f"Deployed tuned config to {base_dir}/assets/")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tune HTP backend config and perf profile for qnn-net-run")
+    parser.add_argument("--image", default="test/test_image.jpg", help="Benchmark input image")
+    parser.add_argument("--grid", nargs="*", help="Override graph config grid, e.g. O=2,3 vtcm_mb=none,8 hvx_threads=none,4")
+    parser.add_argument("--perf-profiles", nargs="+", default=DEFAULT_PERF_PROFILES,
+                        help="qnn-net-run --perf_profile values to try")
+    parser.add_argument("--htp-arch", default=DEFAULT_HTP_ARCH, help="HTP architecture written to the device config")
+    parser.add_argument("--num-inferences", type=int, default=20, help="Inferences per qnn-net-run invocation")
+    parser.add_argument("--repeats", type=int, default=3, help="qnn-net-run invocations per variant")
+    parser.add_argument("--max-cv", type=float, default=0.10, help="Max coefficient of variation across repeats to count as stable")
+    parser.add_argument("--min-cos", type=float, default=0.999, help="Min pooler_output cosine vs. default config to count as stable")
+    parser.add_argument("--output", default=qnn_utils.HTP_TUNING_PATH, help="Where to persist the chosen configuration")
+    parser.add_argument("--emit-only", metavar="DIR", help="Only write the config variants to DIR")
+    args = parser.parse_args()
+
+    device = devices.select_device()
+    base_dir = device["base_dir"]
+
+    variants = expand_variants(parse_grid(args.grid), args.perf_profiles)
+    if args.emit_only:
+        emit_variants(variants, args.emit_only, base_dir, args.htp_arch)
+        return
+
+    from inference import connect_device
+
+    print(f"--- Connecting to {device['host']} ---")
+    ssh = connect_device(device)
+    if not ssh:
+        return
+    sftp = ssh.open_sftp()
+
+    try:
+        tune(args, ssh, sftp, variants, base_dir)
+    finally:
+        sftp.close()
+        ssh.close()
+
+
+if __name__ == "__main__":
+    main()
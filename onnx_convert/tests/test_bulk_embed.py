@@ -0,0 +1,22 @@
+import json
+import sys
+
+import bulk_embed
+
+
+def test_status_leaves_the_journal_untouched(tmp_path, monkeypatch, capsys):
+    job_dir = tmp_path / "job"
+    job_dir.mkdir()
+    images = [f"img{i}.jpg" for i in range(4)]
+    (job_dir / bulk_embed.JOB_FILE).write_text(json.dumps({"num_images": 4, "chunk_size": 2, "backend": "fake",
+                                                           "outputs": ["pooler_output"]}))
+    (job_dir / bulk_embed.IMAGES_FILE).write_text("\n".join(images) + "\n")
+    entry = {"chunk": 0, "rows": 0, "skipped": ["img0.jpg", "img1.jpg"], "elapsed_s": 1.0, "time": 0.0}
+    # The last line is still being written by a running job
+    journal = (json.dumps(entry) + "\n" + '{"chunk": 1, "ro').encode()
+    (job_dir / bulk_embed.JOURNAL_FILE).write_bytes(journal)
+
+    monkeypatch.setattr(sys, "argv", ["bulk_embed.py", "--job_dir", str(job_dir), "--status"])
+    bulk_embed.main()
+    assert "2/4 images, 1/2 chunks committed" in capsys.readouterr().out
+    assert (job_dir / bulk_embed.JOURNAL_FILE).read_bytes() == journal
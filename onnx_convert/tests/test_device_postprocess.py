@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+import device_postprocess
+
+PREFIX_TOKENS = 5
+GRID_HW = (14, 14)
+
+
+def hidden_state():
+    return np.random.RandomState(0).rand(PREFIX_TOKENS + GRID_HW[0] * GRID_HW[1], 8).astype(np.float32)
+
+
+def test_grid_pool_is_finite_up_to_the_patch_grid():
+    pooled = device_postprocess.reduce_output("grid14", hidden_state(), PREFIX_TOKENS, GRID_HW)
+    assert pooled.shape == (14, 14, 8) and np.isfinite(pooled).all()
+
+
+@pytest.mark.parametrize("name", ["grid0", "grid20"])
+def test_grid_size_outside_the_patch_grid_is_rejected(name):
+    with pytest.raises(ValueError, match="1 <= N <= 14"):
+        device_postprocess.reduce_output(name, hidden_state(), PREFIX_TOKENS, GRID_HW)
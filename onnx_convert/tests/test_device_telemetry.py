@@ -0,0 +1,37 @@
+import random
+
+import pytest
+
+import device_telemetry
+import telemetry
+
+SAMPLES = 20
+
+
+def test_sampler_reads_a_fake_board(tmp_path):
+    random.seed(0)
+    root = str(tmp_path / "sys")
+    board = telemetry.FakeRoot(root, cpus=4)
+    (tmp_path / "sys" / "cdsp_load").write_text("37\n")
+    sampler = device_telemetry.Sampler(root, extra=[("cdsp_load", "cdsp_load")])
+    assert len(sampler.thermal) == len(telemetry.FAKE_ZONES)
+
+    for _ in range(SAMPLES):
+        board.step(1.0, 0.5)
+        sample = sampler.sample()
+
+    zones = {name.split(":")[0]: temp for name, temp in sample["temp_c"].items()}
+    assert zones["cpu-0-0"] == pytest.approx(board.temp, abs=0.1)
+    assert zones["gpu"] == pytest.approx(board.temp - 4, abs=0.1)
+    assert sample["cpu_mhz"] == {f"cpu{i}": round(telemetry.FAKE_CPU_KHZ / 1000) for i in range(4)}
+    assert sample["devfreq_mhz"] == {"cdsp-cpufreq": telemetry.FAKE_CDSP_HZ / 1e6}
+    assert sample["rproc"] == {"cdsp": device_telemetry.REMOTEPROC_STATES["running"]}
+    assert sample["extra"] == {"cdsp_load": 37.0}
+    # Load 0.5 +- 0.1 per CPU, from the jiffies delta since the previous sample
+    assert len(sample["cpus"]) == 4
+    assert all(35.0 <= load <= 65.0 for load in sample["cpus"])
+    assert 35.0 <= sample["cpu"] <= 65.0
+
+    # The header's promise: ~0.1 ms per sample, well under 1% of a core at 10 Hz
+    cost_ms = 1000.0 * sampler.cpu_seconds / SAMPLES
+    assert cost_ms < 1.0
@@ -0,0 +1,23 @@
+import importlib
+import json
+
+import pytest
+
+import devices
+
+
+def test_select_device_unknown_name_lists_known(tmp_path, monkeypatch):
+    inventory = tmp_path / "devices.json"
+    inventory.write_text(json.dumps([{"name": "evk-a"}, {"name": "evk-b"}]))
+    monkeypatch.setenv(devices.INVENTORY_ENV, str(inventory))
+    monkeypatch.setenv(devices.DEVICE_ENV, "evk-c")
+    with pytest.raises(SystemExit) as e:
+        devices.select_device()
+    assert "evk-a, evk-b" in str(e.value)
+
+
+def test_scripts_import_with_unknown_device(monkeypatch):
+    # The device is resolved in main(), so --help and library imports work
+    monkeypatch.setenv(devices.DEVICE_ENV, "no-such-board")
+    for name in ("inference", "deploy", "stream_inference"):
+        importlib.reload(importlib.import_module(name))
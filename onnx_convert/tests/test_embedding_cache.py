@@ -0,0 +1,28 @@
+import numpy as np
+
+import embedding_cache
+
+
+def stored_bytes(cache):
+    return cache.db.execute("SELECT COALESCE(SUM(nbytes), 0) FROM embeddings").fetchone()[0]
+
+
+def test_running_size_tracks_puts_replacements_and_evictions(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    entry = {"pooler_output": np.ones(1024, dtype=np.float32)}  # 2 KB as fp16
+    cache = embedding_cache.EmbeddingCache(path, max_mb=20 / 1024)
+    for i in range(8):
+        cache.put(f"img{i}", "build", entry)
+    cache.put("img7", "build", entry)  # replacing an entry does not grow the store
+    assert cache.evictions == 0
+    assert cache._total_bytes() == stored_bytes(cache) == 8 * 2048
+    for i in range(8, 16):
+        cache.put(f"img{i}", "build", entry)
+    assert cache.evictions > 0
+    assert cache._total_bytes() == stored_bytes(cache) <= cache.max_bytes
+    cache.close()
+
+    # Reopening with a lower bound evicts against the persisted total
+    cache = embedding_cache.EmbeddingCache(path, max_mb=8 / 1024)
+    assert cache._total_bytes() == stored_bytes(cache) <= cache.max_bytes
+    cache.close()
@@ -0,0 +1,44 @@
+import json
+import threading
+import urllib.error
+import urllib.request
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import backends
+import embedding_server
+
+
+@pytest.fixture
+def server(tmp_path):
+    root = tmp_path / "images"
+    root.mkdir()
+    Image.fromarray(np.zeros((32, 32, 3), dtype=np.uint8)).save(root / "ok.jpg")
+    (tmp_path / "secret.txt").write_text("not for clients")
+    batcher = embedding_server.MicroBatcher(backends.FakeBackend().open()).start()
+    handler = embedding_server.make_handler(batcher, 224, 10.0, image_root=str(root))
+    httpd = embedding_server.BatchingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}/embed", tmp_path
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def post_path(url, image_path):
+    request = urllib.request.Request(url, json.dumps({"image_path": image_path}).encode(),
+                                     {"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def test_image_path_is_confined_to_image_root(server):
+    url, tmp_path = server
+    assert post_path(url, "ok.jpg") == 200
+    assert post_path(url, "../secret.txt") == 403
+    assert post_path(url, str(tmp_path / "secret.txt")) == 403
+    assert post_path(url, str(tmp_path / "missing.txt")) == 403
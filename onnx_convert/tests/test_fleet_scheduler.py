@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+from PIL import Image
+
+import fleet_scheduler
+
+INVENTORY = [{"name": "local-a", "kind": "local", "simulate_ms_per_image": 1},
+             {"name": "local-b", "kind": "local", "simulate_ms_per_image": 2}]
+
+
+def write_images(tmp_path, n, bad=()):
+    paths = []
+    for i in range(n):
+        path = str(tmp_path / f"{i:02d}.jpg")
+        if i in bad:
+            with open(path, "wb") as f:
+                f.write(b"not a jpeg")
+        else:
+            Image.fromarray(np.full((32, 32, 3), i, dtype=np.uint8)).save(path)
+        paths.append(path)
+    return paths
+
+
+def test_unreadable_image_is_skipped_not_blamed_on_boards(tmp_path):
+    paths = write_images(tmp_path, 12, bad={5})
+    scheduler = fleet_scheduler.FleetScheduler(INVENTORY, shard_size=2)
+    emitted = []
+    merged = scheduler.run(paths, on_result=lambda i, outputs: emitted.append(i))
+    assert len(merged) == 11
+    assert emitted == [i for i in range(12) if i != 5]
+    assert scheduler.skipped == [paths[5]]
+    assert all(w.alive and not w.failures for w in scheduler.workers)
+
+
+def test_worker_crash_fails_the_job_instead_of_hanging(tmp_path, monkeypatch):
+    paths = write_images(tmp_path, 8)
+    scheduler = fleet_scheduler.FleetScheduler(INVENTORY, shard_size=2)
+
+    def crash(self, pixel_values):
+        raise ValueError("bug")
+
+    monkeypatch.setattr(fleet_scheduler.DeviceWorker, "run", crash)
+    with pytest.raises(RuntimeError, match="crashed"):
+        scheduler.run(paths)
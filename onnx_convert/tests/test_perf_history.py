@@ -0,0 +1,61 @@
+import json
+import sys
+
+import perf_history
+
+DEVICE = "board"
+BACKEND_CONFIG = {"backend": "htp", "tuning": None}
+JITTER = (0.0, 0.1, -0.1, 0.05, -0.05)
+
+
+def record_build(db, onnx_path, inference_ms):
+    """What deploy.py then a few inference.py runs record for one model."""
+    for jitter in JITTER[:3]:
+        ms = inference_ms + jitter
+        perf_history.record_run("deploy", {"inference_ms": ms, "throughput_fps": 1000.0 / ms}, BACKEND_CONFIG,
+                                {"profiling_level": "basic"}, "dinov3-test", onnx_path, deployed=True, path=db,
+                                device=DEVICE)
+    for jitter in JITTER:
+        ms = inference_ms + 2 * jitter
+        run_config = {"profiling_level": "basic", "device_preprocess": False, "encoding": "fp32"}
+        perf_history.record_run("inference", {"inference_ms": ms, "throughput_fps": 1000.0 / ms, "total_ms": ms + 50},
+                                BACKEND_CONFIG, run_config, path=db, device=DEVICE)
+
+
+def compare(monkeypatch, tmp_path, db, *extra):
+    out = tmp_path / "compare.json"
+    monkeypatch.setattr(sys, "argv", ["perf_history.py", "--db", db, "compare", "--json", str(out), *extra])
+    perf_history.main()
+    with open(out) as f:
+        return json.load(f)
+
+
+def test_slower_build_is_flagged_for_both_sources(monkeypatch, tmp_path):
+    db = str(tmp_path / "history.sqlite")
+    onnx_a, onnx_b = tmp_path / "a.onnx", tmp_path / "b.onnx"
+    onnx_a.write_bytes(b"model a")
+    onnx_b.write_bytes(b"model b")
+    record_build(db, str(onnx_a), 10.0)
+    record_build(db, str(onnx_b), 12.0)
+
+    history = perf_history.PerfHistory(db)
+    builds = history.builds(device=DEVICE)
+    history.close()
+    assert len(builds) == 2  # deploy and inference runs of one model share its build
+
+    # Default: previous vs latest build, over the candidate's latest tool (inference)
+    result = compare(monkeypatch, tmp_path, db)
+    assert result["source"] == "inference"
+    verdicts = {row["metric"]: row["verdict"] for row in result["metrics"]}
+    assert verdicts["inference_ms"] == verdicts["throughput_fps"] == "REGRESSION"
+
+    result = compare(monkeypatch, tmp_path, db, "--source", "deploy")
+    verdicts = {row["metric"]: row["verdict"] for row in result["metrics"]}
+    assert verdicts["inference_ms"] == verdicts["throughput_fps"] == "REGRESSION"
+
+
+def test_zero_baseline_is_not_comparable():
+    row = perf_history.compare_metric("host_overhead_ms", [0.0] * 5, [5.0, 5.1, 4.9, 5.0, 5.2])
+    assert row["verdict"] == "not comparable"
+    row = perf_history.compare_metric("host_overhead_ms", [0.0] * 5, [0.0] * 5)
+    assert row["change_pct"] == 0.0 and row["verdict"] == "no change"
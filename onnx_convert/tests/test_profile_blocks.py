@@ -0,0 +1,28 @@
+import profile_blocks
+
+VIEWER_TEXT = """Execute Stats (Average):
+------------------------
+Total Inference Time:
+---------------------
+    NetRun: 1500 us
+    Backend (RPC (execute) time): 1200 us
+    Backend (QNN Accelerator (execute) time): 1100 us
+    Backend (Accelerator (execute) time): 1000 us
+    Backend (layer_0_attn_q:OpId_3 (cycles)): 700
+    Backend (layer_0_mlp_fc1:OpId_9 (cycles)): 300
+"""
+
+
+def test_accelerator_time_ignores_qnn_accelerator_line():
+    parsed = profile_blocks.parse_viewer_text(VIEWER_TEXT)
+    assert parsed["accelerator_us"] == 1000.0
+
+
+def test_accelerator_time_plain_label():
+    parsed = profile_blocks.parse_viewer_text("QNN Accelerator (execute) time: 1100 us\nAccelerator (execute) time: 900 us\n")
+    assert parsed["accelerator_us"] == 900.0
+
+
+def test_op_cycles():
+    parsed = profile_blocks.parse_viewer_text(VIEWER_TEXT)
+    assert parsed["ops"] == {"layer_0_attn_q": 700, "layer_0_mlp_fc1": 300}
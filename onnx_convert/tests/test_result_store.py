@@ -0,0 +1,28 @@
+import numpy as np
+import pytest
+
+import result_store
+
+
+def fill(store, start, stop):
+    for i in range(start, stop):
+        store.append([f"img{i}"], {"pooler_output": np.full((1, 4), i)})
+    store.flush()
+
+
+def test_lookup_uses_the_persisted_index_until_a_shard_is_sealed(tmp_path):
+    path = str(tmp_path / "results.store")
+    store = result_store.ResultStore(path, shard_rows=3)
+    fill(store, 0, 10)
+    store.write_index()
+
+    reader = result_store.ResultStore(path)
+    assert reader.get("img7")[0] == 7
+    assert reader._ids is None  # answered from the index, not a scan of every ids.txt
+    with pytest.raises(KeyError, match="'missing' not in store"):
+        reader.row_of("missing")
+
+    fill(store, 10, 12)  # the index no longer covers every row
+    reader = result_store.ResultStore(path)
+    assert "index_rows" not in reader.manifest
+    assert reader.row_of("img11") == 11 and reader.row_of("img2") == 2
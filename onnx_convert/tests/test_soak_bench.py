@@ -0,0 +1,46 @@
+import numpy as np
+
+import soak_bench
+import telemetry
+
+STEP_S = 0.5
+WINDOW_S = 5.0
+MARGIN_C = 3.0
+
+
+def run_board(board, seconds, rate=None, t=0.0):
+    """Drive a fake board in simulated time: (samples (t, temp), completion times, latencies ms)."""
+    samples, times, latencies = [], [], []
+    owed = 0.0
+    for _ in range(int(seconds / STEP_S)):
+        latency = soak_bench.FAKE_LATENCY_MS / board.clock_ratio
+        max_fps = 1000 / latency
+        fps = max_fps if rate is None else min(rate, max_fps)
+        board.step(STEP_S, fps / max_fps)
+        owed += fps * STEP_S
+        n = int(owed)
+        owed -= n
+        times += [t + STEP_S * (i + 1) / n for i in range(n)]
+        latencies += [latency] * n
+        t += STEP_S
+        samples.append((t, board.temp))
+    return samples, times, latencies
+
+
+def test_suggested_rate_stays_below_trip(tmp_path):
+    board = telemetry.FakeRoot(str(tmp_path / "soak"))
+    idle, _, _ = run_board(board, soak_bench.DEFAULT_IDLE_SECONDS, rate=0)
+    load_start = idle[-1][0]
+    loaded, times, latencies = run_board(board, 200, t=load_start)
+    t, temp = np.array(idle + loaded).T
+    rows = soak_bench.window_table(np.array(times), np.array(latencies), load_start, t[-1], WINDOW_S, (t, temp))
+    idle_c = soak_bench.idle_temperature((t, temp), load_start)
+    summary = soak_bench.analyze(rows, soak_bench.DEFAULT_BURST_SECONDS, 10.0, 3, MARGIN_C, idle_c)
+    assert summary["time_to_throttle_s"] is not None
+    assert "thermal_fit" in summary
+
+    board = telemetry.FakeRoot(str(tmp_path / "limited"))
+    limited, _, _ = run_board(board, 600, rate=summary["suggested_rate"])
+    assert not board.throttled
+    # The suggestion promises --margin_c of headroom below the trip point
+    assert max(temp for _, temp in limited) < telemetry.FAKE_TRIP_C - MARGIN_C
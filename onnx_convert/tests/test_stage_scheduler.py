@@ -0,0 +1,16 @@
+import pytest
+
+import stage_scheduler
+
+
+def test_non_runtime_error_in_a_stage_fails_the_run(tmp_path, monkeypatch):
+    manifest = {"stages": [{"name": "stage0"}, {"name": "stage1"}]}
+
+    def run_stage(manifest, k, c, chunk_lines, work_dir):
+        if k == 1:
+            raise OSError("disk full")
+
+    monkeypatch.setattr(stage_scheduler, "run_stage", run_stage)
+    with pytest.raises(RuntimeError, match="stage1 failed on chunk 0: OSError"):
+        stage_scheduler.run_pipeline(manifest, ["a", "b", "c", "d"], str(tmp_path / "out"), str(tmp_path / "work"),
+                                     chunk_size=2, max_concurrent=2)
@@ -64,8 +64,10 @@ def main(image_path, model_path, patch_size=16, input_size=224, output_path="pat
         end_time = time.time()
         print(f"Inference time: {end_time - start_time:.4f} seconds")
         patch_features = features_dict["x_norm_patchtokens"]
-        num_patches = patch_features.shape[1]
-        H = W = int(num_patches ** 0.5)
+        # Patch tokens are row-major over the input grid (not necessarily square)
+        H, W = tensor_image.shape[2] // patch_size, tensor_image.shape[3] // patch_size
+        if H * W != patch_features.shape[1]:
+            raise ValueError(f"{patch_features.shape[1]} patch tokens for a {H}x{W} grid")
         target_patch_coord = (H // 2, W // 2)
         heatmap = compute_patch_similarity_heatmap(patch_features, H, W, target_patch_coord)
         plot_similarity_heatmap(heatmap, target_patch_coord, save_path=output_path)
@@ -0,0 +1,265 @@
+import argparse
+import json
+import os
+
+# Export DINOv3 as K pipeline stages split at transformer block boundaries.
+# Models whose weights do not fit one HTP graph (e.g. the 7B variant) are
+# partitioned so that every stage stays under a memory budget; each stage is
+# exported to its own ONNX file and described in stages.json, which drives
+# native_qnn/convert_stages.sh and scripts/deploy_stages.py.
+#
+# Usage:
+#   python3 export_dinov3_stages.py --config dinov3_vit7b_pth/config.json --plan_only
+#   python3 export_dinov3_stages.py --model_id dinov3_vit7b_pth --output_dir dinov3-vitb7b16/stages --memory_budget_mb 1024
+
+HIDDEN_INPUT_NAME = "hidden_states_in"
+HIDDEN_OUTPUT_NAME = "hidden_states_out"
+FINAL_OUTPUT_NAMES = ["last_hidden_state", "pooler_output"]
+MANIFEST_NAME = "stages.json"
+
+
+def get_args():
+    parser = argparse.ArgumentParser(description="Export DINOv3 as memory-bounded pipeline stages")
+    parser.add_argument("--model_id", type=str, default="dinov3_vit7b_pth", help="Hugging Face model ID or local checkpoint dir")
+    parser.add_argument("--config", type=str, default=None, help="config.json to plan from (default: <model_id>/config.json)")
+    parser.add_argument("--output_dir", type=str, default="dinov3-vitb7b16/stages", help="Where stage ONNX files and stages.json go")
+    parser.add_argument("--memory_budget_mb", type=float, default=1024, help="Per-stage budget (weights + activations)")
+    parser.add_argument("--num_stages", type=int, default=None, help="Exactly K stages (balanced); must still fit the budget")
+    parser.add_argument("--weight_bits", type=int, default=8, help="Weight bitwidth after conversion (8 = default quantized flow)")
+    parser.add_argument("--image_size", type=int, default=None, help="Input resolution (default: config image_size)")
+    parser.add_argument("--plan_only", action="store_true", help="Print the partition without loading the model")
+    parser.add_argument("--auth_token", type=str, default=None, help="Hugging Face authentication token")
+    return parser.parse_args()
+
+
+def num_tokens(config, image_size):
+    patches = (image_size // config["patch_size"]) ** 2
+    return 1 + config.get("num_register_tokens", 0) + patches
+
+
+def layer_params(config):
+    """Parameter count of one transformer block."""
+    h = config["hidden_size"]
+    i = config["intermediate_size"]
+    attn = 4 * h * h
+    attn += h * (int(config.get("query_bias", True)) + int(config.get("key_bias", True))
+                 + int(config.get("value_bias", True)) + int(config.get("proj_bias", True)))
+    if config.get("use_gated_mlp"):
+        mlp = 3 * h * i + (2 * i + h if config.get("mlp_bias", True) else 0)
+    else:
+        mlp = 2 * h * i + (i + h if config.get("mlp_bias", True) else 0)
+    norms_and_scales = 2 * 2 * h + 2 * h
+    return attn + mlp + norms_and_scales
+
+
+def embedding_params(config):
+    h = config["hidden_size"]
+    p = config["patch_size"]
+    conv = config.get("num_channels", 3) * p * p * h + h
+    return conv + h * (2 + config.get("num_register_tokens", 0))  # cls + mask + registers
+
+
+def activation_bytes(config, tokens):
+    """Peak live activations of one block at fp32 (residual, MLP hidden, attention scores)."""
+    h = config["hidden_size"]
+    i = config["intermediate_size"]
+    mlp_width = 2 * i if config.get("use_gated_mlp") else i
+    scores = config["num_attention_heads"] * tokens * tokens
+    return 4 * tokens * (3 * h + mlp_width) + 4 * scores
+
+
+def stage_cost_mb(config, tokens, weight_bits, start, end, first, last):
+    params = layer_params(config) * (end - start)
+    if first:
+        params += embedding_params(config)
+    if last:
+        params += 2 * config["hidden_size"]
+    weights = params * weight_bits / 8
+    return weights / 1024 / 1024, activation_bytes(config, tokens) / 1024 / 1024
+
+
+def partition(config, tokens, budget_mb, weight_bits, num_stages=None):
+    """
+    Split the blocks into contiguous stages. Greedy under the budget by
+    default; with num_stages, binary-search the smallest per-stage cap that
+    yields at most K stages so the stages come out balanced, then split the
+    costliest stage until there are exactly K.
+    """
+    num_layers = config["num_hidden_layers"]
+
+    def cost(start, end):
+        w, a = stage_cost_mb(config, tokens, weight_bits, start, end, start == 0, end == num_layers)
+        return w + a
+
+    def greedy(cap):
+        bounds = []
+        start = 0
+        while start < num_layers:
+            end = start + 1
+            if cost(start, end) > cap:
+                return None
+            while end < num_layers and cost(start, end + 1) <= cap:
+                end += 1
+            bounds.append((start, end))
+            start = end
+        return bounds
+
+    bounds = greedy(budget_mb)
+    if bounds is None:
+        raise ValueError(f"A single block does not fit in {budget_mb} MB; raise --memory_budget_mb or lower --weight_bits")
+    if num_stages:
+        if num_stages > num_layers:
+            raise ValueError(f"Cannot split {num_layers} blocks into {num_stages} stages")
+        if len(bounds) > num_stages:
+            raise ValueError(f"{num_stages} stages cannot fit in {budget_mb} MB (need at least {len(bounds)})")
+        lo, hi = 0.0, budget_mb
+        for _ in range(40):
+            mid = (lo + hi) / 2
+            candidate = greedy(mid)
+            if candidate is not None and len(candidate) <= num_stages:
+                hi, bounds = mid, candidate
+            else:
+                lo = mid
+        # The smallest cap may be reached with fewer stages; splitting only lowers stage costs
+        while len(bounds) < num_stages:
+            k = max((k for k, (start, end) in enumerate(bounds) if end - start > 1), key=lambda k: cost(*bounds[k]))
+            start, end = bounds[k]
+            split = min(range(start + 1, end), key=lambda m: max(cost(start, m), cost(m, end)))
+            bounds[k:k + 1] = [(start, split), (split, end)]
+    return bounds
+
+
+def build_manifest(config, bounds, tokens, args, image_size):
+    hidden_dims = [1, tokens, config["hidden_size"]]
+    stages = []
+    for k, (start, end) in enumerate(bounds):
+        first, last = k == 0, k == len(bounds) - 1
+        weight_mb, act_mb = stage_cost_mb(config, tokens, args.weight_bits, start, end, first, last)
+        stages.append({
+            "index": k,
+            "name": f"dinov3_stage{k}",
+            "onnx": f"dinov3_stage{k}.onnx",
+            "layers": [start, end],
+            "include_embeddings": first,
+            "include_final_norm": last,
+            "input": {"name": "pixel_values", "dims": [1, 3, image_size, image_size]} if first
+                     else {"name": HIDDEN_INPUT_NAME, "dims": hidden_dims},
+            "outputs": [{"name": n, "dims": hidden_dims if n == "last_hidden_state" else [1, config["hidden_size"]]}
+                        for n in FINAL_OUTPUT_NAMES] if last
+                       else [{"name": HIDDEN_OUTPUT_NAME, "dims": hidden_dims}],
+            "weight_mb": round(weight_mb, 1),
+            "activation_mb": round(act_mb, 1),
+        })
+    return {
+        "model_id": args.model_id,
+        "num_hidden_layers": config["num_hidden_layers"],
+        "hidden_size": config["hidden_size"],
+        "tokens": tokens,
+        "image_size": image_size,
+        "memory_budget_mb": args.memory_budget_mb,
+        "weight_bits": args.weight_bits,
+        "stages": stages,
+    }
+
+
+def print_plan(manifest):
+    print(f"Partition: {len(manifest['stages'])} stages, budget {manifest['memory_budget_mb']} MB, "
+          f"{manifest['weight_bits']}-bit weights, {manifest['tokens']} tokens")
+    for s in manifest["stages"]:
+        extras = [x for x, on in (("embeddings", s["include_embeddings"]), ("final norm", s["include_final_norm"])) if on]
+        print(f"  {s['name']}: blocks {s['layers'][0]}-{s['layers'][1] - 1}"
+              f"{' + ' + ', '.join(extras) if extras else ''}  weights {s['weight_mb']} MB, activations {s['activation_mb']} MB")
+
+
+def export_stages(manifest, output_dir, auth_token=None):
+    import torch
+    from transformers import AutoModel
+
+    token = auth_token if auth_token else os.environ.get("HF_TOKEN", "")
+    if token:
+        from huggingface_hub import login
+        print("Logging in to Hugging Face...")
+        login(token=token)
+
+    print(f"Loading model: {manifest['model_id']}")
+    model = AutoModel.from_pretrained(manifest["model_id"], device_map="cpu", trust_remote_code=True, low_cpu_mem_usage=True)
+    model.eval()
+    image_size = manifest["image_size"]
+
+    class Stage(torch.nn.Module):
+        def __init__(self, stage):
+            super().__init__()
+            self.first = stage["include_embeddings"]
+            self.last = stage["include_final_norm"]
+            self.layers = model.layer[stage["layers"][0]:stage["layers"][1]]
+            self.embeddings = model.embeddings if self.first else None
+            self.norm = model.norm if self.last else None
+            self.rope_embeddings = model.rope_embeddings
+            # RoPE tables only depend on the input resolution, so later stages
+            # derive them from a constant probe (folded away at export)
+            self.register_buffer("rope_probe", torch.zeros(1, 3, image_size, image_size), persistent=False)
+
+        def forward(self, x):
+            if self.first:
+                hidden = self.embeddings(x.to(self.embeddings.patch_embeddings.weight.dtype))
+                position_embeddings = self.rope_embeddings(x)
+            else:
+                hidden = x
+                position_embeddings = self.rope_embeddings(self.rope_probe)
+            for layer in self.layers:
+                hidden = layer(hidden, position_embeddings=position_embeddings)
+                if isinstance(hidden, tuple):
+                    hidden = hidden[0]
+            if self.last:
+                sequence_output = self.norm(hidden)
+                return sequence_output, sequence_output[:, 0, :]
+            return hidden
+
+    os.makedirs(output_dir, exist_ok=True)
+    for stage in manifest["stages"]:
+        output_file = os.path.join(output_dir, stage["onnx"])
+        print(f"Exporting {stage['name']} (blocks {stage['layers'][0]}-{stage['layers'][1] - 1}) to {output_file}")
+        dummy_input = torch.randn(*stage["input"]["dims"])
+        with torch.no_grad():
+            torch.onnx.export(
+                Stage(stage),
+                (dummy_input,),
+                output_file,
+                input_names=[stage["input"]["name"]],
+                output_names=[o["name"] for o in stage["outputs"]],
+                opset_version=17,
+                do_constant_folding=True,
+            )
+    print("Export complete.")
+
+
+def main():
+    args = get_args()
+    config_path = args.config or os.path.join(args.model_id, "config.json")
+    if not os.path.exists(config_path):
+        print(f"Error: {config_path} not found (pass --config).")
+        return
+    with open(config_path) as f:
+        config = json.load(f)
+
+    image_size = args.image_size or config.get("image_size", 224)
+    tokens = num_tokens(config, image_size)
+    try:
+        bounds = partition(config, tokens, args.memory_budget_mb, args.weight_bits, args.num_stages)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return
+
+    manifest = build_manifest(config, bounds, tokens, args, image_size)
+    print_plan(manifest)
+    if args.plan_only:
+        return
+
+    export_stages(manifest, args.output_dir, args.auth_token)
+    with open(os.path.join(args.output_dir, MANIFEST_NAME), "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Saved stage manifest to {os.path.join(args.output_dir, MANIFEST_NAME)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,29 @@
-import onnxruntime as ort
-import numpy as np
+import os
 import sys
 
+# Shared inference backends live in onnx_convert/scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../onnx_convert/scripts"))
+import backends
+
 def inspect_model(model_path):
     print(f"Inspecting {model_path}...")
     try:
-        session = ort.InferenceSession(model_path)
+        # Reuses the cached optimized model, so repeated inspections start fast
+        info = backends.create_backend("ort", model_path=model_path).describe()
     except Exception as e:
         print(f"Failed to load model: {e}")
         return
 
     print("Inputs:")
-    for i in session.get_inputs():
-        print(f"  Name: {i.name}, Shape: {i.shape}, Type: {i.type}")
+    for name, shape, dtype in info["inputs"]:
+        print(f"  Name: {name}, Shape: {shape}, Type: {dtype}")
 
     print("Outputs:")
-    for o in session.get_outputs():
-        print(f"  Name: {o.name}, Shape: {o.shape}, Type: {o.type}")
+    for name, shape, dtype in info["outputs"]:
+        print(f"  Name: {name}, Shape: {shape}, Type: {dtype}")
     print("-" * 20)
 
-model_paths = [
+model_paths = sys.argv[1:] or [
     "/home/hyeokjun/IQ-9075 Evaluation Kit (EVK)/onnx_download/dinov3-vitb16/dinov3.onnx",
     "/home/hyeokjun/IQ-9075 Evaluation Kit (EVK)/onnx_download/dinov3-vitb7b16/dinov3.onnx"
 ]
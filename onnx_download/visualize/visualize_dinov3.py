@@ -1,10 +1,15 @@
 import argparse
-import onnxruntime as ort
 import numpy as np
 from PIL import Image
 from sklearn.decomposition import PCA
 import matplotlib.pyplot as plt
 import os
+import sys
+
+# Shared inference backends (ort / htp / fake / auto) live in onnx_convert/scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../onnx_convert/scripts"))
+import backends
+from patch_store import TokenLayout
 
 def preprocess_image(image_path, size=224):
     img = Image.open(image_path).convert('RGB')
@@ -21,64 +26,38 @@ def preprocess_image(image_path, size=224):
     img_data = np.expand_dims(img_data, axis=0) # Add batch dimension
     return img_data, img, original_size
 
-def visualize_tokens(model_path, image_path, output_path, patch_size=14): # Default patch size usually 14 for DINOv2 but let's check
-    # Note: DINOv3-vitb16 likely has patch size 16. The name says 'vitb16'.
-    if 'vitb16' in model_path:
-        patch_size = 16
-    elif 'vitl14' in model_path:
-        patch_size = 14
-    
-    print(f"Loading model: {model_path}")
-    session = ort.InferenceSession(model_path)
+def visualize_tokens(model_path, image_path, output_path, backend_name="ort", config_path=None):
+    print(f"Loading model: {model_path} (backend: {backend_name})")
+    backend = backends.create_backend(backend_name, model_path=model_path)
     
     # Get input size from model if possible, else default 224
-    input_shape = session.get_inputs()[0].shape
-    h, w = 224, 224
-    if len(input_shape) == 4:
-        if isinstance(input_shape[2], int): h = input_shape[2]
-        if isinstance(input_shape[3], int): w = input_shape[3]
+    h, w = backend.input_size()
     
-    print(f"Using input size: {h}x{w} (Patch size assumption: {patch_size})")
+    # Token layout (registers, patch size) from the model's config.json
+    layout = TokenLayout.load(config_path or os.path.join(os.path.dirname(model_path), "config.json"), (h, w))
+    patch_size = layout.patch_size
+    print(f"Using input size: {h}x{w} (patch {patch_size}, {layout.num_register_tokens} register tokens)")
 
     input_data, pil_img, original_size = preprocess_image(image_path, size=h)
     
-    input_name = session.get_inputs()[0].name
     # Run inference
     # We expect 'last_hidden_state' or similar. 
     # Let's check outputs
-    output_names = [o.name for o in session.get_outputs()]
-    print(f"Model outputs: {output_names}")
-    
-    outputs = session.run(None, {input_name: input_data})
+    outputs = backend.infer(input_data)
+    print(f"Model outputs: {list(outputs)}")
     
-    # Assuming the first output is the sequence of tokens
-    last_hidden_state = outputs[0] 
+    last_hidden_state = outputs["last_hidden_state"]
     print(f"Output shape: {last_hidden_state.shape}")
     
     # Shape: (Batch, Sequence, Dim)
-    # Sequence = 1 (CLS) + n_patches + registers (maybe)
-    # For 224x224 and patch 16: 14x14 = 196 patches.
-    # Total tokens = 197 usually.
-    
+    # Sequence = 1 (CLS) + num_register_tokens + grid_h * grid_w patches (row-major)
     tokens = last_hidden_state[0] # remove batch dim -> (Seq, Dim)
-    
-    # Heuristic to find patch tokens
-    n_patches = (h // patch_size) * (w // patch_size)
-    print(f"Expected patches: {n_patches}")
-    
-    if tokens.shape[0] == n_patches:
-        patch_tokens = tokens
-    elif tokens.shape[0] > n_patches:
-        # Assuming CLS token is first and registers are after or before. 
-        # Usually CLS is at 0.
-        # DINOv2 registers are usually at the end? Or after CLS?
-        # Let's assume standard ViT: CLS at 0, then patches. 
-        # But if registers exist, they might be after CLS.
-        # Let's take the last n_patches
-        patch_tokens = tokens[-n_patches:]
-    else:
-        print(f"Error: Token count {tokens.shape[0]} is less than expected patches {n_patches}")
+    try:
+        _, _, patch_grid = layout.split(tokens)
+    except ValueError as e:
+        print(f"Error: {e}")
         return
+    patch_tokens = patch_grid.reshape(-1, patch_grid.shape[-1])
 
     # PCA
     print("Running PCA...")
@@ -89,8 +68,7 @@ def visualize_tokens(model_path, image_path, output_path, patch_size=14): # Defa
     pca_tokens = (pca_tokens - pca_tokens.min(0)) / (pca_tokens.max(0) - pca_tokens.min(0))
     
     # Reshape to grid
-    grid_h = h // patch_size
-    grid_w = w // patch_size
+    grid_h, grid_w = layout.grid_hw
     pca_img = pca_tokens.reshape(grid_h, grid_w, 3)
     
     # Resize to original image size for overlay/comparison
@@ -116,6 +94,10 @@ if __name__ == "__main__":
     parser.add_argument("--model_path", type=str, required=True)
     parser.add_argument("--image_path", type=str, required=True)
     parser.add_argument("--output_path", type=str, required=True)
+    parser.add_argument("--backend", type=str, default="ort", choices=backends.BACKENDS,
+                        help="ort (host CPU), htp (device), auto (device with CPU failover) or fake")
+    parser.add_argument("--config", type=str, default=None,
+                        help="Model config.json for the token layout (default: next to the model)")
     args = parser.parse_args()
     
-    visualize_tokens(args.model_path, args.image_path, args.output_path)
+    visualize_tokens(args.model_path, args.image_path, args.output_path, backend_name=args.backend, config_path=args.config)
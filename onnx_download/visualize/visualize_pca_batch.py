@@ -0,0 +1,162 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from PIL import Image
+
+# Patch stores and shared helpers live in onnx_convert/scripts
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "../../onnx_convert/scripts"))
+from feature_utils import iter_batches, png_name, png_writers
+from patch_store import PatchStore
+
+# PCA visualization of many images (or video frames) with ONE shared basis.
+# visualize_dinov3.py fits a PCA per image and normalizes per image, so the
+# same object changes colour from frame to frame. Here the patch tokens of
+# every image in a patch store are streamed once, batch by batch, into a
+# float64 mean + covariance accumulator (memory: one batch + D x D), the top
+# 3 eigenvectors become the basis, and colours are normalized with global
+# percentiles taken from a reservoir sample of patches. Every image is then
+# projected with one matmul per batch and the PNGs are written by a thread
+# pool. The basis can be saved and reused so later runs share the colours.
+# For wide models (4096-d 7B) --fit_patches fits on a random subset of the
+# patches of every image; the covariance update is the dominant cost.
+#
+# Usage (from onnx_convert/):
+#   python3 ../onnx_download/visualize/visualize_pca_batch.py dataset.patches --output_dir pca_vis
+#   python3 ../onnx_download/visualize/visualize_pca_batch.py video.patches --output_dir pca_video \
+#       --save_basis pca_basis.npz --size 448 --with_image
+#   python3 ../onnx_download/visualize/visualize_pca_batch.py other.patches --basis pca_basis.npz
+
+N_COMPONENTS = 3
+RESERVOIR_PATCHES = 20000
+CLIP_PERCENTILES = (1, 99)
+
+
+class StreamingPCA:
+    """Mean and covariance accumulated batch by batch; exact top-k eigenvectors at the end."""
+
+    def __init__(self, dim, reservoir=RESERVOIR_PATCHES, seed=0):
+        self.count = 0
+        self.sum = np.zeros(dim, dtype=np.float64)
+        self.outer = np.zeros((dim, dim), dtype=np.float64)
+        self.rng = np.random.RandomState(seed)
+        self.reservoir = np.empty((reservoir, dim), dtype=np.float32)
+        self.mean = self.components = self.lo = self.hi = None
+
+    def partial_fit(self, x):
+        self.sum += x.sum(axis=0, dtype=np.float64)
+        self.outer += x.T.astype(np.float64) @ x.astype(np.float64)
+        # Reservoir sample of patches for the colour range (uniform over everything seen)
+        size = len(self.reservoir)
+        positions = np.arange(self.count, self.count + len(x))
+        fill = positions < size
+        self.reservoir[positions[fill]] = x[fill]
+        if (~fill).any():
+            slots = self.rng.randint(0, positions[~fill] + 1)
+            keep = slots < size
+            self.reservoir[slots[keep]] = x[~fill][keep]
+        self.count += len(x)
+
+    def finalize(self, k=N_COMPONENTS):
+        self.mean = (self.sum / self.count).astype(np.float32)
+        cov = self.outer / self.count - np.outer(self.sum / self.count, self.sum / self.count)
+        _, vectors = np.linalg.eigh(cov)
+        components = vectors[:, ::-1][:, :k].astype(np.float32)
+        # Deterministic signs: largest |loading| positive, so refits keep their colours
+        signs = np.sign(components[np.abs(components).argmax(axis=0), np.arange(k)])
+        self.components = components * signs
+        sample = self.project(self.reservoir[:min(self.count, len(self.reservoir))])
+        self.lo, self.hi = np.percentile(sample, CLIP_PERCENTILES, axis=0)
+
+    def project(self, x):
+        return (x - self.mean) @ self.components
+
+    def colours(self, x):
+        """(n, 3) uint8 colours of patch tokens under the shared basis and range."""
+        scaled = (self.project(x) - self.lo) / np.maximum(self.hi - self.lo, 1e-6)
+        return (np.clip(scaled, 0, 1) * 255).astype(np.uint8)
+
+    def save(self, path):
+        np.savez(path, mean=self.mean, components=self.components, lo=self.lo, hi=self.hi)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        pca = cls(data["mean"].shape[0], reservoir=0)
+        pca.mean, pca.components, pca.lo, pca.hi = data["mean"], data["components"], data["lo"], data["hi"]
+        return pca
+
+
+def write_visualization(path, grid_rgb, size, image_path=None):
+    vis = Image.fromarray(grid_rgb).resize(size, Image.Resampling.NEAREST)
+    if image_path and os.path.exists(image_path):
+        original = Image.open(image_path).convert("RGB").resize(size, Image.Resampling.BILINEAR)
+        canvas = Image.new("RGB", (size[0] * 2, size[1]))
+        canvas.paste(original, (0, 0))
+        canvas.paste(vis, (size[0], 0))
+        vis = canvas
+    vis.save(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch PCA visualization of patch tokens with one shared basis")
+    parser.add_argument("store", help="Patch store (onnx_convert/scripts/patch_store.py)")
+    parser.add_argument("--output_dir", default="pca_vis", help="Where the PNGs go")
+    parser.add_argument("--batch_size", type=int, default=64, help="Images per fit / projection batch")
+    parser.add_argument("--size", type=int, default=224, help="Output size of each visualization (square)")
+    parser.add_argument("--with_image", action="store_true", help="Put the original image (id = path) on the left")
+    parser.add_argument("--basis", help="Reuse a saved basis (.npz) instead of fitting")
+    parser.add_argument("--fit_patches", type=int, default=0, help="Random patches per image used for the fit (0: all)")
+    parser.add_argument("--save_basis", help="Save the fitted basis (.npz) for later runs")
+    parser.add_argument("--workers", type=int, default=4, help="PNG writer threads")
+    args = parser.parse_args()
+
+    patches = PatchStore(args.store)
+    gh, gw = patches.layout.grid_hw
+    print(f"--- {len(patches)} images, {gh}x{gw} patches, {patches.layout.hidden_size}-d ---")
+
+    fit_patches = len(patches) * min(args.fit_patches or gh * gw, gh * gw)
+    t0 = time.time()
+    if args.basis:
+        pca = StreamingPCA.load(args.basis)
+        print(f"Using basis {args.basis}")
+    else:
+        pca = StreamingPCA(patches.layout.hidden_size)
+        rng = np.random.RandomState(0)
+        for _, ids, grids in iter_batches(patches, args.batch_size):
+            batch = np.asarray(grids, dtype=np.float32).reshape(len(ids), -1, grids.shape[-1])
+            if args.fit_patches and args.fit_patches < batch.shape[1]:
+                batch = batch[:, rng.choice(batch.shape[1], args.fit_patches, replace=False)]
+            pca.partial_fit(batch.reshape(-1, batch.shape[-1]))
+        pca.finalize()
+    t_fit = time.time() - t0
+    if args.save_basis:
+        pca.save(args.save_basis)
+        print(f"Saved basis to {args.save_basis}")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    t1 = time.time()
+    t_project = 0.0
+    with png_writers(args.workers) as submit:
+        for first_row, ids, grids in iter_batches(patches, args.batch_size):
+            tp = time.time()
+            flat = np.asarray(grids, dtype=np.float32).reshape(-1, grids.shape[-1])
+            rgb = pca.colours(flat).reshape(len(ids), gh, gw, 3)
+            t_project += time.time() - tp
+            for i, image_id in enumerate(ids):
+                submit(write_visualization, os.path.join(args.output_dir, png_name(first_row + i, image_id)), rgb[i],
+                       (args.size, args.size), image_id if args.with_image else None)
+    t_total = time.time() - t1
+
+    print("\n--- PCA Visualization Summary ---")
+    if not args.basis:
+        print(f"[TIME] Fit       : {t_fit:.2f} s  ({len(patches) / t_fit:.1f} images/s, {fit_patches / t_fit:.0f} patches/s)")
+    print(f"[TIME] Projection: {t_project:.2f} s  ({len(patches) / max(t_project, 1e-9):.1f} images/s)")
+    print(f"[TIME] Project + write: {t_total:.2f} s  ({len(patches) / t_total:.1f} images/s, {args.workers} writers)")
+    print(f"Saved {len(patches)} visualizations to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()